@@ -16,26 +16,59 @@
 
 """Docs Agent"""
 
+import hashlib
+import math
 import typing
 import os, pathlib
 
 from absl import logging
 import google.api_core
 import google.ai.generativelanguage as glm
+from chromadb.api.types import Documents, Embeddings
 from chromadb.utils import embedding_functions
 
 from docs_agent.storage.chroma import ChromaEnhanced
+from docs_agent.storage.chroma import release_chroma_client
+from docs_agent.storage.collection_registry import get_collection_registry
+from docs_agent.storage.numpy_store import NumpyCollection
+from docs_agent.storage.numpy_store import default_numpy_dir
+from docs_agent.storage.embedding_cache import CachedEmbeddingFunction
+from docs_agent.storage.embedding_cache import QueryEmbeddingCache
+from docs_agent.storage.embedding_cache import get_query_embedding_cache
+from docs_agent.storage.answer_cache import CachedAnswer
+from docs_agent.storage.answer_cache import get_answer_cache
+from docs_agent.storage.page_cache import get_page_cache
+from docs_agent.storage.context_windows import ContextWindowStore
+from docs_agent.storage.context_windows import ContextWindowsNotFoundError
+from docs_agent.storage.context_windows import default_context_window_dir
+from docs_agent.storage.hybrid_search import HybridCollection
+from docs_agent.storage.lexical_index import LexicalIndex
+from docs_agent.storage.lexical_index import LexicalIndexNotFoundError
+from docs_agent.storage.lexical_index import default_lexical_index_dir
+from docs_agent.storage.metadata_filters import filters_to_key
 
 from docs_agent.models.google_genai import Gemini
 
 from docs_agent.utilities.config import ProductConfig, Models
+from docs_agent.utilities.config import DbConfig
 from docs_agent.preprocess.splitters import markdown_splitter
 
 from docs_agent.preprocess.splitters.markdown_splitter import Section as Section
+from docs_agent.postprocess.docs_retriever import FullPage as FullPage
 from docs_agent.postprocess.docs_retriever import SectionDistance as SectionDistance
 from docs_agent.postprocess.docs_retriever import (
     SectionProbability as SectionProbability,
 )
+from docs_agent.postprocess.context_packer import PACKING_STRATEGIES
+from docs_agent.postprocess.context_packer import pack_context
+from docs_agent.postprocess.diversify import DIVERSITY_MODES
+from docs_agent.postprocess.diversify import describe_diversity
+from docs_agent.postprocess.diversify import diversify_results
+from docs_agent.postprocess.rerankers import RERANKERS
+from docs_agent.postprocess.rerankers import get_reranker
+from docs_agent.postprocess.rerankers import rerank_results
+from docs_agent.postprocess.adaptive_top_k import AdaptiveTopK
+from docs_agent.postprocess.adaptive_top_k import choose_top_k
 
 
 class DocsAgent:
@@ -63,21 +96,213 @@ class DocsAgent:
 
         # Use the new chroma db for all queries
         # Should make a function for this or clean this behavior
+        self.query_embedding_cache = None
+        self.context_windows = None
         if init_chroma:
+            self.query_embedding_cache = get_query_embedding_cache_from_config(
+                self.config
+            )
+            self.vector_backend = "chroma"
+            hybrid_db_config = None
             for item in self.config.db_configs:
                 if "chroma" in item.db_type:
+                    if item.enable_hybrid_search == "True":
+                        hybrid_db_config = item
+                    if item.enable_context_windows == "True":
+                        self.context_windows = get_context_window_store(item)
                     self.vector_db_dir = item.vector_db_dir
                     self.collection_name = item.collection_name
-            self.chroma = ChromaEnhanced(self.vector_db_dir)
-            logging.info(
-                "Using the local vector database created at %s", self.vector_db_dir
+                    self.hnsw_search_ef = item.hnsw_search_ef
+                    if item.vector_backend is not None:
+                        self.vector_backend = item.vector_backend
+                    self.numpy_dir = item.numpy_dir
+                    self.numpy_block_size = item.numpy_block_size
+                    self.quantization = item.quantization
+                    self.rerank_oversample = item.rerank_oversample
+                    self.reduction = item.reduction
+                    self.reduced_dimension = item.reduced_dimension
+            # Collections are opened once per process and shared by all
+            # agents with the same store and embedding function settings.
+            registry = get_collection_registry()
+            embedding_key = (
+                self.embedding_model,
+                str(self.config.models.api_key),
+                id(self.query_embedding_cache),
             )
-            self.collection = self.chroma.get_collection(
-                self.collection_name,
-                embedding_model=self.embedding_model,
-                embedding_function=embedding_function_gemini_retrieval(
-                    self.config.models.api_key, self.embedding_model
-                ),
+            if self.vector_backend == "numpy":
+                # Query a read-only, memory-mapped export of the collection.
+                if self.numpy_dir is None or self.numpy_dir == "":
+                    self.numpy_dir = default_numpy_dir(self.vector_db_dir)
+                logging.info(
+                    "Using the NumPy vector store exported to %s", self.numpy_dir
+                )
+                self.collection = registry.get(
+                    (
+                        "numpy",
+                        str(self.numpy_dir),
+                        self.collection_name,
+                        self.numpy_block_size,
+                        self.quantization,
+                        self.rerank_oversample,
+                        self.reduction,
+                        self.reduced_dimension,
+                    )
+                    + embedding_key,
+                    lambda: NumpyCollection(
+                        self.numpy_dir,
+                        self.collection_name,
+                        embedding_function=embedding_function_gemini_retrieval(
+                            self.config.models.api_key,
+                            self.embedding_model,
+                            cache=self.query_embedding_cache,
+                        ),
+                        block_size=self.numpy_block_size,
+                        quantization=self.quantization,
+                        rerank_oversample=self.rerank_oversample,
+                        reduction=self.reduction,
+                        reduced_dimension=self.reduced_dimension,
+                    ),
+                )
+            else:
+                logging.info(
+                    "Using the local vector database created at %s",
+                    self.vector_db_dir,
+                )
+                self.collection = registry.get(
+                    (
+                        "chroma",
+                        str(self.vector_db_dir),
+                        self.collection_name,
+                        self.hnsw_search_ef,
+                    )
+                    + embedding_key,
+                    lambda: ChromaEnhanced(self.vector_db_dir).get_collection(
+                        self.collection_name,
+                        embedding_model=self.embedding_model,
+                        embedding_function=embedding_function_gemini_retrieval(
+                            self.config.models.api_key,
+                            self.embedding_model,
+                            cache=self.query_embedding_cache,
+                        ),
+                        search_ef=self.hnsw_search_ef,
+                    ),
+                    on_reopen=lambda: release_chroma_client(self.vector_db_dir),
+                )
+
+            if hybrid_db_config is not None:
+                self.collection = get_hybrid_collection(
+                    self.collection, hybrid_db_config
+                )
+
+        # Page cache settings
+        self.page_cache = None
+        if init_chroma:
+            try:
+                page_cache_size = int(self.config.page_cache_size)
+            except (TypeError, ValueError):
+                page_cache_size = 256
+            if page_cache_size > 0:
+                self.page_cache = get_page_cache(max_size=page_cache_size)
+
+        # Context packer settings
+        self.context_packer = "even"
+        if self.config.context_packer in PACKING_STRATEGIES:
+            self.context_packer = self.config.context_packer
+        elif self.config.context_packer not in [None, "", "even"]:
+            logging.warning(
+                f"Unknown context_packer {self.config.context_packer}. "
+                + "Splitting the token limit evenly across results."
+            )
+        # The candidates and selected sections of the last packed context
+        self.last_packed_context = None
+
+        # Result diversity settings
+        self.result_diversity = None
+        if self.config.result_diversity in DIVERSITY_MODES:
+            self.result_diversity = self.config.result_diversity
+        elif self.config.result_diversity not in [None, "", "none"]:
+            logging.warning(
+                f"Unknown result_diversity {self.config.result_diversity}. "
+                + "Using the results in distance order."
+            )
+        try:
+            self.mmr_lambda = float(self.config.mmr_lambda)
+        except (TypeError, ValueError):
+            self.mmr_lambda = 0.5
+        try:
+            self.max_results_per_page = int(self.config.max_results_per_page)
+        except (TypeError, ValueError):
+            self.max_results_per_page = 0
+
+        # Reranker settings
+        self.reranker = None
+        if self.config.reranker in RERANKERS:
+            if init_chroma:
+                # None if the dependencies of the reranker are not installed
+                self.reranker = get_reranker(
+                    self.config.reranker, self.config.reranker_model
+                )
+        elif self.config.reranker not in [None, "", "none"]:
+            logging.warning(
+                f"Unknown reranker {self.config.reranker}. "
+                + "Using the results in distance order."
+            )
+        try:
+            self.rerank_top_n = int(self.config.rerank_top_n)
+        except (TypeError, ValueError):
+            self.rerank_top_n = 20
+        try:
+            self.rerank_batch_size = int(self.config.rerank_batch_size)
+        except (TypeError, ValueError):
+            self.rerank_batch_size = 16
+        try:
+            self.rerank_latency_budget_ms = float(self.config.rerank_latency_budget_ms)
+        except (TypeError, ValueError):
+            self.rerank_latency_budget_ms = 50.0
+        # The timing and outcome of the last reranked question
+        self.last_rerank = None
+
+        # Adaptive top-k settings
+        self.adaptive_top_k = self.config.adaptive_top_k == "True"
+        try:
+            self.adaptive_min_k = int(self.config.adaptive_min_k)
+        except (TypeError, ValueError):
+            self.adaptive_min_k = 1
+        try:
+            self.adaptive_max_k = int(self.config.adaptive_max_k)
+        except (TypeError, ValueError):
+            self.adaptive_max_k = 0
+        try:
+            self.adaptive_distance_gap = float(self.config.adaptive_distance_gap)
+        except (TypeError, ValueError):
+            self.adaptive_distance_gap = 0.05
+        try:
+            self.adaptive_relevance_threshold = float(
+                self.config.adaptive_relevance_threshold
+            )
+        except (TypeError, ValueError):
+            self.adaptive_relevance_threshold = 0.8
+        if self.adaptive_top_k and self.context_packer in PACKING_STRATEGIES:
+            logging.warning(
+                f"adaptive_top_k is ignored because the {self.context_packer} "
+                + "context packer chooses its own results."
+            )
+        # The number of results used for the last question and why
+        self.last_adaptive_top_k = None
+
+        # Answer cache settings
+        self.answer_cache = None
+        try:
+            self.answer_cache_threshold = float(self.config.answer_cache_threshold)
+        except (TypeError, ValueError):
+            self.answer_cache_threshold = 0.95
+        if init_chroma and self.config.enable_answer_cache == "True":
+            try:
+                answer_cache_size = int(self.config.answer_cache_size)
+            except (TypeError, ValueError):
+                answer_cache_size = 1024
+            self.answer_cache = get_answer_cache(
+                self.config.answer_cache_path, max_size=answer_cache_size
             )
 
         # AQA model settings
@@ -346,6 +571,39 @@ class DocsAgent:
     def query_vector_store(self, question, num_returns: int = 5):
         return self.collection.query(question, num_returns)
 
+    # Return the largest number of results that adaptive top-k can use:
+    # `adaptive_max_k`, or twice `max_sources` if it isn't set.
+    def get_adaptive_max_k(self, max_sources: int) -> int:
+        if self.adaptive_max_k > 0:
+            return self.adaptive_max_k
+        return 2 * max_sources
+
+    # Query the vector database with many questions at once. The questions
+    # are embedded in one request and searched in one call, and the results
+    # are returned in the order of the questions. With a reranker, at least
+    # `rerank_top_n` candidates are returned for each question, and with
+    # adaptive top-k, as many candidates as `query_vector_store_to_build`
+    # fetches for the same `max_sources` (by default, `num_returns`).
+    def query_vector_store_batch(
+        self,
+        questions: list[str],
+        num_returns: int = 5,
+        filters: typing.Optional[dict] = None,
+        max_sources: typing.Optional[int] = None,
+    ):
+        if max_sources is None:
+            max_sources = num_returns
+        if self.adaptive_top_k and self.context_packer not in PACKING_STRATEGIES:
+            num_returns = max(num_returns, self.get_adaptive_max_k(max_sources))
+        if self.reranker is not None:
+            num_returns = max(num_returns, self.rerank_top_n)
+        return self.collection.query_batch(
+            questions,
+            num_returns,
+            filters=filters,
+            include_embeddings=(self.result_diversity == "mmr"),
+        )
+
     # Add specific instruction as a prefix to the context
     def add_instruction_to_context(self, context):
         new_context = ""
@@ -394,23 +652,92 @@ class DocsAgent:
         print("#########################################")
         print("\n")
 
+    # Return a FullPage for each origin_uuid. Pages are looked up in the page
+    # cache first, and the remaining pages are fetched in a single query.
+    def get_full_pages(self, origin_uuids: list[str]) -> dict:
+        origin_uuids = list(dict.fromkeys(origin_uuids))
+        if self.page_cache is None or self.page_cache.max_size == 0:
+            return self.collection.getPagesOriginUUIDList(origin_uuids)
+        version = self.collection.version()
+        full_pages = {}
+        missing_uuids = []
+        for origin_uuid in origin_uuids:
+            page = self.page_cache.get(version, origin_uuid)
+            if page is None:
+                missing_uuids.append(origin_uuid)
+            else:
+                full_pages[origin_uuid] = page
+        if missing_uuids:
+            fetched_pages = self.collection.getPagesOriginUUIDList(missing_uuids)
+            for origin_uuid, page in fetched_pages.items():
+                self.page_cache.put(version, origin_uuid, page)
+                full_pages[origin_uuid] = page
+        return full_pages
+
     # Query the local Chroma vector database. Starts with the number of results
     # from results
     # Results_num is the initial result set based on distance to the question
     # Max_sources is the number of those results_num to use to build a final
     # context page
+    # Filters (for example, {"url_prefix": "https://example.com/docs/"}) limit
+    # the search to entries whose metadata match all of them
     def query_vector_store_to_build(
         self,
         question: str,
         token_limit: float = 30000,
         results_num: int = 10,
         max_sources: int = 4,
+        filters: typing.Optional[dict] = None,
+        query_result=None,
     ):
         # Looks for contexts related to a question that is limited to an int
-        # Returns a list
-        contexts_query = self.collection.query(question, results_num)
+        # Returns a list. A result from `query_vector_store_batch` can be
+        # passed as `query_result` to skip the search.
+        # With adaptive top-k, up to `adaptive_max_k` results (by default,
+        # twice max_sources) can be used
+        adaptive = self.adaptive_top_k and self.context_packer not in PACKING_STRATEGIES
+        max_k = self.get_adaptive_max_k(max_sources)
+        if adaptive:
+            results_num = max(results_num, max_k)
+        # With a reranker, fetch `rerank_top_n` candidates to rescore and
+        # keep the best `results_num`
+        fetch_num = results_num
+        if self.reranker is not None:
+            fetch_num = max(results_num, self.rerank_top_n)
+        if query_result is None:
+            contexts_query = self.collection.query(
+                question,
+                fetch_num,
+                filters=filters,
+                include_embeddings=(self.result_diversity == "mmr"),
+            )
+        else:
+            contexts_query = query_result
         # This returns a list of results
         build_context = contexts_query.returnDBObjList()
+        if self.reranker is not None:
+            self.last_rerank = rerank_results(
+                question,
+                build_context,
+                self.reranker,
+                top_n=self.rerank_top_n,
+                batch_size=self.rerank_batch_size,
+                latency_budget_ms=self.rerank_latency_budget_ms,
+            )
+            logging.info(str(self.last_rerank))
+            build_context = self.last_rerank.items[:results_num]
+        # Move results from pages (or content) that are already covered by
+        # better results behind the results from other pages
+        if self.result_diversity is not None:
+            diverse_context = diversify_results(
+                build_context,
+                mode=self.result_diversity,
+                lambda_mult=self.mmr_lambda,
+                max_per_page=self.max_results_per_page,
+            )
+            if self.config.log_level == "VERBOSE":
+                print(describe_diversity(build_context, diverse_context, max_sources))
+            build_context = diverse_context
         # Use the token limit and distances to assign a token limit for each
         # page. For time being split evenly into top max_sources
         token_limit_temp = token_limit / max_sources
@@ -465,16 +792,129 @@ class DocsAgent:
         this_range = len(search_result)
         if this_range > max_sources:
             this_range = max_sources
+        # Grow the number of results until the distances jump or the results
+        # hold enough of the relevance. The token budget is checked below.
+        if adaptive:
+            this_range, adaptive_reason = choose_top_k(
+                build_context,
+                min_k=self.adaptive_min_k,
+                max_k=max_k,
+                distance_gap=self.adaptive_distance_gap,
+                relevance_threshold=self.adaptive_relevance_threshold,
+            )
+        # Fill the token limit with the most relevant sections per token
+        # instead of splitting it evenly across results
+        if self.context_packer in PACKING_STRATEGIES:
+            # Fetch all pages of the top results at once (each page only once)
+            full_pages = self.get_full_pages(
+                [search_result[i].section.origin_uuid for i in range(this_range)]
+            )
+            packed_context = pack_context(
+                search_result=search_result[:this_range],
+                full_pages=full_pages,
+                token_limit=token_limit,
+                strategy=self.context_packer,
+                include_neighbors=(self.config.docs_agent_config == "experimental"),
+            )
+            self.last_packed_context = packed_context
+            if self.config.log_level == "VERBOSE":
+                print(packed_context.debug_view())
+            # Adaptive top-k is ignored, but the number of results given to
+            # the packer is still recorded.
+            if self.adaptive_top_k:
+                self.last_adaptive_top_k = AdaptiveTopK(
+                    k=this_range,
+                    candidates=len(search_result),
+                    reason="packer",
+                    tokens=packed_context.used_tokens(),
+                    pages_fetched=len(full_pages),
+                )
+                logging.info(str(self.last_adaptive_top_k))
+            return search_result, packed_context.build_context()
+        # Look up the precomputed context windows of the top results in a
+        # single query, and fetch the pages of the results without one
+        windows = {}
+        if self.context_windows is not None:
+            windows = self.context_windows.get_windows(
+                [
+                    (search_result[i].section.origin_uuid, search_result[i].section.id)
+                    for i in range(this_range)
+                ]
+            )
+        # With adaptive top-k, the pages of results after max_sources are
+        # only fetched while the context has room for them
+        prefetch_range = this_range
+        if adaptive:
+            prefetch_range = min(this_range, max_sources)
+        full_pages = self.get_full_pages(
+            [
+                search_result[i].section.origin_uuid
+                for i in range(prefetch_range)
+                if (search_result[i].section.origin_uuid, search_result[i].section.id)
+                not in windows
+            ]
+        )
+        pages_fetched = len(full_pages)
+        context_tokens = 0
+        include_related = self.config.docs_agent_config == "experimental"
         for i in range(this_range):
+            if adaptive and i >= max_sources:
+                # Stop once the context is full
+                if context_tokens >= token_limit:
+                    adaptive_reason = "token_budget"
+                    break
+                token_limit_per_source.append(
+                    min(token_limit_temp, token_limit - context_tokens)
+                )
             # The current section that is being built
             # eval turns str representation of array into an array
             curr_section_id = search_result[i].section.name_id
-            curr_parent_tree = eval(search_result[i].section.parent_tree)
+            curr_parent_tree = search_result[i].section.parent_ids
             # Assigned token limit for this position in the list
             page_token_limit = token_limit_per_source[i]
+            window = windows.get(
+                (search_result[i].section.origin_uuid, search_result[i].section.id)
+            )
+            if window is not None:
+                # Use all sections in experimental, only self when "normal"
+                test_page = window.buildSections(
+                    selfSection=True,
+                    children=include_related,
+                    parent=include_related,
+                    siblings=include_related,
+                    token_limit=page_token_limit,
+                )
+                final_pages.append(test_page)
+                context_tokens += sum(
+                    item.token_count for item in test_page.section_list
+                )
+                continue
+            if i >= prefetch_range:
+                # Fetch the pages of as many more results as the rest of the
+                # token limit is likely to hold, at once
+                tokens_per_source = max(context_tokens / max(i, 1), 1.0)
+                prefetch_range = min(
+                    this_range,
+                    i + math.ceil((token_limit - context_tokens) / tokens_per_source),
+                )
+                more_pages = self.get_full_pages(
+                    [
+                        search_result[j].section.origin_uuid
+                        for j in range(i, prefetch_range)
+                        if search_result[j].section.origin_uuid not in full_pages
+                        and (
+                            search_result[j].section.origin_uuid,
+                            search_result[j].section.id,
+                        )
+                        not in windows
+                    ]
+                )
+                full_pages.update(more_pages)
+                pages_fetched += len(more_pages)
             # Returns a FullPage which is just a list of Section
-            same_page = self.collection.getPageOriginUUIDList(
-                origin_uuid=search_result[i].section.origin_uuid
+            # Building sections returns copies, so the cached page is shared
+            same_page = full_pages.get(
+                search_result[i].section.origin_uuid, FullPage(section_list=[])
             )
             same_pages.append(same_page)
             # Use all sections in experimental, only self when "normal"
@@ -497,6 +937,20 @@ class DocsAgent:
                     token_limit=token_limit_per_source[i],
                 )
             final_pages.append(test_page)
+            context_tokens += sum(item.token_count for item in test_page.section_list)
+        if adaptive:
+            self.last_adaptive_top_k = AdaptiveTopK(
+                k=len(final_pages),
+                candidates=len(search_result),
+                reason=adaptive_reason,
+                tokens=context_tokens,
+                pages_fetched=pages_fetched,
+            )
+            logging.info(str(self.last_adaptive_top_k))
+            if self.config.log_level == "VERBOSE":
+                print(self.last_adaptive_top_k)
+            # Only return the results that are used in the context
+            search_result = search_result[: len(final_pages)]
         # Each item here is a FullPage corresponding to the source
         final_context = ""
         for item in final_pages:
@@ -574,6 +1028,72 @@ class DocsAgent:
     def generate_embedding(self, text, task_type: str = "SEMANTIC_SIMILARITY"):
         return self.gemini.embed(text, task_type)[0]
 
+    # Return the scope of cached answers. Answers are only shared by agents
+    # with the same product, models, collection, prompt conditions, and
+    # metadata filters.
+    def get_answer_cache_scope(self, filters: typing.Optional[dict] = None):
+        condition_hash = hashlib.sha256(
+            str(self.config.conditions.condition_text).encode("utf-8")
+        ).hexdigest()
+        scope = [
+            str(self.config.product_name),
+            self.language_model,
+            self.embedding_model,
+            str(self.collection_name),
+            condition_hash[:16],
+        ]
+        if filters:
+            scope.append(filters_to_key(filters))
+        return "|".join(scope)
+
+    # Return a previous answer to a question similar to `question`, or None
+    # if the answer cache is disabled or has no similar question.
+    def lookup_cached_answer(
+        self, question: str, filters: typing.Optional[dict] = None
+    ) -> typing.Optional[CachedAnswer]:
+        if self.answer_cache is None:
+            return None
+        embedding = self.collection.embedding_function([question])[0]
+        cached_answer = self.answer_cache.lookup(
+            self.get_answer_cache_scope(filters),
+            self.collection.version(),
+            embedding,
+            threshold=self.answer_cache_threshold,
+        )
+        if cached_answer is not None:
+            logging.info(
+                f"Using the cached answer of a similar question "
+                + f"(similarity: {cached_answer.similarity:.3f}): "
+                + cached_answer.question
+            )
+        return cached_answer
+
+    # Save an answer so that it can be returned for similar questions.
+    def save_answer_to_cache(
+        self, question, response, context, search_result, filters=None
+    ):
+        if self.answer_cache is None:
+            return
+        # Do not cache error messages.
+        if response is None or response == self.config.conditions.model_error_message:
+            return
+        embedding = self.collection.embedding_function([question])[0]
+        self.answer_cache.add(
+            self.get_answer_cache_scope(filters),
+            self.collection.version(),
+            question,
+            embedding,
+            response,
+            context,
+            search_result,
+        )
+
+    # Return the hit rate and size of the question embedding cache
+    def get_query_embedding_cache_stats(self):
+        if self.query_embedding_cache is None:
+            return {}
+        return self.query_embedding_cache.stats()
+
     # Generate a response to an image
     def ask_model_about_image(self, prompt: str, image):
         if not prompt:
@@ -642,8 +1162,101 @@ class DocsAgent:
             exit(1)
         return response
 
+# Return the process-wide cache of question embeddings configured for
+# a product, or None if the cache is disabled.
+def get_query_embedding_cache_from_config(config: ProductConfig):
+    try:
+        max_size = int(config.query_embedding_cache_size)
+    except (TypeError, ValueError):
+        max_size = 1024
+    store_path = config.query_embedding_store_path
+    if store_path is None:
+        store_path = ""
+    if max_size <= 0 and store_path == "":
+        return None
+    return get_query_embedding_cache(max_size=max_size, store_path=store_path)
+
+
+# Return the context window store of a collection, or None (with a warning)
+# if the context windows are not built.
+def get_context_window_store(db_config: DbConfig):
+    window_dir = db_config.context_window_dir
+    if window_dir is None or window_dir == "":
+        window_dir = default_context_window_dir(db_config.vector_db_dir)
+    try:
+        return get_collection_registry().get(
+            ("contexts", str(window_dir), db_config.collection_name),
+            lambda: ContextWindowStore(window_dir, db_config.collection_name),
+        )
+    except ContextWindowsNotFoundError as error:
+        logging.warning(f"{error} Building context windows from pages.")
+        return None
+
+
+# Wrap a vector collection so that its results are fused with the lexical
+# index of the collection. Returns the collection unchanged if the lexical
+# index is not built.
+def get_hybrid_collection(collection, db_config: DbConfig):
+    index_dir = db_config.lexical_index_dir
+    if index_dir is None or index_dir == "":
+        index_dir = default_lexical_index_dir(db_config.vector_db_dir)
+    try:
+        lexical_index = get_collection_registry().get(
+            ("lexical", str(index_dir), db_config.collection_name),
+            lambda: LexicalIndex(index_dir, db_config.collection_name),
+        )
+    except LexicalIndexNotFoundError as error:
+        logging.warning(f"{error} Using vector search only.")
+        return collection
+    logging.info("Using hybrid search with the lexical index in %s", index_dir)
+    return HybridCollection(
+        collection,
+        lexical_index,
+        vector_k=db_config.hybrid_vector_k,
+        lexical_k=db_config.hybrid_lexical_k,
+        vector_weight=db_config.hybrid_vector_weight,
+        lexical_weight=db_config.hybrid_lexical_weight,
+        rrf_k=db_config.rrf_k,
+    )
+
+
+class GeminiBatchEmbeddingFunction(
+    embedding_functions.GoogleGenerativeAiEmbeddingFunction
+):
+    """Embeds all texts of a call in batch requests.
+
+    Chroma's embedding function sends one request per text, so a batch of
+    questions would take as many round trips.
+    """
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if len(input) == 0:
+            return []
+        return list(
+            self._genai.embed_content(
+                model=self._model_name,
+                content=list(input),
+                task_type=self._task_type,
+                title=self._task_title,
+            )["embedding"]
+        )
+
+
 # Function to give an embedding function for gemini using an API key
-def embedding_function_gemini_retrieval(api_key, embedding_model: str):
-    return embedding_functions.GoogleGenerativeAiEmbeddingFunction(
+# If a cache is given, identical questions are embedded only once.
+def embedding_function_gemini_retrieval(
+    api_key,
+    embedding_model: str,
+    cache: typing.Optional[QueryEmbeddingCache] = None,
+):
+    embedding_function = GeminiBatchEmbeddingFunction(
         api_key=api_key, model_name=embedding_model, task_type="RETRIEVAL_QUERY"
     )
+    if cache is None:
+        return embedding_function
+    return CachedEmbeddingFunction(
+        embedding_function,
+        cache=cache,
+        model=embedding_model,
+        task_type="RETRIEVAL_QUERY",
+    )
@@ -0,0 +1,705 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks that measure the recall and latency of vector indexes"""
+
+import os
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.chroma import HNSW_DEFAULTS
+from docs_agent.storage.chroma import release_chroma_client
+from docs_agent.storage.chroma import set_search_ef
+from docs_agent.storage.context_windows import ContextWindowStore
+from docs_agent.storage.context_windows import default_context_window_dir
+from docs_agent.storage.hybrid_search import HybridCollection
+from docs_agent.storage.lexical_index import LexicalIndex
+from docs_agent.storage.lexical_index import default_lexical_index_dir
+from docs_agent.storage.numpy_store import NumpyCollection
+from docs_agent.storage.numpy_store import NumpyStoreNotFoundError
+from docs_agent.storage.numpy_store import default_numpy_dir
+from docs_agent.storage.quantization import build_quantized_index
+from docs_agent.storage.quantization import get_quantized_index_size
+from docs_agent.storage.reduction import build_reduced_index
+from docs_agent.storage.reduction import get_reduced_index_size
+from docs_agent.storage.reduction import get_reduced_paths
+
+
+# Return the average fraction of the exact top-k rows that are found in
+# the approximate top-k rows.
+def compute_recall(exact_results: list, approximate_results: list) -> float:
+    if not exact_results:
+        return 0.0
+    recalls = []
+    for exact_rows, approximate_rows in zip(exact_results, approximate_results):
+        if len(exact_rows) == 0:
+            continue
+        found = len(set(exact_rows.tolist()) & set(approximate_rows.tolist()))
+        recalls.append(found / len(exact_rows))
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+# Run each query through a search function and return the results and
+# the average latency in milliseconds.
+def time_queries(search_function, queries) -> tuple[list, float]:
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        rows, _ = search_function(query)
+        results.append(rows)
+    elapsed = time.perf_counter() - start
+    return results, 1000 * elapsed / max(len(queries), 1)
+
+
+# Compare the top-k results of quantized indexes to the exact float32 index
+# of an exported NumPy store. Queries are sampled from the stored vectors,
+# so no embedding model is called.
+def benchmark_quantization(
+    numpy_dir: str,
+    collection_name: str,
+    quantizations: list[str] = ["int8", "pq"],
+    top_k: int = 10,
+    num_queries: int = 100,
+    rerank_oversample: int = 4,
+    pq_subvectors: int = 0,
+    rebuild: bool = False,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures recall@k and latency of quantized indexes.
+    Args:
+        numpy_dir: The directory of the NumPy store.
+        collection_name: The name of the exported collection.
+        quantizations: The quantized indexes to compare.
+        top_k: The number of results per query.
+        num_queries: The number of queries sampled from the collection.
+        rerank_oversample: The candidate set size as a multiple of `top_k`.
+        pq_subvectors: The number of subvectors when building a `pq` index.
+        rebuild: Build the quantized indexes even if they exist.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per index, with the recall@k (with and
+        without re-ranking), average latency, and size of the index.
+    """
+    exact = NumpyCollection(numpy_dir, collection_name)
+    total = exact.count()
+    generator = np.random.RandomState(seed)
+    query_rows = generator.choice(total, min(num_queries, total), replace=False)
+    queries = [np.asarray(exact.vectors[row], dtype=np.float32) for row in query_rows]
+    exact_results, exact_latency = time_queries(
+        lambda query: exact.search(query, top_k), queries
+    )
+    reports = [
+        {
+            "index": "float32",
+            "recall": 1.0,
+            "recall_without_rerank": 1.0,
+            "latency_ms": exact_latency,
+            "index_bytes": os.path.getsize(exact.paths["vectors"]),
+        }
+    ]
+    for quantization in quantizations:
+        if rebuild or not os.path.isfile(
+            f"{exact.paths['base']}.{quantization}.params.npz"
+        ):
+            build_quantized_index(
+                vectors=exact.vectors,
+                base_path=exact.paths["base"],
+                quantization=quantization,
+                pq_subvectors=pq_subvectors,
+            )
+        quantized = NumpyCollection(
+            numpy_dir,
+            collection_name,
+            quantization=quantization,
+            rerank_oversample=rerank_oversample,
+        )
+        results, latency = time_queries(
+            lambda query: quantized.search(query, top_k), queries
+        )
+        results_without_rerank, _ = time_queries(
+            lambda query: quantized.scan(
+                query, min(top_k, total), quantized.approximate_distances
+            ),
+            queries,
+        )
+        reports.append(
+            {
+                "index": quantization,
+                "recall": compute_recall(exact_results, results),
+                "recall_without_rerank": compute_recall(
+                    exact_results, results_without_rerank
+                ),
+                "latency_ms": latency,
+                "index_bytes": get_quantized_index_size(
+                    exact.paths["base"], quantization
+                ),
+            }
+        )
+    return reports
+
+
+# Compare the top-k results of reduced indexes of several dimensions to the
+# exact float32 index of an exported NumPy store. Queries are sampled from
+# the stored vectors, so no embedding model is called. Reduced indexes that
+# the benchmark builds are removed afterwards, unless `keep` is set.
+def benchmark_reduction(
+    numpy_dir: str,
+    collection_name: str,
+    reductions: list[str] = ["pca", "random_projection"],
+    dimensions: list[int] = [64, 128, 256],
+    top_k: int = 10,
+    num_queries: int = 100,
+    rerank_oversample: int = 4,
+    keep: bool = False,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures recall@k and latency of reduced indexes.
+    Args:
+        numpy_dir: The directory of the NumPy store.
+        collection_name: The name of the exported collection.
+        reductions: The reductions to compare.
+        dimensions: The dimensions of the reduced indexes.
+        top_k: The number of results per query.
+        num_queries: The number of queries sampled from the collection.
+        rerank_oversample: The candidate set size as a multiple of `top_k`.
+        keep: Keep the reduced indexes that the benchmark builds.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per index, with the recall@k (with and
+        without re-ranking), average latency, size, and build time of the
+        index.
+    """
+    exact = NumpyCollection(numpy_dir, collection_name)
+    total = exact.count()
+    full_dimension = int(exact.vectors.shape[1])
+    generator = np.random.RandomState(seed)
+    query_rows = generator.choice(total, min(num_queries, total), replace=False)
+    queries = [np.asarray(exact.vectors[row], dtype=np.float32) for row in query_rows]
+    exact_results, exact_latency = time_queries(
+        lambda query: exact.search(query, top_k), queries
+    )
+    reports = [
+        {
+            "index": "float32",
+            "dimension": full_dimension,
+            "recall": 1.0,
+            "recall_without_rerank": 1.0,
+            "latency_ms": exact_latency,
+            "index_bytes": os.path.getsize(exact.paths["vectors"]),
+            "build_s": 0.0,
+        }
+    ]
+    for reduction in reductions:
+        for dimension in dimensions:
+            if dimension <= 0 or dimension >= full_dimension:
+                continue
+            paths = get_reduced_paths(exact.paths["base"], reduction, dimension)
+            built = not os.path.isfile(paths["params"])
+            start = time.perf_counter()
+            if built:
+                build_reduced_index(
+                    vectors=exact.vectors,
+                    base_path=exact.paths["base"],
+                    reduction=reduction,
+                    dimension=dimension,
+                )
+            build_time = time.perf_counter() - start
+            reduced = NumpyCollection(
+                numpy_dir,
+                collection_name,
+                rerank_oversample=rerank_oversample,
+                reduction=reduction,
+                reduced_dimension=dimension,
+            )
+            reducer = reduced.reduced_index[0]
+            results, latency = time_queries(
+                lambda query: reduced.search(query, top_k), queries
+            )
+            results_without_rerank, _ = time_queries(
+                lambda query: reduced.scan(
+                    reducer.transform(query),
+                    min(top_k, total),
+                    reduced.reduced_distances,
+                ),
+                queries,
+            )
+            reports.append(
+                {
+                    "index": reduction,
+                    "dimension": dimension,
+                    "recall": compute_recall(exact_results, results),
+                    "recall_without_rerank": compute_recall(
+                        exact_results, results_without_rerank
+                    ),
+                    "latency_ms": latency,
+                    "index_bytes": get_reduced_index_size(
+                        exact.paths["base"], reduction, dimension
+                    ),
+                    "build_s": build_time,
+                }
+            )
+            del reduced, reducer
+            if built and not keep:
+                for path in paths.values():
+                    os.remove(path)
+    return reports
+
+
+# Return the average and 95th percentile of latencies in milliseconds.
+def summarize_latencies(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"latency_ms": 0.0, "p95_latency_ms": 0.0}
+    return {
+        "latency_ms": float(np.mean(latencies)),
+        "p95_latency_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+# Measure the latency that the lexical index and rank fusion add to vector
+# search. Each query is a short passage of a stored text chunk with the
+# stored embedding of the chunk, so no embedding model is called.
+def benchmark_hybrid(
+    vector_db_dir: str,
+    collection_name: str,
+    lexical_index_dir: str = "",
+    top_k: int = 10,
+    num_queries: int = 100,
+    query_words: int = 8,
+    vector_weight: float = 1.0,
+    lexical_weight: float = 1.0,
+    rrf_k: float = 60,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures the latency of vector, lexical, and hybrid search.
+    Args:
+        vector_db_dir: The directory of the Chroma database.
+        collection_name: The name of the collection.
+        lexical_index_dir: (Optional) The directory of the lexical index.
+        top_k: The number of results per query.
+        num_queries: The number of queries sampled from the collection.
+        query_words: The number of words in each query.
+        vector_weight: The weight of the vector results in rank fusion.
+        lexical_weight: The weight of the lexical results in rank fusion.
+        rrf_k: The rank constant of reciprocal rank fusion.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per search mode, with the average and
+        95th percentile latency and the fraction of results that differ from
+        vector search.
+    """
+    if lexical_index_dir is None or lexical_index_dir == "":
+        lexical_index_dir = default_lexical_index_dir(vector_db_dir)
+    chroma_client = chromadb.PersistentClient(path=vector_db_dir)
+    vector_collection = ChromaCollectionEnhanced(
+        chroma_client.get_collection(name=collection_name), None
+    )
+    lexical_index = LexicalIndex(lexical_index_dir, collection_name)
+    hybrid = HybridCollection(
+        vector_collection,
+        lexical_index,
+        vector_weight=vector_weight,
+        lexical_weight=lexical_weight,
+        rrf_k=rrf_k,
+    )
+    entries = vector_collection.collection.get(include=["documents", "embeddings"])
+    generator = np.random.RandomState(seed)
+    query_rows = generator.choice(
+        len(entries["ids"]), min(num_queries, len(entries["ids"])), replace=False
+    )
+    queries = []
+    for row in query_rows:
+        words = str(entries["documents"][row]).split()
+        start = generator.randint(0, max(1, len(words) - query_words + 1))
+        text = " ".join(words[start : start + query_words])
+        queries.append((text, entries["embeddings"][row]))
+    modes = {
+        "vector": lambda text, vector: vector_collection.query_by_embedding(
+            vector, top_k
+        ).result["ids"][0],
+        "lexical": lambda text, vector: lexical_index.search(text, top_k)["ids"],
+        "hybrid": lambda text, vector: hybrid.query_by_embedding(
+            text, vector, top_k
+        ).result["ids"][0],
+    }
+    results = {}
+    reports = []
+    for mode, search_function in modes.items():
+        latencies = []
+        results[mode] = []
+        for text, vector in queries:
+            start = time.perf_counter()
+            results[mode].append(search_function(text, vector))
+            latencies.append(1000 * (time.perf_counter() - start))
+        report = {"mode": mode} | summarize_latencies(latencies)
+        changed = []
+        for ids, vector_ids in zip(results[mode], results["vector"]):
+            if ids:
+                changed.append(len(set(ids) - set(vector_ids)) / len(ids))
+        report["changed"] = float(np.mean(changed)) if changed else 0.0
+        reports.append(report)
+    vector_latency = reports[0]["latency_ms"]
+    for report in reports:
+        report["overhead_ms"] = report["latency_ms"] - vector_latency
+    return reports
+
+
+# Compare querying stored embeddings one at a time to querying them in one
+# batch, for the Chroma collection and (if it is exported) its NumPy store.
+# Queries are sampled from the stored vectors, so no embedding model is
+# called.
+def benchmark_batch_queries(
+    vector_db_dir: str,
+    collection_name: str,
+    numpy_dir: str = "",
+    top_k: int = 10,
+    num_queries: int = 100,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures the latency of sequential and batch queries.
+    Args:
+        vector_db_dir: The directory of the Chroma database.
+        collection_name: The name of the collection.
+        numpy_dir: (Optional) The directory of the NumPy store.
+        top_k: The number of results per query.
+        num_queries: The number of queries sampled from the collection.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per vector store, with the average
+        latency per query of sequential and batch queries, the speedup, and
+        the fraction of queries whose batch results match.
+    """
+    chroma_client = chromadb.PersistentClient(path=vector_db_dir)
+    collections = {
+        "chroma": ChromaCollectionEnhanced(
+            chroma_client.get_collection(name=collection_name), None
+        )
+    }
+    if numpy_dir is None or numpy_dir == "":
+        numpy_dir = default_numpy_dir(vector_db_dir)
+    try:
+        collections["numpy"] = NumpyCollection(numpy_dir, collection_name)
+    except NumpyStoreNotFoundError:
+        pass
+    entries = collections["chroma"].collection.get(include=["embeddings"])
+    generator = np.random.RandomState(seed)
+    query_rows = generator.choice(
+        len(entries["ids"]), min(num_queries, len(entries["ids"])), replace=False
+    )
+    queries = [entries["embeddings"][row] for row in query_rows]
+    reports = []
+    for name, collection in collections.items():
+        start = time.perf_counter()
+        sequential = [
+            collection.query_by_embedding(query, top_k).result["ids"][0]
+            for query in queries
+        ]
+        sequential_ms = 1000 * (time.perf_counter() - start) / max(len(queries), 1)
+        start = time.perf_counter()
+        batch = [
+            result.result["ids"][0]
+            for result in collection.query_batch_by_embedding(queries, top_k)
+        ]
+        batch_ms = 1000 * (time.perf_counter() - start) / max(len(queries), 1)
+        matches = [ids == batch_ids for ids, batch_ids in zip(sequential, batch)]
+        reports.append(
+            {
+                "store": name,
+                "sequential_ms": sequential_ms,
+                "batch_ms": batch_ms,
+                "speedup": sequential_ms / batch_ms if batch_ms > 0 else 0.0,
+                "matches": float(np.mean(matches)) if matches else 1.0,
+            }
+        )
+    return reports
+
+
+# Compare building the context of search results from their pages to
+# building it from precomputed context windows. Each query is a sample of
+# stored sections, so no embedding model is called.
+def benchmark_context_windows(
+    vector_db_dir: str,
+    collection_name: str,
+    context_window_dir: str = "",
+    token_limit: float = 30000,
+    max_sources: int = 5,
+    num_queries: int = 100,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures the latency of building the context of search results.
+    Args:
+        vector_db_dir: The directory of the Chroma database.
+        collection_name: The name of the collection.
+        context_window_dir: (Optional) The directory of the context windows.
+        token_limit: The token limit of the context, split across results.
+        max_sources: The number of results in each context.
+        num_queries: The number of queries sampled from the collection.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per method (fetching the pages, reusing
+        cached pages, and looking up context windows), with the average and
+        95th percentile latency, the time saved compared to fetching the
+        pages, the fraction of contexts that match the pages, and the sizes
+        of the context windows and the Chroma database in bytes.
+    """
+    if context_window_dir is None or context_window_dir == "":
+        context_window_dir = default_context_window_dir(vector_db_dir)
+    chroma_client = chromadb.PersistentClient(path=vector_db_dir)
+    collection = ChromaCollectionEnhanced(
+        chroma_client.get_collection(name=collection_name), None
+    )
+    store = ContextWindowStore(context_window_dir, collection_name)
+    entries = collection.collection.get(include=["metadatas"])
+    generator = np.random.RandomState(seed)
+    queries = []
+    for _ in range(num_queries):
+        rows = generator.choice(
+            len(entries["ids"]), min(max_sources, len(entries["ids"])), replace=False
+        )
+        queries.append(
+            [
+                (
+                    entries["metadatas"][row].get("origin_uuid", None),
+                    entries["metadatas"][row].get("section_id", None),
+                )
+                for row in rows
+            ]
+        )
+    source_limit = token_limit / max_sources
+    cached_pages = {}
+
+    def build_from_pages(hits, full_pages):
+        return [
+            full_pages[origin_uuid].buildSections(
+                section_id=section_id,
+                selfSection=True,
+                children=True,
+                parent=True,
+                siblings=True,
+                token_limit=source_limit,
+            )
+            for origin_uuid, section_id in hits
+        ]
+
+    def build_from_cached_pages(hits):
+        for origin_uuid, section_id in hits:
+            if origin_uuid not in cached_pages:
+                cached_pages.update(collection.getPagesOriginUUIDList([origin_uuid]))
+        return build_from_pages(hits, cached_pages)
+
+    def build_from_windows(hits):
+        windows = store.get_windows(hits)
+        return [
+            windows[hit].buildSections(
+                selfSection=True,
+                children=True,
+                parent=True,
+                siblings=True,
+                token_limit=source_limit,
+            )
+            for hit in hits
+        ]
+
+    # Warm the page cache, as a long-running agent would
+    for hits in queries:
+        build_from_cached_pages(hits)
+    methods = {
+        "pages": lambda hits: build_from_pages(
+            hits,
+            collection.getPagesOriginUUIDList([origin_uuid for origin_uuid, _ in hits]),
+        ),
+        "cached": build_from_cached_pages,
+        "windows": build_from_windows,
+    }
+    contexts = {}
+    reports = []
+    for method, build_function in methods.items():
+        latencies = []
+        contexts[method] = []
+        for hits in queries:
+            start = time.perf_counter()
+            pages = build_function(hits)
+            latencies.append(1000 * (time.perf_counter() - start))
+            contexts[method].append(
+                "\n\n".join(
+                    section.content for page in pages for section in page.section_list
+                )
+            )
+        report = {"method": method} | summarize_latencies(latencies)
+        matches = [
+            context == page_context
+            for context, page_context in zip(contexts[method], contexts["pages"])
+        ]
+        report["matches"] = float(np.mean(matches)) if matches else 1.0
+        reports.append(report)
+    page_latency = reports[0]["latency_ms"]
+    store_bytes = store.stats()["store_bytes"]
+    chroma_file = os.path.join(vector_db_dir, "chroma.sqlite3")
+    chroma_bytes = os.path.getsize(chroma_file) if os.path.isfile(chroma_file) else 0
+    for report in reports:
+        report["saved_ms"] = page_latency - report["latency_ms"]
+        report["store_bytes"] = store_bytes
+        report["chroma_bytes"] = chroma_bytes
+    return reports
+
+
+# Return the rows of the `top_k` nearest vectors of each query, using the
+# same distance functions as Chroma.
+def get_exact_top_k(vectors: np.ndarray, queries: np.ndarray, space: str, top_k: int):
+    if space == "cosine":
+        vectors = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+    products = queries @ vectors.T
+    if space in ["cosine", "ip"]:
+        distances = 1.0 - products
+    else:
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        distances = norms[None, :] - 2.0 * products
+    return [np.argsort(row, kind="stable")[:top_k] for row in distances]
+
+
+# Return the total size in bytes of the files under a directory.
+def get_directory_size(directory: str) -> int:
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+# Sweep the HNSW settings of a Chroma collection. The stored embeddings are
+# copied into a temporary collection for each combination of `M` and
+# `construction_ef`, which is then queried with each `search_ef`. Queries
+# are sampled from the stored vectors, so no embedding model is called, and
+# recall@k is measured against an exact search in the collection's space.
+def benchmark_hnsw(
+    vector_db_dir: str,
+    collection_name: str,
+    m_values: list[int] = [16],
+    construction_ef_values: list[int] = [100],
+    search_ef_values: list[int] = [10, 20, 50, 100],
+    top_k: int = 10,
+    num_queries: int = 100,
+    max_entries: int = 0,
+    batch_size: int = 1000,
+    seed: int = 0,
+) -> list[dict]:
+    """Measures recall@k, latency, and build time of HNSW settings.
+    Args:
+        vector_db_dir: The directory of the Chroma database.
+        collection_name: The name of the collection.
+        m_values: The values of `hnsw:M` to build.
+        construction_ef_values: The values of `hnsw:construction_ef` to build.
+        search_ef_values: The values of `hnsw:search_ef` to query with.
+        top_k: The number of results per query.
+        num_queries: The number of queries sampled from the collection.
+        max_entries: (Optional) Only copy this many entries (0 copies all).
+        batch_size: The number of entries copied in a single call.
+        seed: The seed used to sample queries.
+
+    Returns:
+        A list of dictionaries, one per combination of settings, with the
+        recall@k, the average and 95th percentile latency, the build time,
+        and the size of the index.
+    """
+    chroma_client = chromadb.PersistentClient(path=vector_db_dir)
+    collection = chroma_client.get_collection(name=collection_name)
+    space = HNSW_DEFAULTS["hnsw:space"]
+    if collection.metadata:
+        space = collection.metadata.get("hnsw:space", space)
+    total = collection.count()
+    if max_entries > 0:
+        total = min(total, max_entries)
+    batches = []
+    for offset in range(0, total, batch_size):
+        entries = collection.get(
+            include=["embeddings"], limit=min(batch_size, total - offset), offset=offset
+        )
+        batches.append(np.asarray(entries["embeddings"], dtype=np.float32))
+    vectors = np.concatenate(batches) if batches else np.zeros((0, 0), np.float32)
+    generator = np.random.RandomState(seed)
+    query_rows = generator.choice(
+        len(vectors), min(num_queries, len(vectors)), replace=False
+    )
+    queries = vectors[query_rows]
+    exact_results = get_exact_top_k(vectors, queries, space, top_k)
+    reports = []
+    for m in m_values:
+        for construction_ef in construction_ef_values:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                sweep_client = chromadb.PersistentClient(path=temp_dir)
+                sweep_collection = sweep_client.create_collection(
+                    name="hnsw_sweep",
+                    metadata={
+                        "hnsw:space": space,
+                        "hnsw:M": int(m),
+                        "hnsw:construction_ef": int(construction_ef),
+                    },
+                )
+                start = time.perf_counter()
+                for offset in range(0, len(vectors), batch_size):
+                    batch = vectors[offset : offset + batch_size]
+                    sweep_collection.add(
+                        ids=[str(offset + i) for i in range(len(batch))],
+                        embeddings=batch.tolist(),
+                    )
+                build_time = time.perf_counter() - start
+                index_bytes = get_directory_size(temp_dir) - os.path.getsize(
+                    os.path.join(temp_dir, "chroma.sqlite3")
+                )
+                for search_ef in search_ef_values:
+                    set_search_ef(sweep_collection, int(search_ef))
+                    # The first query loads the index.
+                    sweep_collection.query(
+                        query_embeddings=[queries[0].tolist()], n_results=top_k
+                    )
+                    results = []
+                    latencies = []
+                    for query in queries:
+                        start = time.perf_counter()
+                        result = sweep_collection.query(
+                            query_embeddings=[query.tolist()],
+                            n_results=top_k,
+                            include=["distances"],
+                        )
+                        latencies.append(1000 * (time.perf_counter() - start))
+                        results.append(np.array([int(id) for id in result["ids"][0]]))
+                    reports.append(
+                        {
+                            "m": int(m),
+                            "construction_ef": int(construction_ef),
+                            "search_ef": int(search_ef),
+                            "recall": compute_recall(exact_results, results),
+                            "build_s": build_time,
+                            "index_bytes": index_bytes,
+                        }
+                        | summarize_latencies(latencies)
+                    )
+                del sweep_collection, sweep_client
+                release_chroma_client(temp_dir)
+    return reports
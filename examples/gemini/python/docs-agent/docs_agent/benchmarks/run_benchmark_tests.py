@@ -33,7 +33,9 @@ from docs_agent.utilities.config import ProductConfig
 
 
 # A function that asks the questin to the AI model using the RAG technique.
-def ask_model(question: str, docs_agent: DocsAgent):
+# A result from `DocsAgent.query_vector_store_batch` can be passed as
+# `query_result` to skip the search.
+def ask_model(question: str, docs_agent: DocsAgent, query_result=None):
     results_num = 5
     if "gemini" in docs_agent.config.models.language_model:
         # print("Asking a Gemini model")
@@ -42,6 +44,7 @@ def ask_model(question: str, docs_agent: DocsAgent):
             token_limit=30000,
             results_num=results_num,
             max_sources=results_num,
+            query_result=query_result,
         )
         response, full_prompt = docs_agent.ask_content_model_with_context_prompt(
             context=final_context, question=question
@@ -120,6 +123,19 @@ def run_benchmarks():
     # Read the `benchmarks.yaml` file.
     benchmark_values = read_benchmarks_yaml()
 
+    # Search the vector database for all questions at once, which embeds
+    # the questions in one request.
+    query_results = [None] * len(benchmark_values["benchmarks"])
+    if (
+        "gemini" in product.models.language_model
+        and product.db_type != "google_semantic_retriever"
+    ):
+        query_results = docs_agent.query_vector_store_batch(
+            [benchmark["question"] for benchmark in benchmark_values["benchmarks"]],
+            num_returns=5,
+            max_sources=5,
+        )
+
     questions = []
     results = []
     index = 0
@@ -153,7 +169,7 @@ def run_benchmarks():
         vprint(str(embedding_01))
 
         # Step 3. Ask `question` to the AI model.
-        response = ask_model(question, docs_agent)
+        response = ask_model(question, docs_agent, query_results[index])
         vprint("################")
         vprint("# Response     #")
         vprint("################")
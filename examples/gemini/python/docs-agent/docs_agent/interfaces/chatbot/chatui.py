@@ -39,6 +39,9 @@ from docs_agent.preprocess.splitters import markdown_splitter
 from docs_agent.postprocess.docs_retriever import SectionProbability
 
 from docs_agent.storage.chroma import Format
+from docs_agent.storage.collection_registry import get_collection_registry
+from docs_agent.storage.metadata_filters import InvalidFilterError
+from docs_agent.storage.metadata_filters import normalize_filters
 from docs_agent.agents.docs_agent import DocsAgent
 
 from docs_agent.memory.logging import (
@@ -104,12 +107,22 @@ def construct_blueprint(
         try:
             input = request.get_json()
             if input["question"]:
+                # Optional metadata filters, for example,
+                # {"url_prefix": "https://example.com/docs/"}
+                filters = input.get("filters", None)
+                if filters is not None and not isinstance(filters, dict):
+                    error = "The filters key must be a JSON object"
+                    return jsonify({"error": error}), 400
+                filters = normalize_filters(filters)
                 (
                     full_prompt,
                     response,
                     context,
                     search_result,
-                ) = ask_model_with_sources(input["question"], agent=docs_agent)
+                    cached,
+                ) = ask_model_with_sources(
+                    input["question"], agent=docs_agent, filters=filters
+                )
                 source_array = []
                 # for source in search_result:
                 #     source_array.append(source.returnDictionary())
@@ -117,11 +130,14 @@ def construct_blueprint(
                     "response": response,
                     "full_prompt": full_prompt,
                     "sources": source_array,
+                    "cached": cached,
                 }
                 return jsonify(dictionary)
             else:
                 error = "Must have a valid question key in your JSON"
                 return jsonify({"error": error}), 400
+        except InvalidFilterError as error:
+            return jsonify({"error": str(error)}), 400
         except:
             error = "Must be a valid JSON"
             return jsonify({"error": error}), 400
@@ -266,6 +282,22 @@ def construct_blueprint(
     def logs():
         return show_logs(agent=docs_agent)
 
+    # Return the hit rates of the caches, which are used to size them.
+    @bp.route("/api/cache-stats", methods=["GET"])
+    def cache_stats():
+        if docs_agent.config.enable_show_logs != "True":
+            return jsonify({"error": "Logs are not enabled"}), 403
+        page_cache_stats = {}
+        if docs_agent.page_cache is not None:
+            page_cache_stats = docs_agent.page_cache.stats()
+        return jsonify(
+            {
+                "query_embedding_cache": docs_agent.get_query_embedding_cache_stats(),
+                "page_cache": page_cache_stats,
+                "collection_registry": get_collection_registry().stats(),
+            }
+        )
+
     # Render the debug view page.
     @bp.route("/debugs/<filename>", methods=["GET", "POST"])
     def debugs(filename):
@@ -303,6 +335,8 @@ def ask_model(question, agent, template: str = "chatui/index.html"):
     new_question_count = 5
     results_num = 5
     aqa_response_in_html = ""
+    cached_answer = None
+    adaptive_top_k = "None"
 
     # Debugging feature: Do not log this question if it ends with `?do_not_log`.
     can_be_logged = True
@@ -355,22 +389,42 @@ def ask_model(question, agent, template: str = "chatui/index.html"):
             # response = ask_content_model_with_context(context="", question=question)
             # Issue if max_sources > results_num, so leave the same for now
         else:
-            this_token_limit = 30000
-            if docs_agent.config.models.language_model.startswith("models/gemini-1.5"):
-                this_token_limit = 50000
-            search_result, final_context = docs_agent.query_vector_store_to_build(
-                question=question,
-                token_limit=this_token_limit,
-                results_num=results_num,
-                max_sources=results_num,
-            )
-        try:
-            response, full_prompt = docs_agent.ask_content_model_with_context_prompt(
-                context=final_context, question=question
-            )
-            aqa_response_in_html = ""
-        except:
-            logging.error("Failed to ask content model with context prompt.")
+            # Return the answer of a similar question if it is in the cache.
+            cached_answer = docs_agent.lookup_cached_answer(question)
+            if cached_answer is not None:
+                search_result = cached_answer.search_result
+                final_context = cached_answer.context
+                response = cached_answer.response
+            else:
+                this_token_limit = 30000
+                if docs_agent.config.models.language_model.startswith(
+                    "models/gemini-1.5"
+                ):
+                    this_token_limit = 50000
+                search_result, final_context = docs_agent.query_vector_store_to_build(
+                    question=question,
+                    token_limit=this_token_limit,
+                    results_num=results_num,
+                    max_sources=results_num,
+                )
+                # Record the number of results used for this question
+                if docs_agent.last_adaptive_top_k is not None:
+                    adaptive_top_k = str(docs_agent.last_adaptive_top_k)
+        if cached_answer is None:
+            try:
+                (
+                    response,
+                    full_prompt,
+                ) = docs_agent.ask_content_model_with_context_prompt(
+                    context=final_context, question=question
+                )
+                aqa_response_in_html = ""
+                if docs_agent.config.db_type != "none":
+                    docs_agent.save_answer_to_cache(
+                        question, response, final_context, search_result
+                    )
+            except:
+                logging.error("Failed to ask content model with context prompt.")
 
     ### Check the AQA model's answerable_probability field
     probability = "None"
@@ -507,6 +561,7 @@ def ask_model(question, agent, template: str = "chatui/index.html"):
                 source_urls=source_urls,
                 probability=probability,
                 server_url=server_url,
+                adaptive_top_k=adaptive_top_k,
             )
 
     ### Check the feedback mode in the `config.yaml` file.
@@ -530,29 +585,40 @@ def ask_model(question, agent, template: str = "chatui/index.html"):
         search_result=search_result,
         summary_response=summary_response,
         feedback_mode=feedback_mode,
+        cached_answer=cached_answer,
     )
 
 
 # Not fully implemented
 # This method is used for the API endpoint, so it returns values that can be
 # packaged as JSON
-def ask_model_with_sources(question, agent):
+def ask_model_with_sources(question, agent, filters=None):
     docs_agent = agent
     full_prompt = ""
+    # Return the answer of a similar question if it is in the cache.
+    cached_answer = docs_agent.lookup_cached_answer(question, filters)
+    if cached_answer is not None:
+        return (
+            full_prompt,
+            cached_answer.response,
+            cached_answer.context,
+            cached_answer.search_result,
+            True,
+        )
     search_result, context = docs_agent.query_vector_store_to_build(
-        question=question, token_limit=30000, results_num=10, max_sources=10
+        question=question,
+        token_limit=30000,
+        results_num=10,
+        max_sources=10,
+        filters=filters,
     )
-    context_with_instruction = docs_agent.add_instruction_to_context(context)
-    if "gemini" in docs_agent.get_language_model_name():
-        response, full_prompt = docs_agent.ask_content_model_with_context_prompt(
-            context=context, question=question
-        )
-    else:
-        response = docs_agent.ask_text_model_with_context(
-            context_with_instruction, question
-        )
+    # The content model is the language_model in the product's config.
+    response, full_prompt = docs_agent.ask_content_model_with_context_prompt(
+        context=context, question=question
+    )
+    docs_agent.save_answer_to_cache(question, response, context, search_result, filters)
 
-    return full_prompt, response, context, search_result
+    return full_prompt, response, context, search_result, False
 
 
 # Display a page showing logs
@@ -35,6 +35,27 @@ from docs_agent.benchmarks import run_benchmark_tests as benchmarks
 from docs_agent.interfaces import chatbot as chatbot_flask
 from docs_agent.storage.google_semantic_retriever import SemanticRetriever
 from docs_agent.storage.chroma import ChromaEnhanced
+from docs_agent.storage.numpy_store import NumpyStoreNotFoundError
+from docs_agent.storage.numpy_store import default_numpy_dir
+from docs_agent.benchmarks.retrieval_benchmarks import (
+    benchmark_quantization as benchmark_quantization_of_store,
+)
+from docs_agent.benchmarks.retrieval_benchmarks import (
+    benchmark_reduction as benchmark_reduction_of_store,
+)
+from docs_agent.benchmarks.retrieval_benchmarks import (
+    benchmark_hybrid as benchmark_hybrid_search,
+)
+from docs_agent.benchmarks.retrieval_benchmarks import benchmark_batch_queries
+from docs_agent.benchmarks.retrieval_benchmarks import (
+    benchmark_hnsw as benchmark_hnsw_settings,
+)
+from docs_agent.benchmarks.retrieval_benchmarks import (
+    benchmark_context_windows as benchmark_context_windows_of_store,
+)
+from docs_agent.storage.context_windows import ContextWindowsNotFoundError
+from docs_agent.storage.reduction import REDUCTIONS
+from docs_agent.storage.lexical_index import LexicalIndexNotFoundError
 from docs_agent.memory.logging import write_logs_to_csv_file
 from docs_agent.interfaces.cli.cli_common import common_options
 from docs_agent.interfaces.cli.cli_common import show_config
@@ -57,12 +78,25 @@ def cli_admin(ctx, config_file, product):
 
 
 @cli_admin.command()
+@click.option(
+    "--collapse_near_duplicates",
+    is_flag=True,
+    help="Collapse near-duplicate text chunks into canonical chunks.",
+)
 @common_options
-def chunk(config_file: typing.Optional[str], product: list[str] = [""]):
+def chunk(
+    config_file: typing.Optional[str],
+    collapse_near_duplicates: bool = False,
+    product: list[str] = [""],
+):
     """Convert files to plain text chunks."""
     loaded_config, product_config = return_config_and_product(
         config_file=config_file, product=product
     )
+    # If `--collapse_near_duplicates` flag is set, update the config object.
+    if collapse_near_duplicates:
+        for product in product_config.products:
+            product.enable_near_duplicate_collapsing = "True"
     chunker.process_all_products(config_file=product_config)
     click.echo("\nFiles are successfully converted into text chunks.")
 
@@ -73,13 +107,37 @@ def chunk(config_file: typing.Optional[str], product: list[str] = [""]):
     is_flag=True,
     help="Delete stale chunks in the existing databases.",
 )
+@click.option(
+    "--popular_first",
+    is_flag=True,
+    help="Populate the pages retrieved most often in the local logs first.",
+)
+@click.option(
+    "--dry_run",
+    is_flag=True,
+    help="Estimate the number of chunks, embedding calls, tokens, and time without populating the databases.",
+)
+@click.option(
+    "--shard",
+    default="",
+    help="Populate only shard i of N (for example, 2/4) into a shard-local database.",
+)
 @common_options
 def populate(
     config_file: typing.Optional[str],
     enable_delete_chunks: bool = False,
+    popular_first: bool = False,
+    dry_run: bool = False,
+    shard: str = "",
     product: list[str] = [""],
 ):
     """Populate a vector database using text chunks."""
+    # Check the `--shard` flag before loading anything.
+    if shard != "":
+        try:
+            populate_script.parse_shard(shard)
+        except ValueError as error:
+            raise click.BadParameter(str(error), param_hint="--shard")
     # Loads configurations from common options
     loaded_config, product_config = return_config_and_product(
         config_file=config_file, product=product
@@ -88,12 +146,518 @@ def populate(
     if enable_delete_chunks:
         for product in product_config.products:
             product.enable_delete_chunks = "True"
+    # If `--popular_first` flag is set, update the config object.
+    if popular_first:
+        for product in product_config.products:
+            product.populate_order = "popularity"
+
+    # If `--dry_run` flag is set, only print the estimates.
+    if dry_run:
+        populate_script.estimate_all_products(config_file=product_config, shard=shard)
+        return
 
-    populate_script.process_all_products(config_file=product_config)
+    populate_script.process_all_products(config_file=product_config, shard=shard)
     for item in product_config.products:
         click.echo(f"\nText chunks are successfully added to {item.db_type}.")
 
 
+@cli_admin.command()
+@click.option(
+    "--shards",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="The number of shards (N) used by `agent populate --shard i/N`.",
+)
+@common_options
+def merge_db(
+    shards: int,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Merge shard-local databases into one Chroma database."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    populate_script.merge_all_products(config_file=product_config, shard_count=shards)
+    click.echo(f"Merged {shards} shards without re-embedding text chunks.")
+
+
+@cli_admin.command()
+@common_options
+def export_numpy(
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Export Chroma collections to memory-mapped NumPy stores."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        populate_script.export_numpy_from_product(product_config=item, export_all=True)
+    click.echo("\nChroma collections are successfully exported to NumPy stores.")
+
+
+@cli_admin.command()
+@common_options
+def compact_metadata(
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Rewrite the parent trees of existing entries in the compact format."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        click.echo(f"Product: {item.product_name}")
+        populate_script.compact_metadata_from_product(product_config=item)
+
+
+@cli_admin.command()
+@common_options
+def index_metadata(
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Prepare existing Chroma collections for metadata filters."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        click.echo(f"Product: {item.product_name}")
+        populate_script.index_metadata_from_product(product_config=item)
+    click.echo("\nChroma metadata is successfully indexed.")
+
+
+@cli_admin.command()
+@click.option("--top_k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--rerank_oversample",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Re-rank this many times top_k candidates with the float vectors.",
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Rebuild the quantized indexes even if they exist.",
+)
+@common_options
+def benchmark_quantization(
+    top_k: int,
+    num_queries: int,
+    rerank_oversample: int,
+    rebuild: bool,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Compare the recall@k of quantized indexes to the float index."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            numpy_dir = db_config.numpy_dir
+            if numpy_dir is None or numpy_dir == "":
+                numpy_dir = default_numpy_dir(db_config.vector_db_dir)
+            try:
+                reports = benchmark_quantization_of_store(
+                    numpy_dir=numpy_dir,
+                    collection_name=db_config.collection_name,
+                    top_k=top_k,
+                    num_queries=num_queries,
+                    rerank_oversample=rerank_oversample,
+                    pq_subvectors=db_config.pq_subvectors,
+                    rebuild=rebuild,
+                )
+            except NumpyStoreNotFoundError as error:
+                click.echo(str(error))
+                continue
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(f"Collection: {db_config.collection_name} (top_k={top_k})")
+            click.echo(
+                f"{'Index':<10}{'Recall@k':>10}{'No rerank':>11}"
+                + f"{'Latency (ms)':>14}{'Size (MB)':>12}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['index']:<10}{report['recall']:>10.3f}"
+                    + f"{report['recall_without_rerank']:>11.3f}"
+                    + f"{report['latency_ms']:>14.3f}"
+                    + f"{report['index_bytes'] / 1e6:>12.2f}"
+                )
+
+
+@cli_admin.command()
+@click.option(
+    "--reduction",
+    multiple=True,
+    default=REDUCTIONS,
+    show_default=True,
+    type=click.Choice(REDUCTIONS),
+    help="The reductions to compare (can be repeated).",
+)
+@click.option(
+    "--dimension",
+    multiple=True,
+    default=[64, 128, 256],
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="The dimensions of the reduced indexes (can be repeated).",
+)
+@click.option("--top_k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--rerank_oversample",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Re-rank this many times top_k candidates with the float vectors.",
+)
+@click.option(
+    "--keep",
+    is_flag=True,
+    help="Keep the reduced indexes that the benchmark builds.",
+)
+@common_options
+def benchmark_reduction(
+    reduction: list[str],
+    dimension: list[int],
+    top_k: int,
+    num_queries: int,
+    rerank_oversample: int,
+    keep: bool,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Compare the recall@k of reduced indexes to the float index."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            numpy_dir = db_config.numpy_dir
+            if numpy_dir is None or numpy_dir == "":
+                numpy_dir = default_numpy_dir(db_config.vector_db_dir)
+            try:
+                reports = benchmark_reduction_of_store(
+                    numpy_dir=numpy_dir,
+                    collection_name=db_config.collection_name,
+                    reductions=list(reduction),
+                    dimensions=sorted(set(dimension)),
+                    top_k=top_k,
+                    num_queries=num_queries,
+                    rerank_oversample=rerank_oversample,
+                    keep=keep,
+                )
+            except NumpyStoreNotFoundError as error:
+                click.echo(str(error))
+                continue
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(f"Collection: {db_config.collection_name} (top_k={top_k})")
+            click.echo(
+                f"{'Index':<19}{'Dim':>6}{'Recall@k':>10}{'No rerank':>11}"
+                + f"{'Latency (ms)':>14}{'Size (MB)':>12}{'Build (s)':>11}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['index']:<19}{report['dimension']:>6}"
+                    + f"{report['recall']:>10.3f}"
+                    + f"{report['recall_without_rerank']:>11.3f}"
+                    + f"{report['latency_ms']:>14.3f}"
+                    + f"{report['index_bytes'] / 1e6:>12.2f}"
+                    + f"{report['build_s']:>11.2f}"
+                )
+
+
+@cli_admin.command()
+@common_options
+def build_lexical_index(
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Build full-text indexes of Chroma collections for hybrid search."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        populate_script.build_lexical_index_from_product(
+            product_config=item, build_all=True
+        )
+    click.echo("\nLexical indexes are successfully built.")
+
+
+@cli_admin.command()
+@common_options
+def build_context_windows(
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Precompute the context windows of sections in Chroma collections."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        populate_script.build_context_windows_from_product(
+            product_config=item, build_all=True
+        )
+    click.echo("\nContext windows are successfully built.")
+
+
+@cli_admin.command()
+@click.option(
+    "--token_limit", default=30000, show_default=True, type=click.FloatRange(min=1)
+)
+@click.option("--max_sources", default=5, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@common_options
+def benchmark_context_windows(
+    token_limit: float,
+    max_sources: int,
+    num_queries: int,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Measure the latency that precomputed context windows save."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            try:
+                reports = benchmark_context_windows_of_store(
+                    vector_db_dir=resolve_path(db_config.vector_db_dir),
+                    collection_name=db_config.collection_name,
+                    context_window_dir=db_config.context_window_dir,
+                    token_limit=token_limit,
+                    max_sources=max_sources,
+                    num_queries=num_queries,
+                )
+            except ContextWindowsNotFoundError as error:
+                click.echo(str(error))
+                continue
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(
+                f"Collection: {db_config.collection_name} "
+                + f"(max_sources={max_sources})"
+            )
+            click.echo(
+                f"{'Context':<10}{'Latency (ms)':>14}{'p95 (ms)':>10}"
+                + f"{'Saved (ms)':>12}{'Matches':>9}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['method']:<10}{report['latency_ms']:>14.3f}"
+                    + f"{report['p95_latency_ms']:>10.3f}"
+                    + f"{report['saved_ms']:>12.3f}"
+                    + f"{report['matches']:>9.2f}"
+                )
+            click.echo(
+                f"Context windows: {reports[-1]['store_bytes'] / 1e6:.2f} MB, "
+                + f"Chroma database: {reports[-1]['chroma_bytes'] / 1e6:.2f} MB"
+            )
+
+
+@cli_admin.command()
+@click.option("--top_k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@common_options
+def benchmark_hybrid(
+    top_k: int,
+    num_queries: int,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Measure the latency that hybrid search adds to vector search."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            try:
+                reports = benchmark_hybrid_search(
+                    vector_db_dir=resolve_path(db_config.vector_db_dir),
+                    collection_name=db_config.collection_name,
+                    lexical_index_dir=db_config.lexical_index_dir,
+                    top_k=top_k,
+                    num_queries=num_queries,
+                    vector_weight=db_config.hybrid_vector_weight,
+                    lexical_weight=db_config.hybrid_lexical_weight,
+                    rrf_k=db_config.rrf_k,
+                )
+            except LexicalIndexNotFoundError as error:
+                click.echo(str(error))
+                continue
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(f"Collection: {db_config.collection_name} (top_k={top_k})")
+            click.echo(
+                f"{'Search':<10}{'Latency (ms)':>14}{'p95 (ms)':>10}"
+                + f"{'Overhead (ms)':>15}{'Changed':>9}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['mode']:<10}{report['latency_ms']:>14.3f}"
+                    + f"{report['p95_latency_ms']:>10.3f}"
+                    + f"{report['overhead_ms']:>15.3f}"
+                    + f"{report['changed']:>9.2f}"
+                )
+
+
+@cli_admin.command()
+@click.option(
+    "--m",
+    multiple=True,
+    default=[16],
+    show_default=True,
+    type=click.IntRange(min=2),
+    help="The values of hnsw:M to build (can be repeated).",
+)
+@click.option(
+    "--construction_ef",
+    multiple=True,
+    default=[100],
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="The values of hnsw:construction_ef to build (can be repeated).",
+)
+@click.option(
+    "--search_ef",
+    multiple=True,
+    default=[10, 20, 50, 100],
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="The values of hnsw:search_ef to query with (can be repeated).",
+)
+@click.option("--top_k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@click.option(
+    "--max_entries",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Only copy this many entries of each collection (0 copies all).",
+)
+@common_options
+def benchmark_hnsw(
+    m: list[int],
+    construction_ef: list[int],
+    search_ef: list[int],
+    top_k: int,
+    num_queries: int,
+    max_entries: int,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Sweep the HNSW settings of collections and report recall and latency."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            reports = benchmark_hnsw_settings(
+                vector_db_dir=resolve_path(db_config.vector_db_dir),
+                collection_name=db_config.collection_name,
+                m_values=sorted(set(m)),
+                construction_ef_values=sorted(set(construction_ef)),
+                search_ef_values=sorted(set(search_ef)),
+                top_k=top_k,
+                num_queries=num_queries,
+                max_entries=max_entries,
+            )
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(f"Collection: {db_config.collection_name} (top_k={top_k})")
+            click.echo(
+                f"{'M':>4}{'construction_ef':>17}{'search_ef':>11}{'Recall@k':>10}"
+                + f"{'Latency (ms)':>14}{'p95 (ms)':>10}{'Build (s)':>11}"
+                + f"{'Size (MB)':>11}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['m']:>4}{report['construction_ef']:>17}"
+                    + f"{report['search_ef']:>11}{report['recall']:>10.3f}"
+                    + f"{report['latency_ms']:>14.3f}"
+                    + f"{report['p95_latency_ms']:>10.3f}"
+                    + f"{report['build_s']:>11.2f}"
+                    + f"{report['index_bytes'] / 1e6:>11.2f}"
+                )
+
+
+@cli_admin.command()
+@click.option("--top_k", default=10, show_default=True, type=click.IntRange(min=1))
+@click.option(
+    "--num_queries", default=100, show_default=True, type=click.IntRange(min=1)
+)
+@common_options
+def benchmark_batch_query(
+    top_k: int,
+    num_queries: int,
+    config_file: typing.Optional[str],
+    product: list[str] = [""],
+):
+    """Compare the latency of sequential and batch vector queries."""
+    # Loads configurations from common options
+    loaded_config, product_config = return_config_and_product(
+        config_file=config_file, product=product
+    )
+    for item in product_config.products:
+        for db_config in item.db_configs:
+            if "chroma" not in db_config.db_type:
+                continue
+            reports = benchmark_batch_queries(
+                vector_db_dir=resolve_path(db_config.vector_db_dir),
+                collection_name=db_config.collection_name,
+                numpy_dir=db_config.numpy_dir,
+                top_k=top_k,
+                num_queries=num_queries,
+            )
+            click.echo(f"\nProduct: {item.product_name}")
+            click.echo(f"Collection: {db_config.collection_name} (top_k={top_k})")
+            click.echo(
+                f"{'Store':<10}{'Sequential (ms)':>17}{'Batch (ms)':>12}"
+                + f"{'Speedup':>9}{'Matches':>9}"
+            )
+            for report in reports:
+                click.echo(
+                    f"{report['store']:<10}{report['sequential_ms']:>17.3f}"
+                    + f"{report['batch_ms']:>12.3f}"
+                    + f"{report['speedup']:>9.2f}"
+                    + f"{report['matches']:>9.2f}"
+                )
+
+
 @cli_admin.command()
 @click.option("--hostname", default=socket.gethostname(), show_default=True)
 @click.option("--port", default=5000, show_default=True, type=int)
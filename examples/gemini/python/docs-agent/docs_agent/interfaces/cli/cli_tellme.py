@@ -21,6 +21,8 @@ import typing
 from docs_agent.utilities import config
 from docs_agent.utilities.config import ConfigFile
 from docs_agent.utilities.config import return_config_and_product
+from docs_agent.storage.metadata_filters import InvalidFilterError
+from docs_agent.storage.metadata_filters import parse_filters
 
 from docs_agent.interfaces import run_console as console
 from docs_agent.interfaces.cli.cli_common import common_options
@@ -59,6 +61,23 @@ def cli_tellme(ctx, config_file, product):
     is_flag=True,
     help="Use the previous responses in the session as context.",
 )
+@click.option(
+    "--filter",
+    "filters",
+    help="Only search text chunks whose metadata match key=value "
+    + "(for example, url_prefix=https://example.com/docs/). Can be repeated.",
+    multiple=True,
+)
+@click.option(
+    "--merge",
+    is_flag=True,
+    help="Merge the answers of all products into a single answer.",
+)
+@click.option(
+    "--sequential_generation",
+    is_flag=True,
+    help="Search all products at the same time, but ask their models one at a time.",
+)
 @click.option(
     "--sleep",
     type=int,
@@ -75,6 +94,9 @@ def tellme(
     sleep: int = 0,
     product: list[str] = [""],
     model: typing.Optional[str] = None,
+    filters: tuple[str, ...] = (),
+    merge: bool = False,
+    sequential_generation: bool = False,
 ):
     """Answer a question related to the product."""
     # Loads configurations from common options
@@ -96,8 +118,22 @@ def tellme(
         question += word + " "
     question = question.strip()
 
+    # Parse the metadata filters of the search.
+    try:
+        search_filters = parse_filters(filters)
+    except InvalidFilterError as error:
+        click.echo(str(error))
+        return
+
     # Ask the model and retrieve the response.
-    this_output = console.ask_model(question, product_config, return_output=True)
+    this_output = console.ask_model(
+        question,
+        product_config,
+        return_output=True,
+        filters=search_filters,
+        merge_answers=merge,
+        parallel_generation=not sequential_generation,
+    )
 
     # If the `--new` flag is set, overwrite the history file.
     write_mode = "None"
@@ -16,6 +16,10 @@
 
 """Run the Docs Agent console in the terminal"""
 
+import concurrent.futures
+import contextlib
+import threading
+import time
 import typing
 from absl import logging
 from rich.console import Console
@@ -27,6 +31,7 @@ from PIL import Image
 
 from docs_agent.agents.docs_agent import DocsAgent
 from docs_agent.utilities.config import ConfigFile
+from docs_agent.utilities.config import ProductConfig
 
 
 # This function is used by the `helpme` command to ask the Gemini Pro model
@@ -56,129 +61,229 @@ def ask_model_for_help(question: str, context: str, product_configs: ConfigFile)
     ai_console.print(good_response)
 
 
+class ProductAnswer:
+    """The answer of a product to a question and where it came from"""
+
+    def __init__(
+        self,
+        product_name: str,
+        response: str,
+        search_result: list,
+        link: typing.Optional[str] = None,
+        cached_question: typing.Optional[str] = None,
+        elapsed_seconds: float = 0.0,
+    ) -> None:
+        self.product_name = product_name
+        self.response = response
+        self.search_result = search_result
+        self.link = link
+        # The similar question whose cached answer is returned, if any
+        self.cached_question = cached_question
+        self.elapsed_seconds = elapsed_seconds
+
+
+# Return the link to the first search result of an answer.
+def get_source_link(search_result: list):
+    if len(search_result) >= 1:
+        if search_result[0].section.url == "":
+            return str(search_result[0].section)
+        return search_result[0].section.url
+    return None
+
+
+# Ask a single product a question: searches its vector database (or online
+# corpus) and asks its model. Returns None if the product isn't supported.
+# `on_status` is called with a description of the current step. If a
+# `generation_lock` is given, the model is asked while holding it, so that
+# products search at the same time but only one asks its model at a time
+# (AQA models search and answer in one call, so they hold it for both).
+def ask_product(
+    question: str,
+    product: ProductConfig,
+    filters: typing.Optional[dict] = None,
+    generation_lock: typing.Optional[threading.Lock] = None,
+    on_status: typing.Optional[typing.Callable[[str], None]] = None,
+) -> typing.Optional[ProductAnswer]:
+    start = time.perf_counter()
+    if generation_lock is None:
+        generation_lock = contextlib.nullcontext()
+    if on_status is None:
+        on_status = lambda description: None
+    results_num = 5
+    cached_question = None
+    if "gemini" in product.models.language_model:
+        docs_agent = DocsAgent(config=product)
+        on_status(
+            f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, source: {docs_agent.return_chroma_collection()}) "
+        )
+        if docs_agent.config.docs_agent_config == "experimental":
+            results_num = 10
+        # Return the answer of a similar question if it is in the cache.
+        cached_answer = docs_agent.lookup_cached_answer(question, filters)
+        if cached_answer is not None:
+            search_result = cached_answer.search_result
+            response = cached_answer.response
+            cached_question = cached_answer.question
+        else:
+            # Issue if max_sources > results_num, so leave the same for now
+            (
+                search_result,
+                final_context,
+            ) = docs_agent.query_vector_store_to_build(
+                question=question,
+                token_limit=30000,
+                results_num=results_num,
+                max_sources=results_num,
+                filters=filters,
+            )
+            with generation_lock:
+                (
+                    response,
+                    full_prompt,
+                ) = docs_agent.ask_content_model_with_context_prompt(
+                    context=final_context, question=question
+                )
+            docs_agent.save_answer_to_cache(
+                question, response, final_context, search_result, filters
+            )
+    elif "aqa" in product.models.language_model:
+        if product.db_type == "google_semantic_retriever":
+            docs_agent = DocsAgent(config=product, init_chroma=False)
+            label = f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, "
+            corpus_name = ""
+            for db_config in product.db_configs:
+                if db_config.db_type == "google_semantic_retriever":
+                    corpus_name = db_config.corpus_name
+            if corpus_name != "":
+                label += "source: " + corpus_name + ") "
+            on_status(label)
+            with generation_lock:
+                (response, search_result) = docs_agent.ask_aqa_model_using_corpora(
+                    question=question
+                )
+        elif product.db_type == "chroma":
+            docs_agent = DocsAgent(config=product, init_chroma=True)
+            on_status(
+                f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, source: {docs_agent.return_chroma_collection()}) "
+            )
+            with generation_lock:
+                (
+                    response,
+                    search_result,
+                ) = docs_agent.ask_aqa_model_using_local_vector_store(
+                    question=question, results_num=results_num
+                )
+        else:
+            logging.error(f"Unknown db_type: {product.db_type}")
+            return None
+    else:
+        return None
+    return ProductAnswer(
+        product_name=product.product_name,
+        response=response,
+        search_result=search_result,
+        link=get_source_link(search_result),
+        cached_question=cached_question,
+        elapsed_seconds=time.perf_counter() - start,
+    )
+
+
 # This function is used by the `tellme` command to ask the Gemini AQA model
-# a question from an online corpus.
-def ask_model(question: str, product_configs: ConfigFile, return_output: bool = False):
+# a question from an online corpus. Filters limit the search of a local vector
+# database to text chunks whose metadata match all of them.
+# All products are asked at the same time, and each answer is printed as soon
+# as it's ready. If `merge_answers` is set, the answers are merged into a
+# single answer by a Gemini model instead. If `parallel_generation` is not
+# set, products search at the same time but ask their models one at a time.
+def ask_model(
+    question: str,
+    product_configs: ConfigFile,
+    return_output: bool = False,
+    filters: typing.Optional[dict] = None,
+    merge_answers: bool = False,
+    parallel_generation: bool = True,
+):
     # Initialize Rich console
     ai_console = Console(width=160)
-    full_prompt = ""
-    final_context = ""
-    results_num = 5
+    products = list(product_configs.products)
     # Initialize Docs Agent
     with Progress(transient=True) as progress:
-        search_results = []
-        responses = []
-        links = []
+        answers = [None] * len(products)
         task_docs_agent = progress.add_task(
             "[turquoise4 bold]Starting Docs Agent ", total=None, refresh=True
         )
-        for product in product_configs.products:
-            if "gemini" in product.models.language_model:
-                docs_agent = DocsAgent(config=product)
+
+        # Show the current step of a single product, or the products that
+        # are still being asked
+        def update_status(description: str):
+            if len(products) == 1:
+                progress.update(task_docs_agent, description=description, total=None)
+
+        def update_pending(pending: list[str]):
+            if len(products) > 1 and len(pending) > 0:
                 progress.update(
                     task_docs_agent,
-                    description=f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, source: {docs_agent.return_chroma_collection()}) ",
+                    description=f"[turquoise4 bold]Asking {len(pending)} products ({', '.join(pending)}) ",
                     total=None,
                 )
-                if docs_agent.config.docs_agent_config == "experimental":
-                    results_num = 10
-                    new_question_count = 5
-                else:
-                    results_num = 5
-                    new_question_count = 5
-                # Issue if max_sources > results_num, so leave the same for now
-                search_result, final_context = docs_agent.query_vector_store_to_build(
-                    question=question,
-                    token_limit=30000,
-                    results_num=results_num,
-                    max_sources=results_num,
-                )
-                (
-                    response,
-                    full_prompt,
-                ) = docs_agent.ask_content_model_with_context_prompt(
-                    context=final_context, question=question
-                )
-                if len(search_result) >= 1:
-                    if search_result[0].section.url == "":
-                        link = str(search_result[0].section)
-                    else:
-                        link = search_result[0].section.url
-                search_results.append(search_result)
-                responses.append(response)
-                links.append(link)
-            elif "aqa" in product.models.language_model:
-                if product.db_type == "google_semantic_retriever":
-                    docs_agent = DocsAgent(config=product, init_chroma=False)
-                    label = f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, "
-                    corpus_name = ""
-                    for db_config in product.db_configs:
-                        if db_config.db_type == "google_semantic_retriever":
-                            corpus_name = db_config.corpus_name
-                    if corpus_name != "":
-                        label += "source: " + corpus_name + ") "
-                    progress.update(
-                        task_docs_agent, description=label, total=None, refresh=True
-                    )
-                    (response, search_result) = docs_agent.ask_aqa_model_using_corpora(
-                        question=question
-                    )
-                    if len(search_result) >= 1:
-                        if search_result[0].section.url == "":
-                            link = str(search_result[0].section)
-                        else:
-                            link = search_result[0].section.url
-                    search_results.append(search_result)
-                    responses.append(response)
-                    links.append(link)
-                elif product.db_type == "chroma":
-                    docs_agent = DocsAgent(config=product, init_chroma=True)
-                    progress.update(
-                        task_docs_agent,
-                        description=f"[turquoise4 bold]Asking Gemini (model: {product.models.language_model}, source: {docs_agent.return_chroma_collection()}) ",
-                        total=None,
-                    )
-                    (
-                        response,
-                        search_result,
-                    ) = docs_agent.ask_aqa_model_using_local_vector_store(
-                        question=question, results_num=results_num
+
+        generation_lock = None if parallel_generation else threading.Lock()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(products))
+        ) as executor:
+            futures = {
+                executor.submit(
+                    ask_product,
+                    question,
+                    product,
+                    filters,
+                    generation_lock,
+                    update_status,
+                ): index
+                for index, product in enumerate(products)
+            }
+            pending = [product.product_name for product in products]
+            update_pending(pending)
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                pending.remove(products[index].product_name)
+                update_pending(pending)
+                try:
+                    answer = future.result()
+                except Exception as error:
+                    # A single product fails as before, but the answers of
+                    # the other products are still shown
+                    if len(products) == 1:
+                        raise
+                    logging.error(
+                        f"Failed to ask {products[index].product_name}: {error}"
                     )
-                    if len(search_result) >= 1:
-                        if search_result[0].section.url == "":
-                            link = str(search_result[0].section)
-                        else:
-                            link = search_result[0].section.url
-                    search_results.append(search_result)
-                    responses.append(response)
-                    links.append(link)
-                else:
-                    logging.error(f"Unknown db_type: {product.db_type}")
-        final_search = []
-        final_responses = []
+                    continue
+                if answer is None:
+                    continue
+                logging.info(
+                    f"{answer.product_name} answered in {answer.elapsed_seconds:.2f} s"
+                )
+                answers[index] = answer
+                if not merge_answers:
+                    # Print each answer as soon as it's ready
+                    ai_console.print()
+                    if len(products) > 1:
+                        ai_console.print(f"[{answer.product_name}]", markup=False)
+                    ai_console.print(Markdown(answer.response))
+        # Keep the answers in the order of the products
+        answers = [answer for answer in answers if answer is not None]
         final_response_md = ""
-        final_links = []
-        count = 0
-        # Prune the generated answers as needed
-        for item in search_results:
-            # Gemini-pro + chroma will give distance instead of probability
-            # if (item[0].probability != 0):
-            final_search.append(search_results[count])
-            final_responses.append(responses[count])
-            final_response_md += responses[count] + "\n"
-            final_links.append(links[count])
-            count += 1
-
-        # Print the response.
-        count = 0
-        synthesize = False
-        synthesize_product = None
+        for answer in answers:
+            final_response_md += answer.response + "\n"
+
         # Currently only triggers from a gemini entry into the provided products
-        for product in product_configs.products:
+        synthesize_product = None
+        for product in products:
             if "gemini" in product.models.language_model:
                 synthesize_product = product
 
-        if synthesize and not (synthesize_product == None):
+        if merge_answers and synthesize_product is not None and len(answers) > 0:
             docs_agent = DocsAgent(config=synthesize_product, init_chroma=False)
             progress.update(
                 task_docs_agent,
@@ -192,28 +297,42 @@ def ask_model(question: str, product_configs: ConfigFile, return_output: bool =
             ) = docs_agent.ask_content_model_with_context_prompt(
                 context=final_response_md, question=new_question, prompt=""
             )
+            final_response_md = good_response
             progress.update(task_docs_agent, visible=False, refresh=True)
             # Final printing to console
             ai_console.print()
             ai_console.print(Markdown(good_response))
-        else:
-            # This returns the responses as is for each agent interaction
+        elif merge_answers:
+            # Without a Gemini model, print the answers as they are
             progress.update(task_docs_agent, visible=False, refresh=True)
             ai_console.print()
             ai_console.print(Markdown(final_response_md))
+        else:
+            progress.update(task_docs_agent, visible=False, refresh=True)
 
         # Get the link to the source.
         md_links = ""
-        for item in final_links:
-            if isinstance(item, str):
-                if not item.startswith("UUID"):
-                    md_links += f"\n* [{item}]({item})\n"
+        for answer in answers:
+            if isinstance(answer.link, str):
+                if not answer.link.startswith("UUID"):
+                    md_links += f"\n* [{answer.link}]({answer.link})\n"
 
         # Print the link to the source.
         ai_console.print()
         ai_console.print(Markdown("To verify this information, see:\n"))
         ai_console.print(Markdown(md_links))
 
+        # Show which answers are returned from the answer cache.
+        for answer in answers:
+            if answer.cached_question is None:
+                continue
+            ai_console.print()
+            ai_console.print(
+                f"[Cached] This answer was generated earlier for a similar question: "
+                + answer.cached_question,
+                markup=False,
+            )
+
         # Retrun the output if the `return_output` flag is set.
         if return_output:
             return_string = (
@@ -14,12 +14,14 @@
 # limitations under the License.
 #
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import os
 import re
 from uuid import UUID
 
+from docs_agent.utilities.helpers import trim_section_for_page_link
+
 """Module to log interactions with the chatbot"""
 
 
@@ -71,6 +73,7 @@ def log_debug_info_to_file(
     source_urls: str,
     probability: str = "None",
     server_url: str = "None",
+    adaptive_top_k: str = "None",
 ):
     # Compose a filename
     date = datetime.now(tz=pytz.utc)
@@ -100,6 +103,8 @@ def log_debug_info_to_file(
         debug_file.write("\n")
         debug_file.write("TOP SOURCE URL: " + top_source_url.strip() + "\n")
         debug_file.write("ANSWERABLE PROBABILITY: " + str(probability) + "\n")
+        if adaptive_top_k != "None":
+            debug_file.write("ADAPTIVE TOP K: " + str(adaptive_top_k) + "\n")
         debug_file.write("\n")
         debug_file.write("QUESTION: " + user_question.strip() + "\n\n")
         debug_file.write("RESPONSE:\n\n")
@@ -221,6 +226,57 @@ def write_logs_to_csv_file(log_date: str = "None"):
                 )
 
 
+# Return a page URL without the section anchor and the trailing slash.
+def normalize_page_url(url: str):
+    return trim_section_for_page_link(str(url).strip()).rstrip("/")
+
+
+# Count how many times each source page was retrieved, based on the source URLs
+# recorded in the debug logs. Only debug logs from the last `since_days` days
+# are read (set `since_days` to 0 to read all debug logs).
+def count_source_page_hits(since_days: int = 30, debug_dir: str = "./logs/debugs"):
+    page_hits = {}
+    oldest_date = None
+    if since_days > 0:
+        date = datetime.now(tz=pytz.utc)
+        date = date.astimezone(pytz.timezone("US/Pacific"))
+        oldest_date = (date - timedelta(days=since_days)).strftime("%Y-%m-%d")
+    for root, dirs, files in os.walk(debug_dir):
+        for file in files:
+            if not file.endswith("txt"):
+                continue
+            # Debug log filenames start with the date, for example `2024-05-01-`.
+            if oldest_date is not None and re.search(r"^\d{4}-\d{2}-\d{2}", file):
+                if file[:10] < oldest_date:
+                    continue
+            with open(os.path.join(root, file), "r", encoding="utf-8") as debug_file:
+                debug_record = debug_file.readlines()
+                debug_file.close()
+            top_source_url = ""
+            source_urls = []
+            in_source_urls = False
+            for line in debug_record:
+                match_top_url = re.search(r"^TOP SOURCE URL:\s+(.*)$", line)
+                if match_top_url:
+                    top_source_url = match_top_url.group(1)
+                elif line.startswith("SOURCE URLS:"):
+                    in_source_urls = True
+                elif in_source_urls:
+                    match_source_url = re.search(r"^\[\d+\]:\s+(.*)$", line)
+                    if match_source_url:
+                        source_urls.append(match_source_url.group(1))
+            if not source_urls and top_source_url != "":
+                source_urls.append(top_source_url)
+            # Count a page only once per request.
+            pages = set()
+            for url in source_urls:
+                if url != "" and url != "None":
+                    pages.add(normalize_page_url(url))
+            for page in pages:
+                page_hits[page] = page_hits.get(page, 0) + 1
+    return page_hits
+
+
 # Save the short version of debug information into a CSV file.
 def log_debug_info_to_csv_file(
     output_filename: str,
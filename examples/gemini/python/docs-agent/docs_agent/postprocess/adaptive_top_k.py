@@ -0,0 +1,93 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Choose the number of search results used for the context of a question"""
+
+import numpy as np
+
+from docs_agent.postprocess.diversify import get_relevance
+
+
+class AdaptiveTopK:
+    """The number of results used for a question and why no more were used"""
+
+    def __init__(
+        self,
+        k: int,
+        candidates: int,
+        reason: str,
+        tokens: float = 0.0,
+        pages_fetched: int = 0,
+    ) -> None:
+        self.k = k
+        self.candidates = candidates
+        # "distance_gap", "relevance", "token_budget", "max_k", "no_results",
+        # or "packer" (a context packer chose the results)
+        self.reason = reason
+        self.tokens = tokens
+        self.pages_fetched = pages_fetched
+
+    def __str__(self):
+        return (
+            f"Adaptive top-k: used {self.k} of {self.candidates} results "
+            + f"({self.reason}), {self.tokens:.0f} tokens, "
+            + f"{self.pages_fetched} pages fetched"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "k": self.k,
+            "candidates": self.candidates,
+            "reason": self.reason,
+            "tokens": self.tokens,
+            "pages_fetched": self.pages_fetched,
+        }
+
+
+# Return the number of results (ChromaSectionDBItem, best first) to use and
+# the reason to stop. k grows from `min_k` until the distance to the next
+# result is more than `distance_gap` larger than the distance to the last
+# one, until the first k results hold `relevance_threshold` of the relevance
+# of all results, or until k reaches `max_k`. A gap or threshold of 0 is not
+# checked. The token budget is checked while the context is built.
+def choose_top_k(
+    items: list,
+    min_k: int = 1,
+    max_k: int = 10,
+    distance_gap: float = 0.05,
+    relevance_threshold: float = 0.8,
+) -> tuple[int, str]:
+    max_k = min(max_k, len(items))
+    if max_k <= 0:
+        return 0, "no_results"
+    min_k = max(1, min(min_k, max_k))
+    cumulative_relevance = None
+    if relevance_threshold > 0:
+        relevance = np.asarray(get_relevance(items[:max_k]), dtype=float)
+        if relevance.sum() > 0:
+            cumulative_relevance = np.cumsum(relevance) / relevance.sum()
+    for k in range(min_k, max_k):
+        if distance_gap > 0:
+            last_distance = items[k - 1].distance
+            next_distance = items[k].distance
+            # Lexical-only results of hybrid search have no distance
+            if last_distance is not None and next_distance is not None:
+                if float(next_distance) - float(last_distance) > distance_gap:
+                    return k, "distance_gap"
+        if cumulative_relevance is not None:
+            if cumulative_relevance[k - 1] >= relevance_threshold:
+                return k, "relevance"
+    return max_k, "max_k"
@@ -0,0 +1,300 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Pack the sections around search results into a token budget"""
+
+from collections import OrderedDict
+import math
+import threading
+import typing
+
+from docs_agent.models import tokenCount
+from docs_agent.postprocess.docs_retriever import FullPage
+from docs_agent.postprocess.docs_retriever import SectionDistance
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+
+# The strategies that can fill a token budget.
+PACKING_STRATEGIES = ["greedy", "knapsack"]
+
+# The value of a section relative to the relevance of the search result that
+# it was found from.
+ROLE_WEIGHTS = {"hit": 1.0, "child": 0.6, "parent": 0.5, "sibling": 0.4}
+
+# The knapsack strategy rounds token costs up to 1/KNAPSACK_STEPS of the
+# budget, which bounds its run time.
+KNAPSACK_STEPS = 1000
+
+
+class TokenCostCache:
+    """A thread-safe LRU of the token counts of templated sections.
+
+    Entries are keyed by the title and content strings of a section, which
+    are shared by the pages in the page cache, so a lookup doesn't hash or
+    count the content again.
+    """
+
+    def __init__(self, max_size: int = 8192) -> None:
+        self.max_size = max(0, int(max_size))
+        self.costs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_cost(self, section: Section) -> float:
+        key = (section.section_title, section.page_title, section.content)
+        with self.lock:
+            cost = self.costs.get(key)
+            if cost is not None:
+                self.costs.move_to_end(key)
+                self.hits += 1
+                return cost
+            self.misses += 1
+        cost = tokenCount.returnHighestTokens(section.returnContentTemplate())
+        if self.max_size > 0:
+            with self.lock:
+                self.costs[key] = cost
+                while len(self.costs) > self.max_size:
+                    self.costs.popitem(last=False)
+        return cost
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_rate = 0.0
+            if lookups > 0:
+                hit_rate = self.hits / lookups
+            return {
+                "size": len(self.costs),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": hit_rate,
+            }
+
+
+# The token cost cache shared by all agents in a process.
+_token_cost_cache = None
+_token_cost_cache_lock = threading.Lock()
+
+
+def get_token_cost_cache() -> TokenCostCache:
+    global _token_cost_cache
+    with _token_cost_cache_lock:
+        if _token_cost_cache is None:
+            _token_cost_cache = TokenCostCache()
+        return _token_cost_cache
+
+
+class ContextItem:
+    """A candidate section for the context of a question"""
+
+    def __init__(
+        self,
+        section: Section,
+        origin_uuid: str,
+        hit_index: int,
+        role: str,
+        relevance: float,
+        cost: float,
+    ):
+        self.section = section
+        self.origin_uuid = origin_uuid
+        self.hit_index = hit_index
+        self.role = role
+        self.relevance = relevance
+        self.value = relevance * ROLE_WEIGHTS.get(role, 0.0)
+        self.cost = cost
+        self.included = False
+        self.reason = ""
+
+    def density(self) -> float:
+        if self.cost <= 0:
+            return math.inf
+        return self.value / self.cost
+
+
+class PackedContext:
+    """The candidate sections of a question and the ones that fit the budget"""
+
+    def __init__(
+        self, items: list[ContextItem], token_limit: float, strategy: str
+    ) -> None:
+        self.items = items
+        self.token_limit = token_limit
+        self.strategy = strategy
+
+    def included_items(self) -> list[ContextItem]:
+        return [item for item in self.items if item.included]
+
+    def used_tokens(self) -> float:
+        return sum(item.cost for item in self.included_items())
+
+    # Return the included sections as context. Pages are ordered by their
+    # best search result and sections by their position in the page.
+    def build_context(self) -> str:
+        pages = {}
+        for item in self.included_items():
+            pages.setdefault(item.origin_uuid, []).append(item)
+        ordered_pages = sorted(
+            pages.values(), key=lambda page: min(item.hit_index for item in page)
+        )
+        contents = []
+        for page in ordered_pages:
+            page.sort(key=lambda item: item.section.id)
+            for item in page:
+                contents.append(item.section.returnContentTemplate())
+        return "\n\n".join(contents).strip()
+
+    # Return a table of all candidates that shows what was included and why.
+    def debug_view(self) -> str:
+        lines = [
+            f"Context packer: {self.strategy}, "
+            + f"{self.used_tokens():.0f} of {self.token_limit:.0f} tokens, "
+            + f"{len(self.included_items())} of {len(self.items)} sections included"
+        ]
+        ordered_items = sorted(
+            self.items, key=lambda item: (item.hit_index, item.section.id)
+        )
+        for item in ordered_items:
+            mark = "+" if item.included else "-"
+            title = str(item.section.section_title)
+            if len(title) > 40:
+                title = title[:37] + "..."
+            lines.append(
+                f"[{mark}] result {item.hit_index + 1:<3}{item.role:<8}"
+                + f"{title:<41}value {item.value:.3f}  "
+                + f"tokens {item.cost:>7.0f}  {item.reason}"
+            )
+        return "\n".join(lines)
+
+
+# Convert the distance of a search result into a relevance between 0 and 1.
+def distance_to_relevance(distance) -> float:
+    try:
+        return 1.0 / (1.0 + max(0.0, float(distance)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# Collect the hits and (optionally) their parents, children and siblings as
+# candidates. A section found from several hits is kept once with its
+# highest value.
+def collect_candidates(
+    search_result: list[SectionDistance],
+    full_pages: dict[str, FullPage],
+    include_neighbors: bool = True,
+    cost_cache: typing.Optional[TokenCostCache] = None,
+) -> list[ContextItem]:
+    if cost_cache is None:
+        cost_cache = get_token_cost_cache()
+    candidates = {}
+    for hit_index, result in enumerate(search_result):
+        origin_uuid = result.section.origin_uuid
+        relevance = distance_to_relevance(result.distance)
+        page = full_pages.get(origin_uuid, FullPage(section_list=[]))
+        hit_section = page.returnSectionById(result.section.id)
+        if hit_section is None:
+            hit_section = result.section
+        sections = [("hit", hit_section)]
+        if include_neighbors:
+            for role, related in page.returnRelatedSections(result.section.id).items():
+                sections += [(role, section) for section in related]
+        for role, section in sections:
+            item = ContextItem(
+                section=section,
+                origin_uuid=origin_uuid,
+                hit_index=hit_index,
+                role=role,
+                relevance=relevance,
+                cost=cost_cache.get_cost(section),
+            )
+            key = (origin_uuid, section.id)
+            if key not in candidates or candidates[key].value < item.value:
+                candidates[key] = item
+    return list(candidates.values())
+
+
+# Include the items with the highest value per token that fit the budget.
+def pack_greedy(items: list[ContextItem], token_limit: float):
+    used_tokens = 0.0
+    ordered_items = sorted(
+        items, key=lambda item: (-item.density(), -item.value, item.hit_index)
+    )
+    for item in ordered_items:
+        if used_tokens + item.cost <= token_limit:
+            used_tokens += item.cost
+            item.included = True
+            item.reason = f"value per token {item.value / max(item.cost, 1):.5f}"
+        else:
+            item.reason = f"does not fit ({token_limit - used_tokens:.0f} tokens left)"
+
+
+# Include the items with the highest total value that fit the budget (0/1
+# knapsack over costs rounded up to a step of the budget).
+def pack_knapsack(items: list[ContextItem], token_limit: float):
+    if not items:
+        return
+    step = max(1.0, token_limit / KNAPSACK_STEPS)
+    capacity = int(token_limit // step)
+    weights = [int(math.ceil(item.cost / step)) for item in items]
+    best = [0.0] * (capacity + 1)
+    chosen = [[False] * (capacity + 1) for _ in items]
+    for index, item in enumerate(items):
+        weight = weights[index]
+        if weight > capacity:
+            continue
+        for size in range(capacity, weight - 1, -1):
+            value = best[size - weight] + item.value
+            if value > best[size]:
+                best[size] = value
+                chosen[index][size] = True
+    size = capacity
+    for index in range(len(items) - 1, -1, -1):
+        if chosen[index][size]:
+            items[index].included = True
+            items[index].reason = "selected by knapsack"
+            size -= weights[index]
+    for item in items:
+        if not item.included:
+            if item.cost > token_limit:
+                item.reason = "larger than the budget"
+            else:
+                item.reason = "not selected by knapsack"
+
+
+# Select the sections around the search results that fit in token_limit.
+def pack_context(
+    search_result: list[SectionDistance],
+    full_pages: dict[str, FullPage],
+    token_limit: float,
+    strategy: str = "greedy",
+    include_neighbors: bool = True,
+) -> PackedContext:
+    if strategy not in PACKING_STRATEGIES:
+        raise ValueError(
+            f"Unknown context packer {strategy}. "
+            + f"Use one of: {', '.join(PACKING_STRATEGIES)}"
+        )
+    items = collect_candidates(
+        search_result=search_result,
+        full_pages=full_pages,
+        include_neighbors=include_neighbors,
+    )
+    if strategy == "knapsack":
+        pack_knapsack(items, token_limit)
+    else:
+        pack_greedy(items, token_limit)
+    return PackedContext(items=items, token_limit=token_limit, strategy=strategy)
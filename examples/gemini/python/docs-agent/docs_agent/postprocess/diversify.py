@@ -0,0 +1,173 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Diversify search results with maximal marginal relevance"""
+
+import typing
+
+import numpy as np
+
+# The ways that search results can be diversified.
+DIVERSITY_MODES = ["mmr", "page"]
+
+# Results whose embeddings are at least this similar to a better result are
+# treated as copies of it (for example, the same page published twice).
+DUPLICATE_SIMILARITY = 0.98
+
+
+# Return the cosine similarities between all pairs of embeddings. Rows
+# without an embedding (None) have no similarity to any other row.
+def cosine_similarity_matrix(embeddings: list) -> np.ndarray:
+    count = len(embeddings)
+    present = [index for index, item in enumerate(embeddings) if item is not None]
+    similarities = np.zeros((count, count), dtype=np.float32)
+    if len(present) == 0:
+        return similarities
+    matrix = np.asarray([embeddings[index] for index in present], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms[:, None]
+    similarities[np.ix_(present, present)] = matrix @ matrix.T
+    return similarities
+
+
+# Return the relevance of results scaled from 1 (the best result) to 0 (the
+# worst result), so that it is comparable to a cosine similarity in any
+# distance space. Reranked results are ranked by their reranker scores,
+# hybrid search results by their fused scores (higher is better), and other
+# results by their distances.
+def get_relevance(items: list) -> np.ndarray:
+    scores = [getattr(item, "rerank_score", None) for item in items]
+    if any(score is None for score in scores):
+        scores = [getattr(item, "rrf_score", None) for item in items]
+    if any(score is None for score in scores):
+        scores = [-item.distance for item in items]
+    scores = np.asarray(scores, dtype=np.float32)
+    if len(scores) == 0:
+        return scores
+    spread = float(scores.max() - scores.min())
+    if spread == 0:
+        return np.ones(len(scores), dtype=np.float32)
+    return (scores - scores.min()) / spread
+
+
+# Return the indexes of results in maximal marginal relevance order. Each
+# step picks the result with the highest
+# `lambda_mult * relevance - (1 - lambda_mult) * max_similarity`, where
+# `max_similarity` is its highest similarity to the results picked before.
+# A `lambda_mult` of 1.0 keeps the relevance order.
+def maximal_marginal_relevance(
+    relevance: np.ndarray, similarities: np.ndarray, lambda_mult: float = 0.5
+) -> list[int]:
+    count = len(relevance)
+    order = []
+    if count == 0:
+        return order
+    remaining = np.ones(count, dtype=bool)
+    max_similarity = np.zeros(count, dtype=np.float32)
+    while len(order) < count:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~remaining] = -np.inf
+        # Ties keep the order of the results.
+        index = int(np.argmax(scores))
+        order.append(index)
+        remaining[index] = False
+        max_similarity = np.maximum(max_similarity, similarities[index])
+    return order
+
+
+# Return the indexes of results with at most `max_per_page` results of each
+# page first, followed by the remaining results. Results that are copies of
+# a result before them (the same content hash, or embeddings that are at
+# least DUPLICATE_SIMILARITY similar) are moved to the end.
+def dedupe_pages(
+    items: list,
+    order: list[int],
+    similarities: np.ndarray,
+    max_per_page: int = 0,
+) -> list[int]:
+    kept = []
+    demoted = []
+    duplicates = []
+    page_counts = {}
+    content_hashes = set()
+    for index in order:
+        metadata = items[index].metadata or {}
+        md_hash = metadata.get("md_hash", None)
+        if (md_hash and md_hash in content_hashes) or any(
+            similarities[index, other] >= DUPLICATE_SIMILARITY for other in kept
+        ):
+            duplicates.append(index)
+            continue
+        if md_hash:
+            content_hashes.add(md_hash)
+        origin_uuid = metadata.get("origin_uuid", None)
+        page_count = page_counts.get(origin_uuid, 0)
+        if max_per_page > 0 and page_count >= max_per_page:
+            demoted.append(index)
+            continue
+        page_counts[origin_uuid] = page_count + 1
+        kept.append(index)
+    return kept + demoted + duplicates
+
+
+# Reorder query result items (ChromaSectionDBItem) so that the first results
+# cover different pages and content. With "mmr", results are ordered by
+# maximal marginal relevance using their stored embeddings. With "page",
+# results keep their order but each page gets at most `max_per_page` results
+# before any page gets more. Both modes move copies of a better result to
+# the end. No results are dropped, and the embedding model isn't called.
+def diversify_results(
+    items: list,
+    mode: str = "mmr",
+    lambda_mult: float = 0.5,
+    max_per_page: int = 0,
+) -> list:
+    if mode not in DIVERSITY_MODES or len(items) < 2:
+        return items
+    similarities = cosine_similarity_matrix(
+        [getattr(item, "embedding", None) for item in items]
+    )
+    if mode == "mmr":
+        order = maximal_marginal_relevance(
+            get_relevance(items),
+            similarities,
+            lambda_mult=min(max(float(lambda_mult), 0.0), 1.0),
+        )
+    else:
+        order = list(range(len(items)))
+        if max_per_page <= 0:
+            max_per_page = 1
+    order = dedupe_pages(items, order, similarities, max_per_page=max_per_page)
+    return [items[index] for index in order]
+
+
+# Return a short description of the pages of the first results before and
+# after diversification, which is printed in VERBOSE mode.
+def describe_diversity(
+    before: list, after: list, top_k: typing.Optional[int] = None
+) -> str:
+    def pages(items):
+        return [(item.metadata or {}).get("origin_uuid", None) for item in items]
+
+    before_pages = pages(before[:top_k])
+    after_pages = pages(after[:top_k])
+    return (
+        f"Diversified the top {len(after_pages)} results: "
+        + f"{len(set(before_pages))} -> {len(set(after_pages))} distinct pages, "
+        + f"ids {[item.id for item in before[:top_k]]} -> "
+        + f"{[item.id for item in after[:top_k]]}"
+    )
@@ -16,6 +16,9 @@
 # from markdown import markdown
 # from bs4 import BeautifulSoup
 # import re, os
+
+import threading
+
 from docs_agent.models import tokenCount
 from docs_agent.preprocess.splitters.markdown_splitter import Section as Section
 
@@ -42,15 +45,99 @@ class SectionProbability:
         self.probability = probability
 
 
+# Returns a copy of a section with a template added to its content, and a
+# token count that includes the template
+def withTemplateTokenCount(section: Section) -> Section:
+    templated = section.updateContentTemplate()
+    return templated.replace(
+        token_count=tokenCount.returnHighestTokens(templated.content)
+    )
+
+
 # Let's you build a full page based on list of Sections and in the order provided
 # Returns a string of final page and a token_count_estimate of the final page
 class FullPage:
     def __init__(self, section_list: list[Section]):
         self.section_list = section_list
+        # Lookup tables of the sections, which are built on first use. Pages
+        # are shared across threads by the page cache, so the tables are
+        # built under a lock and published together.
+        self.indexes_lock = threading.Lock()
+        self.sections_by_id = None
+        self.children_by_parent_id = None
+        self.sections_by_parent_tree = None
+        self.sections_by_level = None
 
     def __str__(self):
         return f"This is a page with the following content:\n"
 
+    # Returns a FullPage with the same sections. Sections are immutable, so
+    # the copy can share them
+    def copy(self):
+        return FullPage(section_list=list(self.section_list))
+
+    # Builds the id, parent and level lookup tables of the page in a single
+    # pass, so that finding a section, its children or its siblings doesn't
+    # scan the page. Sections keep the order of section_list. The tables are
+    # filled as local variables and assigned at the end, with sections_by_id
+    # last, so other threads never see a partly filled table.
+    def buildIndexes(self):
+        with self.indexes_lock:
+            if self.sections_by_id is not None:
+                return
+            sections_by_id = {}
+            children_by_parent_id = {}
+            sections_by_parent_tree = {}
+            sections_by_level = {}
+            for item in self.section_list:
+                if item is None:
+                    continue
+                # Keep the first section of an id, which is the one a scan finds
+                sections_by_id.setdefault(item.id, item)
+                try:
+                    parent_id = int(item.returnDirectParentId())
+                except (TypeError, ValueError):
+                    parent_id = None
+                children_by_parent_id.setdefault(parent_id, []).append(item)
+                sections_by_parent_tree.setdefault(item.parent_ids, []).append(item)
+                sections_by_level.setdefault(item.level, []).append(item)
+            self.children_by_parent_id = children_by_parent_id
+            self.sections_by_parent_tree = sections_by_parent_tree
+            self.sections_by_level = sections_by_level
+            self.sections_by_id = sections_by_id
+
+    # Returns the Section that matches a section_id, or None
+    def returnSectionById(self, section_id):
+        if self.sections_by_id is None:
+            self.buildIndexes()
+        return self.sections_by_id.get(section_id, None)
+
+    # Returns all sections of a heading level (for example, 2 for ##)
+    def returnSectionsAtLevel(self, level) -> list[Section]:
+        if self.sections_by_id is None:
+            self.buildIndexes()
+        return list(self.sections_by_level.get(level, []))
+
+    # Returns the parent, children and siblings of a section without updating
+    # them, keyed by their relation to the section
+    def returnRelatedSections(self, section_id) -> dict[str, list[Section]]:
+        related = {"parent": [], "child": [], "sibling": []}
+        given_section = self.returnSectionById(section_id)
+        if given_section is None:
+            return related
+        given_parent = given_section.returnDirectParentId()
+        if given_parent != 0:
+            parent_section = self.returnSectionById(int(given_parent))
+            if parent_section is not None:
+                related["parent"].append(parent_section)
+        related["child"] = list(
+            self.children_by_parent_id.get(int(given_section.id), [])
+        )
+        for item in self.sections_by_parent_tree.get(given_section.parent_ids, []):
+            if item.id != given_section.id:
+                related["sibling"].append(item)
+        return related
+
     def buildPage(self):
         final_page = ""
         total_token_count = 0
@@ -64,15 +151,11 @@ class FullPage:
     # Given a page, returns only the section that matches the provided id
     # Also adds a preamble (which can be customized)
     def returnSelfSection(self, section_id):
-        # Adds initial section from match
-        for item in self.section_list:
-            try:
-                if section_id == item.id:
-                    # Updates the content of a section on the fly with a template
-                    item.updateContentTemplate()
-                    return item
-            except:
-                print(f"Could not find a section with the provided ID {section_id}")
+        item = self.returnSectionById(section_id)
+        if item is None:
+            return None
+        # Returns a copy of the section with a template added to its content
+        return item.updateContentTemplate()
 
     # Returns all of the children for a given section_id. Any section that
     # are under the given header. For example, if the provided section_id is
@@ -80,32 +163,23 @@ class FullPage:
     # Specify a token_limit to limit amount of sections returned
     def returnChildrenSections(self, section_id, token_limit: float = float("inf")):
         # Finds the Section given a section_id
-        match = False
         updated_list = []
-        for item in self.section_list:
-            if section_id == item.id:
-                given_section = item
-                match = True
-                break
+        given_section = self.returnSectionById(section_id)
         # If Section doesn't match, just return a FullPage with a blank list
-        if not match:
+        if given_section is None:
             print(f"Could not find a section with the provided ID {section_id}")
             return FullPage(section_list=updated_list)
         # Start token count at 0
         curr_token = 0
-        # updated_list = []
-        for item in self.section_list:
-            direct_parent = item.returnDirectParentId()
-            if int(direct_parent) == int(given_section.id):
-                if (curr_token + item.token_count) < token_limit:
-                    curr_token += item.token_count
-                    # Updates the content of a section on the fly with a template
-                    item.updateContentTemplate()
-                    # Estimate token count for preamble and add it to curr_token
-                    item.token_count = tokenCount.returnHighestTokens(item.content)
-                    curr_token += item.token_count
-                    # Append each Section to a new list to return
-                    updated_list.append(item)
+        for item in self.children_by_parent_id.get(int(given_section.id), []):
+            if (curr_token + item.token_count) < token_limit:
+                curr_token += item.token_count
+                # Copies the section with a template added to its content and
+                # the token count of the templated content
+                item = withTemplateTokenCount(item)
+                curr_token += item.token_count
+                # Append each Section to a new list to return
+                updated_list.append(item)
         updated_page = FullPage(section_list=updated_list)
         # You can view token count by doing sum of all Section.token_count
         return updated_page
@@ -114,35 +188,22 @@ class FullPage:
     # has the same parent_tree
     def returnSiblingSections(self, section_id, token_limit: float = float("inf")):
         # Finds the Section given a section_id
-        match = False
         updated_list = []
-        for item in self.section_list:
-            if section_id == item.id:
-                given_section = item
-                match = True
-                # Break out of loop once a match is found
-                break
+        given_section = self.returnSectionById(section_id)
         # If Section doesn't match, just return a FullPage with a blank list
-        if not match:
+        if given_section is None:
             print(f"Could not find a section with the provided ID {section_id}")
             return FullPage(section_list=updated_list)
         # Start token count at 0
         curr_token = 0
-        # updated_list = []
-        given_parent_tree = eval(given_section.parent_tree)
-        for item in self.section_list:
-            direct_parent = item.returnDirectParentId()
-            # Matches parent_tree and skips the same section
-            if (
-                given_parent_tree == eval(item.parent_tree)
-                and given_section.id != item.id
-            ):
+        for item in self.sections_by_parent_tree.get(given_section.parent_ids, []):
+            # Skips the same section
+            if given_section.id != item.id:
                 if (curr_token + item.token_count) < token_limit:
                     curr_token += item.token_count
-                    # Updates the content of a section on the fly with a template
-                    item.updateContentTemplate()
-                    # Estimate token count for preamble and add it to curr_token
-                    item.token_count = tokenCount.returnHighestTokens(item.content)
+                    # Copies the section with a template added to its content
+                    # and the token count of the templated content
+                    item = withTemplateTokenCount(item)
                     curr_token += item.token_count
                     # Append each Section to a new list to return
                     updated_list.append(item)
@@ -154,35 +215,21 @@ class FullPage:
     # If updated_page contains no parents, return []
     def returnParentSection(self, section_id, token_limit: float = float("inf")):
         # Finds the Section given a section_id
-        match = False
-        updated_list = []
-        for item in self.section_list:
-            if section_id == item.id:
-                given_section = item
-                match = True
-                # Break out of loop once a match is found
-                given_parent = given_section.returnDirectParentId()
-                break
+        given_section = self.returnSectionById(section_id)
         # If Section doesn't match, just return a FullPage with a blank list
-        if not match:
+        if given_section is None:
             print(f"Could not find a section with the provided ID {section_id}")
             # return FullPage(section_list=updated_list)
             return None
-        # Start token count at 0
-        curr_token = 0
-        # updated_list = []
-        for item in self.section_list:
-            direct_parent = item.returnDirectParentId()
-            if int(given_parent) == int(item.id) and given_parent != 0:
-                if (curr_token + item.token_count) < token_limit:
-                    curr_token += item.token_count
-                    # Updates the content of a section on the fly with a template
-                    item.updateContentTemplate()
-                    # Estimate token count for preamble and add it to curr_token
-                    item.token_count = tokenCount.returnHighestTokens(item.content)
-                    curr_token += item.token_count
-                    # A section only can only have a single item
-                    return item
+        given_parent = given_section.returnDirectParentId()
+        if given_parent == 0:
+            return None
+        item = self.returnSectionById(int(given_parent))
+        if item is not None and item.token_count < token_limit:
+            # Copies the section with a template added to its content and
+            # the token count of the templated content
+            # A section only can only have a single item
+            return withTemplateTokenCount(item)
 
     # Sorts Section by a clause, defaults to id (only supported at the moment)
     # Include a reverse flag to also do a reverse order
@@ -239,4 +286,4 @@ class FullPage:
                 if item is not None:
                     section_token_count += item.token_count
         final_page = FullPage(final_sections).sortSections(reverse=reverse)
-        return final_page
\ No newline at end of file
+        return final_page
@@ -0,0 +1,229 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Rerank search results on the CPU within a latency budget"""
+
+import re
+import threading
+import time
+import typing
+
+from absl import logging
+
+from docs_agent.postprocess.diversify import get_relevance
+
+# The rerankers that can be set in `reranker`.
+RERANKERS = ["lexical", "cross-encoder"]
+
+# The cross-encoder model that is used if `reranker_model` is not set.
+DEFAULT_CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# The weights of the features of the lexical reranker. `vector` is the
+# relevance from the vector search, so results without lexical evidence keep
+# their vector order.
+LEXICAL_WEIGHTS = {"vector": 0.3, "content": 0.35, "title": 0.2, "identifier": 0.15}
+
+# Words that are ignored by the lexical reranker.
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or "
+    "the this to what when where which who why with you your".split()
+)
+
+
+class Error(Exception):
+    """Base error class for rerankers"""
+
+
+class RerankerNotAvailableError(Error, RuntimeError):
+    """Raised if the dependencies of a reranker are not installed."""
+
+
+# Return the lowercase words of a text, without stop words.
+def get_terms(text: str) -> list[str]:
+    return [
+        term for term in re.findall(r"\w+", str(text).lower()) if term not in STOP_WORDS
+    ]
+
+
+# Return the words of a text that look like code identifiers (for example,
+# `fuchsia.io.Directory`, `ZX_ERR_NOT_FOUND` or `getPageTitle`).
+def get_identifiers(text: str) -> set[str]:
+    return {
+        word.lower()
+        for word in re.findall(r"[\w.:/-]+", str(text))
+        if re.search(r"[._:/-]\w", word) or re.search(r"[a-z][A-Z]", word)
+    }
+
+
+class LexicalReranker:
+    """Scores results with cheap lexical features and their vector relevance.
+
+    A result scores higher if it contains more of the question's words (in
+    its content or its page and section titles) and the question's code
+    identifiers.
+    """
+
+    name = "lexical"
+
+    def score(self, question: str, candidates: list[dict]) -> list[float]:
+        terms = set(get_terms(question))
+        identifiers = get_identifiers(question)
+        scores = []
+        for candidate in candidates:
+            content = str(candidate["document"]).lower()
+            title = str(candidate["title"]).lower()
+            content_terms = set(get_terms(content))
+            title_terms = set(get_terms(title))
+            features = {"vector": candidate["relevance"]}
+            features["content"] = len(terms & content_terms) / max(len(terms), 1)
+            features["title"] = len(terms & title_terms) / max(len(terms), 1)
+            features["identifier"] = 0.0
+            if identifiers:
+                features["identifier"] = sum(
+                    1
+                    for identifier in identifiers
+                    if identifier in content or identifier in title
+                ) / len(identifiers)
+            scores.append(
+                sum(LEXICAL_WEIGHTS[name] * value for name, value in features.items())
+            )
+        return scores
+
+
+class CrossEncoderReranker:
+    """Scores (question, result) pairs with a small cross-encoder on the CPU.
+
+    Requires the `sentence-transformers` package, which is not installed with
+    Docs Agent.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = DEFAULT_CROSS_ENCODER_MODEL) -> None:
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise RerankerNotAvailableError(
+                "The cross-encoder reranker requires the sentence-transformers "
+                + "package. Run `pip install sentence-transformers` first."
+            )
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, question: str, candidates: list[dict]) -> list[float]:
+        pairs = [
+            (question, candidate["title"] + "\n" + str(candidate["document"]))
+            for candidate in candidates
+        ]
+        return [float(score) for score in self.model.predict(pairs)]
+
+
+# The rerankers shared by all agents in a process, keyed by name and model,
+# since loading a model is slow.
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+# Return a shared reranker, or None (with a warning) if it can't be loaded.
+def get_reranker(name: str, model_name: typing.Optional[str] = None):
+    if name not in RERANKERS:
+        return None
+    if model_name is None or model_name == "":
+        model_name = DEFAULT_CROSS_ENCODER_MODEL
+    key = (name, model_name if name == "cross-encoder" else "")
+    with _rerankers_lock:
+        if key not in _rerankers:
+            try:
+                if name == "cross-encoder":
+                    _rerankers[key] = CrossEncoderReranker(model_name)
+                else:
+                    _rerankers[key] = LexicalReranker()
+            except RerankerNotAvailableError as error:
+                logging.warning(f"{error} Using the results in distance order.")
+                _rerankers[key] = None
+        return _rerankers[key]
+
+
+class RerankResult:
+    """The reranked results of a question and how long scoring took"""
+
+    def __init__(
+        self,
+        items: list,
+        scored: int,
+        batches: int,
+        elapsed_ms: float,
+        status: str,
+    ) -> None:
+        self.items = items
+        self.scored = scored
+        self.batches = batches
+        self.elapsed_ms = elapsed_ms
+        # "reranked", "timeout" (kept the vector order) or "skipped"
+        self.status = status
+
+    def __str__(self):
+        return (
+            f"Reranker {self.status}: scored {self.scored} candidates in "
+            + f"{self.batches} batches, {self.elapsed_ms:.1f} ms"
+        )
+
+
+# Rerank the first `top_n` query result items (ChromaSectionDBItem) with a
+# reranker, scoring `batch_size` candidates at a time. If the scores are not
+# complete within `latency_budget_ms`, the results keep their vector order.
+# Items after `top_n` keep their order after the reranked items.
+def rerank_results(
+    question: str,
+    items: list,
+    reranker,
+    top_n: int = 20,
+    batch_size: int = 16,
+    latency_budget_ms: float = 50,
+) -> RerankResult:
+    start = time.perf_counter()
+    if reranker is None or len(items) < 2:
+        return RerankResult(items, 0, 0, 0.0, "skipped")
+    top_n = len(items) if top_n <= 0 else min(top_n, len(items))
+    batch_size = max(1, int(batch_size))
+    candidates = []
+    for item, relevance in zip(items[:top_n], get_relevance(items[:top_n])):
+        metadata = item.metadata or {}
+        candidates.append(
+            {
+                "document": item.document,
+                "title": f"{metadata.get('page_title', '')} "
+                + f"{metadata.get('section_title', '')}",
+                "relevance": float(relevance),
+            }
+        )
+    deadline = start + latency_budget_ms / 1000.0
+    scores = []
+    batches = 0
+    for offset in range(0, top_n, batch_size):
+        if batches > 0 and time.perf_counter() > deadline:
+            break
+        scores += reranker.score(question, candidates[offset : offset + batch_size])
+        batches += 1
+    elapsed_ms = (time.perf_counter() - start) * 1000.0
+    if len(scores) < top_n or elapsed_ms > latency_budget_ms:
+        return RerankResult(items, len(scores), batches, elapsed_ms, "timeout")
+    # Ties keep the vector order.
+    order = sorted(range(top_n), key=lambda index: -scores[index])
+    for item, score in zip(items, scores):
+        item.rerank_score = score
+    reranked = [items[index] for index in order] + list(items[top_n:])
+    return RerankResult(reranked, len(scores), batches, elapsed_ms, "reranked")
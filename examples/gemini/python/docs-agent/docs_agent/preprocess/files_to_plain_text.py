@@ -39,6 +39,7 @@ from docs_agent.preprocess.splitters import (
     html_splitter,
     fidl_splitter,
 )
+from docs_agent.preprocess.near_duplicates import collapse_near_duplicates
 
 
 # Construct a URL from a URL prefix and a relative path.
@@ -663,6 +664,36 @@ def process_inputs_from_product(input_product: ProductConfig, temp_process_path:
     )
 
 
+# Collapse near-duplicate text chunks of a product into canonical chunks and
+# print the space saved.
+def collapse_near_duplicates_from_product(input_product: ProductConfig):
+    json_file = resolve_path(input_product.output_path) + "/file_index.json"
+    with open(json_file, "r", encoding="utf-8") as index_file:
+        index_object = json.load(index_file)
+        index_file.close()
+    threshold = float(input_product.near_duplicate_threshold)
+    result = collapse_near_duplicates(
+        index_object=index_object,
+        threshold=threshold,
+        canonical=input_product.near_duplicate_canonical,
+    )
+    save_file_index_json(
+        output_path=input_product.output_path, output_content=index_object
+    )
+    saved_percent = 0.0
+    if result["total_bytes"] > 0:
+        saved_percent = 100 * result["aliased_bytes"] / result["total_bytes"]
+    print(
+        "\n[Near-duplicate chunks]"
+        + f"\nSimilarity threshold: {threshold}"
+        + f"\nGroups of near-duplicate chunks: {result['groups']}"
+        + f"\nCollapsed chunks (aliases): {result['aliased_chunks']}"
+        + f"\nVectors not stored: {result['aliased_chunks']}"
+        + f"\nText not embedded: {result['aliased_bytes']} bytes ({saved_percent:.1f}%)"
+        + f"\nEmbedding tokens saved: {result['aliased_tokens']}"
+    )
+
+
 # Print the size distribution map of created text chunks.
 def get_chunk_size_distribution_from_product(input_product: ProductConfig):
     chunk_size_map = {
@@ -755,6 +786,9 @@ def process_all_products(
         process_inputs_from_product(
             input_product=product, temp_process_path=temp_process_path
         )
+        # Collapse near-duplicate text chunks into canonical chunks.
+        if product.enable_near_duplicate_collapsing == "True":
+            collapse_near_duplicates_from_product(input_product=product)
 
         # Print the distribution map of text chunk sizes.
         get_chunk_size_distribution_from_product(input_product=product)
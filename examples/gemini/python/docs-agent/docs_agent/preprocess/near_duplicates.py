@@ -0,0 +1,272 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Find and collapse near-duplicate text chunks using MinHash and LSH"""
+
+import hashlib
+import os
+import re
+import typing
+
+from absl import logging
+import numpy as np
+
+from docs_agent.models.tokenCount import returnHighestTokens
+
+# A Mersenne prime larger than any 32-bit shingle hash.
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# The supported values of the `near_duplicate_canonical` field.
+CANONICAL_CHOICES = ["first", "newest", "shortest_path"]
+
+
+# Return the set of word shingles (n-grams of `size` words) in a text.
+def get_shingles(text: str, size: int = 5) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+# Return the exact Jaccard similarity of two sets.
+def jaccard_similarity(set_a: set, set_b: set) -> float:
+    if not set_a and not set_b:
+        return 1.0
+    return len(set_a & set_b) / len(set_a | set_b)
+
+
+# Return the number of LSH bands and rows per band for a similarity
+# threshold, which minimizes the weighted sum of the false positive and
+# false negative probabilities.
+def get_lsh_params(threshold: float, num_perm: int) -> tuple[int, int]:
+    def probability(s, bands, rows):
+        return 1 - (1 - s**rows) ** bands
+
+    best_params = (num_perm, 1)
+    best_error = float("inf")
+    steps = 100
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands != 0:
+            continue
+        rows = num_perm // bands
+        false_positive = 0.0
+        false_negative = 0.0
+        for i in range(steps):
+            s = i / steps
+            if s < threshold:
+                false_positive += probability(s, bands, rows) / steps
+            else:
+                false_negative += (1 - probability(s, bands, rows)) / steps
+        error = false_positive + false_negative
+        if error < best_error:
+            best_error = error
+            best_params = (bands, rows)
+    return best_params
+
+
+class MinHasher:
+    """Computes MinHash signatures of sets of shingles.
+
+    Each of the `num_perm` hash functions has the form (a * x + b) mod p,
+    where x is a 32-bit hash of a shingle.
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1) -> None:
+        self.num_perm = num_perm
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles: set[str]) -> np.ndarray:
+        hashes = np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(),
+                    "little",
+                )
+                for shingle in shingles
+            ],
+            dtype=np.uint64,
+        )
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        # (a * x + b) fits in 64 bits because a, b, and x are all below 2^32.
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0)
+
+
+# Return the estimated Jaccard similarity of two MinHash signatures.
+def estimate_similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    return float(np.mean(signature_a == signature_b))
+
+
+# Group the keys of near-duplicate texts, whose Jaccard similarity is at or
+# above the threshold. Only groups with more than one key are returned, and
+# keys in each group keep the order of `texts`.
+def find_near_duplicate_groups(
+    texts: dict[str, str],
+    threshold: float = 0.9,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+) -> list[list[str]]:
+    keys = list(texts)
+    minhasher = MinHasher(num_perm=num_perm)
+    shingles = [get_shingles(texts[key], size=shingle_size) for key in keys]
+    signatures = [minhasher.signature(shingle_set) for shingle_set in shingles]
+    # Split each signature into bands and put texts that share a band into
+    # the same bucket. Each text in a bucket is only compared with the first
+    # text of the bucket (its representative), so that a large bucket of
+    # copies doesn't produce a quadratic number of pairs.
+    bands, rows = get_lsh_params(threshold, num_perm)
+    candidate_pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for index, signature in enumerate(signatures):
+            band_key = signature[band * rows : (band + 1) * rows].tobytes()
+            buckets.setdefault(band_key, []).append(index)
+        for bucket in buckets.values():
+            for member in bucket[1:]:
+                candidate_pairs.add((bucket[0], member))
+
+    # Join the candidates above the threshold using union-find.
+    parents = list(range(len(keys)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    # The exact Jaccard similarity with the representative is checked, since
+    # a band can match by chance.
+    for i, j in sorted(candidate_pairs):
+        if jaccard_similarity(shingles[i], shingles[j]) >= threshold:
+            root_i = find(i)
+            root_j = find(j)
+            if root_i != root_j:
+                parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for index, key in enumerate(keys):
+        groups.setdefault(find(index), []).append(key)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+# Return a key that sorts paths by the numbers in them (for example,
+# `v2` before `v10`) and by their text otherwise.
+def get_version_key(path: str) -> list:
+    return [
+        (1, int(part), "") if part.isdigit() else (0, 0, part)
+        for part in re.split(r"(\d+)", path)
+    ]
+
+
+# Return the canonical chunk of a group of near-duplicate chunk files:
+# "first" is the first path in sorted order, "newest" is the path with the
+# highest version numbers (for example, `v2` over `v1`), and
+# "shortest_path" is the shortest path.
+def choose_canonical(group: list[str], canonical: str = "first") -> str:
+    if canonical == "first":
+        return min(group)
+    if canonical == "newest":
+        return max(group, key=get_version_key)
+    if canonical == "shortest_path":
+        return min(group, key=lambda path: (len(path), path))
+    raise ValueError(f"Unsupported canonical chunk choice: {canonical}")
+
+
+# Collapse near-duplicate text chunks in a product's file index. One chunk of
+# each group (see `choose_canonical`) is kept as the canonical chunk and
+# records its variants. The other chunks stay in the index and the output
+# directory as aliases (`alias_of`), so that the pages they belong to are
+# still complete, but populate stores them in an alias table instead of the
+# vector index, without embeddings. Returns a dictionary with the savings.
+def collapse_near_duplicates(
+    index_object: dict,
+    threshold: float = 0.9,
+    num_perm: int = 128,
+    canonical: str = "first",
+) -> dict:
+    if canonical not in CANONICAL_CHOICES:
+        raise ValueError(f"Unsupported canonical chunk choice: {canonical}")
+    aliased_chunks = 0
+    aliased_bytes = 0
+    aliased_tokens = 0
+    total_bytes = 0
+    group_count = 0
+    for product in index_object:
+        dictionary_input = index_object[product]
+        texts = {}
+        for chunk_file in sorted(dictionary_input):
+            if not os.path.isfile(chunk_file):
+                continue
+            with open(chunk_file, "r", encoding="utf-8") as auto:
+                texts[chunk_file] = auto.read()
+                auto.close()
+            total_bytes += len(texts[chunk_file].encode("utf-8"))
+            # Aliases from an earlier run are already collapsed.
+            if "alias_of" in dictionary_input[chunk_file]:
+                texts.pop(chunk_file)
+        groups = find_near_duplicate_groups(
+            texts=texts, threshold=threshold, num_perm=num_perm
+        )
+        for group in groups:
+            canonical_file = choose_canonical(group, canonical)
+            canonical_data = dictionary_input[canonical_file]
+            variants = canonical_data.get("variants", [])
+            for variant in group:
+                if variant == canonical_file:
+                    continue
+                variant_data = dictionary_input[variant]
+                variant_data["alias_of"] = canonical_file
+                if not isinstance(variant_data.get("metadata", None), dict):
+                    variant_data["metadata"] = {}
+                variant_data["metadata"]["alias_of"] = canonical_data.get("UUID", "")
+                variants.append(
+                    {
+                        "UUID": variant_data.get("UUID", ""),
+                        "URL": variant_data.get("URL", ""),
+                        "source_file": variant_data.get("source_file", ""),
+                        "text_chunk_filename": variant_data.get(
+                            "text_chunk_filename", ""
+                        ),
+                    }
+                )
+                aliased_chunks += 1
+                aliased_bytes += len(texts[variant].encode("utf-8"))
+                aliased_tokens += returnHighestTokens(texts[variant])
+            canonical_data["variants"] = variants
+            # Chroma metadata only supports flat values, so the variant URLs
+            # are also stored as a single string.
+            if not isinstance(canonical_data.get("metadata", None), dict):
+                canonical_data["metadata"] = {}
+            canonical_data["metadata"]["variant_count"] = len(variants)
+            canonical_data["metadata"]["variant_urls"] = ",".join(
+                variant["URL"] for variant in variants
+            )
+            group_count += 1
+            logging.info(
+                f"Kept {canonical_file} and collapsed {len(group) - 1} "
+                + "near-duplicate chunks into aliases."
+            )
+    return {
+        "groups": group_count,
+        "aliased_chunks": aliased_chunks,
+        "aliased_bytes": aliased_bytes,
+        "aliased_tokens": int(aliased_tokens),
+        "total_bytes": total_bytes,
+    }
@@ -16,10 +16,13 @@
 
 """Populate vector databases with embeddings generated from text chunks."""
 
+import datetime
+import hashlib
 import json
 import os
 import re
 import sys
+import typing
 
 from absl import logging
 import chromadb
@@ -27,9 +30,24 @@ from chromadb.utils import embedding_functions
 import flatdict
 import tqdm
 
+from docs_agent.memory.logging import count_source_page_hits
+from docs_agent.memory.logging import normalize_page_url
+from docs_agent.models import tokenCount
 from docs_agent.models.google_genai import Gemini
 from docs_agent.preprocess.splitters import markdown_splitter
+from docs_agent.storage.alias_store import AliasStore
+from docs_agent.storage.alias_store import get_alias_store_path
+from docs_agent.storage.alias_store import open_alias_store
+from docs_agent.storage.embedding_store import EmbeddingStore
+from docs_agent.storage.embedding_store import content_hash
 from docs_agent.storage.google_semantic_retriever import SemanticRetriever
+from docs_agent.storage.chroma import create_metadata_indexes
+from docs_agent.storage.chroma import get_hnsw_metadata
+from docs_agent.storage.chroma import get_or_create_collection
+from docs_agent.storage.metadata_filters import get_url_prefix_fields
+from docs_agent.storage.numpy_store import export_chroma_to_numpy
+from docs_agent.storage.lexical_index import build_lexical_index_from_chroma
+from docs_agent.storage.context_windows import build_context_windows_from_chroma
 from docs_agent.utilities import config
 from docs_agent.utilities.config import ConfigFile
 from docs_agent.utilities.config import ProductConfig
@@ -52,6 +70,86 @@ def get_file_count_in_a_dir(path):
     return file_count
 
 
+# Get the list of (root, file) pairs in a directory and its subdirectories.
+def get_file_list_in_a_dir(path):
+    file_list = []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            file_list.append((root, file))
+    return file_list
+
+
+# Reorder a list of (root, file) pairs so that text chunks from the pages
+# retrieved most often in the local logs come first. Pages without any hits
+# keep their original order.
+def order_files_by_popularity(file_list, index_object):
+    page_hits = count_source_page_hits()
+    if not page_hits:
+        logging.info("No source URLs found in the logs. Keeping the default order.")
+        return file_list
+    for product in index_object:
+        dictionary_input = index_object[product]
+    file_hits = {}
+    for root, file in file_list:
+        full_file_name = resolve_path(os.path.join(root, "")) + file
+        hits = 0
+        if full_file_name in dictionary_input:
+            chunk_url = str(dictionary_input[full_file_name].get("URL", ""))
+            hits = page_hits.get(normalize_page_url(chunk_url), 0)
+        file_hits[(root, file)] = hits
+    # `sorted()` is stable, so files with the same count keep the walk order.
+    ordered_list = sorted(file_list, key=lambda item: -file_hits[item])
+    hottest_pages = sorted(page_hits.items(), key=lambda item: -item[1])[:5]
+    print(f"Populating the most retrieved pages first:")
+    for url, hits in hottest_pages:
+        print(f"  {hits} hits: {url}")
+    return ordered_list
+
+
+# Parse a shard in the form of `i/N` (for example, `2/4`), where shards
+# are numbered from 1 to N.
+def parse_shard(shard: str) -> tuple[int, int]:
+    match = re.search(r"^\s*(\d+)\s*/\s*(\d+)\s*$", str(shard))
+    if not match:
+        raise ValueError(f"The shard {shard} is not in the form of i/N.")
+    shard_index = int(match.group(1))
+    shard_count = int(match.group(2))
+    if shard_count < 1 or shard_index < 1 or shard_index > shard_count:
+        raise ValueError(f"The shard {shard} must be between 1/N and N/N.")
+    return shard_index, shard_count
+
+
+# Return the shard-local Chroma directory of shard `i` of `N`.
+def get_shard_vector_db_dir(vector_db_dir: str, shard_index: int, shard_count: int):
+    return f"{str(vector_db_dir).rstrip('/')}_shard_{shard_index}_of_{shard_count}"
+
+
+# Return the shard (from 1 to N) that a page belongs to. A stable hash is
+# used so that every machine assigns the same pages to the same shard.
+def get_shard_of_origin_uuid(origin_uuid: str, shard_count: int):
+    digest = hashlib.sha256(str(origin_uuid).encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count + 1
+
+
+# Keep only the (root, file) pairs that belong to shard `i` of `N`. Text
+# chunks are sharded by their `origin_uuid` so that all chunks of a page
+# stay in the same shard. Files that are not in the index are kept in the
+# first shard so that they are reported only once.
+def filter_files_by_shard(file_list, index_object, shard_index, shard_count):
+    for product in index_object:
+        dictionary_input = index_object[product]
+    shard_file_list = []
+    for root, file in file_list:
+        full_file_name = resolve_path(os.path.join(root, "")) + file
+        this_shard = 1
+        if full_file_name in dictionary_input:
+            origin_uuid = dictionary_input[full_file_name].get("origin_uuid", "")
+            this_shard = get_shard_of_origin_uuid(origin_uuid, shard_count)
+        if this_shard == shard_index:
+            shard_file_list.append((root, file))
+    return shard_file_list
+
+
 # Return the relative path after the `docs-agent/data` path
 def get_relative_path_and_filename(full_path: str):
     path_and_filename = full_path
@@ -141,7 +239,7 @@ def upload_an_entry_to_a_corpus(
 
 # Delete entries in the Chroma database if we cannot find matches in the current dataset.
 def delete_unmatched_entries_in_chroma(
-    product_config: ProductConfig, chroma_client, collection
+    product_config: ProductConfig, chroma_client, collection, alias_store=None
 ):
     print()
     print(f"Scanning the Chroma database to identify entries to be deleted.")
@@ -216,6 +314,19 @@ def delete_unmatched_entries_in_chroma(
         print(f"Deleted entries count: {deleted_entries_count}")
     else:
         print(f"Keeping all existing entries in the Chroma database.")
+
+    # Delete the aliases of near-duplicate chunks that are no longer found in
+    # the current dataset. Aliases whose content has changed are replaced.
+    if alias_store is not None:
+        aliases = alias_store.get(collection.name)
+        to_be_deleted_alias_ids = [
+            aliases["ids"][index]
+            for index, metadata in enumerate(aliases["metadatas"])
+            if str(metadata.get("text_chunk_filename", "")) not in candidate_entries
+        ]
+        if to_be_deleted_alias_ids:
+            alias_store.delete(collection.name, to_be_deleted_alias_ids)
+            print(f"Deleted aliases count: {len(to_be_deleted_alias_ids)}")
     return to_be_deleted_online_entry_ids
 
 
@@ -308,25 +419,54 @@ def delete_unmatched_entries_in_online_corpus(
 # Read plain text files (.md) from an input dir and
 # add their content to the vector database.
 # Embeddings are generated automatically as they are added to the database.
-def populateToDbFromProduct(product_config: ProductConfig):
+def populateToDbFromProduct(product_config: ProductConfig, shard: str = ""):
     """Populates the vector database with product documentation.
     Args:
         product_config: A ProductConfig object containing configuration details.
+        shard: (Optional) A shard in the form of `i/N`. If specified, only
+            the pages in this shard are populated into a shard-local database.
     """
+    shard_index = 1
+    shard_count = 1
+    if shard != "":
+        (shard_index, shard_count) = parse_shard(shard)
+
     # Initialize Gemini objects.
     (gemini_new, embedding_function_gemini) = init_gemini_model(product_config)
+    # Open the local store of embeddings, which is shared by all products
+    # so that an identical text chunk is embedded only once.
+    embedding_store = None
+    if product_config.embedding_store_path != "":
+        embedding_store = EmbeddingStore(product_config.embedding_store_path)
 
     # Initialize the Chroma database.
+    alias_store = None
     for item in product_config.db_configs:
         if "chroma" in item.db_type:
             logging.info("Initializing Chroma for a local storage.")
-            chroma_client = chromadb.PersistentClient(
-                path=resolve_path(item.vector_db_dir)
-            )
-            collection = chroma_client.get_or_create_collection(
+            vector_db_dir = item.vector_db_dir
+            if shard != "":
+                vector_db_dir = get_shard_vector_db_dir(
+                    vector_db_dir, shard_index, shard_count
+                )
+                print(
+                    f"Populating shard {shard_index}/{shard_count} to {vector_db_dir}"
+                )
+            chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+            collection = get_or_create_collection(
+                chroma_client,
                 name=item.collection_name,
                 embedding_function=embedding_function_gemini,
+                hnsw_metadata=get_hnsw_metadata(
+                    space=item.hnsw_space,
+                    construction_ef=item.hnsw_construction_ef,
+                    m=item.hnsw_m,
+                    search_ef=item.hnsw_search_ef,
+                ),
             )
+            # Aliases of near-duplicate chunks are kept out of the vector
+            # index, in a table next to the database.
+            alias_store = AliasStore(get_alias_store_path(vector_db_dir))
             if (
                 hasattr(product_config, "enable_delete_chunks")
                 and product_config.enable_delete_chunks == "True"
@@ -334,7 +474,7 @@ def populateToDbFromProduct(product_config: ProductConfig):
                 # Delete entries in the database if we cannot find matches
                 # in the current dataset.
                 delete_unmatched_entries_in_chroma(
-                    product_config, chroma_client, collection
+                    product_config, chroma_client, collection, alias_store
                 )
 
     # Initialzie the Semantic Retreival API.
@@ -357,8 +497,25 @@ def populateToDbFromProduct(product_config: ProductConfig):
                         product_config, semantic, corpus_name
                     )
 
+    # Get the preprocess information from the `file_index.json` file.
+    (index, full_index_path) = load_index(input_path=product_config.output_path)
+
+    # Get all files found in the `output_path` directory.
+    file_list = get_file_list_in_a_dir(product_config.output_path)
+    # Keep only the files in this shard.
+    if shard != "":
+        file_list = filter_files_by_shard(
+            file_list=file_list,
+            index_object=index,
+            shard_index=shard_index,
+            shard_count=shard_count,
+        )
+    # Process the pages that users retrieve most often first.
+    if product_config.populate_order == "popularity":
+        file_list = order_files_by_popularity(file_list=file_list, index_object=index)
+
     # Initialize progress bar objects.
-    file_count = get_file_count_in_a_dir(product_config.output_path)
+    file_count = len(file_list)
     (
         progress_bar,
         progress_new_file,
@@ -366,9 +523,6 @@ def populateToDbFromProduct(product_config: ProductConfig):
         progress_update_file,
     ) = init_progress_bars(file_count)
 
-    # Get the preprocess information from the `file_index.json` file.
-    (index, full_index_path) = load_index(input_path=product_config.output_path)
-
     # Local variables track the resource names of documents for the Semantic Retrieval API.
     document_name_in_corpus = ""
     dict_document_names_in_corpus = {}
@@ -378,58 +532,67 @@ def populateToDbFromProduct(product_config: ProductConfig):
     updated_count = 0
     new_count = 0
     unchanged_count = 0
+    aliased_count = 0
 
-    # Loop through each `path` in the `config.yaml` file.
-    for root, dirs, files in os.walk(product_config.output_path):
-        # Convert `output_path` to be a fully resolved path.
-        fully_resolved_output = end_path_backslash(
-            resolve_path(product_config.output_path)
-        )
-        # Loop through all files found in the `output_path` directory.
-        for file in files:
-            # Displays status bar, sleep helps to stick the progress
-            progress_bar.update(1)
-            progress_bar.set_description_str(f"Processing file {file}", refresh=True)
-            # Get the full path for the file.
-            full_file_name = resolve_path(os.path.join(root, "")) + file
-            # Process only files with `.md` extension.
-            if file.endswith(".md"):
-                # Open the file and get the content.
-                content_file = get_file_content(os.path.join(root, file))
-                # Get a Section object from the file index object.
-                chroma_add_item = findFileinDict(
-                    input_file_name=full_file_name,
-                    index_object=index,
-                    content_file=content_file,
-                )
-                # Quick fix: If the filename ends with `_##.md`, extract the file prefix
-                # Then check if this prefix exists in a local dict, which tracks document
-                # resource names for the Semantic Retrieval API call.
-                file_page_prefix = ""
-                is_this_first_chunk = False
-                match_file_page = re.search(r"(.*)_\d+\.md$", full_file_name)
-                if match_file_page:
-                    file_page_prefix = match_file_page.group(1)
-                    if file_page_prefix in dict_document_names_in_corpus:
-                        # If the prefix exists in the dict, retrieve the document resource name.
-                        document_name_in_corpus = dict_document_names_in_corpus.get(
-                            file_page_prefix
+    # Loop through all files found in the `output_path` directory.
+    for root, file in file_list:
+        # Displays status bar, sleep helps to stick the progress
+        progress_bar.update(1)
+        progress_bar.set_description_str(f"Processing file {file}", refresh=True)
+        # Get the full path for the file.
+        full_file_name = resolve_path(os.path.join(root, "")) + file
+        # Process only files with `.md` extension.
+        if file.endswith(".md"):
+            # Open the file and get the content.
+            content_file = get_file_content(os.path.join(root, file))
+            # Get a Section object from the file index object.
+            chroma_add_item = findFileinDict(
+                input_file_name=full_file_name,
+                index_object=index,
+                content_file=content_file,
+            )
+            # Quick fix: If the filename ends with `_##.md`, extract the file prefix
+            # Then check if this prefix exists in a local dict, which tracks document
+            # resource names for the Semantic Retrieval API call.
+            file_page_prefix = ""
+            is_this_first_chunk = False
+            match_file_page = re.search(r"(.*)_\d+\.md$", full_file_name)
+            if match_file_page:
+                file_page_prefix = match_file_page.group(1)
+                if file_page_prefix in dict_document_names_in_corpus:
+                    # If the prefix exists in the dict, retrieve the document resource name.
+                    document_name_in_corpus = dict_document_names_in_corpus.get(
+                        file_page_prefix
+                    )
+                else:
+                    # if not, set the flag to indicate that a new `document` needs
+                    # to be created.
+                    is_this_first_chunk = True
+                    document_name_in_corpus = ""
+            else:
+                # If the file is not in a group, treat it as its own document.
+                file_page_prefix = full_file_name
+            # Skip if the file size is larger than 10000 bytes (API limit)
+            if (
+                chroma_add_item.section.content != ""
+                and len(chroma_add_item.section.content) < 10000
+                and chroma_add_item.section.md_hash != ""
+                and chroma_add_item.section.uuid != ""
+            ):
+                # An alias of a near-duplicate chunk (see
+                # `collapse_near_duplicates`) is stored in the alias table
+                # instead of the vector index, without an embedding.
+                alias_of = str(chroma_add_item.metadata.get("alias_of", ""))
+                if alias_of != "" and alias_store is not None:
+                    id_to_not_change = []
+                    if (
+                        alias_store.get_md_hash(
+                            collection.name, chroma_add_item.section.uuid
                         )
-                    else:
-                        # if not, set the flag to indicate that a new `document` needs
-                        # to be created.
-                        is_this_first_chunk = True
-                        document_name_in_corpus = ""
+                        == chroma_add_item.section.md_hash
+                    ):
+                        id_to_not_change = [chroma_add_item.section.uuid]
                 else:
-                    # If the file is not in a group, treat it as its own document.
-                    file_page_prefix = full_file_name
-                # Skip if the file size is larger than 10000 bytes (API limit)
-                if (
-                    chroma_add_item.section.content != ""
-                    and len(chroma_add_item.section.content) < 10000
-                    and chroma_add_item.section.md_hash != ""
-                    and chroma_add_item.section.uuid != ""
-                ):
                     # Compare the text chunk entries in the local Chroma database
                     # to check if the hash value has changed.
                     id_to_not_change = collection.get(
@@ -437,67 +600,106 @@ def populateToDbFromProduct(product_config: ProductConfig):
                         ids=chroma_add_item.section.uuid,
                         where={"md_hash": {"$eq": chroma_add_item.section.md_hash}},
                     )["ids"]
-                    if id_to_not_change != []:
-                        # This text chunk is unchanged. Skip this text chunk.
-                        qty_change = len(id_to_not_change)
-                        progress_unchanged_file.update(qty_change)
-                        unchanged_count += qty_change
-                        progress_unchanged_file.set_description_str(
-                            f"Total unchanged file {unchanged_count}",
-                            refresh=True,
+                if id_to_not_change != []:
+                    # This text chunk is unchanged. Skip this text chunk.
+                    qty_change = len(id_to_not_change)
+                    progress_unchanged_file.update(qty_change)
+                    unchanged_count += qty_change
+                    progress_unchanged_file.set_description_str(
+                        f"Total unchanged file {unchanged_count}",
+                        refresh=True,
+                    )
+                elif alias_of != "" and alias_store is not None:
+                    alias_store.put(
+                        collection.name,
+                        chroma_add_item.section.uuid,
+                        chroma_add_item.section.content,
+                        chroma_add_item.metadata
+                        | get_url_prefix_fields(chroma_add_item.section.url),
+                    )
+                    # Remove the entry of a text chunk that wasn't an alias
+                    # in an earlier run from the vector index.
+                    existing_ids = collection.get(
+                        ids=[chroma_add_item.section.uuid], include=[]
+                    )["ids"]
+                    if existing_ids:
+                        collection.delete(ids=existing_ids)
+                    aliased_count += 1
+                else:
+                    # Process this text chunk and store it into the databases.
+                    # Generate an embedding
+                    if embedding_store is not None:
+                        # Reuse the embedding of an identical text chunk
+                        # (in any product) if it exists.
+                        this_embedding = embedding_store.get_or_embed(
+                            embed_function=lambda: gemini_new.embed(
+                                content=chroma_add_item.section.content,
+                                task_type="RETRIEVAL_DOCUMENT",
+                                title=chroma_add_item.doc_title,
+                            )[0],
+                            content=chroma_add_item.section.content,
+                            model=product_config.models.embedding_model,
+                            task_type="RETRIEVAL_DOCUMENT",
+                            title=chroma_add_item.doc_title,
                         )
                     else:
-                        # Process this text chunk and store it into the databases.
-                        # Generate an embedding
                         this_embedding = gemini_new.embed(
                             content=chroma_add_item.section.content,
                             task_type="RETRIEVAL_DOCUMENT",
                             title=chroma_add_item.doc_title,
                         )[0]
-                        # Store this text chunk entry in Chroma.
-                        collection.add(
-                            documents=[chroma_add_item.section.content],
-                            embeddings=[this_embedding],
-                            metadatas=[chroma_add_item.metadata],
-                            ids=[chroma_add_item.section.uuid],
-                        )
-                        # Update the progress bar.
-                        new_count += 1
-                        progress_new_file.update(1)
-                        progress_new_file.set_description_str(
-                            f"Total new files {new_count}", refresh=True
+                    # Store this text chunk entry in Chroma with the URL
+                    # prefixes of its page, which are used by filters.
+                    collection.add(
+                        documents=[chroma_add_item.section.content],
+                        embeddings=[this_embedding],
+                        metadatas=[
+                            chroma_add_item.metadata
+                            | get_url_prefix_fields(chroma_add_item.section.url)
+                        ],
+                        ids=[chroma_add_item.section.uuid],
+                    )
+                    # Remove the text chunk from the alias table if it was an
+                    # alias in an earlier run.
+                    if alias_store is not None:
+                        alias_store.delete(
+                            collection.name, [chroma_add_item.section.uuid]
                         )
-                        # Add this text chunk to the online storage.
-                        if product_config.db_type == "google_semantic_retriever":
-                            document_name = upload_an_entry_to_a_corpus(
-                                semantic,
-                                corpus_name,
-                                document_name_in_corpus,
-                                chroma_add_item,
-                                is_this_first_chunk,
-                            )
-                            # Store the document resource name
-                            dict_document_names_in_corpus[
-                                file_page_prefix
-                            ] = document_name
-                    total_files += 1
-                else:
-                    if chroma_add_item.section.content == "":
-                        logging.error(f"Skipped {file} because the file is empty.")
-                    else:
-                        logging.error(
-                            f"Skipped {file} because the file is is too large {str(len(chroma_add_item.section.content))}"
+                    # Update the progress bar.
+                    new_count += 1
+                    progress_new_file.update(1)
+                    progress_new_file.set_description_str(
+                        f"Total new files {new_count}", refresh=True
+                    )
+                    # Add this text chunk to the online storage.
+                    if product_config.db_type == "google_semantic_retriever":
+                        document_name = upload_an_entry_to_a_corpus(
+                            semantic,
+                            corpus_name,
+                            document_name_in_corpus,
+                            chroma_add_item,
+                            is_this_first_chunk,
                         )
-            # Skips logging a warning if the file being walked is the index file
-            elif full_file_name == full_index_path:
-                next
+                        # Store the document resource name
+                        dict_document_names_in_corpus[file_page_prefix] = document_name
+                total_files += 1
             else:
-                # Logs missing extensions from input directory that may be
-                # processed
-                file_name, extension = os.path.splitext(file)
-                logging.warning(
-                    f"Skipped {file} because there is no configured parser for extension {extension}"
-                )
+                if chroma_add_item.section.content == "":
+                    logging.error(f"Skipped {file} because the file is empty.")
+                else:
+                    logging.error(
+                        f"Skipped {file} because the file is is too large {str(len(chroma_add_item.section.content))}"
+                    )
+        # Skips logging a warning if the file being walked is the index file
+        elif full_file_name == full_index_path:
+            next
+        else:
+            # Logs missing extensions from input directory that may be
+            # processed
+            file_name, extension = os.path.splitext(file)
+            logging.warning(
+                f"Skipped {file} because there is no configured parser for extension {extension}"
+            )
 
     progress_bar.set_description_str(
         f"Finished processing text chunk files (and file_index.json).", refresh=True
@@ -505,6 +707,22 @@ def populateToDbFromProduct(product_config: ProductConfig):
     progress_unchanged_file.set_description_str(
         f"Total number of entries: {total_files}", refresh=True
     )
+    if aliased_count > 0:
+        print()
+        print(
+            f"Stored {aliased_count} near-duplicate chunks as aliases outside "
+            + "of the vector index (without embeddings)."
+        )
+    if alias_store is not None:
+        alias_store.close()
+    if embedding_store is not None:
+        reused_count = embedding_store.stats()["hits"]
+        print()
+        print(
+            f"Reused {reused_count} embeddings of identical text chunks "
+            + f"(from {resolve_path(product_config.embedding_store_path)})."
+        )
+        embedding_store.close()
 
 
 def findFileinDict(input_file_name: str, index_object, content_file):
@@ -531,9 +749,9 @@ def findFileinDict(input_file_name: str, index_object, content_file):
             dictionary_input[input_file_name]
         )
         if "URL" in metadata_dict_extra:
-            section.url = metadata_dict_extra["URL"]
+            section = section.replace(url=metadata_dict_extra["URL"])
         # Merges dictionaries with main metadata and additional metadata
-        section.content = content_file
+        section = section.replace(content=content_file)
         # Combines Section db in dictionary with extra
         metadata_dict_final = section.encodeToChromaDBNoContent() | metadata_dict_extra
         # Add the text chunk filename to the metadata.
@@ -585,6 +803,7 @@ def load_index(
 # defaults to /tmp
 def process_all_products(
     config_file: ConfigFile = config.ReadConfig().returnProducts(),
+    shard: str = "",
 ):
     print(
         f"Starting to verify files to populate database for {str(len(config_file.products))} products.\n"
@@ -598,7 +817,626 @@ def process_all_products(
         for item in product.db_configs:
             print(f"{item}")
         print(f"===========================================")
-        populateToDbFromProduct(product_config=product)
+        populateToDbFromProduct(product_config=product, shard=shard)
+        # Refresh the NumPy stores exported from the (non-shard) databases.
+        if shard == "":
+            index_metadata_from_product(product_config=product, update_entries=False)
+            export_numpy_from_product(product_config=product)
+            build_lexical_index_from_product(product_config=product)
+            build_context_windows_from_product(product_config=product)
+
+
+# Export the Chroma collections of a product to memory-mapped NumPy stores.
+# Unless `export_all` is set, only collections that use the `numpy` vector
+# backend are exported.
+def export_numpy_from_product(product_config: ProductConfig, export_all=False):
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        if not export_all and item.vector_backend != "numpy":
+            continue
+        manifest = export_chroma_to_numpy(
+            vector_db_dir=item.vector_db_dir,
+            collection_name=item.collection_name,
+            numpy_dir=item.numpy_dir,
+            quantization=item.quantization,
+            pq_subvectors=item.pq_subvectors,
+            reduction=item.reduction,
+            reduced_dimension=item.reduced_dimension,
+        )
+        print(
+            f"Exported {manifest['count']} entries ({manifest['dimension']} dimensions) "
+            + f"of {item.collection_name} to a NumPy store."
+        )
+
+
+# Build the full-text indexes of the Chroma collections of a product from
+# the same text chunks. Unless `build_all` is set, only collections that use
+# hybrid search are indexed.
+def build_lexical_index_from_product(product_config: ProductConfig, build_all=False):
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        if not build_all and item.enable_hybrid_search != "True":
+            continue
+        count = build_lexical_index_from_chroma(
+            vector_db_dir=item.vector_db_dir,
+            collection_name=item.collection_name,
+            index_dir=item.lexical_index_dir,
+        )
+        print(f"Built a lexical index of {count} entries of {item.collection_name}.")
+
+
+# Precompute the context windows (the parent, children, and siblings) of the
+# sections of the Chroma collections of a product. Unless `build_all` is set,
+# only collections that enable context windows are processed.
+def build_context_windows_from_product(product_config: ProductConfig, build_all=False):
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        if not build_all and item.enable_context_windows != "True":
+            continue
+        stats = build_context_windows_from_chroma(
+            vector_db_dir=item.vector_db_dir,
+            collection_name=item.collection_name,
+            window_dir=item.context_window_dir,
+        )
+        overhead = ""
+        if stats["chroma_bytes"] > 0:
+            overhead = (
+                f", {100 * stats['store_bytes'] / stats['chroma_bytes']:.1f}% "
+                + "of the Chroma database"
+            )
+        print(
+            f"Built {stats['windows']} context windows of {item.collection_name} "
+            + f"({stats['store_bytes'] / 1e6:.2f} MB{overhead})."
+        )
+
+
+# Return the IDs and md hashes of the entries stored in an existing Chroma
+# collection. Returns an empty dictionary if the collection does not exist yet.
+def get_existing_chroma_entries(vector_db_dir: str, collection_name: str):
+    existing_entries = {}
+    # Creating a client creates the directory, which a dry run must not do.
+    if not os.path.isdir(resolve_path(vector_db_dir)):
+        logging.info(f"The database {vector_db_dir} does not exist yet.")
+        return existing_entries
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    try:
+        collection = chroma_client.get_collection(name=collection_name)
+    except ValueError:
+        logging.info(f"The collection {collection_name} does not exist yet.")
+        return existing_entries
+    all_entries = collection.get(include=["metadatas"])
+    for index, entry_id in enumerate(all_entries["ids"]):
+        metadata = all_entries["metadatas"][index] or {}
+        existing_entries[str(entry_id)] = {
+            "md_hash": str(metadata.get("md_hash", "")),
+            "text_chunk_filename": str(metadata.get("text_chunk_filename", "")),
+        }
+    return existing_entries
+
+
+# Return the IDs and md hashes of the aliases of near-duplicate chunks that
+# are stored next to a Chroma database, in the same format as
+# `get_existing_chroma_entries`.
+def get_existing_alias_entries(vector_db_dir: str, collection_name: str):
+    existing_aliases = {}
+    alias_store = open_alias_store(vector_db_dir)
+    if alias_store is None:
+        return existing_aliases
+    aliases = alias_store.get(collection_name)
+    alias_store.close()
+    for index, entry_id in enumerate(aliases["ids"]):
+        metadata = aliases["metadatas"][index]
+        existing_aliases[str(entry_id)] = {
+            "md_hash": str(metadata.get("md_hash", "")),
+            "text_chunk_filename": str(metadata.get("text_chunk_filename", "")),
+        }
+    return existing_aliases
+
+
+# Return the size in bytes of the metadata of an entry, as stored in JSON.
+def get_metadata_size(metadata: dict) -> int:
+    return len(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+
+
+# Rewrite the `parent_tree` of the entries of an existing Chroma collection
+# from the list literal form (for example, "[0, 1]") to the compact form
+# (for example, "0.1"). Entries that are already compact are not updated.
+def compact_parent_trees_in_chroma(
+    vector_db_dir: str, collection_name: str, batch_size: int = 1000
+) -> dict:
+    report = {"entries": 0, "updated": 0, "bytes_before": 0, "bytes_after": 0}
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    try:
+        collection = chroma_client.get_collection(name=collection_name)
+    except ValueError:
+        logging.info(f"The collection {collection_name} does not exist yet.")
+        return report
+    offset = 0
+    while True:
+        entries = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not entries["ids"]:
+            break
+        offset += len(entries["ids"])
+        updated_ids = []
+        updated_metadatas = []
+        for entry_id, metadata in zip(entries["ids"], entries["metadatas"]):
+            report["entries"] += 1
+            report["bytes_before"] += get_metadata_size(metadata)
+            if "parent_tree" in metadata:
+                parent_tree = markdown_splitter.encode_parent_tree(
+                    metadata["parent_tree"]
+                )
+                if parent_tree != metadata["parent_tree"]:
+                    metadata = dict(metadata)
+                    metadata["parent_tree"] = parent_tree
+                    updated_ids.append(entry_id)
+                    updated_metadatas.append(metadata)
+            report["bytes_after"] += get_metadata_size(metadata)
+        if updated_ids:
+            collection.update(ids=updated_ids, metadatas=updated_metadatas)
+            report["updated"] += len(updated_ids)
+    return report
+
+
+# Compact the section metadata of the Chroma collections of a product.
+def compact_metadata_from_product(product_config: ProductConfig):
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        report = compact_parent_trees_in_chroma(
+            vector_db_dir=item.vector_db_dir, collection_name=item.collection_name
+        )
+        saved = report["bytes_before"] - report["bytes_after"]
+        percent = 0.0
+        if report["bytes_before"] > 0:
+            percent = 100 * saved / report["bytes_before"]
+        print(
+            f"Updated {report['updated']} of {report['entries']} entries "
+            + f"of {item.collection_name}."
+        )
+        print(
+            f"Metadata size: {report['bytes_before']} bytes -> "
+            + f"{report['bytes_after']} bytes ({saved} bytes, {percent:.1f}% smaller)."
+        )
+        if report["updated"] > 0 and item.vector_backend == "numpy":
+            print("Run `agent export-numpy` to update the NumPy store.")
+
+
+# Add the URL prefix fields (which are used by filters) to the entries of an
+# existing Chroma collection that were populated without them.
+def add_url_prefixes_in_chroma(
+    vector_db_dir: str, collection_name: str, batch_size: int = 1000
+) -> dict:
+    report = {"entries": 0, "updated": 0}
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    try:
+        collection = chroma_client.get_collection(name=collection_name)
+    except ValueError:
+        logging.info(f"The collection {collection_name} does not exist yet.")
+        return report
+    offset = 0
+    while True:
+        entries = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not entries["ids"]:
+            break
+        offset += len(entries["ids"])
+        updated_ids = []
+        updated_metadatas = []
+        for entry_id, metadata in zip(entries["ids"], entries["metadatas"]):
+            report["entries"] += 1
+            url_prefix_fields = get_url_prefix_fields(metadata.get("url", None))
+            if any(
+                metadata.get(key) != value for key, value in url_prefix_fields.items()
+            ):
+                updated_ids.append(entry_id)
+                updated_metadatas.append(metadata | url_prefix_fields)
+        if updated_ids:
+            collection.update(ids=updated_ids, metadatas=updated_metadatas)
+            report["updated"] += len(updated_ids)
+    return report
+
+
+# Prepare the Chroma collections of a product for filtered queries: add the
+# URL prefix fields to existing entries (if `update_entries` is set) and
+# index the metadata table.
+def index_metadata_from_product(product_config: ProductConfig, update_entries=True):
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        if update_entries:
+            report = add_url_prefixes_in_chroma(
+                vector_db_dir=item.vector_db_dir, collection_name=item.collection_name
+            )
+            print(
+                f"Added URL prefixes to {report['updated']} of {report['entries']} "
+                + f"entries of {item.collection_name}."
+            )
+            if report["updated"] > 0 and item.vector_backend == "numpy":
+                print("Run `agent export-numpy` to update the NumPy store.")
+        create_metadata_indexes(item.vector_db_dir)
+        logging.info(f"Indexed the metadata of {resolve_path(item.vector_db_dir)}.")
+
+
+# Compare the text chunks in `file_index.json` to the existing Chroma collection
+# and estimate the cost of populating the database. No model is called.
+def estimate_populate_from_product(
+    product_config: ProductConfig,
+    shard: str = "",
+    embedded_hashes: typing.Optional[set] = None,
+):
+    """Estimates the work needed to populate the vector database.
+    Args:
+        product_config: A ProductConfig object containing configuration details.
+        shard: (Optional) A shard in the form of `i/N`.
+        embedded_hashes: (Optional) A set of content hashes to be embedded by
+            the products estimated earlier, which is updated by this call.
+
+    Returns:
+        A dictionary containing the estimated counts, tokens, and time.
+    """
+    shard_index = 1
+    shard_count = 1
+    if shard != "":
+        (shard_index, shard_count) = parse_shard(shard)
+    existing_entries = {}
+    existing_aliases = {}
+    for item in product_config.db_configs:
+        if "chroma" in item.db_type:
+            vector_db_dir = item.vector_db_dir
+            if shard != "":
+                vector_db_dir = get_shard_vector_db_dir(
+                    vector_db_dir, shard_index, shard_count
+                )
+            existing_entries = get_existing_chroma_entries(
+                vector_db_dir, item.collection_name
+            )
+            existing_aliases = get_existing_alias_entries(
+                vector_db_dir, item.collection_name
+            )
+
+    # Open the embedding store only if it exists, so that a dry run
+    # does not create any files.
+    embedding_store = None
+    if product_config.embedding_store_path != "" and os.path.isfile(
+        resolve_path(product_config.embedding_store_path)
+    ):
+        embedding_store = EmbeddingStore(product_config.embedding_store_path)
+    embedding_model = product_config.models.embedding_model
+
+    # Get the preprocess information from the `file_index.json` file.
+    (index, full_index_path) = load_index(input_path=product_config.output_path)
+
+    # Get all files found in the `output_path` directory.
+    file_list = get_file_list_in_a_dir(product_config.output_path)
+    if shard != "":
+        file_list = filter_files_by_shard(
+            file_list=file_list,
+            index_object=index,
+            shard_index=shard_index,
+            shard_count=shard_count,
+        )
+
+    new_count = 0
+    changed_count = 0
+    unchanged_count = 0
+    skipped_count = 0
+    reused_count = 0
+    aliased_count = 0
+    embedding_tokens = 0
+    if embedded_hashes is None:
+        embedded_hashes = set()
+    for root, file in file_list:
+        if not file.endswith(".md"):
+            continue
+        full_file_name = resolve_path(os.path.join(root, "")) + file
+        content_file = get_file_content(os.path.join(root, file))
+        chroma_add_item = findFileinDict(
+            input_file_name=full_file_name,
+            index_object=index,
+            content_file=content_file,
+        )
+        # Apply the same rules that populate uses to skip a text chunk.
+        if (
+            chroma_add_item.section.content == ""
+            or len(chroma_add_item.section.content) >= 10000
+            or chroma_add_item.section.md_hash == ""
+            or chroma_add_item.section.uuid == ""
+        ):
+            skipped_count += 1
+            continue
+        this_id = str(chroma_add_item.section.uuid)
+        # Aliases of near-duplicate chunks are stored in the alias table.
+        is_alias = str(chroma_add_item.metadata.get("alias_of", "")) != ""
+        stored_entries = existing_entries
+        if is_alias:
+            stored_entries = existing_aliases
+        if this_id not in stored_entries:
+            new_count += 1
+        elif stored_entries[this_id]["md_hash"] != str(chroma_add_item.section.md_hash):
+            changed_count += 1
+        else:
+            unchanged_count += 1
+            continue
+        # Aliases are stored without embeddings.
+        if is_alias:
+            aliased_count += 1
+            continue
+        # Identical text chunks are embedded only once.
+        if product_config.embedding_store_path != "":
+            this_hash = content_hash(
+                chroma_add_item.section.content,
+                model=embedding_model,
+                task_type="RETRIEVAL_DOCUMENT",
+                title=chroma_add_item.doc_title,
+            )
+            if this_hash in embedded_hashes or (
+                embedding_store is not None and this_hash in embedding_store
+            ):
+                reused_count += 1
+                continue
+            embedded_hashes.add(this_hash)
+        # The title is sent to the embedding model along with the content.
+        embedding_tokens += tokenCount.returnHighestTokens(
+            chroma_add_item.section.content + " " + chroma_add_item.doc_title
+        )
+    # Entries are stale if their text chunk file is no longer in the index,
+    # which is how `delete_unmatched_entries_in_chroma` finds them.
+    candidate_filenames = set()
+    for product in index:
+        for chunk_data in index[product].values():
+            candidate_filenames.add(str(chunk_data.get("text_chunk_filename", "")))
+    candidate_filenames.discard("")
+    stale_count = len(
+        [
+            entry
+            for entry in list(existing_entries.values())
+            + list(existing_aliases.values())
+            if entry["text_chunk_filename"] not in candidate_filenames
+        ]
+    )
+    if embedding_store is not None:
+        embedding_store.close()
+
+    # Each new or changed text chunk requires a single embedding call
+    # unless its embedding is reused or it's an alias.
+    embedding_calls = new_count + changed_count - reused_count - aliased_count
+    call_limit = int(product_config.models.embedding_api_call_limit)
+    call_period = int(product_config.models.embedding_api_call_period)
+    estimated_seconds = 0
+    if call_limit > 0:
+        estimated_seconds = (embedding_calls / call_limit) * call_period
+    return {
+        "new": new_count,
+        "changed": changed_count,
+        "unchanged": unchanged_count,
+        "stale": stale_count,
+        "skipped": skipped_count,
+        "reused": reused_count,
+        "aliased": aliased_count,
+        "embedding_calls": embedding_calls,
+        "embedding_tokens": int(embedding_tokens),
+        "estimated_seconds": estimated_seconds,
+    }
+
+
+# Given a ReadConfig object, print the populate estimates of all products
+def estimate_all_products(
+    config_file: ConfigFile = config.ReadConfig().returnProducts(),
+    shard: str = "",
+):
+    print(
+        f"Estimating the cost of populating databases for {str(len(config_file.products))} products (dry run).\n"
+    )
+    # Identical text chunks in different products are embedded only once.
+    embedded_hashes = set()
+    for product in config_file.products:
+        estimate = estimate_populate_from_product(
+            product_config=product, shard=shard, embedded_hashes=embedded_hashes
+        )
+        call_limit = product.models.embedding_api_call_limit
+        call_period = product.models.embedding_api_call_period
+        wall_time = datetime.timedelta(seconds=int(estimate["estimated_seconds"]))
+        stale_action = "kept"
+        if product.enable_delete_chunks == "True":
+            stale_action = "deleted"
+        print(f"===========================================")
+        print(f"Product: {product.product_name}")
+        print(f"Input directory: {resolve_path(product.output_path)}")
+        if shard != "":
+            print(f"Shard: {shard}")
+        print(f"Embedding model: {product.models.embedding_model}")
+        print(f"===========================================")
+        print(f"New text chunks: {estimate['new']}")
+        print(f"Changed text chunks: {estimate['changed']}")
+        print(f"Unchanged text chunks: {estimate['unchanged']}")
+        print(
+            f"Stale entries in the database: {estimate['stale']} (to be {stale_action})"
+        )
+        print(f"Skipped text chunks (empty or too large): {estimate['skipped']}")
+        print(f"Reused embeddings of identical text chunks: {estimate['reused']}")
+        print(f"Near-duplicate chunks stored as aliases: {estimate['aliased']}")
+        print(f"Embedding API calls: {estimate['embedding_calls']}")
+        print(f"Estimated embedding tokens: {estimate['embedding_tokens']}")
+        print(
+            f"Estimated wall time: {wall_time} (at {call_limit} calls per {call_period} seconds)"
+        )
+        if product.db_type == "google_semantic_retriever":
+            print(
+                f"Semantic Retrieval API chunk uploads: {estimate['embedding_calls']}"
+            )
+        print()
+
+
+# Copy all entries (including their embeddings) of the shard-local Chroma
+# collections into the product's Chroma collection. No model is called.
+# With `enable_delete_chunks`, entries of the product's collection that are
+# not in any shard are deleted, but only if all shards are merged.
+def merge_shards_from_product(
+    product_config: ProductConfig, shard_count: int, batch_size: int = 1000
+):
+    """Merges shard-local Chroma collections into one collection.
+    Args:
+        product_config: A ProductConfig object containing configuration details.
+        shard_count: The number of shards (N) used by `agent populate --shard i/N`.
+        batch_size: The number of entries to copy in a single call.
+
+    Returns:
+        The number of entries copied from the shards.
+    """
+    merged_count = 0
+    for item in product_config.db_configs:
+        if "chroma" not in item.db_type:
+            continue
+        chroma_client = chromadb.PersistentClient(path=resolve_path(item.vector_db_dir))
+        collection = None
+        shard_ids = set()
+        skipped_shards = 0
+        # Aliases of near-duplicate chunks are merged into the alias table.
+        alias_store = None
+        if os.path.isfile(get_alias_store_path(item.vector_db_dir)):
+            alias_store = AliasStore(get_alias_store_path(item.vector_db_dir))
+        shard_alias_ids = set()
+        for shard_index in range(1, shard_count + 1):
+            shard_dir = get_shard_vector_db_dir(
+                item.vector_db_dir, shard_index, shard_count
+            )
+            if not os.path.isdir(resolve_path(shard_dir)):
+                logging.error(
+                    f"Skipped shard {shard_index}/{shard_count} because {shard_dir} does not exist."
+                )
+                skipped_shards += 1
+                continue
+            shard_client = chromadb.PersistentClient(path=resolve_path(shard_dir))
+            try:
+                shard_collection = shard_client.get_collection(
+                    name=item.collection_name
+                )
+            except ValueError:
+                logging.error(
+                    f"Skipped shard {shard_index}/{shard_count} because the collection "
+                    + f"{item.collection_name} does not exist in {shard_dir}."
+                )
+                skipped_shards += 1
+                continue
+            if collection is None:
+                # Embeddings are copied as they are, so the collection does not
+                # need an embedding function here.
+                collection = chroma_client.get_or_create_collection(
+                    name=item.collection_name, metadata=shard_collection.metadata
+                )
+            shard_total = shard_collection.count()
+            offset = 0
+            while offset < shard_total:
+                entries = shard_collection.get(
+                    include=["embeddings", "documents", "metadatas"],
+                    limit=batch_size,
+                    offset=offset,
+                )
+                if not entries["ids"]:
+                    break
+                collection.upsert(
+                    ids=entries["ids"],
+                    embeddings=entries["embeddings"],
+                    documents=entries["documents"],
+                    metadatas=entries["metadatas"],
+                )
+                shard_ids.update(entries["ids"])
+                offset += len(entries["ids"])
+            print(
+                f"Merged {offset} entries from shard {shard_index}/{shard_count} ({shard_dir})."
+            )
+            merged_count += offset
+            shard_alias_store = open_alias_store(shard_dir)
+            if shard_alias_store is not None:
+                aliases = shard_alias_store.get(item.collection_name)
+                shard_alias_store.close()
+                if alias_store is None:
+                    alias_store = AliasStore(get_alias_store_path(item.vector_db_dir))
+                alias_store.put_entries(item.collection_name, aliases)
+                shard_alias_ids.update(aliases["ids"])
+                print(
+                    f"Merged {len(aliases['ids'])} aliases from shard {shard_index}/{shard_count}."
+                )
+        # A text chunk that is an alias in one run and not in another is only
+        # kept where the shards stored it last.
+        if alias_store is not None:
+            alias_store.delete(item.collection_name, list(shard_ids))
+        if collection is not None and shard_alias_ids:
+            existing_ids = collection.get(ids=list(shard_alias_ids), include=[])["ids"]
+            if existing_ids:
+                collection.delete(ids=existing_ids)
+        if (
+            collection is not None
+            and hasattr(product_config, "enable_delete_chunks")
+            and product_config.enable_delete_chunks == "True"
+        ):
+            if skipped_shards > 0:
+                logging.warning(
+                    f"Skipped deleting entries in {item.vector_db_dir} because "
+                    + f"{skipped_shards} of {shard_count} shards were not merged."
+                )
+            else:
+                delete_entries_not_in_shards(collection, shard_ids, batch_size)
+                if alias_store is not None:
+                    aliases = alias_store.get(item.collection_name)
+                    alias_store.delete(
+                        item.collection_name,
+                        [
+                            entry_id
+                            for entry_id in aliases["ids"]
+                            if entry_id not in shard_alias_ids
+                        ],
+                    )
+        if alias_store is not None:
+            alias_store.close()
+    return merged_count
+
+
+# Delete the entries of a Chroma collection whose IDs are not in `shard_ids`,
+# that is, entries that no shard has populated.
+def delete_entries_not_in_shards(collection, shard_ids: set, batch_size: int = 1000):
+    ids_to_delete = []
+    total = collection.count()
+    offset = 0
+    while offset < total:
+        entries = collection.get(include=[], limit=batch_size, offset=offset)
+        if not entries["ids"]:
+            break
+        ids_to_delete.extend(
+            entry_id for entry_id in entries["ids"] if entry_id not in shard_ids
+        )
+        offset += len(entries["ids"])
+    for start in range(0, len(ids_to_delete), batch_size):
+        collection.delete(ids=ids_to_delete[start : start + batch_size])
+    if ids_to_delete:
+        print(f"Deleted {len(ids_to_delete)} entries that are not in any shard.")
+    return len(ids_to_delete)
+
+
+# Given a ReadConfig object, merge the shard-local databases of all products
+def merge_all_products(
+    config_file: ConfigFile = config.ReadConfig().returnProducts(),
+    shard_count: int = 1,
+):
+    for product in config_file.products:
+        print(f"===========================================")
+        print(f"Merging {shard_count} shards for product: {product.product_name}")
+        for item in product.db_configs:
+            if "chroma" in item.db_type:
+                print(f"Output database: {resolve_path(item.vector_db_dir)}")
+        print(f"===========================================")
+        merged_count = merge_shards_from_product(
+            product_config=product, shard_count=shard_count
+        )
+        print(f"Total merged entries: {merged_count}")
+        index_metadata_from_product(product_config=product, update_entries=False)
+        export_numpy_from_product(product_config=product)
+        build_lexical_index_from_product(product_config=product)
+        build_context_windows_from_product(product_config=product)
+        print()
 
 
 def extract_extra_metadata(input_dictionary):
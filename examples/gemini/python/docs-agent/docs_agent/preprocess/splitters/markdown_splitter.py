@@ -24,7 +24,69 @@ import frontmatter
 from docs_agent.utilities.helpers import add_scheme_url
 
 
+# Parent trees are stored in metadata as the ids of the parents joined by
+# this delimiter, for example "0.1.5" for [0, 1, 5]
+PARENT_TREE_DELIMITER = "."
+
+
+# Encode a parent tree (a list or tuple of ids) into its compact string form
+def encode_parent_tree(parent_tree) -> str:
+    return PARENT_TREE_DELIMITER.join(
+        str(int(item)) for item in parse_parent_tree(parent_tree)
+    )
+
+
+# Parse a parent tree into a tuple of ints without evaluating it. Accepts
+# a list or tuple, the compact form such as "0.1", and the list literal
+# form such as "[0, 1]" that older collections store
+def parse_parent_tree(parent_tree) -> tuple[int, ...]:
+    if parent_tree is None:
+        return ()
+    if isinstance(parent_tree, (list, tuple)):
+        return tuple(int(item) for item in parent_tree)
+    if isinstance(parent_tree, int):
+        return (parent_tree,)
+    text = str(parent_tree).strip()
+    if text.startswith("["):
+        text = text.strip("[]")
+        delimiter = ","
+    else:
+        delimiter = PARENT_TREE_DELIMITER
+    if text.strip() == "":
+        return ()
+    return tuple(int(item) for item in text.split(delimiter))
+
+
+# The arguments of Section, in order. These are the fields that are stored
+# when a section is serialized.
+SECTION_FIELDS = (
+    "id",
+    "name_id",
+    "page_title",
+    "section_title",
+    "level",
+    "previous_id",
+    "parent_tree",
+    "token_count",
+    "content",
+    "url",
+    "origin_uuid",
+    "md_hash",
+    "uuid",
+    "templated",
+)
+
+
 class Section:
+    """An immutable section of a page.
+
+    Sections are shared by the page cache and by concurrent queries, so they
+    can't be modified in place. Use `replace` to make a modified copy. The
+    content with its page and section title is rendered once per section.
+    """
+
+    __slots__ = SECTION_FIELDS + ("parent_ids", "_rendered_content")
+
     def __init__(
         self,
         id: int,
@@ -40,20 +102,45 @@ class Section:
         origin_uuid: typing.Optional[str] = None,
         md_hash: typing.Optional[str] = None,
         uuid: typing.Optional[str] = None,
+        templated: bool = False,
     ):
-        self.id = id
-        self.name_id = name_id
-        self.page_title = page_title
-        self.section_title = section_title
-        self.level = level
-        self.previous_id = previous_id
-        self.parent_tree = parent_tree
-        self.token_count = token_count
-        self.content = content
-        self.url = url
-        self.origin_uuid = origin_uuid
-        self.md_hash = md_hash
-        self.uuid = uuid
+        set_field = object.__setattr__
+        set_field(self, "id", id)
+        set_field(self, "name_id", name_id)
+        set_field(self, "page_title", page_title)
+        set_field(self, "section_title", section_title)
+        set_field(self, "level", level)
+        set_field(self, "previous_id", previous_id)
+        set_field(self, "parent_tree", parent_tree)
+        set_field(self, "token_count", token_count)
+        set_field(self, "content", content)
+        set_field(self, "url", url)
+        set_field(self, "origin_uuid", origin_uuid)
+        set_field(self, "md_hash", md_hash)
+        set_field(self, "uuid", uuid)
+        # True if `content` already includes the page and section title
+        set_field(self, "templated", bool(templated))
+        # Parse parent_tree once, so that comparisons don't need to parse it
+        set_field(self, "parent_ids", parse_parent_tree(parent_tree))
+        set_field(self, "_rendered_content", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            f"Section is immutable. Use replace({name}=...) to make a modified copy."
+        )
+
+    def __delattr__(self, name):
+        raise AttributeError("Section is immutable.")
+
+    # Sections are immutable, so copies can share the same object
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Section, self.to_tuple())
 
     def __str__(self):
         return f"UUID: {self.uuid}\n\
@@ -69,27 +156,48 @@ Parent tree: {self.parent_tree}\n\
 Tokens: {self.token_count}\n\
 Content hash: {self.md_hash}\n"
 
-    # Updates the content of a section using page and section title
-    def updateContentTemplate(self):
-        new_content = f"The section titled {self.section_title} is from the page titled {self.page_title} and has this content:\n{self.content}"
-        self.content = new_content
-        return self
+    # Return a copy of this section with some fields replaced
+    def replace(self, **changes) -> "Section":
+        for field in changes:
+            if field not in SECTION_FIELDS:
+                raise TypeError(f"Section has no field {field}")
+        return Section(
+            *[changes.get(field, getattr(self, field)) for field in SECTION_FIELDS]
+        )
+
+    # The content of a section with its page and section title, which is
+    # rendered on first use and then cached
+    @property
+    def rendered_content(self) -> str:
+        rendered_content = self._rendered_content
+        if rendered_content is None:
+            if self.templated:
+                rendered_content = self.content
+            else:
+                rendered_content = f"The section titled {self.section_title} is from the page titled {self.page_title} and has this content:\n{self.content}"
+            object.__setattr__(self, "_rendered_content", rendered_content)
+        return rendered_content
+
+    # Returns the content of a section with its page and section title,
+    # without updating the section
+    def returnContentTemplate(self) -> str:
+        return self.rendered_content
+
+    # Returns a copy of the section whose content includes the page and
+    # section title. Sections that already include them are returned as is,
+    # so the template is never added twice
+    def updateContentTemplate(self) -> "Section":
+        if self.templated:
+            return self
+        return self.replace(content=self.rendered_content, templated=True)
 
     # Given a section, return the id of the parent. If no, parent returns 0
     # 0 is equivalent to the top of the page
     def returnDirectParentId(self):
-        parent_tree = eval(self.parent_tree)
-        # Prepare direct_parent variable
-        if len(parent_tree) > 1:
-            direct_parent = parent_tree[len(parent_tree) - 1]
-        # If the curr_parent_tree has a len of 0, this means that no parents
-        if len(parent_tree) == 0:
-            no_parent = True
-            direct_parent = 0
-        else:
-            no_parent = False
-            direct_parent = parent_tree[len(parent_tree) - 1]
-        return direct_parent
+        # If the parent tree is empty, this means that there are no parents
+        if len(self.parent_ids) == 0:
+            return 0
+        return self.parent_ids[-1]
 
     def encodeToChromaDBNoContent(self):
         metadata = {}
@@ -100,7 +208,7 @@ Content hash: {self.md_hash}\n"
         metadata.update({"section_level": int(self.level)})
         metadata.update({"previous_id": int(self.previous_id)})
         # Lists like parent_tree need to be converted to str
-        metadata.update({"parent_tree": str(self.parent_tree)})
+        metadata.update({"parent_tree": encode_parent_tree(self.parent_ids)})
         metadata.update({"token_estimate": float(self.token_count)})
         metadata.update({"origin_uuid": str(self.origin_uuid)})
         metadata.update({"md_hash": str(self.md_hash)})
@@ -117,78 +225,49 @@ Content hash: {self.md_hash}\n"
     def return_id(self):
         return self.id
 
+    # Return the fields of the section in the order of SECTION_FIELDS
+    def to_tuple(self) -> tuple:
+        return tuple([getattr(self, field) for field in SECTION_FIELDS])
+
+    # Return the fields of the section as a dictionary that can be stored
+    # as JSON and passed to `from_dict`
+    def to_dict(self) -> dict:
+        return dict(zip(SECTION_FIELDS, self.to_tuple()))
+
+    @classmethod
+    def from_dict(cls, fields: dict) -> "Section":
+        return cls(**fields)
+
+
+# Return an int from a metadata field, or "" if the field is missing or empty
+def metadata_int(metadata: dict, key: str):
+    value = metadata.get(key, "")
+    if value == "":
+        return ""
+    return int(value)
+
 
 def DictionarytoSection(metadata: dict) -> Section:
-    if "section_id" in metadata and metadata["section_id"] != '':
-        section_id = int(metadata["section_id"])
-    else:
-        section_id = ""
-    if "section_name_id" in metadata:
-        section_name_id = str(metadata["section_name_id"])
-    else:
-        section_name_id = ""
-    if "section_title" in metadata:
-        section_title = str(metadata["section_title"])
-    else:
-        section_title = ""
-    if "page_title" in metadata:
-        page_title = str(metadata["page_title"])
-    else:
-        page_title = ""
-    if "section_level" in metadata and metadata["section_level"] != '':
-        section_level = int(metadata["section_level"])
-    else:
-        section_level = ""
-    if "previous_id" in metadata and metadata["previous_id"] != '':
-        previous_id = int(metadata["previous_id"])
-    else:
-        previous_id = ""
-    if "parent_tree" in metadata:
-        parent_tree = metadata["parent_tree"]
-    else:
-        parent_tree = []
-    if "token_estimate" in metadata and metadata["token_estimate"] != '':
-        token_estimate = int(metadata["token_estimate"])
-    else:
-        token_estimate = ""
-    if "content" in metadata:
-        content = str(metadata["content"])
-    else:
-        content = ""
+    get = metadata.get
     if "URL" in metadata:
         url = str(metadata["URL"])
-    elif "url" in metadata:
-        url = str(metadata["url"])
-    else:
-        url = ""
-    if "origin_uuid" in metadata:
-        origin_uuid = str(metadata["origin_uuid"])
-    else:
-        origin_uuid = ""
-    if "md_hash" in metadata:
-        md_hash = str(metadata["md_hash"])
-    else:
-        md_hash = ""
-    if "UUID" in metadata:
-        UUID = str(metadata["UUID"])
     else:
-        UUID = ""
-    section = Section(
-        id=section_id,
-        name_id=section_name_id,
-        page_title=page_title,
-        section_title=section_title,
-        level=section_level,
-        previous_id=previous_id,
-        parent_tree=parent_tree,
-        token_count=token_estimate,
-        content=content,
+        url = str(get("url", ""))
+    return Section(
+        id=metadata_int(metadata, "section_id"),
+        name_id=str(get("section_name_id", "")),
+        page_title=str(get("page_title", "")),
+        section_title=str(get("section_title", "")),
+        level=metadata_int(metadata, "section_level"),
+        previous_id=metadata_int(metadata, "previous_id"),
+        parent_tree=get("parent_tree", []),
+        token_count=metadata_int(metadata, "token_estimate"),
+        content=str(get("content", "")),
         url=url,
-        origin_uuid=origin_uuid,
-        md_hash=md_hash,
-        uuid=UUID,
+        origin_uuid=str(get("origin_uuid", "")),
+        md_hash=str(get("md_hash", "")),
+        uuid=str(get("UUID", "")),
     )
-    return section
 
 
 class Page:
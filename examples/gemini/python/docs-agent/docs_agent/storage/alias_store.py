@@ -0,0 +1,184 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Side table of near-duplicate text chunks kept out of the vector index"""
+
+import json
+import os
+import sqlite3
+import threading
+import typing
+
+from docs_agent.utilities.helpers import resolve_path
+
+
+# The name of the alias table's file in a Chroma database directory.
+ALIAS_STORE_FILENAME = "aliases.sqlite3"
+
+
+# Return the path of the alias table of a Chroma database.
+def get_alias_store_path(vector_db_dir: str) -> str:
+    return os.path.join(resolve_path(vector_db_dir), ALIAS_STORE_FILENAME)
+
+
+class AliasStore:
+    """A SQLite table of the text chunks that are aliases of a near-duplicate.
+
+    Aliases (see `collapse_near_duplicates`) have no entries in the vector
+    index, so they never take the place of other results and need no
+    embeddings. Their documents and metadata are kept in this table, which
+    sits next to the Chroma database, so that the pages they belong to can
+    still be rebuilt in full. Entries are keyed by collection and ID.
+    """
+
+    def __init__(self, store_path: str, read_only: bool = False) -> None:
+        self.store_path = resolve_path(store_path)
+        self.lock = threading.Lock()
+        if read_only:
+            self.connection = sqlite3.connect(
+                "file:" + self.store_path + "?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            return
+        store_dir = os.path.dirname(self.store_path)
+        if store_dir != "":
+            os.makedirs(store_dir, exist_ok=True)
+        self.connection = sqlite3.connect(self.store_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS aliases (collection TEXT, id TEXT, "
+            + "origin_uuid TEXT, alias_of TEXT, md_hash TEXT, document TEXT, "
+            + "metadata TEXT, PRIMARY KEY (collection, id))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS aliases_origin_uuid "
+            + "ON aliases (collection, origin_uuid)"
+        )
+        self.connection.commit()
+
+    # Add or replace an alias.
+    def put(self, collection_name: str, entry_id: str, document: str, metadata: dict):
+        self.put_entries(
+            collection_name,
+            {"ids": [entry_id], "documents": [document], "metadatas": [metadata]},
+        )
+
+    # Add or replace the aliases in a Chroma `get` result.
+    def put_entries(self, collection_name: str, entries: dict):
+        rows = []
+        for i, entry_id in enumerate(entries["ids"]):
+            metadata = entries["metadatas"][i] or {}
+            rows.append(
+                (
+                    collection_name,
+                    str(entry_id),
+                    str(metadata.get("origin_uuid", "")),
+                    str(metadata.get("alias_of", "")),
+                    str(metadata.get("md_hash", "")),
+                    entries["documents"][i],
+                    json.dumps(metadata),
+                )
+            )
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+
+    # Return the md hash of an alias, or None if it isn't stored.
+    def get_md_hash(self, collection_name: str, entry_id: str) -> typing.Optional[str]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT md_hash FROM aliases WHERE collection = ? AND id = ?",
+                (collection_name, str(entry_id)),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # Return the aliases of a collection (only those of the pages in
+    # `origin_uuids` if set) in the format of a Chroma `get` result.
+    def get(
+        self, collection_name: str, origin_uuids: typing.Optional[list[str]] = None
+    ) -> dict:
+        query = "SELECT id, document, metadata FROM aliases WHERE collection = ?"
+        params = [collection_name]
+        if origin_uuids is not None:
+            origin_uuids = [str(origin_uuid) for origin_uuid in origin_uuids]
+            if len(origin_uuids) == 0:
+                return {"ids": [], "documents": [], "metadatas": []}
+            placeholders = ", ".join("?" for _ in origin_uuids)
+            query += f" AND origin_uuid IN ({placeholders})"
+            params += origin_uuids
+        with self.lock:
+            rows = self.connection.execute(query + " ORDER BY id", params).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows],
+            "metadatas": [json.loads(row[2]) for row in rows],
+        }
+
+    # Delete aliases by their IDs.
+    def delete(self, collection_name: str, ids: list[str]):
+        if not ids:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM aliases WHERE collection = ? AND id = ?",
+                [(collection_name, str(entry_id)) for entry_id in ids],
+            )
+            self.connection.commit()
+
+    def count(self, collection_name: str) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM aliases WHERE collection = ?",
+                (collection_name,),
+            ).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Open the alias table of a Chroma database for reading. Returns None if
+# the database has no aliases.
+def open_alias_store(vector_db_dir: str) -> typing.Optional[AliasStore]:
+    store_path = get_alias_store_path(vector_db_dir)
+    if not os.path.isfile(store_path):
+        return None
+    return AliasStore(store_path, read_only=True)
+
+
+# Add the aliases of a collection (only those of the pages in
+# `origin_uuids` if set) to a Chroma `get` result, so that pages are
+# rebuilt with all of their sections.
+def add_aliases_to_entries(
+    entries: dict,
+    alias_store: typing.Optional[AliasStore],
+    collection_name: str,
+    origin_uuids: typing.Optional[list[str]] = None,
+) -> dict:
+    if alias_store is None:
+        return entries
+    aliases = alias_store.get(collection_name, origin_uuids)
+    if not aliases["ids"]:
+        return entries
+    return {
+        "ids": list(entries["ids"]) + aliases["ids"],
+        "documents": list(entries["documents"]) + aliases["documents"],
+        "metadatas": list(entries["metadatas"]) + aliases["metadatas"],
+    }
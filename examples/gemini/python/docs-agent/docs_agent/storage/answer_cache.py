@@ -0,0 +1,281 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Semantic cache of answers keyed by question embeddings"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from absl import logging
+import numpy as np
+
+from docs_agent.postprocess.docs_retriever import SectionDistance
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+from docs_agent.utilities.helpers import resolve_path
+
+
+class CachedAnswer:
+    """A previous answer to a question that is similar to a new question"""
+
+    def __init__(
+        self,
+        question: str,
+        response: str,
+        context: str,
+        search_result: list[SectionDistance],
+        similarity: float,
+    ):
+        self.question = question
+        self.response = response
+        self.context = context
+        self.search_result = search_result
+        self.similarity = similarity
+
+
+# Convert a search result to JSON so that it can be stored with an answer.
+def search_result_to_json(search_result: list[SectionDistance]) -> str:
+    items = []
+    for item in search_result:
+        items.append(
+            {"section": item.section.to_dict(), "distance": float(item.distance)}
+        )
+    return json.dumps(items, default=str)
+
+
+def search_result_from_json(search_result_json: str) -> list[SectionDistance]:
+    search_result = []
+    for item in json.loads(search_result_json):
+        search_result.append(
+            SectionDistance(
+                section=Section.from_dict(item["section"]), distance=item["distance"]
+            )
+        )
+    return search_result
+
+
+class AnswerCache:
+    """A SQLite table of answers and the embeddings of their questions.
+
+    Answers are scoped (for example, by product and model) and tagged with
+    the version of the collection that they were generated from. A lookup
+    only returns answers of the current version, and adding an answer
+    deletes the answers of older versions in the same scope. Once the table
+    holds more than `max_size` answers (0 for no limit), the least recently
+    used answers are deleted.
+    """
+
+    def __init__(self, store_path: str, max_size: int = 1024) -> None:
+        self.store_path = resolve_path(store_path)
+        self.max_size = max(0, int(max_size))
+        store_dir = os.path.dirname(self.store_path)
+        if store_dir != "":
+            os.makedirs(store_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.store_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, "
+            + "scope TEXT, version TEXT, question TEXT, embedding BLOB, "
+            + "response TEXT, context TEXT, search_result TEXT, created REAL, "
+            + "last_used REAL)"
+        )
+        # Tables created before answers were evicted have no `last_used`.
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(answers)")
+        ]
+        if "last_used" not in columns:
+            self.connection.execute("ALTER TABLE answers ADD COLUMN last_used REAL")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope, version)"
+        )
+        self.connection.commit()
+        # Normalized embeddings loaded from the table, keyed by (scope, version).
+        self.matrices = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Load the embeddings added since the last lookup (possibly by another
+    # process) and return the row IDs and the matrix of a scope.
+    def load_embeddings(self, scope: str, version: str):
+        last_id, row_ids, matrix = self.matrices.get((scope, version), (0, [], None))
+        rows = self.connection.execute(
+            "SELECT id, embedding FROM answers "
+            + "WHERE scope = ? AND version = ? AND id > ? ORDER BY id",
+            (scope, version, last_id),
+        ).fetchall()
+        if rows:
+            new_vectors = np.stack(
+                [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+            )
+            new_vectors /= np.maximum(
+                np.linalg.norm(new_vectors, axis=1, keepdims=True), 1e-12
+            )
+            if matrix is None:
+                matrix = new_vectors
+            else:
+                matrix = np.vstack([matrix, new_vectors])
+            row_ids = row_ids + [row[0] for row in rows]
+            last_id = rows[-1][0]
+            self.matrices[(scope, version)] = (last_id, row_ids, matrix)
+        return row_ids, matrix
+
+    # Return the answer of the most similar question in a scope if its cosine
+    # similarity is at least `threshold`, otherwise None.
+    def lookup(
+        self, scope: str, version: str, embedding, threshold: float = 0.95
+    ) -> typing.Optional[CachedAnswer]:
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self.lock:
+            row_ids, matrix = self.load_embeddings(scope, version)
+            if matrix is None or matrix.shape[1] != len(query):
+                self.misses += 1
+                return None
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < float(threshold):
+                self.misses += 1
+                return None
+            row = self.connection.execute(
+                "SELECT question, response, context, search_result FROM answers "
+                + "WHERE id = ?",
+                (row_ids[best],),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE answers SET last_used = ? WHERE id = ?",
+                (time.time(), row_ids[best]),
+            )
+            self.connection.commit()
+            self.hits += 1
+        return CachedAnswer(
+            question=row[0],
+            response=row[1],
+            context=row[2],
+            search_result=search_result_from_json(row[3]),
+            similarity=similarity,
+        )
+
+    def add(
+        self,
+        scope: str,
+        version: str,
+        question: str,
+        embedding,
+        response: str,
+        context: str,
+        search_result: list[SectionDistance],
+    ):
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            self.invalidate(scope, version)
+            self.connection.execute(
+                "INSERT INTO answers (scope, version, question, embedding, "
+                + "response, context, search_result, created, last_used) "
+                + "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    scope,
+                    version,
+                    question,
+                    vector.tobytes(),
+                    response,
+                    context,
+                    search_result_to_json(search_result),
+                    time.time(),
+                    time.time(),
+                ),
+            )
+            self.evict()
+            self.connection.commit()
+
+    # Delete the least recently used answers (in all scopes) until the table
+    # holds at most `max_size` answers. The caller holds the lock.
+    def evict(self):
+        if self.max_size == 0:
+            return
+        size = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if size <= self.max_size:
+            return
+        deleted = self.connection.execute(
+            "DELETE FROM answers WHERE id IN (SELECT id FROM answers "
+            + "ORDER BY COALESCE(last_used, created), id LIMIT ?)",
+            (size - self.max_size,),
+        ).rowcount
+        self.evictions += deleted
+        # The loaded matrices may hold deleted answers, so they are loaded
+        # again on the next lookup.
+        self.matrices.clear()
+
+    # Delete the answers of a scope that were generated from other versions
+    # of the collection. The caller holds the lock.
+    def invalidate(self, scope: str, version: str):
+        deleted = self.connection.execute(
+            "DELETE FROM answers WHERE scope = ? AND version != ?", (scope, version)
+        ).rowcount
+        for key in list(self.matrices):
+            if key[0] == scope and key[1] != version:
+                del self.matrices[key]
+        if deleted > 0:
+            logging.info(f"Deleted {deleted} cached answers of outdated collections.")
+
+    def stats(self) -> dict:
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            lookups = self.hits + self.misses
+            hit_rate = 0.0
+            if lookups > 0:
+                hit_rate = self.hits / lookups
+            return {
+                "size": size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hit_rate,
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Answer caches shared by all agents in a process, keyed by the store path.
+_answer_caches = {}
+_answer_caches_lock = threading.Lock()
+
+
+# Return the process-wide answer cache that uses a store path.
+def get_answer_cache(store_path: str, max_size: int = 1024) -> AnswerCache:
+    with _answer_caches_lock:
+        cache = _answer_caches.get(store_path)
+        if cache is None:
+            cache = AnswerCache(store_path, max_size=max_size)
+            _answer_caches[store_path] = cache
+        with cache.lock:
+            # Products that share a cache use the largest configured size,
+            # where 0 (no limit) is the largest.
+            if int(max_size) <= 0:
+                cache.max_size = 0
+            elif cache.max_size != 0:
+                cache.max_size = max(cache.max_size, int(max_size))
+        return cache
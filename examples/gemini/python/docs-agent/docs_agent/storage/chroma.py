@@ -20,16 +20,28 @@ from enum import auto, Enum
 import os
 import string
 import shutil
+import sqlite3
+import threading
 import typing
+import weakref
 
 from absl import logging
 import chromadb
+from chromadb.api.client import SharedSystemClient
 from chromadb.utils import embedding_functions
 from chromadb.api.models import Collection
 from chromadb.api.types import QueryResult
+from chromadb.segment import VectorReader
 
 from docs_agent.preprocess.splitters.markdown_splitter import Section as Section
+from docs_agent.preprocess.splitters.markdown_splitter import encode_parent_tree
+from docs_agent.preprocess.splitters.markdown_splitter import parse_parent_tree
 from docs_agent.postprocess.docs_retriever import FullPage as FullPage
+from docs_agent.storage.alias_store import add_aliases_to_entries
+from docs_agent.storage.alias_store import get_alias_store_path
+from docs_agent.storage.alias_store import open_alias_store
+from docs_agent.storage.metadata_filters import build_where
+from docs_agent.storage.metadata_filters import matches_filters
 from docs_agent.utilities.helpers import resolve_path, parallel_backup_dir
 
 
@@ -186,11 +198,7 @@ class SectionDB(Enum):
         else:
             previous_id = ""
         if self.PARENT_TREE:
-            parent_tree = self.PARENT_TREE.value
-            parent_tree_str = str(parent_tree).strip("[]").split(",")
-            parent_tree = []
-            for num in parent_tree_str:
-                parent_tree.append(int(num))
+            parent_tree = list(parse_parent_tree(self.PARENT_TREE.value))
         else:
             parent_tree = ""
         if self.TOKEN_ESTIMATE:
@@ -235,6 +243,219 @@ class ChromaDBGet:
     #     return self.id[index]
 
 
+# Return a FullPage (list of Section) built from the entries of a ChromaDBGet
+def build_full_page(get_obj: ChromaDBGet) -> FullPage:
+    page = []
+    # added_id = []
+    for i in range(len(get_obj.id)):
+        # Makes sure that each ID is only added once
+        # if get_obj.id not in added_id:
+        section = Section(
+            id=get_obj.metadata[i].get("section_id", None),
+            name_id=get_obj.metadata[i].get("name_id", None),
+            page_title=get_obj.metadata[i].get("page_title", None),
+            section_title=get_obj.metadata[i].get("section_title", None),
+            level=get_obj.metadata[i].get("level", None),
+            previous_id=get_obj.metadata[i].get("previous_id", None),
+            parent_tree=get_obj.metadata[i].get("parent_tree", None),
+            token_count=get_obj.metadata[i].get("token_estimate", None),
+            url=get_obj.metadata[i].get("url", None),
+            uuid=get_obj.id[i],
+            content=get_obj.document[i],
+        )
+        page.append(section)
+    full_page = FullPage(page)
+    return full_page
+
+
+# Return a FullPage for each origin_uuid in the entries of a ChromaDBGet
+def build_full_pages(get_obj: ChromaDBGet) -> dict[str, FullPage]:
+    grouped = {}
+    for i in range(len(get_obj.id)):
+        origin_uuid = get_obj.metadata[i].get("origin_uuid", None)
+        if origin_uuid not in grouped:
+            grouped[origin_uuid] = {"ids": [], "documents": [], "metadatas": []}
+        grouped[origin_uuid]["ids"].append(get_obj.id[i])
+        grouped[origin_uuid]["documents"].append(get_obj.document[i])
+        grouped[origin_uuid]["metadatas"].append(get_obj.metadata[i])
+    pages = {}
+    for origin_uuid, result in grouped.items():
+        pages[origin_uuid] = build_full_page(ChromaDBGet(result))
+    return pages
+
+
+# Remove the entries of a query result that don't match all filters. Most
+# filters are already applied by the vector store, but a URL prefix deeper
+# than the stored prefix fields is only partly applied.
+def filter_query_result(result: QueryResult, filters: typing.Optional[dict]):
+    if not filters:
+        return result
+    keep = [
+        index
+        for index, metadata in enumerate(result["metadatas"][0])
+        if matches_filters(metadata or {}, filters)
+    ]
+    if len(keep) == len(result["metadatas"][0]):
+        return result
+    filtered = dict(result)
+    for key in ["ids", "documents", "metadatas", "distances", "embeddings"]:
+        if filtered.get(key, None) is not None:
+            filtered[key] = [[result[key][0][index] for index in keep]]
+    return filtered
+
+
+# Return the fields that a Chroma query returns, optionally with the
+# embeddings of the results.
+def get_query_include(include_embeddings: bool = False) -> list[str]:
+    include = ["metadatas", "documents", "distances"]
+    if include_embeddings:
+        include.append("embeddings")
+    return include
+
+
+# Split the result of a query with several query texts or embeddings into
+# one single-query result per input, in the order of the inputs.
+def split_query_result(result: QueryResult) -> list[dict]:
+    results = []
+    for index in range(len(result["ids"])):
+        single = {}
+        for key, value in result.items():
+            if isinstance(value, list) and len(value) == len(result["ids"]):
+                single[key] = [value[index]]
+            else:
+                single[key] = value
+        results.append(single)
+    return results
+
+
+# Drop Chroma's shared client of a database directory, so that the next
+# client reads the database (and its HNSW index) from disk again. Chroma
+# keeps one client per directory in a process, which doesn't see an index
+# that another process has rewritten. Clients that are still open use the
+# next client once it's created.
+def release_chroma_client(chroma_dir: str):
+    systems = getattr(SharedSystemClient, "_identifer_to_system", None)
+    if systems is not None:
+        systems.pop(chroma_dir, None)
+
+
+# The HNSW settings that can be set per collection, and the defaults that
+# Chroma uses for them. Only `hnsw:search_ef` can change after a collection
+# is created.
+HNSW_DEFAULTS = {
+    "hnsw:space": "l2",
+    "hnsw:construction_ef": 100,
+    "hnsw:M": 16,
+    "hnsw:search_ef": 10,
+}
+
+
+# Return the HNSW settings that are set (not None) as Chroma collection
+# metadata.
+def get_hnsw_metadata(
+    space: typing.Optional[str] = None,
+    construction_ef: typing.Optional[int] = None,
+    m: typing.Optional[int] = None,
+    search_ef: typing.Optional[int] = None,
+) -> dict:
+    values = {
+        "hnsw:space": space,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:M": m,
+        "hnsw:search_ef": search_ef,
+    }
+    metadata = {}
+    for key, value in values.items():
+        if value is None or value == "":
+            continue
+        metadata[key] = str(value) if key == "hnsw:space" else int(value)
+    return metadata
+
+
+# Return a collection, which is created with the given HNSW settings if it
+# doesn't exist. Chroma fixes the HNSW index of a collection when it is
+# created, so the settings of an existing collection are not changed (a
+# warning is logged if they differ).
+def get_or_create_collection(
+    chroma_client, name: str, embedding_function=None, hnsw_metadata=None
+):
+    try:
+        collection = chroma_client.get_collection(
+            name=name, embedding_function=embedding_function
+        )
+    except ValueError:
+        return chroma_client.create_collection(
+            name=name,
+            embedding_function=embedding_function,
+            metadata=hnsw_metadata if hnsw_metadata else None,
+        )
+    for key, value in (hnsw_metadata or {}).items():
+        if key == "hnsw:search_ef":
+            continue
+        current = (collection.metadata or {}).get(key, HNSW_DEFAULTS[key])
+        if current != value:
+            logging.warning(
+                f"The collection {name} was created with {key}={current}, not "
+                + f"{value}. Delete the collection and populate it again to "
+                + "change it."
+            )
+    return collection
+
+
+# The `hnsw:search_ef` values set on the HNSW indexes loaded in this process.
+_search_ef_by_segment = weakref.WeakKeyDictionary()
+_search_ef_lock = threading.Lock()
+
+
+# Set the number of candidates that the HNSW index of a collection explores
+# per query. Chroma reads `hnsw:search_ef` when a collection is created, so
+# this sets it on the index that is loaded in this process. All collection
+# objects of the same database directory in a process share that index, so
+# a warning is logged if it was set to a different value before. Returns
+# False if the index could not be reached.
+def set_search_ef(collection: Collection, search_ef: int) -> bool:
+    try:
+        segment = collection._client._manager.get_segment(collection.id, VectorReader)
+    except (AttributeError, StopIteration):
+        return False
+    params = getattr(segment, "_params", None)
+    if params is None:
+        return False
+    with _search_ef_lock:
+        previous = _search_ef_by_segment.get(segment, None)
+        if previous is not None and previous != int(search_ef):
+            logging.warning(
+                f"The HNSW index of the collection {collection.name} is shared "
+                + f"with a collection that uses hnsw:search_ef={previous}. "
+                + f"Both now use hnsw:search_ef={int(search_ef)}."
+            )
+        _search_ef_by_segment[segment] = int(search_ef)
+    params.search_ef = int(search_ef)
+    index = getattr(segment, "_index", None)
+    if index is not None:
+        index.set_ef(int(search_ef))
+    return True
+
+
+# Add indexes on the metadata table of a Chroma database, so that filtered
+# queries look up the matching entries instead of scanning all metadata.
+def create_metadata_indexes(chroma_dir: str):
+    sqlite_file = os.path.join(resolve_path(chroma_dir), "chroma.sqlite3")
+    if not os.path.isfile(sqlite_file):
+        return
+    connection = sqlite3.connect(sqlite_file)
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS docs_agent_metadata_string "
+        + "ON embedding_metadata (key, string_value)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS docs_agent_metadata_int "
+        + "ON embedding_metadata (key, int_value)"
+    )
+    connection.commit()
+    connection.close()
+
+
 class ChromaSectionDBItem:
     """Chroma query result item wrapper for SectionDB objects
 
@@ -261,6 +482,20 @@ class ChromaSectionDBItem:
         self.metadata = result["metadatas"][0][index]
         self.distance = result["distances"][0][index]
         self.id = result["ids"][0][index]
+        # Only set if the query included embeddings
+        self.embedding = None
+        if result.get("embeddings", None) is not None:
+            self.embedding = result["embeddings"][0][index]
+        # Only set for hybrid search results (higher is better)
+        self.rrf_score = None
+        if result.get("rrf_scores", None) is not None:
+            self.rrf_score = result["rrf_scores"][0][index]
+        # Only set by a reranker (higher is better)
+        self.rerank_score = None
+
+    # Returns the parent tree of this section as a tuple of ids
+    def parent_ids(self) -> tuple[int, ...]:
+        return parse_parent_tree(self.metadata.get("parent_tree", None))
 
     def __str__(self):
         return f"This is a section with the following properties:\n\
@@ -279,7 +514,7 @@ Section URL: {SectionDB.URL}\n"
             "tree": self.metadata.get("tree", None),
             "previous_id": self.metadata.get("previous_id", None),
             "token_estimate": self.metadata.get("token_estimate", None),
-            "parent_tree": self.metadata.get("tree", None),
+            "parent_tree": encode_parent_tree(self.parent_ids()),
             "url": self.metadata.get("url", None),
             "distance": self.distance,
         }
@@ -293,6 +528,7 @@ class ChromaEnhanced:
     """Chroma wrapper"""
 
     def __init__(self, chroma_dir) -> None:
+        self.chroma_dir = chroma_dir
         self.client = chromadb.PersistentClient(path=chroma_dir)
 
     def list_collections(self):
@@ -314,13 +550,18 @@ class ChromaEnhanced:
     # def getSameOriginUUID(self):
     #     return self.client.get()
 
-    def get_collection(self, name, embedding_function=None, embedding_model=None):
+    # Returns a wrapped collection. If `search_ef` is set, it sets the number
+    # of candidates that the HNSW index explores per query.
+    def get_collection(
+        self, name, embedding_function=None, embedding_model=None, search_ef=None
+    ):
         if embedding_function is not None:
-            return ChromaCollectionEnhanced(
+            return self.wrap_collection(
                 self.client.get_collection(
                     name=name, embedding_function=embedding_function
                 ),
                 embedding_function,
+                search_ef=search_ef,
             )
         # Read embedding meta information from the collection
         collection = self.client.get_collection(name=name)
@@ -349,28 +590,138 @@ class ChromaEnhanced:
                 "is not supported."
             )
 
-        return ChromaCollectionEnhanced(
+        return self.wrap_collection(
             self.client.get_collection(
                 name=name, embedding_function=embedding_function
             ),
             embedding_function,
+            search_ef=search_ef,
+        )
+
+    def wrap_collection(self, collection, embedding_function, search_ef=None):
+        if search_ef is not None and search_ef != "":
+            if not set_search_ef(collection, int(search_ef)):
+                logging.warning(
+                    f"Could not set hnsw:search_ef of the collection {collection.name}."
+                )
+        return ChromaCollectionEnhanced(
+            collection, embedding_function, chroma_dir=self.chroma_dir
         )
 
 
 class ChromaCollectionEnhanced:
     """Chroma collection wrapper"""
 
-    def __init__(self, collection, embedding_function) -> None:
+    def __init__(self, collection, embedding_function, chroma_dir=None) -> None:
         self.collection = collection
         self.embedding_function = embedding_function
-
-    def query(self, text: str, top_k: int = 1):
-        dict = {}
+        self.chroma_dir = chroma_dir
+        self.alias_store = None
+
+    # Return a fingerprint that changes whenever the collection is modified,
+    # using the size and modification time of the database (and of its
+    # write-ahead log and alias table, if any), which change on every write.
+    # Without a database file, the number of entries is used, which takes a
+    # query.
+    def version(self) -> str:
+        if self.chroma_dir is not None:
+            sqlite_file = os.path.join(resolve_path(self.chroma_dir), "chroma.sqlite3")
+            if os.path.isfile(sqlite_file):
+                fingerprint = []
+                alias_file = get_alias_store_path(self.chroma_dir)
+                for path in [sqlite_file, sqlite_file + "-wal", alias_file]:
+                    if os.path.isfile(path):
+                        stat = os.stat(path)
+                        fingerprint.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+                return f"{self.collection.name}:" + ":".join(fingerprint)
+        return f"{self.collection.name}:{self.collection.count()}:0"
+
+    # Filters (for example, `{"url_prefix": "https://example.com/docs/"}`)
+    # are converted into a `where` clause that Chroma applies in the search.
+    # With `include_embeddings`, the stored embeddings of the results are
+    # returned as well.
+    def query(
+        self,
+        text: str,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        dict = build_where(filters) or {}
         # dict.update({"token_estimate": {"$gt": 100}})
         return ChromaQueryResultEnhanced(
-            self.collection.query(query_texts=[text], n_results=top_k, where=dict)
+            filter_query_result(
+                self.collection.query(
+                    query_texts=[text],
+                    n_results=top_k,
+                    where=dict,
+                    include=get_query_include(include_embeddings),
+                ),
+                filters,
+            )
+        )
+
+    def query_by_embedding(
+        self,
+        query_vector,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return ChromaQueryResultEnhanced(
+            filter_query_result(
+                self.collection.query(
+                    query_embeddings=[list(query_vector)],
+                    n_results=top_k,
+                    where=build_where(filters) or {},
+                    include=get_query_include(include_embeddings),
+                ),
+                filters,
+            )
         )
 
+    # Query with many texts at once. The texts are embedded in one call to
+    # the embedding function and searched in one Chroma query. Returns one
+    # result per text, in the order of the texts.
+    def query_batch(
+        self,
+        texts: list[str],
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> list["ChromaQueryResultEnhanced"]:
+        if len(texts) == 0:
+            return []
+        return self.query_batch_by_embedding(
+            self.embedding_function(list(texts)),
+            top_k,
+            filters=filters,
+            include_embeddings=include_embeddings,
+        )
+
+    def query_batch_by_embedding(
+        self,
+        query_vectors,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> list["ChromaQueryResultEnhanced"]:
+        if len(query_vectors) == 0:
+            return []
+        result = self.collection.query(
+            query_embeddings=[
+                [float(value) for value in query_vector]
+                for query_vector in query_vectors
+            ],
+            n_results=top_k,
+            where=build_where(filters) or {},
+            include=get_query_include(include_embeddings),
+        )
+        return [
+            ChromaQueryResultEnhanced(filter_query_result(single, filters))
+            for single in split_query_result(result)
+        ]
+
         # same_page = self.collection.get(include=["documents","metadatas"],
         #                             where={"origin_uuid": {"$eq": origin_uuid[i]}},)
 
@@ -383,35 +734,45 @@ class ChromaCollectionEnhanced:
     #         )
     #     )
 
-    # Return a FullPage (list of Section) that match an origin_uuid
+    # Return the alias table of near-duplicate text chunks, which is opened
+    # once it exists.
+    def get_alias_store(self):
+        if self.alias_store is None and self.chroma_dir is not None:
+            self.alias_store = open_alias_store(self.chroma_dir)
+        return self.alias_store
+
+    # Return a FullPage (list of Section) that match an origin_uuid. The
+    # aliases of the page, which aren't in the collection, are added.
     def getPageOriginUUIDList(self, origin_uuid):
+        entries = self.collection.get(
+            include=["metadatas", "documents"],
+            where={"origin_uuid": {"$eq": origin_uuid}},
+        )
         get_obj = ChromaDBGet(
-            self.collection.get(
-                include=["metadatas", "documents"],
-                where={"origin_uuid": {"$eq": origin_uuid}},
+            add_aliases_to_entries(
+                entries, self.get_alias_store(), self.collection.name, [origin_uuid]
             )
         )
-        page = []
-        # added_id = []
-        for i in range(len(get_obj.id)):
-            # Makes sure that each ID is only added once
-            # if get_obj.id not in added_id:
-            section = Section(
-                id=get_obj.metadata[i].get("section_id", None),
-                name_id=get_obj.metadata[i].get("name_id", None),
-                page_title=get_obj.metadata[i].get("page_title", None),
-                section_title=get_obj.metadata[i].get("section_title", None),
-                level=get_obj.metadata[i].get("level", None),
-                previous_id=get_obj.metadata[i].get("previous_id", None),
-                parent_tree=get_obj.metadata[i].get("parent_tree", None),
-                token_count=get_obj.metadata[i].get("token_estimate", None),
-                url=get_obj.metadata[i].get("url", None),
-                uuid=get_obj.id[i],
-                content=get_obj.document[i],
+        return build_full_page(get_obj)
+
+    # Return a dictionary of FullPage objects for a list of origin_uuids,
+    # which are fetched in a single query
+    def getPagesOriginUUIDList(self, origin_uuids: list[str]) -> dict[str, FullPage]:
+        origin_uuids = list(dict.fromkeys(origin_uuids))
+        if len(origin_uuids) == 0:
+            return {}
+        if len(origin_uuids) == 1:
+            return {origin_uuids[0]: self.getPageOriginUUIDList(origin_uuids[0])}
+        entries = self.collection.get(
+            include=["metadatas", "documents"],
+            where={"origin_uuid": {"$in": origin_uuids}},
+        )
+        get_obj = ChromaDBGet(
+            add_aliases_to_entries(
+                entries, self.get_alias_store(), self.collection.name, origin_uuids
             )
-            page.append(section)
-        full_page = FullPage(page)
-        return full_page
+        )
+        return build_full_pages(get_obj)
 
     def getPageSection(self, section_title):
         return self.collection.get(
@@ -0,0 +1,107 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Process-wide registry of opened vector store collections"""
+
+import threading
+import typing
+
+from absl import logging
+
+
+class CollectionRegistry:
+    """A thread-safe registry that opens each collection once per process.
+
+    Keys start with the backend, the database directory, and the collection
+    name, followed by the settings of the collection (for example, its
+    embedding function). A collection is opened again if its `version()` has
+    changed since it was opened, for example, after `agent populate` in
+    another process. Agents that still hold the previous collection keep
+    using it.
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.opens = 0
+        self.reopens = 0
+
+    # Return the collection of a key, calling `open_collection` to open it if
+    # it's not registered or its version has changed. `on_reopen` is called
+    # before a changed collection is opened again.
+    def get(
+        self,
+        key: tuple,
+        open_collection: typing.Callable[[], typing.Any],
+        on_reopen: typing.Optional[typing.Callable[[], None]] = None,
+    ):
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        # Only one thread opens a collection, and other threads that need the
+        # same collection wait for it.
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None:
+                version, collection = entry
+                if collection.version() == version:
+                    with self.lock:
+                        self.hits += 1
+                    return collection
+                logging.info(f"The collection {key[2]} has changed. Opening it again.")
+                if on_reopen is not None:
+                    on_reopen()
+            collection = open_collection()
+            version = collection.version()
+            with self.lock:
+                self.entries[key] = (version, collection)
+                if entry is None:
+                    self.opens += 1
+                else:
+                    self.reopens += 1
+            return collection
+
+    # Remove all collections of a vector database directory (for example,
+    # before it's deleted), or all collections.
+    def invalidate(self, db_dir: typing.Optional[str] = None):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if db_dir is None or key[1] == db_dir:
+                    del self.entries[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "opens": self.opens,
+                "reopens": self.reopens,
+            }
+
+
+# The collection registry shared by all agents in a process.
+_collection_registry = None
+_collection_registry_lock = threading.Lock()
+
+
+def get_collection_registry() -> CollectionRegistry:
+    global _collection_registry
+    with _collection_registry_lock:
+        if _collection_registry is None:
+            _collection_registry = CollectionRegistry()
+        return _collection_registry
@@ -0,0 +1,344 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Context windows of sections that are precomputed when a collection is populated"""
+
+import os
+import sqlite3
+import threading
+import typing
+
+from absl import logging
+import chromadb
+
+from docs_agent.postprocess.docs_retriever import FullPage
+from docs_agent.postprocess.docs_retriever import withTemplateTokenCount
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+from docs_agent.storage.alias_store import add_aliases_to_entries
+from docs_agent.storage.alias_store import open_alias_store
+from docs_agent.storage.chroma import ChromaDBGet
+from docs_agent.storage.chroma import build_full_pages
+from docs_agent.utilities.helpers import resolve_path
+
+
+class Error(Exception):
+    """Base error class for context_windows"""
+
+
+class ContextWindowsNotFoundError(Error, RuntimeError):
+    """Raised if the context windows of a collection have not been built."""
+
+
+# The relations of the members of a context window to its section, in the
+# order that `FullPage.buildSections` adds them.
+WINDOW_ROLES = ["self", "child", "parent", "sibling"]
+
+# The fields of a section that are stored with its templated content.
+SECTION_COLUMNS = [
+    "uuid",
+    "section_id",
+    "name_id",
+    "page_title",
+    "section_title",
+    "level",
+    "previous_id",
+    "parent_tree",
+    "url",
+    "origin_uuid",
+    "token_count",
+    "templated_token_count",
+    "content",
+]
+
+
+# Return the default directory of the context windows of a Chroma database,
+# which sits next to the Chroma database.
+def default_context_window_dir(vector_db_dir: str) -> str:
+    return str(vector_db_dir).rstrip("/") + "_contexts"
+
+
+# Return the path of the context windows of a collection.
+def get_context_window_path(window_dir: str, collection_name: str) -> str:
+    return os.path.join(resolve_path(window_dir), collection_name + ".contexts.sqlite3")
+
+
+# Return the members of the context window of a section in a page as
+# (role, section) tuples, without a token limit.
+def get_window_members(page: FullPage, section_id) -> list[tuple[str, Section]]:
+    given_section = page.returnSectionById(section_id)
+    if given_section is None:
+        return []
+    related = page.returnRelatedSections(section_id)
+    members = [("self", given_section)]
+    for role in ["child", "parent", "sibling"]:
+        members += [(role, item) for item in related[role]]
+    return members
+
+
+# Build the context windows of all sections of a Chroma collection. Each
+# section is stored once, with its templated content and token counts, and
+# a window lists the sections of its parent, children, and siblings, so the
+# store grows with the number of sections, not with the size of the windows.
+# The store is written to a temporary file and then renamed, so processes
+# that have the previous store open keep reading a consistent copy.
+def build_context_windows_from_chroma(
+    vector_db_dir: str,
+    collection_name: str,
+    window_dir: str = "",
+    batch_size: int = 1000,
+) -> dict:
+    if window_dir is None or window_dir == "":
+        window_dir = default_context_window_dir(vector_db_dir)
+    os.makedirs(resolve_path(window_dir), exist_ok=True)
+    window_path = get_context_window_path(window_dir, collection_name)
+    temp_path = window_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    collection = chroma_client.get_collection(name=collection_name)
+    # Sections are grouped into pages, so all entries are read first.
+    entries = {"ids": [], "documents": [], "metadatas": []}
+    offset = 0
+    while True:
+        batch = collection.get(
+            include=["documents", "metadatas"], limit=batch_size, offset=offset
+        )
+        if not batch["ids"]:
+            break
+        offset += len(batch["ids"])
+        for key in entries.keys():
+            entries[key] += batch[key]
+    # Aliases of near-duplicate text chunks are sections of their pages too.
+    alias_store = open_alias_store(vector_db_dir)
+    if alias_store is not None:
+        entries = add_aliases_to_entries(entries, alias_store, collection_name)
+        alias_store.close()
+    for index, metadata in enumerate(entries["metadatas"]):
+        entries["metadatas"][index] = metadata or {}
+    pages = build_full_pages(ChromaDBGet(entries))
+    connection = sqlite3.connect(temp_path)
+    connection.execute(
+        "CREATE TABLE sections (uuid TEXT PRIMARY KEY, section_id INTEGER, "
+        + "name_id TEXT, page_title TEXT, section_title TEXT, level INTEGER, "
+        + "previous_id INTEGER, parent_tree TEXT, url TEXT, origin_uuid TEXT, "
+        + "token_count REAL, templated_token_count REAL, content TEXT)"
+    )
+    connection.execute(
+        "CREATE TABLE windows (origin_uuid TEXT, section_id INTEGER, "
+        + "position INTEGER, role TEXT, member_uuid TEXT, "
+        + "PRIMARY KEY (origin_uuid, section_id, position)) WITHOUT ROWID"
+    )
+    stats = {"pages": len(pages), "sections": 0, "windows": 0, "members": 0}
+    for origin_uuid, page in pages.items():
+        section_rows = []
+        window_rows = []
+        for item in page.section_list:
+            templated = withTemplateTokenCount(item)
+            section_rows.append(
+                (
+                    item.uuid,
+                    item.id,
+                    item.name_id,
+                    item.page_title,
+                    item.section_title,
+                    item.level,
+                    item.previous_id,
+                    item.parent_tree,
+                    item.url,
+                    origin_uuid,
+                    item.token_count,
+                    templated.token_count,
+                    templated.content,
+                )
+            )
+        for section_id in dict.fromkeys(item.id for item in page.section_list):
+            members = get_window_members(page, section_id)
+            for position, (role, member) in enumerate(members):
+                window_rows.append(
+                    (origin_uuid, section_id, position, role, member.uuid)
+                )
+            stats["windows"] += 1
+        connection.executemany(
+            f"INSERT OR REPLACE INTO sections ({', '.join(SECTION_COLUMNS)}) "
+            + f"VALUES ({', '.join('?' * len(SECTION_COLUMNS))})",
+            section_rows,
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?)", window_rows
+        )
+        stats["sections"] += len(section_rows)
+        stats["members"] += len(window_rows)
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+    os.replace(temp_path, window_path)
+    stats["store_bytes"] = os.path.getsize(window_path)
+    chroma_file = os.path.join(resolve_path(vector_db_dir), "chroma.sqlite3")
+    stats["chroma_bytes"] = (
+        os.path.getsize(chroma_file) if os.path.isfile(chroma_file) else 0
+    )
+    logging.info(
+        f"Built {stats['windows']} context windows of {collection_name} "
+        + f"({stats['store_bytes']} bytes)."
+    )
+    return stats
+
+
+class ContextWindow:
+    """The precomputed members of a section's context window.
+
+    Each member is a (role, fields) tuple, where `fields` is a dictionary of
+    the stored `SECTION_COLUMNS` of a section. Sections are only created for
+    the members that fit in a token limit.
+    """
+
+    def __init__(self, members: list[tuple[str, dict]]) -> None:
+        self.members = members
+
+    # Returns a FullPage with the same sections as `FullPage.buildSections`
+    # on the page of the section, applying the token limit the same way.
+    def buildSections(
+        self,
+        selfSection: bool = True,
+        children: bool = False,
+        parent: bool = False,
+        siblings: bool = False,
+        token_limit: float = float("inf"),
+        reverse: bool = False,
+    ) -> FullPage:
+        roles = {role: [] for role in WINDOW_ROLES}
+        for role, fields in self.members:
+            roles[role].append(fields)
+        final_sections = []
+        section_token_count = 0
+        if selfSection:
+            for fields in roles["self"]:
+                # The section itself counts the tokens without the template
+                final_sections.append(
+                    buildSection(fields, token_count=fields["token_count"])
+                )
+                section_token_count += fields["token_count"]
+        if children:
+            added = self.fillSections(roles["child"], token_limit - section_token_count)
+            final_sections += added
+            section_token_count += sum(item.token_count for item in added)
+        if parent:
+            for fields in roles["parent"]:
+                if fields["token_count"] < token_limit - section_token_count:
+                    final_sections.append(buildSection(fields))
+                    section_token_count += fields["templated_token_count"]
+        if siblings:
+            final_sections += self.fillSections(
+                roles["sibling"], token_limit - section_token_count
+            )
+        return FullPage(final_sections).sortSections(reverse=reverse)
+
+    # Returns the sections that fit in a token limit, in order. Like
+    # `FullPage.returnChildrenSections`, a section fits if its tokens without
+    # the template fit, and then uses its tokens with and without the
+    # template.
+    def fillSections(self, members: list[dict], token_limit: float) -> list[Section]:
+        added = []
+        curr_token = 0
+        for fields in members:
+            if (curr_token + fields["token_count"]) < token_limit:
+                curr_token += fields["token_count"] + fields["templated_token_count"]
+                added.append(buildSection(fields))
+        return added
+
+
+# Returns a templated Section from the stored fields of a section. The token
+# count defaults to the token count of the templated content.
+def buildSection(fields: dict, token_count: typing.Optional[float] = None) -> Section:
+    if token_count is None:
+        token_count = fields["templated_token_count"]
+    return Section(
+        id=fields["section_id"],
+        name_id=fields["name_id"],
+        page_title=fields["page_title"],
+        section_title=fields["section_title"],
+        level=fields["level"],
+        previous_id=fields["previous_id"],
+        parent_tree=fields["parent_tree"],
+        token_count=token_count,
+        content=fields["content"],
+        url=fields["url"],
+        origin_uuid=fields["origin_uuid"],
+        uuid=fields["uuid"],
+        templated=True,
+    )
+
+
+class ContextWindowStore:
+    """A read-only SQLite store of the context windows of a collection"""
+
+    def __init__(self, window_dir: str, collection_name: str) -> None:
+        self.window_path = get_context_window_path(window_dir, collection_name)
+        self.collection_name = collection_name
+        if not os.path.isfile(self.window_path):
+            raise ContextWindowsNotFoundError(
+                f"The context windows of {collection_name} are not built in "
+                + f"{resolve_path(window_dir)}. Run `agent populate` or "
+                + "`agent build-context-windows` first."
+            )
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            "file:" + self.window_path + "?mode=ro", uri=True, check_same_thread=False
+        )
+
+    # Return a fingerprint that changes whenever the store is built again.
+    def version(self) -> str:
+        mtime = os.stat(self.window_path).st_mtime_ns
+        return f"{self.collection_name}:contexts:{mtime}"
+
+    # Return the context windows of (origin_uuid, section_id) keys in a single
+    # query. Keys without a window (for example, sections added after the
+    # store was built) are left out.
+    def get_windows(self, keys: list[tuple]) -> dict[tuple, ContextWindow]:
+        keys = list(
+            dict.fromkeys(
+                (str(origin_uuid), int(section_id))
+                for origin_uuid, section_id in keys
+                if section_id is not None
+            )
+        )
+        if len(keys) == 0:
+            return {}
+        columns = ", ".join("s." + column for column in SECTION_COLUMNS)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT w.origin_uuid, w.section_id, w.role, {columns} "
+                + "FROM windows w JOIN sections s ON s.uuid = w.member_uuid "
+                + "WHERE "
+                + " OR ".join(["(w.origin_uuid = ? AND w.section_id = ?)"] * len(keys))
+                + " ORDER BY w.origin_uuid, w.section_id, w.position",
+                [value for key in keys for value in key],
+            ).fetchall()
+        members = {}
+        for row in rows:
+            members.setdefault((row[0], row[1]), []).append(
+                (row[2], dict(zip(SECTION_COLUMNS, row[3:])))
+            )
+        return {key: ContextWindow(value) for key, value in members.items()}
+
+    # Return the number of windows and the size of the store in bytes.
+    def stats(self) -> dict:
+        with self.lock:
+            windows = self.connection.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT origin_uuid, section_id "
+                + "FROM windows)"
+            ).fetchone()[0]
+        return {"windows": windows, "store_bytes": os.path.getsize(self.window_path)}
@@ -0,0 +1,171 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""In-process LRU cache of query embeddings"""
+
+from collections import OrderedDict
+import threading
+import typing
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from docs_agent.storage.embedding_store import EmbeddingStore
+from docs_agent.storage.embedding_store import content_hash
+
+
+# Normalize a question so that questions that differ only in case or
+# whitespace share one cache entry.
+def normalize_text(text: str) -> str:
+    return " ".join(str(text).split()).casefold()
+
+
+class QueryEmbeddingCache:
+    """A thread-safe LRU of embeddings keyed by (model, task type, text).
+
+    If a shared `EmbeddingStore` is given, entries evicted from (or not yet
+    in) the in-process LRU are looked up in the store before calling the
+    embedding model, so several processes can share their embeddings.
+    """
+
+    def __init__(
+        self, max_size: int = 1024, store: typing.Optional[EmbeddingStore] = None
+    ) -> None:
+        self.max_size = max(0, int(max_size))
+        self.store = store
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    # Return the cached embedding of a key, or None if it is not found.
+    def get(self, key: tuple) -> typing.Optional[list[float]]:
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+        if self.store is not None:
+            embedding = self.store.get(content_hash(key[2], key[0], key[1]))
+            if embedding is not None:
+                with self.lock:
+                    self.store_hits += 1
+                self.add(key, embedding)
+                return embedding
+        with self.lock:
+            self.misses += 1
+        return None
+
+    # Add an embedding to the LRU, evicting the least recently used entries.
+    def add(self, key: tuple, embedding: list[float]):
+        if self.max_size == 0:
+            return
+        with self.lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: tuple, embedding: list[float]):
+        self.add(key, embedding)
+        if self.store is not None:
+            self.store.put(content_hash(key[2], key[0], key[1]), embedding, key[0])
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.store_hits + self.misses
+            hit_rate = 0.0
+            if lookups > 0:
+                hit_rate = (self.hits + self.store_hits) / lookups
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hit_rate,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Wraps a Chroma embedding function with a `QueryEmbeddingCache`.
+
+    Only texts that miss the cache are sent to the wrapped function, in
+    a single call.
+    """
+
+    def __init__(
+        self,
+        embedding_function: EmbeddingFunction,
+        cache: QueryEmbeddingCache,
+        model: str = "",
+        task_type: str = "",
+    ) -> None:
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.model = str(model)
+        self.task_type = str(task_type)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [(self.model, self.task_type, normalize_text(text)) for text in input]
+        embeddings = [self.cache.get(key) for key in keys]
+        missing = [index for index, value in enumerate(embeddings) if value is None]
+        if missing:
+            new_embeddings = self.embedding_function([input[i] for i in missing])
+            for index, embedding in zip(missing, new_embeddings):
+                embedding = [float(value) for value in embedding]
+                self.cache.put(keys[index], embedding)
+                embeddings[index] = embedding
+        return embeddings
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+# Caches shared by all agents in a process, keyed by the store path.
+_query_embedding_caches = {}
+_query_embedding_caches_lock = threading.Lock()
+
+
+# Return the process-wide query embedding cache that uses a store path.
+# An empty `store_path` means that the cache is in-process only.
+def get_query_embedding_cache(
+    max_size: int = 1024, store_path: str = ""
+) -> QueryEmbeddingCache:
+    with _query_embedding_caches_lock:
+        cache = _query_embedding_caches.get(store_path)
+        if cache is None:
+            store = None
+            if store_path is not None and store_path != "":
+                store = EmbeddingStore(store_path)
+            cache = QueryEmbeddingCache(max_size=max_size, store=store)
+            _query_embedding_caches[store_path] = cache
+        with cache.lock:
+            # Products that share a cache use the largest configured size.
+            cache.max_size = max(cache.max_size, int(max_size))
+        return cache
@@ -0,0 +1,127 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Local store of embeddings keyed by a hash of their input"""
+
+from array import array
+import hashlib
+import os
+import sqlite3
+import threading
+import typing
+
+from absl import logging
+
+from docs_agent.utilities.helpers import resolve_path
+
+
+# Return a hash that identifies the input of an embedding call. Two calls with
+# the same model, task type, title, and content return the same embedding.
+def content_hash(
+    content: str,
+    model: str = "",
+    task_type: str = "",
+    title: typing.Optional[str] = None,
+) -> str:
+    key = "\x1f".join([str(model), str(task_type), str(title or ""), str(content)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """A SQLite table that maps content hashes to embeddings.
+
+    The same store can be shared by all products (and processes) on
+    a machine, so that an identical text is only embedded once.
+    """
+
+    def __init__(self, store_path: str) -> None:
+        self.store_path = resolve_path(store_path)
+        store_dir = os.path.dirname(self.store_path)
+        if store_dir != "":
+            os.makedirs(store_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.store_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            + "(hash TEXT PRIMARY KEY, model TEXT, embedding BLOB)"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+
+    def __contains__(self, key_hash: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM embeddings WHERE hash = ?", (key_hash,)
+            ).fetchone()
+        return row is not None
+
+    # Return the embedding stored for a hash, or None if it is not found.
+    def get(self, key_hash: str) -> typing.Optional[list[float]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT embedding FROM embeddings WHERE hash = ?", (key_hash,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Embeddings are stored as float64 so that they are returned unchanged.
+        return array("d", row[0]).tolist()
+
+    def put(self, key_hash: str, embedding: list[float], model: str = ""):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO embeddings (hash, model, embedding) "
+                + "VALUES (?, ?, ?)",
+                (key_hash, str(model), array("d", embedding).tobytes()),
+            )
+            self.connection.commit()
+
+    # Return the embedding of `content`. `embed_function` is called only if
+    # the embedding of the same input is not in the store yet.
+    def get_or_embed(
+        self,
+        embed_function: typing.Callable[[], list[float]],
+        content: str,
+        model: str = "",
+        task_type: str = "",
+        title: typing.Optional[str] = None,
+    ) -> list[float]:
+        key_hash = content_hash(content, model=model, task_type=task_type, title=title)
+        embedding = self.get(key_hash)
+        if embedding is None:
+            embedding = embed_function()
+            self.put(key_hash, embedding, model=model)
+        return embedding
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        hit_rate = 0.0
+        if lookups > 0:
+            hit_rate = self.hits / lookups
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+        logging.info(f"Closed the embedding store: {self.store_path}")
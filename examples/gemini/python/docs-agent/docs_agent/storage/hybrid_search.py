@@ -0,0 +1,265 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Hybrid lexical and vector retrieval with reciprocal rank fusion"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import typing
+
+from docs_agent.storage.chroma import ChromaQueryResultEnhanced
+from docs_agent.storage.lexical_index import LexicalIndex
+
+
+# Fuse ranked lists of ids with reciprocal rank fusion. Each id scores
+# `weight / (rrf_k + rank)` in every list that it appears in (ranks start at
+# 1). Returns (id, score) pairs with the highest scores first; ties keep the
+# order in which ids were first seen.
+def reciprocal_rank_fusion(
+    ranked_lists: list[list[str]],
+    weights: typing.Optional[list[float]] = None,
+    rrf_k: float = 60,
+) -> list[tuple[str, float]]:
+    if weights is None:
+        weights = [1.0] * len(ranked_lists)
+    scores = {}
+    for ranked_ids, weight in zip(ranked_lists, weights):
+        for rank, entry_id in enumerate(ranked_ids, start=1):
+            scores[entry_id] = scores.get(entry_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+# The thread pool that queries the lexical index while the vector store is
+# queried, shared by all hybrid collections in a process.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=4, thread_name_prefix="lexical_search"
+            )
+        return _executor
+
+
+class HybridCollection:
+    """A collection that fuses vector and full-text (BM25) search results.
+
+    All methods other than the query methods are passed to the wrapped
+    vector collection (ChromaCollectionEnhanced or NumpyCollection).
+    """
+
+    def __init__(
+        self,
+        collection,
+        lexical_index: LexicalIndex,
+        vector_k: int = 0,
+        lexical_k: int = 0,
+        vector_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        rrf_k: float = 60,
+    ) -> None:
+        self.collection = collection
+        self.lexical_index = lexical_index
+        # Zero means that each source returns as many results as requested.
+        self.vector_k = int(vector_k)
+        self.lexical_k = int(lexical_k)
+        self.vector_weight = float(vector_weight)
+        self.lexical_weight = float(lexical_weight)
+        self.rrf_k = float(rrf_k)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def version(self) -> str:
+        return f"{self.collection.version()}:{self.lexical_index.version()}"
+
+    # With `include_embeddings`, the results that the vector store found
+    # include their embeddings. Results that only the lexical index found
+    # have no embedding (None).
+    def query(
+        self,
+        text: str,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return self.query_sources(
+            text,
+            top_k,
+            filters,
+            lambda vector_k: self.collection.query(
+                text,
+                vector_k,
+                filters=filters,
+                include_embeddings=include_embeddings,
+            ),
+        )
+
+    def query_by_embedding(
+        self,
+        text: str,
+        query_vector,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return self.query_sources(
+            text,
+            top_k,
+            filters,
+            lambda vector_k: self.collection.query_by_embedding(
+                query_vector,
+                vector_k,
+                filters=filters,
+                include_embeddings=include_embeddings,
+            ),
+        )
+
+    # Query the lexical index in the background while the vector store is
+    # queried (which usually includes embedding the question), then fuse the
+    # two lists.
+    def query_sources(
+        self, text: str, top_k: int, filters: typing.Optional[dict], vector_query
+    ):
+        vector_k = self.vector_k if self.vector_k > 0 else top_k
+        lexical_k = self.lexical_k if self.lexical_k > 0 else top_k
+        lexical_future = get_executor().submit(
+            self.lexical_index.search, text, lexical_k, filters
+        )
+        vector_result = vector_query(vector_k).result
+        lexical_result = lexical_future.result()
+        return self.fuse(vector_result, lexical_result, top_k)
+
+    def query_batch(
+        self,
+        texts: list[str],
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return self.query_batch_sources(
+            texts,
+            top_k,
+            filters,
+            lambda vector_k: self.collection.query_batch(
+                texts,
+                vector_k,
+                filters=filters,
+                include_embeddings=include_embeddings,
+            ),
+        )
+
+    def query_batch_by_embedding(
+        self,
+        texts: list[str],
+        query_vectors,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return self.query_batch_sources(
+            texts,
+            top_k,
+            filters,
+            lambda vector_k: self.collection.query_batch_by_embedding(
+                query_vectors,
+                vector_k,
+                filters=filters,
+                include_embeddings=include_embeddings,
+            ),
+        )
+
+    # Query the lexical index for all texts in the background while the
+    # vector store is queried for the whole batch, then fuse the lists of
+    # each text.
+    def query_batch_sources(
+        self,
+        texts: list[str],
+        top_k: int,
+        filters: typing.Optional[dict],
+        vector_batch_query,
+    ):
+        vector_k = self.vector_k if self.vector_k > 0 else top_k
+        lexical_k = self.lexical_k if self.lexical_k > 0 else top_k
+        lexical_futures = [
+            get_executor().submit(self.lexical_index.search, text, lexical_k, filters)
+            for text in texts
+        ]
+        vector_results = vector_batch_query(vector_k)
+        return [
+            self.fuse(vector_result.result, lexical_future.result(), top_k)
+            for vector_result, lexical_future in zip(vector_results, lexical_futures)
+        ]
+
+    # Return the `top_k` fused results as a Chroma query result. Entries that
+    # are only found by the lexical index have no vector distance, so they
+    # get the largest distance of the vector results.
+    def fuse(self, vector_result: dict, lexical_result: dict, top_k: int):
+        entries = {}
+        for index, entry_id in enumerate(lexical_result["ids"]):
+            entries[entry_id] = (
+                lexical_result["documents"][index],
+                lexical_result["metadatas"][index],
+                None,
+                None,
+            )
+        vector_embeddings = vector_result.get("embeddings", None)
+        vector_distances = []
+        for index, entry_id in enumerate(vector_result["ids"][0]):
+            distance = vector_result["distances"][0][index]
+            vector_distances.append(distance)
+            entries[entry_id] = (
+                vector_result["documents"][0][index],
+                vector_result["metadatas"][0][index],
+                distance,
+                None if vector_embeddings is None else vector_embeddings[0][index],
+            )
+        default_distance = max(vector_distances) if vector_distances else 0.0
+        fused = reciprocal_rank_fusion(
+            [vector_result["ids"][0], lexical_result["ids"]],
+            weights=[self.vector_weight, self.lexical_weight],
+            rrf_k=self.rrf_k,
+        )[:top_k]
+        ids = []
+        documents = []
+        metadatas = []
+        distances = []
+        embeddings = []
+        scores = []
+        for entry_id, score in fused:
+            document, metadata, distance, embedding = entries[entry_id]
+            if distance is None:
+                distance = default_distance
+            ids.append(entry_id)
+            documents.append(document)
+            metadatas.append(metadata)
+            distances.append(distance)
+            embeddings.append(embedding)
+            scores.append(score)
+        return ChromaQueryResultEnhanced(
+            {
+                "ids": [ids],
+                "embeddings": None if vector_embeddings is None else [embeddings],
+                "documents": [documents],
+                "metadatas": [metadatas],
+                "distances": [distances],
+                "rrf_scores": [scores],
+            }
+        )
@@ -0,0 +1,198 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Full-text (BM25) index of the text chunks of a collection"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import typing
+
+from absl import logging
+import chromadb
+
+from docs_agent.storage.metadata_filters import URL_PREFIX_KEY
+from docs_agent.storage.metadata_filters import matches_filters
+from docs_agent.storage.metadata_filters import normalize_filters
+from docs_agent.utilities.helpers import resolve_path
+
+
+class Error(Exception):
+    """Base error class for lexical_index"""
+
+
+class LexicalIndexNotFoundError(Error, RuntimeError):
+    """Raised if the lexical index of a collection has not been built."""
+
+
+# The weights of the title and content columns in BM25 scores.
+TITLE_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+# The maximum number of terms used from a query.
+MAX_QUERY_TERMS = 64
+
+
+# Return the default directory of the lexical indexes of a Chroma database,
+# which sits next to the Chroma database.
+def default_lexical_index_dir(vector_db_dir: str) -> str:
+    return str(vector_db_dir).rstrip("/") + "_lexical"
+
+
+# Return the path of the lexical index of a collection.
+def get_lexical_index_path(index_dir: str, collection_name: str) -> str:
+    return os.path.join(resolve_path(index_dir), collection_name + ".fts.sqlite3")
+
+
+# Convert a question into an FTS5 query that matches any of its words. Words
+# joined by punctuation (for example, `fuchsia.io.Directory` or `foo-bar`)
+# are also matched as a phrase, so exact identifiers rank higher.
+def build_match_query(text: str) -> str:
+    terms = []
+    for chunk in str(text).split():
+        words = re.findall(r"\w+", chunk)
+        if len(words) > 1:
+            terms.append('"' + " ".join(words) + '"')
+        for word in words:
+            terms.append('"' + word + '"')
+    terms = list(dict.fromkeys(terms))[:MAX_QUERY_TERMS]
+    return " OR ".join(terms)
+
+
+# Build the lexical index of a Chroma collection from its documents and
+# metadata. The index is written to a temporary file and then renamed, so
+# processes that have the previous index open keep reading a consistent copy.
+def build_lexical_index_from_chroma(
+    vector_db_dir: str,
+    collection_name: str,
+    index_dir: str = "",
+    batch_size: int = 1000,
+) -> int:
+    if index_dir is None or index_dir == "":
+        index_dir = default_lexical_index_dir(vector_db_dir)
+    os.makedirs(resolve_path(index_dir), exist_ok=True)
+    index_path = get_lexical_index_path(index_dir, collection_name)
+    temp_path = index_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    collection = chroma_client.get_collection(name=collection_name)
+    connection = sqlite3.connect(temp_path)
+    connection.execute(
+        "CREATE VIRTUAL TABLE chunks USING fts5(id UNINDEXED, title, content, "
+        + "metadata UNINDEXED, tokenize=\"unicode61 tokenchars '_'\")"
+    )
+    count = 0
+    offset = 0
+    while True:
+        entries = collection.get(
+            include=["documents", "metadatas"], limit=batch_size, offset=offset
+        )
+        if not entries["ids"]:
+            break
+        offset += len(entries["ids"])
+        rows = []
+        for entry_id, document, metadata in zip(
+            entries["ids"], entries["documents"], entries["metadatas"]
+        ):
+            metadata = metadata or {}
+            title = " ".join(
+                str(metadata.get(field, ""))
+                for field in ["page_title", "section_title"]
+            )
+            rows.append((entry_id, title, document or "", json.dumps(metadata)))
+        connection.executemany(
+            "INSERT INTO chunks (id, title, content, metadata) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        count += len(rows)
+    connection.execute("INSERT INTO chunks (chunks) VALUES ('optimize')")
+    connection.commit()
+    connection.close()
+    os.replace(temp_path, index_path)
+    logging.info(f"Built the lexical index of {collection_name} ({count} entries).")
+    return count
+
+
+class LexicalIndex:
+    """A read-only SQLite FTS5 index of the text chunks of a collection"""
+
+    def __init__(self, index_dir: str, collection_name: str) -> None:
+        self.index_path = get_lexical_index_path(index_dir, collection_name)
+        self.collection_name = collection_name
+        if not os.path.isfile(self.index_path):
+            raise LexicalIndexNotFoundError(
+                f"The lexical index of {collection_name} is not built in "
+                + f"{resolve_path(index_dir)}. Run `agent populate` or "
+                + "`agent build-lexical-index` first."
+            )
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            "file:" + self.index_path + "?mode=ro", uri=True, check_same_thread=False
+        )
+
+    # Return a fingerprint that changes whenever the index is built again.
+    def version(self) -> str:
+        mtime = os.stat(self.index_path).st_mtime_ns
+        return f"{self.collection_name}:lexical:{mtime}"
+
+    # Return the ids, documents, metadata, and BM25 scores (higher is better)
+    # of the `top_k` best matching entries that match all filters.
+    def search(
+        self, text: str, top_k: int = 10, filters: typing.Optional[dict] = None
+    ) -> dict:
+        result = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        match_query = build_match_query(text)
+        if match_query == "" or top_k <= 0:
+            return result
+        conditions, parameters = build_filter_conditions(filters)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, content, metadata, "
+                + f"bm25(chunks, 0.0, {TITLE_WEIGHT}, {CONTENT_WEIGHT}, 0.0) AS score "
+                + "FROM chunks WHERE chunks MATCH ?"
+                + "".join(" AND " + condition for condition in conditions)
+                + " ORDER BY score LIMIT ?",
+                [match_query] + parameters + [int(top_k)],
+            ).fetchall()
+        for entry_id, document, metadata, score in rows:
+            metadata = json.loads(metadata)
+            if filters and not matches_filters(metadata, filters):
+                continue
+            result["ids"].append(entry_id)
+            result["documents"].append(document)
+            result["metadatas"].append(metadata)
+            # SQLite returns BM25 scores as negative numbers.
+            result["scores"].append(-float(score))
+        return result
+
+
+# Convert filters into SQL conditions on the metadata column of the index.
+# A URL prefix is matched on the start of the URL.
+def build_filter_conditions(filters: typing.Optional[dict]) -> tuple[list, list]:
+    conditions = []
+    parameters = []
+    for key, value in normalize_filters(filters).items():
+        if key == URL_PREFIX_KEY:
+            url_prefix = str(value).rstrip("/") + "/"
+            conditions.append("substr(json_extract(metadata, '$.url'), 1, ?) = ?")
+            parameters += [len(url_prefix), url_prefix]
+        else:
+            conditions.append("json_extract(metadata, ?) = ?")
+            parameters += ['$."' + key.replace('"', "") + '"', value]
+    return conditions, parameters
@@ -0,0 +1,167 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Structured metadata filters that are pushed down to vector stores"""
+
+import json
+import typing
+from urllib.parse import urlsplit
+
+from absl import logging
+
+
+class Error(Exception):
+    """Base error class for metadata_filters"""
+
+
+class InvalidFilterError(Error, ValueError):
+    """Raised if a filter is not in the `key=value` format."""
+
+
+# The filter key that matches entries whose URL starts with a prefix.
+URL_PREFIX_KEY = "url_prefix"
+
+# The number of URL path segments that are stored as prefix fields (for
+# example, `url_prefix_2` is `https://example.com/docs/guide/`).
+URL_PREFIX_DEPTH = 4
+
+# Fields that are stored as integers in the vector store.
+INT_FIELDS = ["section_id", "section_level", "previous_id"]
+
+# Fields that are indexed in the vector stores, since they are commonly used
+# in filters.
+INDEXED_FIELDS = [
+    "origin_uuid",
+    "page_title",
+    "section_title",
+    "url",
+    "source",
+    "source_file",
+] + [f"{URL_PREFIX_KEY}_{depth}" for depth in range(1, URL_PREFIX_DEPTH + 1)]
+
+
+# Return the URL of a page cut after each of its first path segments, which
+# are stored with each entry so that a URL prefix filter is an exact match.
+def get_url_prefix_fields(url: typing.Optional[str]) -> dict:
+    fields = {}
+    if url is None or url == "" or url == "None":
+        return fields
+    parts = urlsplit(str(url))
+    segments = [segment for segment in parts.path.split("/") if segment != ""]
+    # The last segment is the page itself, not a directory.
+    if not parts.path.endswith("/") and len(segments) > 0:
+        segments = segments[:-1]
+    prefix = f"{parts.scheme}://{parts.netloc}/" if parts.scheme else "/"
+    for depth, segment in enumerate(segments[:URL_PREFIX_DEPTH], start=1):
+        prefix += segment + "/"
+        fields[f"{URL_PREFIX_KEY}_{depth}"] = prefix
+    return fields
+
+
+# Return the prefix field and value that match a URL prefix. A prefix
+# matches whole path segments, so `https://example.com/docs` matches
+# `https://example.com/docs/`. A prefix deeper than the stored prefix fields
+# returns the field of its first segments, which is a broader match.
+def get_url_prefix_condition(url_prefix: str) -> typing.Optional[tuple[str, str]]:
+    fields = get_url_prefix_fields(str(url_prefix).rstrip("/") + "/")
+    if not fields:
+        return None
+    key = f"{URL_PREFIX_KEY}_{len(fields)}"
+    return key, fields[key]
+
+
+# Return True if a URL prefix is deeper than the stored prefix fields.
+def is_deep_url_prefix(url_prefix: str) -> bool:
+    path = urlsplit(str(url_prefix)).path
+    return len([segment for segment in path.split("/") if segment]) > URL_PREFIX_DEPTH
+
+
+# Parse filters in the `key=value` format (for example, from the command
+# line) into a dictionary.
+def parse_filters(filter_strings: typing.Iterable[str]) -> dict:
+    filters = {}
+    for filter_string in filter_strings:
+        key, separator, value = str(filter_string).partition("=")
+        key = key.strip()
+        if separator == "" or key == "":
+            raise InvalidFilterError(
+                f"Invalid filter {filter_string}. Use the format key=value."
+            )
+        filters[key] = value.strip()
+    return normalize_filters(filters)
+
+
+# Convert the values of integer fields and drop empty filters.
+def normalize_filters(filters: typing.Optional[dict]) -> dict:
+    normalized = {}
+    if not filters:
+        return normalized
+    for key, value in filters.items():
+        if value is None or value == "":
+            continue
+        if key in INT_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise InvalidFilterError(f"The filter {key} must be an integer.")
+        normalized[str(key)] = value
+    return normalized
+
+
+# Convert filters into a Chroma `where` clause, or None if there are no
+# filters. A URL prefix is matched with the stored prefix field of its depth.
+def build_where(filters: typing.Optional[dict]) -> typing.Optional[dict]:
+    conditions = []
+    for key, value in normalize_filters(filters).items():
+        if key == URL_PREFIX_KEY:
+            condition = get_url_prefix_condition(value)
+            if condition is None:
+                continue
+            if is_deep_url_prefix(value):
+                logging.info(
+                    f"The URL prefix {value} is deeper than {URL_PREFIX_DEPTH} "
+                    + "path segments. Results are also filtered after the query."
+                )
+            key, value = condition
+        conditions.append({key: {"$eq": value}})
+    if len(conditions) == 0:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+# Return True if the metadata of an entry matches all filters.
+def matches_filters(metadata: dict, filters: typing.Optional[dict]) -> bool:
+    for key, value in normalize_filters(filters).items():
+        if key == URL_PREFIX_KEY:
+            url = metadata.get("url", None)
+            condition = get_url_prefix_condition(value)
+            if condition is None:
+                continue
+            if get_url_prefix_fields(url).get(condition[0], None) != condition[1]:
+                return False
+            url_prefix = str(value).rstrip("/") + "/"
+            if is_deep_url_prefix(value) and not str(url).startswith(url_prefix):
+                return False
+        elif str(metadata.get(key, None)) != str(value):
+            return False
+    return True
+
+
+# Return a stable string for filters, which is used in cache keys.
+def filters_to_key(filters: typing.Optional[dict]) -> str:
+    return json.dumps(normalize_filters(filters), sort_keys=True, default=str)
@@ -0,0 +1,817 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Memory-mapped NumPy vector store exported from a Chroma collection"""
+
+import json
+import os
+import sqlite3
+import threading
+import typing
+
+from absl import logging
+import chromadb
+import numpy as np
+
+from docs_agent.storage.alias_store import open_alias_store
+from docs_agent.storage.chroma import ChromaDBGet
+from docs_agent.storage.chroma import ChromaQueryResultEnhanced
+from docs_agent.storage.chroma import build_full_page
+from docs_agent.storage.chroma import build_full_pages
+from docs_agent.storage.chroma import filter_query_result
+from docs_agent.storage.metadata_filters import INDEXED_FIELDS
+from docs_agent.storage.metadata_filters import URL_PREFIX_KEY
+from docs_agent.storage.metadata_filters import get_url_prefix_condition
+from docs_agent.storage.metadata_filters import get_url_prefix_fields
+from docs_agent.storage.metadata_filters import normalize_filters
+from docs_agent.storage.quantization import QUANTIZATIONS
+from docs_agent.storage.quantization import build_quantized_index
+from docs_agent.storage.quantization import load_quantized_index
+from docs_agent.storage.quantization import remove_quantized_index
+from docs_agent.storage.reduction import REDUCTIONS
+from docs_agent.storage.reduction import build_reduced_index
+from docs_agent.storage.reduction import load_reduced_index
+from docs_agent.storage.reduction import remove_reduced_indexes
+from docs_agent.utilities.helpers import resolve_path
+
+# The size in bytes of the float32 values that a block of a quantized index
+# is decoded to. Codes are converted to float32 while they are scored, so
+# quantized indexes are scanned in blocks of at most this size even if
+# `block_size` is 0.
+QUANTIZED_BLOCK_BYTES = 32 * 1024 * 1024
+
+
+class Error(Exception):
+    """Base error class for numpy_store"""
+
+
+class NumpyStoreNotFoundError(Error, RuntimeError):
+    """Raised if a collection has not been exported to a NumPy store."""
+
+
+# Return the default directory of the NumPy store exported from a Chroma
+# database, which sits next to the Chroma database.
+def default_numpy_dir(vector_db_dir: str) -> str:
+    return str(vector_db_dir).rstrip("/") + "_numpy"
+
+
+# Return the paths of the files that make up the NumPy store of a collection.
+def get_store_paths(numpy_dir: str, collection_name: str) -> dict:
+    base = os.path.join(resolve_path(numpy_dir), collection_name)
+    return {
+        "base": base,
+        "vectors": base + ".vectors.npy",
+        "norms": base + ".norms.npy",
+        "sidecar": base + ".sqlite3",
+        "manifest": base + ".json",
+    }
+
+
+# Save an array to an `.npy` file without changing the file's extension.
+def save_npy(path: str, array: np.ndarray):
+    with open(path, "wb") as npy_file:
+        np.save(npy_file, array)
+        npy_file.close()
+
+
+# Return the fields of an entry that are indexed for filters. URL prefix
+# fields are derived from the URL if the entry doesn't store them.
+def get_indexed_fields(metadata: dict) -> dict:
+    fields = get_url_prefix_fields(metadata.get("url", None))
+    for key in INDEXED_FIELDS:
+        if key in metadata and metadata[key] is not None:
+            fields[key] = metadata[key]
+    return fields
+
+
+# Copy the embeddings, documents, and metadata of a Chroma collection into
+# a float32 matrix file (`.npy`) and a SQLite metadata sidecar. Files are
+# written to temporary paths first and then renamed, so processes that have
+# the previous files memory-mapped keep reading a consistent copy.
+def export_chroma_to_numpy(
+    vector_db_dir: str,
+    collection_name: str,
+    numpy_dir: typing.Optional[str] = None,
+    batch_size: int = 1000,
+    quantization: str = "none",
+    pq_subvectors: int = 0,
+    reduction: str = "none",
+    reduced_dimension: int = 0,
+) -> dict:
+    """Exports a Chroma collection to a NumPy store.
+    Args:
+        vector_db_dir: The directory of the Chroma database.
+        collection_name: The name of the collection to export.
+        numpy_dir: (Optional) The output directory of the NumPy store.
+        batch_size: The number of entries to read from Chroma in a single call.
+        quantization: (Optional) Also build a quantized index (`int8` or `pq`).
+        pq_subvectors: (Optional) The number of subvectors of the `pq` index.
+        reduction: (Optional) Also build a reduced index (`pca` or
+          `random_projection`).
+        reduced_dimension: (Optional) The dimension of the reduced index.
+
+    Returns:
+        The manifest of the exported store.
+    """
+    if numpy_dir is None or numpy_dir == "":
+        numpy_dir = default_numpy_dir(vector_db_dir)
+    os.makedirs(resolve_path(numpy_dir), exist_ok=True)
+    paths = get_store_paths(numpy_dir, collection_name)
+    chroma_client = chromadb.PersistentClient(path=resolve_path(vector_db_dir))
+    collection = chroma_client.get_collection(name=collection_name)
+    count = collection.count()
+    space = "l2"
+    embedding_model = None
+    if collection.metadata:
+        space = collection.metadata.get("hnsw:space", "l2")
+        embedding_model = collection.metadata.get("embedding_model", None)
+
+    temp_paths = {key: value + ".tmp" for key, value in paths.items() if key != "base"}
+    for path in temp_paths.values():
+        if os.path.exists(path):
+            os.remove(path)
+    sidecar = sqlite3.connect(temp_paths["sidecar"])
+    sidecar.execute(
+        "CREATE TABLE entries (row INTEGER PRIMARY KEY, id TEXT, "
+        + "origin_uuid TEXT, document TEXT, metadata TEXT)"
+    )
+    # The values of the commonly filtered fields of each row.
+    sidecar.execute("CREATE TABLE metadata_index (row INTEGER, key TEXT, value TEXT)")
+    vectors = None
+    dimension = 0
+    offset = 0
+    while offset < count:
+        entries = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset,
+        )
+        if not entries["ids"]:
+            break
+        batch = np.asarray(entries["embeddings"], dtype=np.float32)
+        if vectors is None:
+            dimension = batch.shape[1]
+            vectors = np.lib.format.open_memmap(
+                temp_paths["vectors"],
+                mode="w+",
+                dtype=np.float32,
+                shape=(count, dimension),
+            )
+        vectors[offset : offset + len(batch)] = batch
+        rows = []
+        index_rows = []
+        for i, entry_id in enumerate(entries["ids"]):
+            metadata = entries["metadatas"][i] or {}
+            for key, value in get_indexed_fields(metadata).items():
+                index_rows.append((offset + i, key, str(value)))
+            rows.append(
+                (
+                    offset + i,
+                    str(entry_id),
+                    str(metadata.get("origin_uuid", "")),
+                    entries["documents"][i],
+                    json.dumps(metadata),
+                )
+            )
+        sidecar.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+        sidecar.executemany("INSERT INTO metadata_index VALUES (?, ?, ?)", index_rows)
+        offset += len(batch)
+    if vectors is None:
+        vectors = np.zeros((0, dimension), dtype=np.float32)
+        save_npy(temp_paths["vectors"], vectors)
+    else:
+        vectors.flush()
+    # Precompute the squared norms used by the distance functions.
+    norms = np.einsum("ij,ij->i", vectors[:offset], vectors[:offset])
+    save_npy(temp_paths["norms"], norms.astype(np.float32))
+    del vectors
+    # Aliases of near-duplicate text chunks have no vectors, but they are
+    # copied so that their pages are rebuilt in full.
+    sidecar.execute(
+        "CREATE TABLE aliases (id TEXT, origin_uuid TEXT, document TEXT, "
+        + "metadata TEXT)"
+    )
+    alias_count = 0
+    alias_store = open_alias_store(vector_db_dir)
+    if alias_store is not None:
+        aliases = alias_store.get(collection_name)
+        alias_store.close()
+        alias_rows = []
+        for i, entry_id in enumerate(aliases["ids"]):
+            metadata = aliases["metadatas"][i]
+            alias_rows.append(
+                (
+                    str(entry_id),
+                    str(metadata.get("origin_uuid", "")),
+                    aliases["documents"][i],
+                    json.dumps(metadata),
+                )
+            )
+        sidecar.executemany("INSERT INTO aliases VALUES (?, ?, ?, ?)", alias_rows)
+        alias_count = len(alias_rows)
+    sidecar.execute("CREATE INDEX entries_origin_uuid ON entries (origin_uuid)")
+    sidecar.execute("CREATE INDEX aliases_origin_uuid ON aliases (origin_uuid)")
+    sidecar.execute("CREATE INDEX metadata_index_key ON metadata_index (key, value)")
+    sidecar.commit()
+    sidecar.close()
+    # Indexes are built from the new vectors before the manifest is renamed,
+    # so a store is only complete with the indexes of its own rows.
+    if quantization in QUANTIZATIONS and offset > 0:
+        build_quantized_index(
+            vectors=np.load(temp_paths["vectors"], mmap_mode="r"),
+            base_path=paths["base"],
+            quantization=quantization,
+            pq_subvectors=int(pq_subvectors),
+        )
+    else:
+        quantization = "none"
+    if reduction in REDUCTIONS and offset > 0:
+        build_reduced_index(
+            vectors=np.load(temp_paths["vectors"], mmap_mode="r"),
+            base_path=paths["base"],
+            reduction=reduction,
+            dimension=int(reduced_dimension),
+        )
+    else:
+        reduction = "none"
+        reduced_dimension = 0
+    manifest = {
+        "collection_name": collection_name,
+        "count": offset,
+        "dimension": int(dimension),
+        "space": space,
+        "embedding_model": embedding_model,
+        "quantization": quantization,
+        "reduction": reduction,
+        "reduced_dimension": int(reduced_dimension),
+        "aliases": alias_count,
+    }
+    with open(temp_paths["manifest"], "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+        manifest_file.close()
+    # Rename the manifest last, which marks the export as complete.
+    for key in ["vectors", "norms", "sidecar", "manifest"]:
+        os.replace(temp_paths[key], paths[key])
+    # Delete the indexes of earlier exports that weren't built again.
+    for other_quantization in QUANTIZATIONS:
+        if other_quantization != quantization:
+            remove_quantized_index(paths["base"], other_quantization)
+    remove_reduced_indexes(paths["base"], reduction, int(reduced_dimension))
+    logging.info(
+        f"Exported {offset} entries of {collection_name} to {resolve_path(numpy_dir)}"
+    )
+    return manifest
+
+
+# Merge the distances of a block of rows (starting at row `start`) into the
+# best rows found so far, keeping the `top_k` smallest distances.
+def merge_top_k(best_rows, best_distances, block_distances, start: int, top_k: int):
+    if len(block_distances) > top_k:
+        keep = np.argpartition(block_distances, top_k - 1)[:top_k]
+    else:
+        keep = np.arange(len(block_distances))
+    best_rows = np.concatenate([best_rows, keep + start])
+    best_distances = np.concatenate([best_distances, block_distances[keep]])
+    if len(best_distances) > top_k:
+        keep = np.argpartition(best_distances, top_k - 1)[:top_k]
+        best_rows = best_rows[keep]
+        best_distances = best_distances[keep]
+    return best_rows, best_distances
+
+
+# Return a Chroma query result for one query from the entries and distances
+# of its rows (and optionally their embeddings).
+def build_query_result(
+    entries: dict, distances, filters: typing.Optional[dict], embeddings=None
+):
+    return ChromaQueryResultEnhanced(
+        filter_query_result(
+            {
+                "ids": [entries["ids"]],
+                "embeddings": None if embeddings is None else [list(embeddings)],
+                "documents": [entries["documents"]],
+                "metadatas": [entries["metadatas"]],
+                "distances": [[float(distance) for distance in distances]],
+            },
+            filters,
+        )
+    )
+
+
+class NumpyCollection:
+    """A read-only collection backed by a memory-mapped float32 matrix.
+
+    Provides the same query methods as `ChromaCollectionEnhanced`. All
+    processes that open the same store share one page-cached copy of the
+    matrix. With a quantized index (`int8` or `pq`), the compact codes are
+    scanned first and an oversampled candidate set is re-ranked with the
+    full-precision rows, so only those rows of the matrix are read. With a
+    reduced index (`pca` or `random_projection`), queries are projected the
+    same way as the rows and the lower-dimensional rows are scanned first,
+    in the same way.
+    """
+
+    def __init__(
+        self,
+        numpy_dir: str,
+        collection_name: str,
+        embedding_function=None,
+        block_size: int = 0,
+        quantization: str = "none",
+        rerank_oversample: int = 4,
+        reduction: str = "none",
+        reduced_dimension: int = 0,
+    ) -> None:
+        self.numpy_dir = numpy_dir
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        # Zero means that all rows are scored in a single block.
+        self.block_size = int(block_size)
+        self.rerank_oversample = max(1, int(rerank_oversample))
+        self.paths = get_store_paths(numpy_dir, collection_name)
+        if not os.path.isfile(self.paths["manifest"]):
+            raise NumpyStoreNotFoundError(
+                f"The collection {collection_name} is not exported to "
+                f"{resolve_path(numpy_dir)}. Run `agent export-numpy` first."
+            )
+        with open(self.paths["manifest"], "r", encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+            manifest_file.close()
+        self.space = self.manifest.get("space", "l2")
+        self.vectors = np.load(self.paths["vectors"], mmap_mode="r")
+        self.norms = np.load(self.paths["norms"], mmap_mode="r")
+        self.quantization = "none"
+        self.quantized_index = None
+        exported_quantization = self.manifest.get("quantization", "none")
+        if quantization in QUANTIZATIONS and quantization != exported_quantization:
+            logging.warning(
+                f"The collection {collection_name} was exported with the "
+                + f"{exported_quantization} quantization, not {quantization}. "
+                + "Using the full-precision vectors."
+            )
+        elif quantization in QUANTIZATIONS:
+            self.quantized_index = load_quantized_index(
+                self.paths["base"], quantization, rows=self.count()
+            )
+            if self.quantized_index is None:
+                logging.warning(
+                    f"The {quantization} index of {collection_name} is not built "
+                    + "for the exported rows. Using the full-precision vectors."
+                )
+            else:
+                self.quantization = quantization
+        self.reduction = "none"
+        self.reduced_index = None
+        exported_reduction = self.manifest.get("reduction", "none")
+        exported_dimension = int(self.manifest.get("reduced_dimension", 0))
+        if reduction in REDUCTIONS and (
+            reduction != exported_reduction
+            or int(reduced_dimension) != exported_dimension
+        ):
+            logging.warning(
+                f"The collection {collection_name} was exported with the "
+                + f"{exported_reduction} reduction ({exported_dimension} "
+                + f"dimensions), not {reduction} ({reduced_dimension} "
+                + "dimensions). Using the full-dimensional vectors."
+            )
+        elif reduction in REDUCTIONS:
+            self.reduced_index = load_reduced_index(
+                self.paths["base"],
+                reduction,
+                int(reduced_dimension),
+                rows=self.count(),
+            )
+            if self.reduced_index is None:
+                logging.warning(
+                    f"The {reduction} index of {collection_name} with "
+                    + f"{reduced_dimension} dimensions is not built for the "
+                    + "exported rows. "
+                    + "Using the full-dimensional vectors."
+                )
+            else:
+                self.reduction = reduction
+                if self.quantized_index is not None:
+                    logging.warning(
+                        f"The {reduction} index of {collection_name} is used "
+                        + f"instead of the {quantization} index."
+                    )
+        self.lock = threading.Lock()
+        self.sidecar = sqlite3.connect(
+            "file:" + self.paths["sidecar"] + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        # Stores exported before aliases were kept out of the vector index
+        # have no alias table.
+        self.has_aliases = (
+            self.sidecar.execute(
+                "SELECT name FROM sqlite_master "
+                + "WHERE type = 'table' AND name = 'aliases'"
+            ).fetchone()
+            is not None
+        )
+
+    def count(self) -> int:
+        return int(self.vectors.shape[0])
+
+    # Return a fingerprint that changes whenever the store is exported again.
+    def version(self) -> str:
+        mtime = os.stat(self.paths["manifest"]).st_mtime_ns
+        return f"{self.collection_name}:{self.count()}:{mtime}"
+
+    # Return distances from dot products and squared norms, using the same
+    # distance functions as Chroma.
+    def distances_from_products(self, products, norms, query_vector):
+        if self.space == "ip":
+            return 1.0 - products
+        if self.space == "cosine":
+            denominator = np.sqrt(norms) * np.linalg.norm(query_vector)
+            denominator[denominator == 0] = 1.0
+            return 1.0 - products / denominator
+        query_norm = float(query_vector @ query_vector)
+        return np.maximum(norms + query_norm - 2.0 * products, 0.0)
+
+    # Return the distances between a query vector and a block of rows.
+    def distances(self, query_vector: np.ndarray, start: int, end: int):
+        products = self.vectors[start:end] @ query_vector
+        return self.distances_from_products(
+            products, self.norms[start:end], query_vector
+        )
+
+    # Return the distances between each query vector (a row of
+    # `query_matrix`) and the selected rows, as a matrix with one column per
+    # query vector. All query vectors are scored in one matrix product.
+    def batch_distances(self, query_matrix: np.ndarray, rows):
+        products = self.vectors[rows] @ query_matrix.T
+        norms = np.asarray(self.norms[rows])[:, None]
+        if self.space == "ip":
+            return 1.0 - products
+        if self.space == "cosine":
+            denominator = np.sqrt(norms) * np.linalg.norm(query_matrix, axis=1)
+            denominator[denominator == 0] = 1.0
+            return 1.0 - products / denominator
+        query_norms = np.einsum("ij,ij->i", query_matrix, query_matrix)
+        return np.maximum(norms + query_norms - 2.0 * products, 0.0)
+
+    # Return the approximate distances between a query vector and a block of
+    # rows, which are computed from the codes of the quantized index.
+    def approximate_distances(self, query_vector: np.ndarray, start: int, end: int):
+        quantizer, codes, norms = self.quantized_index
+        products = quantizer.dots(query_vector, np.asarray(codes[start:end]))
+        return self.distances_from_products(products, norms[start:end], query_vector)
+
+    # Return the distances between a projected query vector and a block of
+    # rows of the reduced index.
+    def reduced_distances(self, reduced_query: np.ndarray, start: int, end: int):
+        _, vectors, norms = self.reduced_index
+        products = vectors[start:end] @ reduced_query
+        return self.distances_from_products(products, norms[start:end], reduced_query)
+
+    # Return the number of rows of the quantized index whose decoded values
+    # fit in `QUANTIZED_BLOCK_BYTES`.
+    def get_quantized_block_size(self) -> int:
+        quantizer, codes, _ = self.quantized_index
+        # Product quantization gathers one float32 per subvector, and int8
+        # decodes one float32 per dimension.
+        row_bytes = 4 * max(1, int(codes.shape[1]))
+        return max(1, QUANTIZED_BLOCK_BYTES // row_bytes)
+
+    # Return the row numbers and distances of the `top_k` nearest rows.
+    def search(self, query_vector, top_k: int = 1):
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        total = self.count()
+        top_k = min(int(top_k), total)
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self.quantized_index is None and self.reduced_index is None:
+            return self.scan(query_vector, top_k, self.distances)
+        # Re-rank an oversampled candidate set with the full-precision rows.
+        candidate_count = min(top_k * self.rerank_oversample, total)
+        if self.reduced_index is not None:
+            reducer = self.reduced_index[0]
+            candidates, _ = self.scan(
+                reducer.transform(query_vector),
+                candidate_count,
+                self.reduced_distances,
+            )
+        else:
+            candidates, _ = self.scan(
+                query_vector, candidate_count, self.approximate_distances
+            )
+        candidates = np.sort(candidates)
+        products = self.vectors[candidates] @ query_vector
+        distances = self.distances_from_products(
+            products, self.norms[candidates], query_vector
+        )
+        order = np.lexsort((candidates, distances))[:top_k]
+        return candidates[order], distances[order]
+
+    # Scan all rows in blocks and return the `top_k` rows with the smallest
+    # distances, which are computed by `distance_function`.
+    def scan(self, query_vector, top_k: int, distance_function):
+        total = self.count()
+        block_size = self.block_size
+        if block_size <= 0 and distance_function == self.approximate_distances:
+            block_size = self.get_quantized_block_size()
+        if block_size <= 0:
+            block_size = total
+        best_rows = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0, dtype=np.float32)
+        for start in range(0, total, block_size):
+            end = min(start + block_size, total)
+            best_rows, best_distances = merge_top_k(
+                best_rows,
+                best_distances,
+                distance_function(query_vector, start, end),
+                start,
+                top_k,
+            )
+        order = np.lexsort((best_rows, best_distances))
+        return best_rows[order], best_distances[order]
+
+    # Return the row numbers and distances of the `top_k` nearest rows of
+    # each query vector. Without a quantized or reduced index, each block of
+    # rows is scored against all query vectors in one matrix product, so the
+    # matrix is read once for the whole batch.
+    def search_batch(self, query_vectors, top_k: int = 1) -> list[tuple]:
+        query_matrix = np.asarray(query_vectors, dtype=np.float32)
+        total = self.count()
+        top_k = min(int(top_k), total)
+        if (
+            self.quantized_index is not None
+            or self.reduced_index is not None
+            or top_k <= 0
+        ):
+            return [self.search(query_vector, top_k) for query_vector in query_matrix]
+        block_size = self.block_size if self.block_size > 0 else total
+        best = [
+            (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            for _ in range(len(query_matrix))
+        ]
+        for start in range(0, total, block_size):
+            end = min(start + block_size, total)
+            block_distances = self.batch_distances(query_matrix, slice(start, end))
+            for index, (best_rows, best_distances) in enumerate(best):
+                best[index] = merge_top_k(
+                    best_rows, best_distances, block_distances[:, index], start, top_k
+                )
+        results = []
+        for best_rows, best_distances in best:
+            order = np.lexsort((best_rows, best_distances))
+            results.append((best_rows[order], best_distances[order]))
+        return results
+
+    # Return the ids, documents, and metadata of rows in the given order.
+    def get_rows(self, rows) -> dict:
+        rows = [int(row) for row in rows]
+        entries = {}
+        if rows:
+            placeholders = ",".join("?" * len(rows))
+            with self.lock:
+                for row, entry_id, document, metadata in self.sidecar.execute(
+                    "SELECT row, id, document, metadata FROM entries "
+                    + f"WHERE row IN ({placeholders})",
+                    rows,
+                ):
+                    entries[row] = (entry_id, document, json.loads(metadata))
+        return {
+            "ids": [entries[row][0] for row in rows],
+            "documents": [entries[row][1] for row in rows],
+            "metadatas": [entries[row][2] for row in rows],
+        }
+
+    # Return the rows that match all filters, or None if there are no
+    # filters. Indexed fields are looked up in the metadata index, and other
+    # fields are compared in the metadata of each entry.
+    def filter_rows(self, filters: typing.Optional[dict]):
+        filters = normalize_filters(filters)
+        if not filters:
+            return None
+        rows = None
+        for key, value in filters.items():
+            if key == URL_PREFIX_KEY:
+                condition = get_url_prefix_condition(value)
+                if condition is None:
+                    continue
+                key, value = condition
+            with self.lock:
+                if key in INDEXED_FIELDS and self.has_metadata_index():
+                    matches = self.sidecar.execute(
+                        "SELECT row FROM metadata_index WHERE key = ? AND value = ?",
+                        (key, str(value)),
+                    ).fetchall()
+                else:
+                    matches = self.sidecar.execute(
+                        "SELECT row FROM entries "
+                        + "WHERE json_extract(metadata, ?) = ?",
+                        ('$."' + key.replace('"', "") + '"', value),
+                    ).fetchall()
+            matched_rows = {row[0] for row in matches}
+            rows = matched_rows if rows is None else rows & matched_rows
+        if rows is None:
+            return None
+        return np.array(sorted(rows), dtype=np.int64)
+
+    # Return True if the store was exported with a metadata index.
+    def has_metadata_index(self) -> bool:
+        if not hasattr(self, "metadata_index_exists"):
+            self.metadata_index_exists = (
+                self.sidecar.execute(
+                    "SELECT name FROM sqlite_master "
+                    + "WHERE type = 'table' AND name = 'metadata_index'"
+                ).fetchone()
+                is not None
+            )
+        return self.metadata_index_exists
+
+    # Return the row numbers and distances of the `top_k` nearest rows among
+    # the given rows, which are scored with the full-precision vectors.
+    def search_rows(self, query_vector, rows, top_k: int = 1):
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        if len(rows) == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        products = self.vectors[rows] @ query_vector
+        distances = self.distances_from_products(
+            products, self.norms[rows], query_vector
+        )
+        order = np.lexsort((rows, distances))[: int(top_k)]
+        return rows[order], distances[order]
+
+    # Return the full-precision vectors of rows, or None if they are not
+    # requested.
+    def get_embeddings(self, rows, include_embeddings: bool = False):
+        if not include_embeddings:
+            return None
+        return np.asarray(self.vectors[np.asarray(rows, dtype=np.int64)])
+
+    def query_by_embedding(
+        self,
+        query_vector,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        allowed_rows = self.filter_rows(filters)
+        if allowed_rows is None:
+            rows, distances = self.search(query_vector, top_k)
+        else:
+            rows, distances = self.search_rows(query_vector, allowed_rows, top_k)
+        entries = self.get_rows(rows)
+        return build_query_result(
+            entries,
+            distances,
+            filters,
+            embeddings=self.get_embeddings(rows, include_embeddings),
+        )
+
+    def query(
+        self,
+        text: str,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ):
+        return self.query_by_embedding(
+            self.embed(text),
+            top_k,
+            filters=filters,
+            include_embeddings=include_embeddings,
+        )
+
+    # Query with many texts at once. The texts are embedded in one call to
+    # the embedding function. Returns one result per text, in the order of
+    # the texts.
+    def query_batch(
+        self,
+        texts: list[str],
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> list[ChromaQueryResultEnhanced]:
+        if len(texts) == 0:
+            return []
+        return self.query_batch_by_embedding(
+            self.embedding_function(list(texts)),
+            top_k,
+            filters=filters,
+            include_embeddings=include_embeddings,
+        )
+
+    # Search all query vectors together, and read the entries of all results
+    # from the sidecar in a single query.
+    def query_batch_by_embedding(
+        self,
+        query_vectors,
+        top_k: int = 1,
+        filters: typing.Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> list[ChromaQueryResultEnhanced]:
+        if len(query_vectors) == 0:
+            return []
+        query_matrix = np.asarray(query_vectors, dtype=np.float32)
+        allowed_rows = self.filter_rows(filters)
+        if allowed_rows is None:
+            searches = self.search_batch(query_matrix, top_k)
+        elif len(allowed_rows) == 0 or top_k <= 0:
+            searches = [
+                (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+                for _ in range(len(query_matrix))
+            ]
+        else:
+            distances = self.batch_distances(query_matrix, allowed_rows)
+            searches = []
+            for index in range(len(query_matrix)):
+                order = np.lexsort((allowed_rows, distances[:, index]))[: int(top_k)]
+                searches.append((allowed_rows[order], distances[order, index]))
+        unique_rows = sorted({int(row) for rows, _ in searches for row in rows})
+        all_entries = self.get_rows(unique_rows)
+        entries_by_row = {
+            row: (entry_id, document, metadata)
+            for row, entry_id, document, metadata in zip(
+                unique_rows,
+                all_entries["ids"],
+                all_entries["documents"],
+                all_entries["metadatas"],
+            )
+        }
+        results = []
+        for rows, distances in searches:
+            entries = [entries_by_row[int(row)] for row in rows]
+            results.append(
+                build_query_result(
+                    {
+                        "ids": [entry[0] for entry in entries],
+                        "documents": [entry[1] for entry in entries],
+                        "metadatas": [entry[2] for entry in entries],
+                    },
+                    distances,
+                    filters,
+                    embeddings=self.get_embeddings(rows, include_embeddings),
+                )
+            )
+        return results
+
+    # Return the entries and aliases of the pages in `origin_uuids` in the
+    # format of a Chroma `get` result.
+    def get_page_entries(self, origin_uuids: list[str]) -> dict:
+        placeholders = ", ".join("?" for _ in origin_uuids)
+        with self.lock:
+            rows = self.sidecar.execute(
+                "SELECT id, document, metadata FROM entries "
+                + f"WHERE origin_uuid IN ({placeholders}) ORDER BY row",
+                origin_uuids,
+            ).fetchall()
+            if self.has_aliases:
+                rows += self.sidecar.execute(
+                    "SELECT id, document, metadata FROM aliases "
+                    + f"WHERE origin_uuid IN ({placeholders}) ORDER BY id",
+                    origin_uuids,
+                ).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows],
+            "metadatas": [json.loads(row[2]) for row in rows],
+        }
+
+    # Return a FullPage (list of Section) that match an origin_uuid
+    def getPageOriginUUIDList(self, origin_uuid):
+        get_obj = ChromaDBGet(self.get_page_entries([str(origin_uuid)]))
+        return build_full_page(get_obj)
+
+    # Return a dictionary of FullPage objects for a list of origin_uuids,
+    # which are fetched in a single query
+    def getPagesOriginUUIDList(self, origin_uuids: list[str]) -> dict:
+        origin_uuids = [str(origin_uuid) for origin_uuid in dict.fromkeys(origin_uuids)]
+        if len(origin_uuids) == 0:
+            return {}
+        get_obj = ChromaDBGet(self.get_page_entries(origin_uuids))
+        return build_full_pages(get_obj)
+
+    def getPageSection(self, section_title):
+        ids = []
+        metadatas = []
+        with self.lock:
+            for entry_id, metadata in self.sidecar.execute(
+                "SELECT id, metadata FROM entries ORDER BY row"
+            ):
+                metadata = json.loads(metadata)
+                if metadata.get("section_title", None) == section_title:
+                    ids.append(entry_id)
+                    metadatas.append(metadata)
+        return {"ids": ids, "metadatas": metadatas}
+
+    def embed(self, text: str):
+        return self.embedding_function([text])[0]
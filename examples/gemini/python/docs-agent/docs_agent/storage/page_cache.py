@@ -0,0 +1,89 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""In-process LRU cache of pages rebuilt from a vector database"""
+
+from collections import OrderedDict
+import threading
+import typing
+
+from docs_agent.postprocess.docs_retriever import FullPage
+
+
+class PageCache:
+    """A thread-safe LRU of FullPage objects keyed by (version, origin_uuid).
+
+    The version is the fingerprint of the collection that a page was built
+    from, so pages of a modified collection are never returned. Callers must
+    copy a page before building sections from it.
+    """
+
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max(0, int(max_size))
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version: str, origin_uuid: str) -> typing.Optional[FullPage]:
+        with self.lock:
+            page = self.pages.get((version, origin_uuid))
+            if page is None:
+                self.misses += 1
+                return None
+            self.pages.move_to_end((version, origin_uuid))
+            self.hits += 1
+            return page
+
+    def put(self, version: str, origin_uuid: str, page: FullPage):
+        if self.max_size == 0:
+            return
+        with self.lock:
+            self.pages[(version, origin_uuid)] = page
+            self.pages.move_to_end((version, origin_uuid))
+            while len(self.pages) > self.max_size:
+                self.pages.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_rate = 0.0
+            if lookups > 0:
+                hit_rate = self.hits / lookups
+            return {
+                "size": len(self.pages),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": hit_rate,
+            }
+
+
+# The page cache shared by all agents in a process.
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+# Return the process-wide page cache, which grows to the largest
+# configured size.
+def get_page_cache(max_size: int = 256) -> PageCache:
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache(max_size=max_size)
+        with _page_cache.lock:
+            _page_cache.max_size = max(_page_cache.max_size, int(max_size))
+        return _page_cache
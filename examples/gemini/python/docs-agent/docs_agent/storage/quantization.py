@@ -0,0 +1,229 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Scalar (int8) and product quantization of embeddings"""
+
+import os
+
+from absl import logging
+import numpy as np
+
+# The supported values of the `quantization` field.
+QUANTIZATIONS = ["int8", "pq"]
+
+
+# Train k-means centroids with Lloyd's algorithm.
+def train_kmeans(
+    data: np.ndarray, k: int, iterations: int = 20, seed: int = 0
+) -> np.ndarray:
+    generator = np.random.RandomState(seed)
+    k = min(k, len(data))
+    centroids = data[generator.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_to_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k)
+        # Keep the previous position of centroids without any members.
+        has_members = counts > 0
+        centroids[has_members] = sums[has_members] / counts[has_members, None]
+    return centroids
+
+
+# Return the index of the nearest centroid of each row.
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    distances = centroid_norms[None, :] - 2.0 * (data @ centroids.T)
+    return distances.argmin(axis=1)
+
+
+class ScalarQuantizer:
+    """Quantizes each dimension to 8 bits between its minimum and maximum."""
+
+    name = "int8"
+
+    def __init__(self, offset=None, scale=None) -> None:
+        self.offset = offset
+        self.scale = scale
+
+    def train(self, vectors: np.ndarray):
+        self.offset = vectors.min(axis=0).astype(np.float32)
+        self.scale = ((vectors.max(axis=0) - self.offset) / 255.0).astype(np.float32)
+        self.scale[self.scale == 0] = 1.0
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.offset + codes.astype(np.float32) * self.scale
+
+    # Return the dot products between a query and the decoded rows.
+    def dots(self, query_vector: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        return float(query_vector @ self.offset) + codes @ (query_vector * self.scale)
+
+    def params(self) -> dict:
+        return {"offset": self.offset, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """Splits vectors into subvectors and quantizes each subvector to one of
+    256 centroids. Distances to a query are computed asymmetrically (ADC),
+    using the full-precision query and a lookup table per subvector.
+    """
+
+    name = "pq"
+
+    def __init__(self, subvectors: int = 0, codebooks=None) -> None:
+        self.subvectors = int(subvectors)
+        self.codebooks = codebooks
+
+    def train(self, vectors: np.ndarray, sample_size: int = 65536, seed: int = 0):
+        dimension = vectors.shape[1]
+        if self.subvectors <= 0 or dimension % self.subvectors != 0:
+            # Use subvectors of 8 dimensions (or the largest divisor below 8).
+            sub_dimension = max(d for d in range(1, 9) if dimension % d == 0)
+            self.subvectors = dimension // sub_dimension
+        sub_dimension = dimension // self.subvectors
+        generator = np.random.RandomState(seed)
+        if len(vectors) > sample_size:
+            sample = vectors[np.sort(generator.choice(len(vectors), sample_size))]
+        else:
+            sample = np.asarray(vectors)
+        codebooks = []
+        for m in range(self.subvectors):
+            subvectors = sample[:, m * sub_dimension : (m + 1) * sub_dimension]
+            centroids = train_kmeans(subvectors, 256, seed=seed + m)
+            # Pad the codebook if there are fewer than 256 rows.
+            padded = np.zeros((256, sub_dimension), dtype=np.float32)
+            padded[: len(centroids)] = centroids
+            codebooks.append(padded)
+        self.codebooks = np.stack(codebooks).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_dimension = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for m in range(self.subvectors):
+            subvectors = vectors[:, m * sub_dimension : (m + 1) * sub_dimension]
+            codes[:, m] = assign_to_centroids(subvectors, self.codebooks[m])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.codebooks[m][codes[:, m]] for m in range(self.subvectors)]
+        return np.concatenate(parts, axis=1)
+
+    # Return the dot products between a query and the decoded rows using
+    # a lookup table of the dot products between subvectors and centroids.
+    def dots(self, query_vector: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        sub_query = query_vector.reshape(self.subvectors, -1)
+        table = np.einsum("mkd,md->mk", self.codebooks, sub_query)
+        return table[np.arange(self.subvectors)[None, :], codes].sum(axis=1)
+
+    def params(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+
+# Return the paths of the files of a quantized index.
+def get_quantized_paths(base_path: str, quantization: str) -> dict:
+    return {
+        "codes": f"{base_path}.{quantization}.codes.npy",
+        "params": f"{base_path}.{quantization}.params.npz",
+    }
+
+
+# Train a quantizer on a (memory-mapped) float32 matrix and write the codes
+# and the quantizer parameters next to it.
+def build_quantized_index(
+    vectors: np.ndarray,
+    base_path: str,
+    quantization: str,
+    pq_subvectors: int = 0,
+    block_size: int = 65536,
+):
+    if quantization == "int8":
+        quantizer = ScalarQuantizer()
+    elif quantization == "pq":
+        quantizer = ProductQuantizer(subvectors=pq_subvectors)
+    else:
+        raise ValueError(f"Unsupported quantization: {quantization}")
+    paths = get_quantized_paths(base_path, quantization)
+    temp_paths = {key: value + ".tmp" for key, value in paths.items()}
+    quantizer.train(vectors)
+    code_width = vectors.shape[1]
+    if quantization == "pq":
+        code_width = quantizer.subvectors
+    codes = np.lib.format.open_memmap(
+        temp_paths["codes"], mode="w+", dtype=np.uint8, shape=(len(vectors), code_width)
+    )
+    # Squared norms of the decoded rows, which are used to compute distances.
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block_size):
+        block_codes = quantizer.encode(np.asarray(vectors[start : start + block_size]))
+        codes[start : start + len(block_codes)] = block_codes
+        decoded = quantizer.decode(block_codes)
+        norms[start : start + len(block_codes)] = np.einsum(
+            "ij,ij->i", decoded, decoded
+        )
+    codes.flush()
+    del codes
+    with open(temp_paths["params"], "wb") as params_file:
+        np.savez(params_file, norms=norms, **quantizer.params())
+        params_file.close()
+    for key in ["codes", "params"]:
+        os.replace(temp_paths[key], paths[key])
+    logging.info(f"Built a {quantization} index of {len(vectors)} rows at {base_path}")
+    return paths
+
+
+# Load a quantizer, its (memory-mapped) codes, and the squared norms of
+# the decoded rows. Returns None if the index is not built, or if `rows` is
+# set and the index has a different number of rows (for example, if the
+# store was exported again without it).
+def load_quantized_index(base_path: str, quantization: str, rows=None):
+    paths = get_quantized_paths(base_path, quantization)
+    if not os.path.isfile(paths["params"]) or not os.path.isfile(paths["codes"]):
+        return None
+    with np.load(paths["params"]) as params:
+        norms = params["norms"]
+        if quantization == "int8":
+            quantizer = ScalarQuantizer(offset=params["offset"], scale=params["scale"])
+        else:
+            codebooks = params["codebooks"]
+            quantizer = ProductQuantizer(
+                subvectors=codebooks.shape[0], codebooks=codebooks
+            )
+    codes = np.load(paths["codes"], mmap_mode="r")
+    if rows is not None and (codes.shape[0] != rows or len(norms) != rows):
+        logging.warning(
+            f"The {quantization} index at {base_path} has {codes.shape[0]} rows, "
+            + f"but the store has {rows} rows."
+        )
+        return None
+    return quantizer, codes, norms
+
+
+# Return the size in bytes of the files of a quantized index.
+def get_quantized_index_size(base_path: str, quantization: str) -> int:
+    paths = get_quantized_paths(base_path, quantization)
+    return sum(os.path.getsize(path) for path in paths.values() if os.path.isfile(path))
+
+
+# Delete the files of a quantized index, if any.
+def remove_quantized_index(base_path: str, quantization: str):
+    for path in get_quantized_paths(base_path, quantization).values():
+        if os.path.isfile(path):
+            os.remove(path)
+            logging.info(f"Deleted the stale {quantization} index file {path}")
@@ -0,0 +1,210 @@
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Dimensionality reduction (PCA and random projection) of embeddings"""
+
+import glob
+import os
+
+from absl import logging
+import numpy as np
+
+# The supported values of the `reduction` field.
+REDUCTIONS = ["pca", "random_projection"]
+
+
+class PCAReducer:
+    """Projects vectors onto the principal components of a sample of rows.
+
+    The components are the directions of largest variance of the centered
+    sample. Vectors are projected without subtracting the mean, so distances
+    and dot products between projected vectors keep the same scale as the
+    original ones.
+    """
+
+    name = "pca"
+
+    def __init__(self, dimension: int = 0, components=None) -> None:
+        self.dimension = int(dimension)
+        self.components = components
+
+    def train(self, vectors: np.ndarray, sample_size: int = 65536, seed: int = 0):
+        sample = get_sample(vectors, sample_size, seed).astype(np.float64)
+        sample -= sample.mean(axis=0)
+        covariance = sample.T @ sample / max(len(sample) - 1, 1)
+        # Eigenvalues are in ascending order, so the largest ones are last.
+        _, eigenvectors = np.linalg.eigh(covariance)
+        self.dimension = min(self.dimension, eigenvectors.shape[1])
+        self.components = eigenvectors[:, ::-1][:, : self.dimension].T.astype(
+            np.float32
+        )
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32) @ self.components.T
+
+    def params(self) -> dict:
+        return {"components": self.components}
+
+
+class RandomProjectionReducer:
+    """Projects vectors with a random Gaussian matrix.
+
+    The matrix is scaled so that distances between projected vectors are
+    the same as the original ones on average (Johnson-Lindenstrauss). It
+    needs no training data, but keeps less of the structure of the vectors
+    than PCA at the same dimension.
+    """
+
+    name = "random_projection"
+
+    def __init__(self, dimension: int = 0, components=None) -> None:
+        self.dimension = int(dimension)
+        self.components = components
+
+    def train(self, vectors: np.ndarray, seed: int = 0):
+        generator = np.random.RandomState(seed)
+        components = generator.standard_normal((self.dimension, vectors.shape[1]))
+        self.components = (components / np.sqrt(self.dimension)).astype(np.float32)
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32) @ self.components.T
+
+    def params(self) -> dict:
+        return {"components": self.components}
+
+
+# Return a random sample of rows, which are read in row order.
+def get_sample(vectors: np.ndarray, sample_size: int, seed: int = 0) -> np.ndarray:
+    if len(vectors) <= sample_size:
+        return np.asarray(vectors)
+    generator = np.random.RandomState(seed)
+    rows = np.sort(generator.choice(len(vectors), sample_size, replace=False))
+    return np.asarray(vectors[rows])
+
+
+# Return a reducer without trained parameters.
+def get_reducer(reduction: str, dimension: int):
+    if reduction == "pca":
+        return PCAReducer(dimension=dimension)
+    if reduction == "random_projection":
+        return RandomProjectionReducer(dimension=dimension)
+    raise ValueError(f"Unsupported reduction: {reduction}")
+
+
+# Return the paths of the files of a reduced index.
+def get_reduced_paths(base_path: str, reduction: str, dimension: int) -> dict:
+    return {
+        "vectors": f"{base_path}.{reduction}{int(dimension)}.vectors.npy",
+        "params": f"{base_path}.{reduction}{int(dimension)}.params.npz",
+    }
+
+
+# Fit a reduction on a (memory-mapped) float32 matrix and write the reduced
+# rows and the projection next to it.
+def build_reduced_index(
+    vectors: np.ndarray,
+    base_path: str,
+    reduction: str,
+    dimension: int,
+    block_size: int = 65536,
+):
+    dimension = int(dimension)
+    if dimension <= 0 or dimension > vectors.shape[1]:
+        raise ValueError(
+            f"The reduced dimension must be between 1 and {vectors.shape[1]}."
+        )
+    reducer = get_reducer(reduction, dimension)
+    paths = get_reduced_paths(base_path, reduction, dimension)
+    temp_paths = {key: value + ".tmp" for key, value in paths.items()}
+    reducer.train(vectors)
+    reduced = np.lib.format.open_memmap(
+        temp_paths["vectors"],
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(vectors), reducer.dimension),
+    )
+    # Squared norms of the reduced rows, which are used to compute distances.
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block_size):
+        block = reducer.transform(vectors[start : start + block_size])
+        reduced[start : start + len(block)] = block
+        norms[start : start + len(block)] = np.einsum("ij,ij->i", block, block)
+    reduced.flush()
+    del reduced
+    with open(temp_paths["params"], "wb") as params_file:
+        np.savez(params_file, norms=norms, **reducer.params())
+        params_file.close()
+    for key in ["vectors", "params"]:
+        os.replace(temp_paths[key], paths[key])
+    logging.info(
+        f"Built a {reduction} index of {len(vectors)} rows with "
+        + f"{reducer.dimension} dimensions at {base_path}"
+    )
+    return paths
+
+
+# Load a reducer, its (memory-mapped) reduced rows, and their squared norms.
+# Returns None if the index is not built, or if `rows` is set and the index
+# has a different number of rows (for example, if the store was exported
+# again without it).
+def load_reduced_index(base_path: str, reduction: str, dimension: int, rows=None):
+    paths = get_reduced_paths(base_path, reduction, dimension)
+    if not os.path.isfile(paths["params"]) or not os.path.isfile(paths["vectors"]):
+        return None
+    with np.load(paths["params"]) as params:
+        norms = params["norms"]
+        components = params["components"]
+    reducer = get_reducer(reduction, components.shape[0])
+    reducer.components = components
+    vectors = np.load(paths["vectors"], mmap_mode="r")
+    if rows is not None and (vectors.shape[0] != rows or len(norms) != rows):
+        logging.warning(
+            f"The {reduction} index at {base_path} has {vectors.shape[0]} rows, "
+            + f"but the store has {rows} rows."
+        )
+        return None
+    return reducer, vectors, norms
+
+
+# Return the size in bytes of the files of a reduced index.
+def get_reduced_index_size(base_path: str, reduction: str, dimension: int) -> int:
+    paths = get_reduced_paths(base_path, reduction, dimension)
+    return sum(os.path.getsize(path) for path in paths.values() if os.path.isfile(path))
+
+
+# Delete the files of the reduced indexes (of any dimension) next to a
+# store, except the index of `keep_reduction` with `keep_dimension`.
+def remove_reduced_indexes(
+    base_path: str, keep_reduction: str = "none", keep_dimension: int = 0
+):
+    keep_paths = set()
+    if keep_reduction in REDUCTIONS:
+        keep_paths = set(
+            get_reduced_paths(base_path, keep_reduction, keep_dimension).values()
+        )
+    for reduction in REDUCTIONS:
+        prefix = f"{base_path}.{reduction}"
+        for path in glob.glob(glob.escape(prefix) + "*"):
+            dimension, _, extension = path[len(prefix) :].partition(".")
+            if not dimension.isdigit() or extension not in [
+                "vectors.npy",
+                "params.npz",
+            ]:
+                continue
+            if path in keep_paths:
+                continue
+            os.remove(path)
+            logging.info(f"Deleted the stale {reduction} index file {path}")
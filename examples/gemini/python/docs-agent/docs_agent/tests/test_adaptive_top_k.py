@@ -0,0 +1,141 @@
+"""Unit tests for choosing the number of search results."""
+
+import os
+import unittest
+from unittest import mock
+
+from docs_agent.agents.docs_agent import DocsAgent
+from docs_agent.postprocess.adaptive_top_k import choose_top_k
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+class Item:
+    def __init__(self, distance):
+        self.distance = distance
+
+
+def make_items(distances):
+    return [Item(distance) for distance in distances]
+
+
+class AdaptiveTopKUnitTest(unittest.TestCase):
+    def test_stops_at_a_distance_gap(self):
+        items = make_items([0.10, 0.11, 0.12, 0.30, 0.31, 0.32])
+        self.assertEqual(
+            choose_top_k(items, max_k=6, relevance_threshold=0), (3, "distance_gap")
+        )
+        # The gap is not checked before min_k results.
+        self.assertEqual(
+            choose_top_k(items, min_k=4, max_k=6, relevance_threshold=0),
+            (6, "max_k"),
+        )
+
+    def test_stops_at_the_relevance_threshold(self):
+        # The first result holds most of the relevance of all results.
+        items = make_items([0.1, 0.9, 0.95, 1.0])
+        self.assertEqual(
+            choose_top_k(items, max_k=4, distance_gap=0, relevance_threshold=0.6),
+            (1, "relevance"),
+        )
+        items = make_items([0.1, 0.2, 0.3, 0.4, 0.5])
+        self.assertEqual(
+            choose_top_k(items, max_k=5, distance_gap=0, relevance_threshold=0.8),
+            (3, "relevance"),
+        )
+
+    def test_limits(self):
+        items = make_items([0.1, 0.1, 0.1])
+        self.assertEqual(choose_top_k(items, min_k=1, max_k=10), (3, "max_k"))
+        self.assertEqual(choose_top_k([], max_k=10), (0, "no_results"))
+        # Results without a distance (lexical-only hybrid results) have no gap.
+        items = make_items([0.1, None, 0.9])
+        self.assertEqual(
+            choose_top_k(items, max_k=3, relevance_threshold=0), (3, "max_k")
+        )
+
+
+class ResultItem:
+    def __init__(self, index):
+        self.metadata = {
+            "section_id": index,
+            "origin_uuid": f"page-{index}",
+            "token_estimate": 10,
+            "md_hash": str(index),
+        }
+        self.document = f"Text of section {index}."
+        self.distance = 0.1 * index
+
+
+class QueryResult:
+    def __init__(self, count):
+        self.count = count
+
+    def returnDBObjList(self):
+        return [ResultItem(index) for index in range(self.count)]
+
+
+class AdaptiveTopKWithPackerUnitTest(unittest.TestCase):
+    def test_packer_records_the_number_of_results(self):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        product.adaptive_top_k = "True"
+        product.context_packer = "greedy"
+        with mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}):
+            with self.assertLogs(level="WARNING") as logs:
+                docs_agent = DocsAgent(config=product, init_chroma=False)
+        self.assertTrue(
+            any("adaptive_top_k is ignored" in line for line in logs.output)
+        )
+        with mock.patch.object(docs_agent, "get_full_pages", return_value={}):
+            docs_agent.query_vector_store_to_build(
+                "question",
+                token_limit=1000,
+                results_num=6,
+                max_sources=4,
+                query_result=QueryResult(6),
+            )
+        self.assertEqual(docs_agent.last_adaptive_top_k.k, 4)
+        self.assertEqual(docs_agent.last_adaptive_top_k.candidates, 6)
+        self.assertEqual(docs_agent.last_adaptive_top_k.reason, "packer")
+
+
+class AdaptiveTopKBatchUnitTest(unittest.TestCase):
+    def make_agent(self, adaptive_max_k):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        product.adaptive_top_k = "True"
+        product.adaptive_max_k = adaptive_max_k
+        product.context_packer = "none"
+        product.reranker = "none"
+        with mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}):
+            docs_agent = DocsAgent(config=product, init_chroma=False)
+        docs_agent.collection = mock.Mock()
+        return docs_agent
+
+    def get_num_returns(self, docs_agent, **kwargs):
+        docs_agent.query_vector_store_batch(["question"], **kwargs)
+        return docs_agent.collection.query_batch.call_args.args[1]
+
+    def test_batch_fetches_as_many_results_as_a_single_question(self):
+        docs_agent = self.make_agent("0")
+        self.assertEqual(self.get_num_returns(docs_agent, num_returns=5), 10)
+        self.assertEqual(
+            self.get_num_returns(docs_agent, num_returns=5, max_sources=4), 8
+        )
+        self.assertEqual(
+            self.get_num_returns(docs_agent, num_returns=5, max_sources=2), 5
+        )
+        docs_agent = self.make_agent("12")
+        self.assertEqual(self.get_num_returns(docs_agent, num_returns=5), 12)
+        # The same number of results is fetched for a single question.
+        docs_agent.collection.query.return_value = QueryResult(0)
+        with mock.patch.object(docs_agent, "get_full_pages", return_value={}):
+            docs_agent.query_vector_store_to_build(
+                "question", results_num=5, max_sources=5
+            )
+        self.assertEqual(docs_agent.collection.query.call_args.args[1], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+"""Unit tests for the semantic answer cache."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from docs_agent.agents.docs_agent import DocsAgent
+from docs_agent.postprocess.docs_retriever import SectionDistance
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+from docs_agent.storage.answer_cache import AnswerCache
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+def make_search_result():
+    section = Section(
+        id=1,
+        name_id="models",
+        page_title="Models",
+        section_title="List models",
+        level=2,
+        previous_id=0,
+        parent_tree="[0]",
+        token_count=12.0,
+        content="The list method returns all models.",
+        url="https://example.com/models",
+        origin_uuid="page1",
+    )
+    return [SectionDistance(section=section, distance=0.25)]
+
+
+class AnswerCacheUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = AnswerCache(os.path.join(self.temp_dir.name, "answers.db"))
+        self.cache.add(
+            "product|model",
+            "v1",
+            "How do I list models?",
+            [1.0, 0.0, 0.0],
+            "Call the list method.",
+            "context",
+            make_search_result(),
+        )
+
+    def tearDown(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+
+    def test_similar_question_returns_cached_answer(self):
+        answer = self.cache.lookup("product|model", "v1", [0.99, 0.1, 0.0], 0.95)
+        self.assertEqual(answer.response, "Call the list method.")
+        self.assertEqual(answer.question, "How do I list models?")
+        self.assertEqual(
+            answer.search_result[0].section.url, "https://example.com/models"
+        )
+        self.assertEqual(answer.search_result[0].distance, 0.25)
+        self.assertIsNone(
+            self.cache.lookup("product|model", "v1", [0.0, 1.0, 0.0], 0.95)
+        )
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_answers_are_scoped_and_versioned(self):
+        self.assertIsNone(self.cache.lookup("other|model", "v1", [1.0, 0.0, 0.0]))
+        self.assertIsNone(self.cache.lookup("product|model", "v2", [1.0, 0.0, 0.0]))
+        # Adding an answer of a new version deletes the answers of older versions.
+        self.cache.add(
+            "product|model", "v2", "Other question", [0.0, 1.0, 0.0], "x", "", []
+        )
+        self.assertIsNone(self.cache.lookup("product|model", "v1", [1.0, 0.0, 0.0]))
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+    def test_least_recently_used_answers_are_evicted(self):
+        self.cache.max_size = 2
+        self.cache.add(
+            "product|model", "v1", "Second question", [0.0, 1.0, 0.0], "2", "", []
+        )
+        # Using the first answer makes the second one the least recently used.
+        self.assertIsNotNone(self.cache.lookup("product|model", "v1", [1.0, 0.0, 0.0]))
+        self.cache.add(
+            "product|model", "v1", "Third question", [0.0, 0.0, 1.0], "3", "", []
+        )
+        stats = self.cache.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertIsNone(self.cache.lookup("product|model", "v1", [0.0, 1.0, 0.0]))
+        self.assertEqual(
+            self.cache.lookup("product|model", "v1", [1.0, 0.0, 0.0]).response,
+            "Call the list method.",
+        )
+        self.assertEqual(
+            self.cache.lookup("product|model", "v1", [0.0, 0.0, 1.0]).response, "3"
+        )
+
+    def test_table_without_last_used_is_upgraded(self):
+        store_path = os.path.join(self.temp_dir.name, "old_answers.db")
+        connection = sqlite3.connect(store_path)
+        connection.execute(
+            "CREATE TABLE answers (id INTEGER PRIMARY KEY, scope TEXT, version TEXT, "
+            + "question TEXT, embedding BLOB, response TEXT, context TEXT, "
+            + "search_result TEXT, created REAL)"
+        )
+        connection.commit()
+        connection.close()
+        cache = AnswerCache(store_path, max_size=1)
+        for index in range(2):
+            cache.add(
+                "scope", "v1", f"Question {index}", [1.0, float(index)], "", "", []
+            )
+        self.assertEqual(cache.stats()["size"], 1)
+        cache.close()
+
+
+class DocsAgentAnswerCacheUnitTest(unittest.TestCase):
+    def make_agent(self, threshold):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        product.answer_cache_threshold = threshold
+        with mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}):
+            return DocsAgent(config=product, init_chroma=False)
+
+    def test_threshold_is_parsed_once(self):
+        self.assertEqual(self.make_agent("0.9").answer_cache_threshold, 0.9)
+        # A missing or invalid value uses the default.
+        self.assertEqual(self.make_agent(None).answer_cache_threshold, 0.95)
+        self.assertEqual(self.make_agent("high").answer_cache_threshold, 0.95)
+
+    def test_lookup_uses_the_parsed_threshold(self):
+        agent = self.make_agent(None)
+        agent.answer_cache = mock.Mock()
+        agent.answer_cache.lookup.return_value = None
+        agent.collection = mock.Mock()
+        agent.collection_name = "docs_collection"
+        agent.collection.embedding_function.return_value = [[1.0, 0.0]]
+        agent.lookup_cached_answer("How do I list models?")
+        self.assertEqual(agent.answer_cache.lookup.call_args.kwargs["threshold"], 0.95)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Unit tests for the chatbot's JSON API."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from docs_agent.interfaces.chatbot import chatui
+from docs_agent.interfaces.chatbot import create_app
+from docs_agent.storage.answer_cache import AnswerCache
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+class ChatuiApiUnitTest(unittest.TestCase):
+    def setUp(self):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        product.db_type = "chroma"
+        patcher = mock.patch.object(chatui, "DocsAgent")
+        self.agent = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.agent.lookup_cached_answer.return_value = None
+        self.agent.query_vector_store_to_build.return_value = ([], "context")
+        self.agent.ask_content_model_with_context_prompt.return_value = (
+            "The answer.",
+            "full prompt",
+        )
+        self.client = create_app(product).test_client()
+
+    def test_ask_with_filters(self):
+        response = self.client.post(
+            "/api/ask-docs-agent",
+            json={
+                "question": "How do I list models?",
+                "filters": {
+                    "url_prefix": "https://example.com/docs/",
+                    "section_id": "2",
+                },
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["response"], "The answer.")
+        self.assertEqual(response.get_json()["full_prompt"], "full prompt")
+        self.assertFalse(response.get_json()["cached"])
+        filters = {"url_prefix": "https://example.com/docs/", "section_id": 2}
+        self.assertEqual(
+            self.agent.query_vector_store_to_build.call_args.kwargs["filters"],
+            filters,
+        )
+        self.agent.save_answer_to_cache.assert_called_once_with(
+            "How do I list models?", "The answer.", "context", [], filters
+        )
+
+    def test_filters_must_be_an_object(self):
+        response = self.client.post(
+            "/api/ask-docs-agent",
+            json={"question": "How do I list models?", "filters": ["url_prefix"]},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("filters", response.get_json()["error"])
+        self.agent.query_vector_store_to_build.assert_not_called()
+
+    def test_invalid_filter_value(self):
+        response = self.client.post(
+            "/api/ask-docs-agent",
+            json={"question": "How do I list models?", "filters": {"section_id": "a"}},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("section_id", response.get_json()["error"])
+
+    def test_second_question_is_answered_from_the_cache(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        cache = AnswerCache(os.path.join(temp_dir.name, "answers.db"))
+        self.addCleanup(cache.close)
+        self.agent.lookup_cached_answer.side_effect = (
+            lambda question, filters: cache.lookup("scope", "v1", [1.0, 0.0])
+        )
+        self.agent.save_answer_to_cache.side_effect = (
+            lambda question, response, context, search_result, filters: cache.add(
+                "scope", "v1", question, [1.0, 0.0], response, context, search_result
+            )
+        )
+        question = {"question": "How do I list models?"}
+        first = self.client.post("/api/ask-docs-agent", json=question).get_json()
+        second = self.client.post("/api/ask-docs-agent", json=question).get_json()
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["response"], "The answer.")
+        self.agent.ask_content_model_with_context_prompt.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Unit tests for the process-wide collection registry."""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import chromadb
+from chromadb.api.types import EmbeddingFunction
+
+from docs_agent.agents import docs_agent
+from docs_agent.agents.docs_agent import DocsAgent
+from docs_agent.storage.chroma import ChromaEnhanced
+from docs_agent.storage.chroma import release_chroma_client
+from docs_agent.storage.collection_registry import CollectionRegistry
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+class FakeCollection:
+    def __init__(self, versions):
+        self.versions = versions
+
+    def version(self):
+        return self.versions[0]
+
+
+class IdentityEmbedding(EmbeddingFunction):
+    def __call__(self, input):
+        return input
+
+
+class CollectionRegistryUnitTest(unittest.TestCase):
+    def test_opens_each_collection_once(self):
+        registry = CollectionRegistry()
+        versions = ["v1"]
+        opened = []
+
+        def open_collection():
+            time.sleep(0.01)
+            opened.append(FakeCollection(versions))
+            return opened[-1]
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    registry.get(("chroma", "db", "docs"), open_collection)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(all(result is opened[0] for result in results))
+        # A changed collection is opened again.
+        versions[0] = "v2"
+        reopened = []
+        collection = registry.get(
+            ("chroma", "db", "docs"), open_collection, lambda: reopened.append(True)
+        )
+        self.assertIsNot(collection, opened[0])
+        self.assertEqual(reopened, [True])
+        self.assertEqual(registry.stats()["reopens"], 1)
+        registry.invalidate("db")
+        self.assertEqual(registry.stats()["size"], 0)
+
+    def test_reopened_chroma_collection_sees_other_processes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            chroma_dir = os.path.join(temp_dir, "chroma")
+            client = chromadb.PersistentClient(path=chroma_dir)
+            client.create_collection("docs").add(
+                ids=["a"], embeddings=[[1.0, 0.0]], documents=["a"]
+            )
+            registry = CollectionRegistry()
+
+            def open_collection():
+                return ChromaEnhanced(chroma_dir).get_collection(
+                    "docs", embedding_function=IdentityEmbedding()
+                )
+
+            def get_collection():
+                return registry.get(
+                    ("chroma", chroma_dir, "docs"),
+                    open_collection,
+                    on_reopen=lambda: release_chroma_client(chroma_dir),
+                )
+
+            collection = get_collection()
+            self.assertEqual(
+                collection.query_by_embedding([0.0, 1.0], 1).result["ids"], [["a"]]
+            )
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import chromadb; chromadb.PersistentClient(path=%r)"
+                    ".get_collection('docs').add(ids=['b'], embeddings=[[0.0, 1.0]], "
+                    "documents=['b'])" % chroma_dir,
+                ],
+                check=True,
+            )
+            collection = get_collection()
+            self.assertEqual(
+                collection.query_by_embedding([0.0, 1.0], 1).result["ids"], [["b"]]
+            )
+
+    def test_agents_with_different_search_ef_use_different_entries(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            chroma_dir = os.path.join(temp_dir, "chroma")
+            client = chromadb.PersistentClient(path=chroma_dir)
+            client.create_collection("docs_collection").add(
+                ids=["a"], embeddings=[[1.0, 0.0]], documents=["a"]
+            )
+            registry = CollectionRegistry()
+
+            @mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "test"})
+            def make_agent(search_ef):
+                config_path = os.path.join(get_project_path(), "config.yaml")
+                product = ReadConfig(config_path).returnProducts().products[0]
+                product.db_type = "chroma"
+                product.db_configs = [
+                    item for item in product.db_configs if "chroma" in item.db_type
+                ]
+                product.db_configs[0].vector_db_dir = chroma_dir
+                product.db_configs[0].hnsw_search_ef = search_ef
+                with mock.patch.object(
+                    docs_agent, "get_collection_registry", return_value=registry
+                ):
+                    return DocsAgent(config=product)
+
+            agent_50 = make_agent(50)
+            self.assertIs(make_agent(50).collection, agent_50.collection)
+            with self.assertLogs(level="WARNING") as logs:
+                agent_100 = make_agent(100)
+            self.assertIsNot(agent_100.collection, agent_50.collection)
+            self.assertTrue(any("hnsw:search_ef=50" in line for line in logs.output))
+            self.assertEqual(registry.stats()["opens"], 2)
+            release_chroma_client(chroma_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
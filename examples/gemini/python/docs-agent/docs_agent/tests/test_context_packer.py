@@ -0,0 +1,81 @@
+"""Unit tests for packing sections into a token budget."""
+
+import unittest
+
+from docs_agent.postprocess.context_packer import TokenCostCache
+from docs_agent.postprocess.context_packer import pack_context
+from docs_agent.postprocess.docs_retriever import FullPage
+from docs_agent.postprocess.docs_retriever import SectionDistance
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+
+
+# A page with the headings: # 1, ## 2, ### 3, ## 4
+PARENT_TREES = {1: "0", 2: "0.1", 3: "0.1.2", 4: "0.1"}
+
+
+def make_section(section_id, words):
+    return Section(
+        id=section_id,
+        name_id=f"s{section_id}",
+        page_title="Page",
+        section_title=f"Section {section_id}",
+        level=len(PARENT_TREES[section_id].split(".")),
+        previous_id=section_id - 1,
+        parent_tree=PARENT_TREES[section_id],
+        token_count=0.0,
+        content=" ".join(["word"] * words),
+        origin_uuid="page",
+    )
+
+
+class ContextPackerUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.page = FullPage([make_section(i, 40 * i) for i in PARENT_TREES])
+        self.search_result = [
+            SectionDistance(section=make_section(2, 80), distance=0.1),
+            SectionDistance(section=make_section(4, 160), distance=0.9),
+        ]
+
+    def test_packed_context_fits_the_budget(self):
+        for strategy in ["greedy", "knapsack"]:
+            for token_limit in [50, 200, 400, 10000]:
+                packed = pack_context(
+                    search_result=self.search_result,
+                    full_pages={"page": self.page},
+                    token_limit=token_limit,
+                    strategy=strategy,
+                )
+                self.assertLessEqual(packed.used_tokens(), token_limit)
+                # Sections found from both results are only considered once.
+                self.assertEqual(len(packed.items), 4)
+                self.assertIn(strategy, packed.debug_view())
+            self.assertEqual(len(packed.included_items()), 4)
+            context = packed.build_context()
+            self.assertTrue(context.startswith("The section titled Section 1"))
+
+    def test_most_relevant_hit_is_included_first(self):
+        packed = pack_context(
+            search_result=self.search_result,
+            full_pages={"page": self.page},
+            token_limit=300,
+            strategy="greedy",
+            include_neighbors=False,
+        )
+        included = [item.section.id for item in packed.included_items()]
+        self.assertEqual(included, [2])
+        self.assertEqual(self.page.section_list[1].content, " ".join(["word"] * 80))
+
+    def test_token_costs_are_cached(self):
+        cache = TokenCostCache(max_size=2)
+        section = self.page.section_list[0]
+        cost = cache.get_cost(section)
+        self.assertEqual(cache.get_cost(section), cost)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            pack_context(self.search_result, {"page": self.page}, 100, strategy="x")
+
+
+if __name__ == "__main__":
+    unittest.main()
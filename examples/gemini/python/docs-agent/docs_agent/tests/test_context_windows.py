@@ -0,0 +1,102 @@
+"""Unit tests for precomputed context windows."""
+
+import os
+import tempfile
+import unittest
+
+import chromadb
+
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.context_windows import ContextWindowStore
+from docs_agent.storage.context_windows import ContextWindowsNotFoundError
+from docs_agent.storage.context_windows import build_context_windows_from_chroma
+
+
+# (section_id, parent_tree, number of words) of the sections of a page
+PAGE_SECTIONS = [
+    (1, "0", 40),
+    (2, "0.1", 120),
+    (3, "0.1", 30),
+    (4, "0.1.3", 200),
+    (5, "0.1.3", 10),
+    (6, "0.1", 60),
+    (7, "0", 80),
+]
+
+
+def add_pages(collection, origin_uuids):
+    for origin_uuid in origin_uuids:
+        ids, documents, metadatas = [], [], []
+        for section_id, parent_tree, words in PAGE_SECTIONS:
+            text = " ".join(f"word{index}" for index in range(words))
+            ids.append(f"{origin_uuid}-{section_id}")
+            documents.append(text)
+            metadatas.append(
+                {
+                    "section_id": section_id,
+                    "name_id": f"s{section_id}",
+                    "page_title": origin_uuid,
+                    "section_title": f"Section {section_id}",
+                    "level": parent_tree.count(".") + 1,
+                    "previous_id": section_id - 1,
+                    "parent_tree": parent_tree,
+                    "token_estimate": float(len(text) // 4),
+                    "url": f"https://example.com/{origin_uuid}#s{section_id}",
+                    "origin_uuid": origin_uuid,
+                }
+            )
+        collection.add(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=[[float(index), 1.0] for index in range(len(ids))],
+        )
+
+
+class ContextWindowsUnitTest(unittest.TestCase):
+    def test_windows_match_pages(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            chroma_dir = os.path.join(temp_dir, "chroma")
+            collection = chromadb.PersistentClient(path=chroma_dir).create_collection(
+                "docs"
+            )
+            add_pages(collection, ["page_a", "page_b"])
+            with self.assertRaises(ContextWindowsNotFoundError):
+                ContextWindowStore(chroma_dir + "_contexts", "docs")
+            stats = build_context_windows_from_chroma(chroma_dir, "docs")
+            self.assertEqual(stats["windows"], 14)
+            self.assertGreater(stats["store_bytes"], 0)
+            store = ContextWindowStore(chroma_dir + "_contexts", "docs")
+            pages = ChromaCollectionEnhanced(collection, None).getPagesOriginUUIDList(
+                ["page_a", "page_b"]
+            )
+            keys = [("page_a", section_id) for section_id, _, _ in PAGE_SECTIONS]
+            windows = store.get_windows(keys + [("page_a", 99), ("page_c", 1)])
+            # Sections that are not stored have no window.
+            self.assertEqual(sorted(windows.keys()), sorted(keys))
+            for origin_uuid, section_id in keys:
+                for token_limit in [0, 20, 100, 250, float("inf")]:
+                    for related in [True, False]:
+                        expected = pages[origin_uuid].buildSections(
+                            section_id=section_id,
+                            selfSection=True,
+                            children=related,
+                            parent=related,
+                            siblings=related,
+                            token_limit=token_limit,
+                        )
+                        actual = windows[(origin_uuid, section_id)].buildSections(
+                            selfSection=True,
+                            children=related,
+                            parent=related,
+                            siblings=related,
+                            token_limit=token_limit,
+                        )
+                        self.assertEqual(
+                            [(item.id, item.content) for item in actual.section_list],
+                            [(item.id, item.content) for item in expected.section_list],
+                        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Unit tests for diversifying search results."""
+
+import os
+import tempfile
+import unittest
+
+import chromadb
+import numpy as np
+
+from docs_agent.postprocess.diversify import diversify_results
+from docs_agent.postprocess.diversify import maximal_marginal_relevance
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.numpy_store import NumpyCollection
+from docs_agent.storage.numpy_store import export_chroma_to_numpy
+
+
+class Item:
+    def __init__(self, id, distance, embedding, origin_uuid, md_hash=None):
+        self.id = id
+        self.distance = distance
+        self.embedding = embedding
+        self.metadata = {"origin_uuid": origin_uuid, "md_hash": md_hash}
+
+
+class DiversifyUnitTest(unittest.TestCase):
+    def test_maximal_marginal_relevance(self):
+        relevance = np.array([1.0, 0.9, 0.5])
+        # The first two results are near copies, the third is different.
+        similarities = np.array([[1.0, 0.95, 0.0], [0.95, 1.0, 0.0], [0.0, 0.0, 1.0]])
+        self.assertEqual(
+            maximal_marginal_relevance(relevance, similarities, 1.0), [0, 1, 2]
+        )
+        self.assertEqual(
+            maximal_marginal_relevance(relevance, similarities, 0.5), [0, 2, 1]
+        )
+
+    def test_mmr_moves_siblings_and_copies_back(self):
+        items = [
+            Item("a1", 0.1, [1.0, 0.0, 0.0], "a", "h1"),
+            Item("a2", 0.2, [0.9, 0.1, 0.0], "a", "h2"),
+            Item("b1", 0.3, [1.0, 0.0, 0.0], "b", "h1"),
+            Item("c1", 0.4, [0.0, 1.0, 0.0], "c", "h3"),
+        ]
+        ordered = diversify_results(items, mode="mmr", lambda_mult=0.5)
+        self.assertEqual([item.id for item in ordered], ["a1", "c1", "a2", "b1"])
+        ordered = diversify_results(items, mode="page")
+        self.assertEqual([item.id for item in ordered], ["a1", "c1", "a2", "b1"])
+        ordered = diversify_results(items, mode="none")
+        self.assertEqual([item.id for item in ordered], ["a1", "a2", "b1", "c1"])
+
+    def test_queries_include_stored_embeddings(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            chroma_dir = os.path.join(temp_dir, "chroma")
+            embeddings = np.random.RandomState(0).rand(20, 4).tolist()
+            client = chromadb.PersistentClient(path=chroma_dir)
+            collection = client.create_collection(name="docs")
+            collection.add(
+                ids=[f"id{i}" for i in range(20)],
+                embeddings=embeddings,
+                documents=[f"text {i}" for i in range(20)],
+                metadatas=[{"origin_uuid": f"page{i % 4}"} for i in range(20)],
+            )
+            numpy_dir = os.path.join(temp_dir, "numpy")
+            export_chroma_to_numpy(chroma_dir, "docs", numpy_dir)
+            for store in [
+                ChromaCollectionEnhanced(collection, None),
+                NumpyCollection(numpy_dir, "docs"),
+            ]:
+                result = store.query_by_embedding(embeddings[0], 3).result
+                self.assertIsNone(result["embeddings"])
+                items = store.query_by_embedding(
+                    embeddings[0], 3, include_embeddings=True
+                ).returnDBObjList()
+                self.assertEqual(items[0].id, "id0")
+                np.testing.assert_allclose(items[0].embedding, embeddings[0], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Unit tests for rebuilding pages from sections."""
+
+import sys
+import threading
+import unittest
+
+from docs_agent.postprocess.docs_retriever import FullPage
+from docs_agent.preprocess.splitters.markdown_splitter import Section
+from docs_agent.preprocess.splitters.markdown_splitter import encode_parent_tree
+from docs_agent.preprocess.splitters.markdown_splitter import parse_parent_tree
+
+
+# A page with the headings: # 1, ## 2, ### 3, ### 4, ## 5, ### 6
+PARENT_TREES = {
+    1: "[0]",
+    2: "[0, 1]",
+    3: "[0, 1, 2]",
+    4: "[0, 1, 2]",
+    5: "[0, 1]",
+    6: [0, 1, 5],
+}
+
+
+def make_page():
+    sections = []
+    for section_id, parent_tree in PARENT_TREES.items():
+        sections.append(
+            Section(
+                id=section_id,
+                name_id=f"s{section_id}",
+                page_title="Page",
+                section_title=f"Section {section_id}",
+                level=len(parse_parent_tree(parent_tree)),
+                previous_id=section_id - 1,
+                parent_tree=parent_tree,
+                token_count=10.0,
+                content=f"Content {section_id}",
+            )
+        )
+    return FullPage(sections)
+
+
+class DocsRetrieverUnitTest(unittest.TestCase):
+    def test_parse_parent_tree(self):
+        self.assertEqual(parse_parent_tree("[0, 1, 2]"), (0, 1, 2))
+        self.assertEqual(parse_parent_tree([0, 1]), (0, 1))
+        self.assertEqual(parse_parent_tree("[]"), ())
+        self.assertEqual(parse_parent_tree(None), ())
+        self.assertEqual(parse_parent_tree("0.1.2"), (0, 1, 2))
+        self.assertEqual(parse_parent_tree("0"), (0,))
+        self.assertEqual(parse_parent_tree(""), ())
+        with self.assertRaises(ValueError):
+            parse_parent_tree("__import__('os')")
+
+    def test_encode_parent_tree(self):
+        self.assertEqual(encode_parent_tree([0, 1, 5]), "0.1.5")
+        self.assertEqual(encode_parent_tree("[0, 1, 5]"), "0.1.5")
+        self.assertEqual(encode_parent_tree([]), "")
+        for parent_tree in PARENT_TREES.values():
+            encoded = encode_parent_tree(parent_tree)
+            self.assertEqual(parse_parent_tree(encoded), parse_parent_tree(parent_tree))
+        section = make_page().section_list[2]
+        metadata = section.encodeToChromaDBNoContent()
+        self.assertEqual(metadata["parent_tree"], "0.1.2")
+
+    def test_build_sections_uses_the_section_tree(self):
+        page = make_page()
+        built = page.buildSections(
+            section_id=2, children=True, parent=True, siblings=True
+        )
+        self.assertEqual([item.id for item in built.section_list], [1, 2, 3, 4, 5])
+        self.assertIsNone(page.returnSelfSection(section_id=9))
+        self.assertEqual([item.id for item in page.returnSectionsAtLevel(3)], [3, 4, 6])
+
+    def test_lookups_from_many_threads(self):
+        sections = [
+            Section(
+                id=section_id,
+                name_id=f"s{section_id}",
+                page_title="Page",
+                section_title=f"Section {section_id}",
+                level=2,
+                previous_id=section_id - 1,
+                parent_tree="[0, 1]",
+                token_count=10.0,
+                content=f"Content {section_id}",
+            )
+            for section_id in range(1, 5001)
+        ]
+        page = FullPage(sections)
+        barrier = threading.Barrier(8)
+        results = []
+
+        def lookup():
+            barrier.wait()
+            for _ in range(20):
+                results.append(page.returnSectionById(4999))
+
+        # Switch threads often, so that lookups run while the tables are built.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=lookup) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(len(results), 160)
+        self.assertTrue(all(item is not None and item.id == 4999 for item in results))
+
+    def test_copy_keeps_the_original_page_unchanged(self):
+        page = make_page()
+        page.copy().buildSections(section_id=3, siblings=True)
+        self.assertEqual(page.section_list[2].content, "Content 3")
+
+    def test_sections_are_immutable(self):
+        page = make_page()
+        section = page.section_list[0]
+        with self.assertRaises(AttributeError):
+            section.content = "Changed"
+        # A section that is both a parent and a sibling is templated once.
+        page.buildSections(section_id=3, parent=True, siblings=True)
+        built = page.buildSections(section_id=2, parent=True, siblings=True)
+        self.assertEqual(built.section_list[0].content.count("Content 1"), 1)
+        self.assertEqual(built.section_list[0].content.count("The section titled"), 1)
+        self.assertEqual(section.content, "Content 1")
+        templated = section.updateContentTemplate()
+        self.assertIs(templated.updateContentTemplate(), templated)
+        self.assertEqual(templated.rendered_content, templated.content)
+
+    def test_replace_and_serialize(self):
+        section = make_page().section_list[1]
+        changed = section.replace(url="https://example.com/page")
+        self.assertEqual(changed.url, "https://example.com/page")
+        self.assertIsNone(section.url)
+        self.assertEqual(changed.parent_ids, (0, 1))
+        with self.assertRaises(TypeError):
+            section.replace(title="Page")
+        restored = Section.from_dict(changed.to_dict())
+        self.assertEqual(restored.to_tuple(), changed.to_tuple())
+
+
+if __name__ == "__main__":
+    unittest.main()
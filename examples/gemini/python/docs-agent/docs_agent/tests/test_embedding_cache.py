@@ -0,0 +1,62 @@
+"""Unit tests for the query embedding cache."""
+
+import os
+import tempfile
+import unittest
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from docs_agent.storage.embedding_cache import CachedEmbeddingFunction
+from docs_agent.storage.embedding_cache import QueryEmbeddingCache
+from docs_agent.storage.embedding_store import EmbeddingStore
+
+
+class CountingEmbeddingFunction(EmbeddingFunction[Documents]):
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, input: Documents) -> Embeddings:
+        self.texts.extend(input)
+        return [[float(len(text)), 1.0] for text in input]
+
+
+class EmbeddingCacheUnitTest(unittest.TestCase):
+    def test_identical_questions_are_embedded_once(self):
+        model = CountingEmbeddingFunction()
+        cached = CachedEmbeddingFunction(
+            model, QueryEmbeddingCache(max_size=10), model="models/m", task_type="Q"
+        )
+        first = cached(["What is Gemini?"])
+        second = cached(["  what is   GEMINI? ", "How do I install it?"])
+        self.assertEqual(second[0], first[0])
+        self.assertEqual(model.texts, ["What is Gemini?", "How do I install it?"])
+        stats = cached.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertAlmostEqual(stats["hit_rate"], 1 / 3)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryEmbeddingCache(max_size=2)
+        cache.put(("m", "Q", "a"), [1.0])
+        cache.put(("m", "Q", "b"), [2.0])
+        cache.get(("m", "Q", "a"))
+        cache.put(("m", "Q", "c"), [3.0])
+        self.assertIsNone(cache.get(("m", "Q", "b")))
+        self.assertEqual(cache.get(("m", "Q", "a")), [1.0])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_shared_store_is_used_after_eviction(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = EmbeddingStore(os.path.join(temp_dir, "queries.db"))
+            model = CountingEmbeddingFunction()
+            cached = CachedEmbeddingFunction(
+                model, QueryEmbeddingCache(max_size=0, store=store), model="m"
+            )
+            cached(["a question"])
+            self.assertEqual(cached(["a question"]), [[10.0, 1.0]])
+            self.assertEqual(len(model.texts), 1)
+            self.assertEqual(cached.stats()["store_hits"], 1)
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
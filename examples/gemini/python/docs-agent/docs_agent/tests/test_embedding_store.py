@@ -0,0 +1,70 @@
+"""Unit tests for the embedding store."""
+
+import os
+import tempfile
+import unittest
+
+from docs_agent.storage.embedding_store import EmbeddingStore
+from docs_agent.storage.embedding_store import content_hash
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+class EmbeddingStoreUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = EmbeddingStore(os.path.join(self.temp_dir.name, "store.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def test_content_hash_includes_all_inputs(self):
+        base = content_hash("text", model="m", task_type="t", title="a")
+        self.assertEqual(
+            base, content_hash("text", model="m", task_type="t", title="a")
+        )
+        self.assertNotEqual(
+            base, content_hash("text", model="m2", task_type="t", title="a")
+        )
+        self.assertNotEqual(
+            base, content_hash("text", model="m", task_type="t2", title="a")
+        )
+        self.assertNotEqual(
+            base, content_hash("text", model="m", task_type="t", title="b")
+        )
+        self.assertNotEqual(
+            base, content_hash("text2", model="m", task_type="t", title="a")
+        )
+
+    def test_store_is_off_by_default(self):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        self.assertEqual(product.embedding_store_path, "")
+
+    def test_get_or_embed_calls_the_model_once(self):
+        calls = []
+
+        def embed():
+            calls.append(1)
+            return [0.1, 0.2, 0.3]
+
+        first = self.store.get_or_embed(embed, "text", model="m", title="a")
+        second = self.store.get_or_embed(embed, "text", model="m", title="a")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first, [0.1, 0.2, 0.3])
+        self.assertEqual(second, first)
+        self.assertEqual(self.store.stats()["hits"], 1)
+        self.assertEqual(self.store.stats()["misses"], 1)
+
+    def test_store_is_persistent(self):
+        key_hash = content_hash("text")
+        self.store.put(key_hash, [1.0, 2.0])
+        other = EmbeddingStore(self.store.store_path)
+        self.assertIn(key_hash, other)
+        self.assertEqual(other.get(key_hash), [1.0, 2.0])
+        other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Unit tests for the HNSW settings of Chroma collections."""
+
+import tempfile
+import unittest
+
+import chromadb
+import numpy as np
+
+from docs_agent.storage.chroma import get_hnsw_metadata
+from docs_agent.storage.chroma import get_or_create_collection
+from docs_agent.storage.chroma import release_chroma_client
+from docs_agent.storage.chroma import set_search_ef
+
+
+class HnswSettingsUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.client = chromadb.PersistentClient(path=self.temp_dir.name)
+
+    def tearDown(self):
+        release_chroma_client(self.temp_dir.name)
+        self.temp_dir.cleanup()
+
+    def test_settings_are_used_when_the_collection_is_created(self):
+        self.assertEqual(get_hnsw_metadata(), {})
+        metadata = get_hnsw_metadata(
+            space="cosine", construction_ef="200", m=32, search_ef=None
+        )
+        self.assertEqual(
+            metadata,
+            {"hnsw:space": "cosine", "hnsw:construction_ef": 200, "hnsw:M": 32},
+        )
+        collection = get_or_create_collection(
+            self.client, "docs", hnsw_metadata=metadata
+        )
+        self.assertEqual(collection.metadata, metadata)
+        # The settings of an existing collection are not changed.
+        with self.assertLogs(level="WARNING"):
+            collection = get_or_create_collection(
+                self.client, "docs", hnsw_metadata=get_hnsw_metadata(space="l2")
+            )
+        self.assertEqual(collection.metadata, metadata)
+
+    def test_set_search_ef(self):
+        collection = get_or_create_collection(self.client, "docs")
+        generator = np.random.RandomState(0)
+        embeddings = generator.rand(200, 8).tolist()
+        collection.add(ids=[str(i) for i in range(200)], embeddings=embeddings)
+        expected = collection.query(query_embeddings=[embeddings[5]], n_results=5)
+        self.assertTrue(set_search_ef(collection, 100))
+        result = collection.query(query_embeddings=[embeddings[5]], n_results=5)
+        self.assertEqual(result["ids"][0][0], "5")
+        self.assertEqual(result["ids"], expected["ids"])
+
+
+if __name__ == "__main__":
+    unittest.main()
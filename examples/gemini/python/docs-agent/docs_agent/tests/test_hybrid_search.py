@@ -0,0 +1,84 @@
+"""Unit tests for hybrid lexical and vector search."""
+
+import os
+import tempfile
+import unittest
+
+import chromadb
+
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.hybrid_search import HybridCollection
+from docs_agent.storage.hybrid_search import reciprocal_rank_fusion
+from docs_agent.storage.lexical_index import LexicalIndex
+from docs_agent.storage.lexical_index import build_lexical_index_from_chroma
+from docs_agent.storage.lexical_index import build_match_query
+
+
+class HybridSearchUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.chroma_dir = os.path.join(self.temp_dir.name, "chroma")
+        self.index_dir = os.path.join(self.temp_dir.name, "lexical")
+        client = chromadb.PersistentClient(path=self.chroma_dir)
+        self.collection = client.create_collection(name="docs")
+        documents = [
+            "Open a directory with fuchsia.io.Directory and read entries.",
+            "The ZX_ERR_NOT_FOUND error is returned when a file is missing.",
+            "Install the SDK and run the build.",
+            "Configure logging for your component.",
+        ]
+        self.collection.add(
+            ids=[f"id{i}" for i in range(len(documents))],
+            embeddings=[[float(i), 1.0, 0.0] for i in range(len(documents))],
+            documents=documents,
+            metadatas=[
+                {"section_title": f"Section {i}", "origin_uuid": f"page{i}"}
+                for i in range(len(documents))
+            ],
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], rrf_k=60)
+        self.assertEqual([entry_id for entry_id, _ in fused], ["c", "a", "b", "d"])
+        self.assertAlmostEqual(fused[0][1], 1 / 63 + 1 / 61)
+        fused = reciprocal_rank_fusion([["a"], ["b"]], weights=[1.0, 2.0])
+        self.assertEqual(fused[0][0], "b")
+
+    def test_build_match_query(self):
+        self.assertEqual(
+            build_match_query("fuchsia.io.Directory?"),
+            '"fuchsia io Directory" OR "fuchsia" OR "io" OR "Directory"',
+        )
+        self.assertEqual(build_match_query("  "), "")
+        self.assertEqual(build_match_query('"x" OR'), '"x" OR "OR"')
+
+    def test_lexical_index_finds_identifiers(self):
+        count = build_lexical_index_from_chroma(self.chroma_dir, "docs", self.index_dir)
+        self.assertEqual(count, 4)
+        index = LexicalIndex(self.index_dir, "docs")
+        self.assertEqual(index.search("ZX_ERR_NOT_FOUND", 2)["ids"], ["id1"])
+        self.assertEqual(index.search("fuchsia.io.Directory", 2)["ids"][0], "id0")
+        self.assertEqual(index.search("", 2)["ids"], [])
+
+    def test_hybrid_query_fuses_both_sources(self):
+        build_lexical_index_from_chroma(self.chroma_dir, "docs", self.index_dir)
+        hybrid = HybridCollection(
+            ChromaCollectionEnhanced(self.collection, None),
+            LexicalIndex(self.index_dir, "docs"),
+        )
+        result = hybrid.query_by_embedding("ZX_ERR_NOT_FOUND", [3.0, 1.0, 0.0], 2)
+        ids = result.result["ids"][0]
+        # id3 is the nearest vector and id1 is the only lexical match.
+        self.assertEqual(sorted(ids), ["id1", "id3"])
+        items = result.returnDBObjList()
+        self.assertEqual(len(items), 2)
+        self.assertEqual(
+            hybrid.getPageOriginUUIDList("page1").section_list[0].uuid, "id1"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
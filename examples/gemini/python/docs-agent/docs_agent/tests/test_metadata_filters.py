@@ -0,0 +1,113 @@
+"""Unit tests for metadata filters in the query path."""
+
+import os
+import tempfile
+import unittest
+
+import chromadb
+import numpy as np
+
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.chroma import create_metadata_indexes
+from docs_agent.storage.lexical_index import LexicalIndex
+from docs_agent.storage.lexical_index import build_lexical_index_from_chroma
+from docs_agent.storage.metadata_filters import InvalidFilterError
+from docs_agent.storage.metadata_filters import build_where
+from docs_agent.storage.metadata_filters import get_url_prefix_fields
+from docs_agent.storage.metadata_filters import matches_filters
+from docs_agent.storage.metadata_filters import parse_filters
+from docs_agent.storage.numpy_store import NumpyCollection
+from docs_agent.storage.numpy_store import export_chroma_to_numpy
+
+URLS = [
+    "https://example.com/docs/guides/files",
+    "https://example.com/docs/reference/io",
+    "https://example.com/blog/launch",
+]
+
+
+class MetadataFiltersUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.chroma_dir = os.path.join(self.temp_dir.name, "chroma")
+        generator = np.random.RandomState(0)
+        self.embeddings = generator.rand(30, 8).tolist()
+        client = chromadb.PersistentClient(path=self.chroma_dir)
+        self.collection = client.create_collection(name="docs")
+        metadatas = []
+        for i in range(30):
+            url = URLS[i % 3]
+            metadatas.append(
+                {"origin_uuid": f"page{i % 3}", "section_id": i, "url": url}
+                | get_url_prefix_fields(url)
+            )
+        self.collection.add(
+            ids=[f"id{i}" for i in range(30)],
+            embeddings=self.embeddings,
+            documents=[f"open a file {i}" for i in range(30)],
+            metadatas=metadatas,
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_url_prefix_fields(self):
+        self.assertEqual(
+            get_url_prefix_fields(URLS[0]),
+            {
+                "url_prefix_1": "https://example.com/docs/",
+                "url_prefix_2": "https://example.com/docs/guides/",
+            },
+        )
+        self.assertEqual(get_url_prefix_fields(""), {})
+
+    def test_parse_filters_and_build_where(self):
+        filters = parse_filters(["url_prefix=https://example.com/docs", "section_id=3"])
+        self.assertEqual(filters["section_id"], 3)
+        self.assertEqual(
+            build_where(filters),
+            {
+                "$and": [
+                    {"url_prefix_1": {"$eq": "https://example.com/docs/"}},
+                    {"section_id": {"$eq": 3}},
+                ]
+            },
+        )
+        self.assertIsNone(build_where({}))
+        with self.assertRaises(InvalidFilterError):
+            parse_filters(["url_prefix"])
+
+    def test_matches_filters(self):
+        metadata = {"url": URLS[0], "source": "docs"}
+        self.assertTrue(
+            matches_filters(metadata, {"url_prefix": "https://example.com/docs"})
+        )
+        self.assertFalse(
+            matches_filters(metadata, {"url_prefix": "https://example.com/do"})
+        )
+        self.assertFalse(matches_filters(metadata, {"source": "blog"}))
+
+    def test_filtered_queries_only_return_matches(self):
+        create_metadata_indexes(self.chroma_dir)
+        numpy_dir = os.path.join(self.temp_dir.name, "numpy")
+        export_chroma_to_numpy(self.chroma_dir, "docs", numpy_dir)
+        index_dir = os.path.join(self.temp_dir.name, "lexical")
+        build_lexical_index_from_chroma(self.chroma_dir, "docs", index_dir)
+        filters = {"url_prefix": "https://example.com/docs/reference/"}
+        query = self.embeddings[0]
+        chroma = ChromaCollectionEnhanced(self.collection, None)
+        chroma_ids = chroma.query_by_embedding(query, 5, filters=filters).result["ids"][
+            0
+        ]
+        self.assertEqual(len(chroma_ids), 5)
+        self.assertTrue(all(int(entry_id[2:]) % 3 == 1 for entry_id in chroma_ids))
+        store = NumpyCollection(numpy_dir, "docs")
+        numpy_ids = store.query_by_embedding(query, 5, filters=filters).result["ids"][0]
+        self.assertEqual(numpy_ids, chroma_ids)
+        lexical = LexicalIndex(index_dir, "docs").search("file", 30, filters)
+        self.assertEqual(len(lexical["ids"]), 10)
+        self.assertTrue(all(int(entry_id[2:]) % 3 == 1 for entry_id in lexical["ids"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Unit tests for near-duplicate chunk detection."""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from docs_agent.preprocess import near_duplicates
+
+
+BASE_TEXT = (
+    "The list method returns all models available through the API, including "
+    "their input and output token limits, supported generation methods, and "
+    "default temperature. Use the page token to fetch the next page of results "
+    "when the response contains more models than the requested page size. "
+)
+
+
+class NearDuplicatesUnitTest(unittest.TestCase):
+    def test_shingles_of_short_text(self):
+        self.assertEqual(near_duplicates.get_shingles("Hello, World"), {"hello world"})
+
+    def test_estimated_similarity_is_close_to_jaccard(self):
+        text_a = BASE_TEXT * 2
+        text_b = text_a.replace("default temperature", "default top_p")
+        shingles_a = near_duplicates.get_shingles(text_a)
+        shingles_b = near_duplicates.get_shingles(text_b)
+        minhasher = near_duplicates.MinHasher(num_perm=256)
+        estimate = near_duplicates.estimate_similarity(
+            minhasher.signature(shingles_a), minhasher.signature(shingles_b)
+        )
+        exact = near_duplicates.jaccard_similarity(shingles_a, shingles_b)
+        self.assertAlmostEqual(estimate, exact, delta=0.1)
+
+    def test_lsh_params_cover_all_permutations(self):
+        bands, rows = near_duplicates.get_lsh_params(0.9, 128)
+        self.assertEqual(bands * rows, 128)
+
+    def test_find_near_duplicate_groups(self):
+        texts = {
+            "v1": BASE_TEXT * 3,
+            "v2": BASE_TEXT * 3 + "Updated in v2.",
+            "v3": BASE_TEXT * 3,
+            "other": "Install the SDK with pip and set the API key environment variable.",
+        }
+        groups = near_duplicates.find_near_duplicate_groups(texts, threshold=0.8)
+        self.assertEqual(groups, [["v1", "v2", "v3"]])
+
+    def test_bucket_members_are_compared_with_the_representative(self):
+        texts = {f"v{i}": BASE_TEXT * 3 for i in range(200)}
+        with mock.patch.object(
+            near_duplicates,
+            "jaccard_similarity",
+            wraps=near_duplicates.jaccard_similarity,
+        ) as jaccard_similarity:
+            groups = near_duplicates.find_near_duplicate_groups(texts, threshold=0.9)
+        self.assertEqual(groups, [list(texts)])
+        # Each copy is only compared with the first one, once for all bands.
+        self.assertEqual(jaccard_similarity.call_count, 199)
+
+    def test_choose_canonical(self):
+        group = ["docs/v10/models.md", "docs/v2/models.md", "docs/api/v1/models.md"]
+        self.assertEqual(
+            near_duplicates.choose_canonical(group, "first"), "docs/api/v1/models.md"
+        )
+        self.assertEqual(
+            near_duplicates.choose_canonical(group, "newest"), "docs/v10/models.md"
+        )
+        self.assertEqual(
+            near_duplicates.choose_canonical(group, "shortest_path"),
+            "docs/v2/models.md",
+        )
+        with self.assertRaises(ValueError):
+            near_duplicates.choose_canonical(group, "oldest")
+
+    def test_collapse_near_duplicates(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index = {"Product": {}}
+            for version in ["v1", "v2"]:
+                chunk_file = os.path.join(temp_dir, f"{version}_0.md")
+                with open(chunk_file, "w", encoding="utf-8") as auto:
+                    auto.write(BASE_TEXT * 3)
+                index["Product"][chunk_file] = {
+                    "UUID": version,
+                    "URL": f"https://example.com/{version}/models",
+                    "metadata": {},
+                }
+            result = near_duplicates.collapse_near_duplicates(
+                index, threshold=0.9, canonical="newest"
+            )
+            self.assertEqual(result["groups"], 1)
+            self.assertEqual(result["aliased_chunks"], 1)
+            self.assertEqual(result["aliased_bytes"], len(BASE_TEXT * 3))
+            canonical = os.path.join(temp_dir, "v2_0.md")
+            alias = os.path.join(temp_dir, "v1_0.md")
+            # The alias stays in the index and the output directory, so that its
+            # page is still complete.
+            self.assertEqual(sorted(index["Product"]), [alias, canonical])
+            self.assertTrue(os.path.exists(alias))
+            self.assertEqual(index["Product"][alias]["alias_of"], canonical)
+            self.assertEqual(index["Product"][alias]["metadata"]["alias_of"], "v2")
+            metadata = index["Product"][canonical]["metadata"]
+            self.assertEqual(metadata["variant_count"], 1)
+            self.assertEqual(metadata["variant_urls"], "https://example.com/v1/models")
+            json.dumps(index)
+            # Collapsing again doesn't change the index.
+            result = near_duplicates.collapse_near_duplicates(
+                index, threshold=0.9, canonical="newest"
+            )
+            self.assertEqual(result["groups"], 0)
+            self.assertEqual(
+                index["Product"][canonical]["metadata"]["variant_count"], 1
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
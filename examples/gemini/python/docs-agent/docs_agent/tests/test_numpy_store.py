@@ -0,0 +1,347 @@
+"""Unit tests for the NumPy vector store."""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+import chromadb
+import numpy as np
+
+from docs_agent.storage import numpy_store
+from docs_agent.storage.alias_store import AliasStore
+from docs_agent.storage.alias_store import get_alias_store_path
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.numpy_store import NumpyCollection
+from docs_agent.storage.numpy_store import export_chroma_to_numpy
+from docs_agent.storage.numpy_store import get_store_paths
+from docs_agent.storage.numpy_store import save_npy
+from docs_agent.storage.quantization import build_quantized_index
+from docs_agent.storage.quantization import get_quantized_paths
+from docs_agent.storage.reduction import PCAReducer
+from docs_agent.storage.reduction import get_reduced_paths
+
+
+# Write the vectors of a NumPy store without a Chroma collection. The
+# sidecar has no entries, so only `search` can be used.
+def write_store(numpy_dir, vectors):
+    os.makedirs(numpy_dir, exist_ok=True)
+    paths = get_store_paths(numpy_dir, "docs")
+    save_npy(paths["vectors"], vectors)
+    save_npy(paths["norms"], np.einsum("ij,ij->i", vectors, vectors))
+    if os.path.exists(paths["sidecar"]):
+        os.remove(paths["sidecar"])
+    sidecar = sqlite3.connect(paths["sidecar"])
+    sidecar.execute("CREATE TABLE entries (row INTEGER PRIMARY KEY)")
+    sidecar.close()
+    with open(paths["manifest"], "w", encoding="utf-8") as manifest_file:
+        json.dump(
+            {
+                "collection_name": "docs",
+                "count": len(vectors),
+                "dimension": vectors.shape[1],
+                "space": "l2",
+            },
+            manifest_file,
+        )
+    return paths
+
+
+class NumpyStoreUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.chroma_dir = os.path.join(self.temp_dir.name, "chroma")
+        self.numpy_dir = os.path.join(self.temp_dir.name, "numpy")
+        generator = np.random.RandomState(0)
+        self.embeddings = generator.rand(50, 8).tolist()
+        client = chromadb.PersistentClient(path=self.chroma_dir)
+        self.collection = client.create_collection(name="docs")
+        self.collection.add(
+            ids=[f"id{i}" for i in range(50)],
+            embeddings=self.embeddings,
+            documents=[f"text {i}" for i in range(50)],
+            metadatas=[
+                {"origin_uuid": f"page{i % 5}", "section_id": i} for i in range(50)
+            ],
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_query_matches_chroma(self):
+        manifest = export_chroma_to_numpy(
+            self.chroma_dir, "docs", self.numpy_dir, batch_size=7
+        )
+        self.assertEqual(manifest["count"], 50)
+        self.assertEqual(manifest["dimension"], 8)
+        query = (np.array(self.embeddings[3]) + 0.05).tolist()
+        expected = self.collection.query(query_embeddings=[query], n_results=5)
+        for block_size in [0, 6]:
+            store = NumpyCollection(self.numpy_dir, "docs", block_size=block_size)
+            result = store.query_by_embedding(query, top_k=5).result
+            self.assertEqual(result["ids"], expected["ids"])
+            self.assertEqual(result["documents"], expected["documents"])
+            np.testing.assert_allclose(
+                result["distances"][0], expected["distances"][0], rtol=1e-4
+            )
+
+    def test_get_page_by_origin_uuid(self):
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        store = NumpyCollection(self.numpy_dir, "docs")
+        page = store.getPageOriginUUIDList("page2")
+        self.assertEqual(len(page.section_list), 10)
+
+    def test_pages_include_aliases(self):
+        store = AliasStore(get_alias_store_path(self.chroma_dir))
+        store.put(
+            "docs", "alias", "alias text", {"origin_uuid": "page2", "section_id": 50}
+        )
+        store.close()
+        manifest = export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        # Aliases have no vectors.
+        self.assertEqual(manifest["count"], 50)
+        self.assertEqual(manifest["aliases"], 1)
+        stores = [
+            NumpyCollection(self.numpy_dir, "docs"),
+            ChromaCollectionEnhanced(self.collection, None, chroma_dir=self.chroma_dir),
+        ]
+        for store in stores:
+            page = store.getPageOriginUUIDList("page2")
+            self.assertEqual(len(page.section_list), 11)
+            self.assertEqual(page.section_list[-1].content, "alias text")
+            pages = store.getPagesOriginUUIDList(["page2", "page4"])
+            self.assertEqual(len(pages["page2"].section_list), 11)
+            self.assertEqual(len(pages["page4"].section_list), 10)
+
+    def test_get_pages_by_origin_uuids_in_one_query(self):
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        stores = [
+            NumpyCollection(self.numpy_dir, "docs"),
+            ChromaCollectionEnhanced(self.collection, None),
+        ]
+        for store in stores:
+            pages = store.getPagesOriginUUIDList(["page2", "page4", "page2"])
+            self.assertEqual(sorted(pages), ["page2", "page4"])
+            for origin_uuid, page in pages.items():
+                expected = store.getPageOriginUUIDList(origin_uuid)
+                self.assertEqual(
+                    [section.uuid for section in page.section_list],
+                    [section.uuid for section in expected.section_list],
+                )
+
+    def test_quantized_search_matches_float_search(self):
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        exact = NumpyCollection(self.numpy_dir, "docs")
+        query = np.array(self.embeddings[3], dtype=np.float32) + 0.05
+        expected_rows, expected_distances = exact.search(query, top_k=5)
+        for quantization in ["int8", "pq"]:
+            export_chroma_to_numpy(
+                self.chroma_dir, "docs", self.numpy_dir, quantization=quantization
+            )
+            store = NumpyCollection(
+                self.numpy_dir, "docs", quantization=quantization, rerank_oversample=10
+            )
+            self.assertEqual(store.quantization, quantization)
+            rows, distances = store.search(query, top_k=5)
+            # Re-ranking returns the exact distances of the candidates.
+            self.assertEqual(rows.tolist(), expected_rows.tolist())
+            np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+    def test_reduced_search_matches_float_search(self):
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        exact = NumpyCollection(self.numpy_dir, "docs")
+        query = np.array(self.embeddings[3], dtype=np.float32) + 0.05
+        expected_rows, expected_distances = exact.search(query, top_k=5)
+        for reduction in ["pca", "random_projection"]:
+            export_chroma_to_numpy(
+                self.chroma_dir,
+                "docs",
+                self.numpy_dir,
+                reduction=reduction,
+                reduced_dimension=4,
+            )
+            store = NumpyCollection(
+                self.numpy_dir,
+                "docs",
+                rerank_oversample=10,
+                reduction=reduction,
+                reduced_dimension=4,
+            )
+            self.assertEqual(store.reduction, reduction)
+            self.assertEqual(store.reduced_index[1].shape, (50, 4))
+            rows, distances = store.search(query, top_k=5)
+            # Re-ranking returns the exact distances of the candidates.
+            self.assertEqual(rows.tolist(), expected_rows.tolist())
+            np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+        # A reduced index that is not built falls back to the full vectors.
+        store = NumpyCollection(
+            self.numpy_dir, "docs", reduction="pca", reduced_dimension=6
+        )
+        self.assertEqual(store.reduction, "none")
+
+    def test_pca_keeps_distances_of_low_rank_vectors(self):
+        generator = np.random.RandomState(1)
+        vectors = (generator.rand(50, 2) @ generator.rand(2, 8)).astype(np.float32)
+        reducer = PCAReducer(dimension=2)
+        reducer.train(vectors)
+        reduced = reducer.transform(vectors)
+        np.testing.assert_allclose(
+            np.linalg.norm(reduced - reduced[0], axis=1),
+            np.linalg.norm(vectors - vectors[0], axis=1),
+            atol=1e-4,
+        )
+
+    def test_quantized_scan_uses_bounded_blocks(self):
+        vectors = np.random.RandomState(0).rand(20000, 256).astype(np.float32)
+        paths = write_store(self.numpy_dir, vectors)
+        build_quantized_index(vectors, paths["base"], "int8")
+        store = NumpyCollection(self.numpy_dir, "docs", quantization="int8")
+        query = vectors[3] + 0.01
+        expected_rows, _ = store.search(query, top_k=5)
+        # Decoding all codes at once takes 20000 * 256 * 4 bytes (20 MB).
+        with mock.patch.object(numpy_store, "QUANTIZED_BLOCK_BYTES", 1024 * 1024):
+            tracemalloc.start()
+            rows, _ = store.search(query, top_k=5)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        self.assertLess(peak, 4 * 1024 * 1024)
+        self.assertEqual(rows.tolist(), expected_rows.tolist())
+
+    def test_stale_quantized_index_is_not_used(self):
+        manifest = export_chroma_to_numpy(
+            self.chroma_dir, "docs", self.numpy_dir, quantization="int8"
+        )
+        self.assertEqual(manifest["quantization"], "int8")
+        self.assertEqual(
+            NumpyCollection(self.numpy_dir, "docs", quantization="int8").quantization,
+            "int8",
+        )
+        # The store is exported again with fewer rows, and without the index.
+        vectors = np.array(self.embeddings[:30], dtype=np.float32)
+        write_store(self.numpy_dir, vectors)
+        store = NumpyCollection(self.numpy_dir, "docs", quantization="int8")
+        self.assertEqual(store.quantization, "none")
+        rows, _ = store.search(vectors[3], top_k=5)
+        self.assertTrue(all(row < 30 for row in rows))
+
+    def test_quantization_must_match_the_manifest(self):
+        export_chroma_to_numpy(
+            self.chroma_dir, "docs", self.numpy_dir, quantization="int8"
+        )
+        base_path = get_store_paths(self.numpy_dir, "docs")["base"]
+        # An int8 index of the same rows from an earlier export.
+        int8_paths = get_quantized_paths(base_path, "int8")
+        copies = {path: path + ".copy" for path in int8_paths.values()}
+        for path, copy in copies.items():
+            shutil.copyfile(path, copy)
+        manifest = export_chroma_to_numpy(
+            self.chroma_dir, "docs", self.numpy_dir, quantization="pq", pq_subvectors=2
+        )
+        self.assertEqual(manifest["quantization"], "pq")
+        # Exporting again deletes the indexes that it didn't build.
+        self.assertFalse(any(os.path.exists(path) for path in int8_paths.values()))
+        for path, copy in copies.items():
+            os.replace(copy, path)
+        with self.assertLogs(level="WARNING"):
+            store = NumpyCollection(self.numpy_dir, "docs", quantization="int8")
+        self.assertEqual(store.quantization, "none")
+        self.assertEqual(
+            NumpyCollection(self.numpy_dir, "docs", quantization="pq").quantization,
+            "pq",
+        )
+
+    def test_stale_reduced_index_is_not_used(self):
+        manifest = export_chroma_to_numpy(
+            self.chroma_dir,
+            "docs",
+            self.numpy_dir,
+            reduction="pca",
+            reduced_dimension=4,
+        )
+        self.assertEqual(manifest["reduction"], "pca")
+        self.assertEqual(manifest["reduced_dimension"], 4)
+        vectors = np.array(self.embeddings[:30], dtype=np.float32)
+        write_store(self.numpy_dir, vectors)
+        store = NumpyCollection(
+            self.numpy_dir, "docs", reduction="pca", reduced_dimension=4
+        )
+        self.assertEqual(store.reduction, "none")
+
+    def test_reduction_must_match_the_manifest(self):
+        export_chroma_to_numpy(
+            self.chroma_dir,
+            "docs",
+            self.numpy_dir,
+            reduction="pca",
+            reduced_dimension=4,
+        )
+        base_path = get_store_paths(self.numpy_dir, "docs")["base"]
+        # A 4-dimensional index of the same rows from an earlier export.
+        pca4_paths = get_reduced_paths(base_path, "pca", 4)
+        copies = {path: path + ".copy" for path in pca4_paths.values()}
+        for path, copy in copies.items():
+            shutil.copyfile(path, copy)
+        manifest = export_chroma_to_numpy(
+            self.chroma_dir,
+            "docs",
+            self.numpy_dir,
+            reduction="pca",
+            reduced_dimension=2,
+        )
+        self.assertEqual(manifest["reduced_dimension"], 2)
+        # Exporting again deletes the indexes that it didn't build.
+        self.assertFalse(any(os.path.exists(path) for path in pca4_paths.values()))
+        self.assertTrue(
+            os.path.exists(get_reduced_paths(base_path, "pca", 2)["vectors"])
+        )
+        for path, copy in copies.items():
+            os.replace(copy, path)
+        for reduction, dimension in [("pca", 4), ("random_projection", 2)]:
+            with self.assertLogs(level="WARNING"):
+                store = NumpyCollection(
+                    self.numpy_dir,
+                    "docs",
+                    reduction=reduction,
+                    reduced_dimension=dimension,
+                )
+            self.assertEqual(store.reduction, "none")
+        store = NumpyCollection(
+            self.numpy_dir, "docs", reduction="pca", reduced_dimension=2
+        )
+        self.assertEqual(store.reduction, "pca")
+        # Exporting without a reduction deletes all reduced indexes.
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        self.assertEqual(
+            [path for path in os.listdir(self.numpy_dir) if ".pca" in path], []
+        )
+
+    def test_batch_query_matches_single_queries(self):
+        export_chroma_to_numpy(self.chroma_dir, "docs", self.numpy_dir)
+        queries = [(np.array(self.embeddings[i]) + 0.05).tolist() for i in [3, 7, 11]]
+        stores = [
+            NumpyCollection(self.numpy_dir, "docs", block_size=6),
+            ChromaCollectionEnhanced(self.collection, None),
+        ]
+        for store in stores:
+            for filters in [None, {"origin_uuid": "page1"}]:
+                results = store.query_batch_by_embedding(queries, 4, filters=filters)
+                self.assertEqual(len(results), len(queries))
+                for query, result in zip(queries, results):
+                    expected = store.query_by_embedding(
+                        query, 4, filters=filters
+                    ).result
+                    self.assertEqual(result.result["ids"], expected["ids"])
+                    np.testing.assert_allclose(
+                        result.result["distances"][0],
+                        expected["distances"][0],
+                        rtol=1e-4,
+                    )
+            self.assertEqual(store.query_batch_by_embedding([], 4), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,329 @@
+"""Unit tests for populating vector databases."""
+
+import json
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import chromadb
+
+from docs_agent.preprocess import populate_vector_database as populate
+from docs_agent.storage.alias_store import AliasStore
+from docs_agent.storage.alias_store import get_alias_store_path
+from docs_agent.storage.chroma import ChromaCollectionEnhanced
+from docs_agent.storage.chroma import release_chroma_client
+from docs_agent.utilities.helpers import resolve_path
+
+
+class ShardsUnitTest(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(populate.parse_shard("2/4"), (2, 4))
+        self.assertEqual(populate.parse_shard(" 1 / 1 "), (1, 1))
+        for shard in ["2", "0/4", "5/4", "1/0", "a/b", "-1/4"]:
+            with self.assertRaises(ValueError):
+                populate.parse_shard(shard)
+
+    def test_get_shard_vector_db_dir(self):
+        self.assertEqual(
+            populate.get_shard_vector_db_dir("vector_stores/chroma/", 2, 4),
+            "vector_stores/chroma_shard_2_of_4",
+        )
+
+    def test_get_shard_of_origin_uuid(self):
+        shards = [populate.get_shard_of_origin_uuid(f"page-{i}", 4) for i in range(200)]
+        self.assertEqual(set(shards), {1, 2, 3, 4})
+        # The shard of a page doesn't depend on the process or machine.
+        self.assertEqual(
+            shards,
+            [populate.get_shard_of_origin_uuid(f"page-{i}", 4) for i in range(200)],
+        )
+        self.assertEqual(populate.get_shard_of_origin_uuid("page-0", 1), 1)
+
+    def test_filter_files_by_shard(self):
+        root = "/tmp/docs"
+        file_list = [
+            (root, f"page{page}_{chunk}.md") for page in range(20) for chunk in range(3)
+        ]
+        file_list.append((root, "not_indexed.md"))
+        index = {"Product": {}}
+        for page in range(20):
+            for chunk in range(3):
+                full_file_name = resolve_path(root + "/") + f"page{page}_{chunk}.md"
+                index["Product"][full_file_name] = {"origin_uuid": f"page-{page}"}
+        shards = [
+            populate.filter_files_by_shard(file_list, index, shard_index, 3)
+            for shard_index in range(1, 4)
+        ]
+        # Every file is in exactly one shard.
+        self.assertEqual(sorted(sum(shards, [])), sorted(file_list))
+        # All chunks of a page are in the same shard.
+        for shard_index, shard in enumerate(shards, start=1):
+            for root, file in shard:
+                if file == "not_indexed.md":
+                    self.assertEqual(shard_index, 1)
+                    continue
+                page = file.split("_")[0][len("page") :]
+                self.assertEqual(
+                    populate.get_shard_of_origin_uuid(f"page-{page}", 3), shard_index
+                )
+
+
+class MergeShardsUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.vector_db_dir = os.path.join(self.temp_dir.name, "chroma")
+        self.db_config = types.SimpleNamespace(
+            db_type="chroma",
+            vector_db_dir=self.vector_db_dir,
+            collection_name="docs_collection",
+        )
+        self.product = types.SimpleNamespace(
+            db_configs=[self.db_config], enable_delete_chunks="True"
+        )
+        self.dirs = [self.vector_db_dir] + [
+            populate.get_shard_vector_db_dir(self.vector_db_dir, i, 2) for i in [1, 2]
+        ]
+
+    def tearDown(self):
+        for chroma_dir in self.dirs:
+            release_chroma_client(chroma_dir)
+        self.temp_dir.cleanup()
+
+    def add_entries(self, chroma_dir, ids):
+        client = chromadb.PersistentClient(path=chroma_dir)
+        collection = client.get_or_create_collection("docs_collection")
+        collection.add(
+            ids=ids,
+            embeddings=[[float(len(entry_id)), 1.0] for entry_id in ids],
+            documents=ids,
+        )
+
+    def get_ids(self):
+        client = chromadb.PersistentClient(path=self.vector_db_dir)
+        return sorted(client.get_collection("docs_collection").get()["ids"])
+
+    def test_merge_deletes_entries_that_are_not_in_any_shard(self):
+        self.add_entries(self.vector_db_dir, ["a", "deleted"])
+        self.add_entries(self.dirs[1], ["a", "b"])
+        self.add_entries(self.dirs[2], ["c"])
+        merged_count = populate.merge_shards_from_product(self.product, 2, batch_size=1)
+        self.assertEqual(merged_count, 3)
+        self.assertEqual(self.get_ids(), ["a", "b", "c"])
+
+    def test_merge_keeps_entries_if_a_shard_is_missing(self):
+        self.add_entries(self.vector_db_dir, ["a", "deleted"])
+        self.add_entries(self.dirs[1], ["a", "b"])
+        with self.assertLogs(level="WARNING"):
+            populate.merge_shards_from_product(self.product, 2)
+        self.assertEqual(self.get_ids(), ["a", "b", "deleted"])
+
+    def test_merge_aliases(self):
+        self.add_entries(self.dirs[1], ["a"])
+        self.add_entries(self.dirs[2], ["c"])
+        # "b" was stored in the vector index before it became an alias.
+        self.add_entries(self.vector_db_dir, ["b"])
+        store = AliasStore(get_alias_store_path(self.vector_db_dir))
+        store.put("docs_collection", "a", "a", {"alias_of": "x"})
+        store.put("docs_collection", "deleted", "deleted", {"alias_of": "x"})
+        store.close()
+        store = AliasStore(get_alias_store_path(self.dirs[1]))
+        store.put("docs_collection", "b", "b", {"alias_of": "a"})
+        store.close()
+        populate.merge_shards_from_product(self.product, 2)
+        self.assertEqual(self.get_ids(), ["a", "c"])
+        store = AliasStore(get_alias_store_path(self.vector_db_dir))
+        self.assertEqual(store.get("docs_collection")["ids"], ["b"])
+        store.close()
+
+    def test_merge_keeps_entries_without_enable_delete_chunks(self):
+        self.product.enable_delete_chunks = "False"
+        self.add_entries(self.vector_db_dir, ["a", "deleted"])
+        self.add_entries(self.dirs[1], ["a", "b"])
+        self.add_entries(self.dirs[2], ["c"])
+        populate.merge_shards_from_product(self.product, 2)
+        self.assertEqual(self.get_ids(), ["a", "b", "c", "deleted"])
+
+
+def make_product(temp_dir: str):
+    output_path = os.path.join(temp_dir, "output")
+    vector_db_dir = os.path.join(temp_dir, "chroma")
+    os.makedirs(output_path)
+    index = {"Product": {}}
+    for name in ["a", "b", "c"]:
+        chunk_file = os.path.join(output_path, f"{name}_0.md")
+        with open(chunk_file, "w", encoding="utf-8") as auto:
+            auto.write(f"Content of page {name}.")
+        index["Product"][chunk_file] = {
+            "UUID": f"uuid-{name}",
+            "origin_uuid": f"page-{name}",
+            "page_title": f"Page {name}",
+            "section_title": "",
+            "section_name_id": "",
+            "section_id": 1,
+            "section_level": 1,
+            "previous_id": 0,
+            "URL": f"https://example.com/{name}",
+            "md_hash": f"hash-{name}",
+            "token_estimate": 5.0,
+            "parent_tree": [0],
+            "text_chunk_filename": f"{name}_0.md",
+            "metadata": {},
+        }
+    with open(
+        os.path.join(output_path, "file_index.json"), "w", encoding="utf-8"
+    ) as index_file:
+        json.dump(index, index_file)
+    return types.SimpleNamespace(
+        db_configs=[
+            types.SimpleNamespace(
+                db_type="chroma",
+                vector_db_dir=vector_db_dir,
+                collection_name="docs_collection",
+                hnsw_space="",
+                hnsw_construction_ef="",
+                hnsw_m="",
+                hnsw_search_ef="",
+            )
+        ],
+        db_type="chroma",
+        embedding_store_path="",
+        enable_delete_chunks="True",
+        output_path=output_path,
+        populate_order="",
+        models=types.SimpleNamespace(
+            embedding_model="models/embedding-001",
+            embedding_api_call_limit="2",
+            embedding_api_call_period="60",
+        ),
+    )
+
+
+# Mark the text chunk `b` as an alias of `a` in the file index, as
+# `collapse_near_duplicates` does.
+def set_alias(output_path: str, is_alias: bool):
+    index_path = os.path.join(output_path, "file_index.json")
+    with open(index_path, "r", encoding="utf-8") as index_file:
+        index = json.load(index_file)
+    chunk_data = index["Product"][os.path.join(output_path, "b_0.md")]
+    chunk_data.pop("alias_of", None)
+    chunk_data["metadata"] = {}
+    if is_alias:
+        chunk_data["alias_of"] = os.path.join(output_path, "a_0.md")
+        chunk_data["metadata"] = {"alias_of": "uuid-a"}
+    with open(index_path, "w", encoding="utf-8") as index_file:
+        json.dump(index, index_file)
+
+
+class PopulateAliasesUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.product = make_product(self.temp_dir.name)
+        self.vector_db_dir = self.product.db_configs[0].vector_db_dir
+        self.gemini = mock.Mock()
+        self.gemini.embed.return_value = [[1.0, 0.0]]
+
+    def tearDown(self):
+        release_chroma_client(self.vector_db_dir)
+        self.temp_dir.cleanup()
+
+    def populate(self):
+        with mock.patch.object(
+            populate, "init_gemini_model", return_value=(self.gemini, None)
+        ):
+            populate.populateToDbFromProduct(self.product)
+        client = chromadb.PersistentClient(path=self.vector_db_dir)
+        collection = client.get_collection("docs_collection")
+        store = AliasStore(get_alias_store_path(self.vector_db_dir))
+        alias_ids = store.get("docs_collection")["ids"]
+        store.close()
+        return sorted(collection.get(include=[])["ids"]), alias_ids
+
+    def test_aliases_are_kept_out_of_the_vector_index(self):
+        set_alias(self.product.output_path, True)
+        self.assertEqual(self.populate(), (["uuid-a", "uuid-c"], ["uuid-b"]))
+        # The alias isn't embedded.
+        self.assertEqual(self.gemini.embed.call_count, 2)
+        # Pages are rebuilt with their aliases.
+        client = chromadb.PersistentClient(path=self.vector_db_dir)
+        collection = ChromaCollectionEnhanced(
+            client.get_collection("docs_collection"),
+            None,
+            chroma_dir=self.vector_db_dir,
+        )
+        pages = collection.getPagesOriginUUIDList(["page-a", "page-b"])
+        self.assertEqual(pages["page-b"].section_list[0].content, "Content of page b.")
+        self.assertEqual(
+            collection.getPageOriginUUIDList("page-b").section_list[0].uuid,
+            "uuid-b",
+        )
+
+    def test_text_chunks_move_between_the_index_and_the_alias_table(self):
+        self.assertEqual(self.populate(), (["uuid-a", "uuid-b", "uuid-c"], []))
+        set_alias(self.product.output_path, True)
+        self.assertEqual(self.populate(), (["uuid-a", "uuid-c"], ["uuid-b"]))
+        set_alias(self.product.output_path, False)
+        self.assertEqual(self.populate(), (["uuid-a", "uuid-b", "uuid-c"], []))
+
+    def test_estimate_counts_aliases(self):
+        set_alias(self.product.output_path, True)
+        estimate = populate.estimate_populate_from_product(self.product)
+        self.assertEqual(estimate["new"], 3)
+        self.assertEqual(estimate["aliased"], 1)
+        self.assertEqual(estimate["embedding_calls"], 2)
+        self.populate()
+        estimate = populate.estimate_populate_from_product(self.product)
+        self.assertEqual(estimate["unchanged"], 3)
+        self.assertEqual(estimate["embedding_calls"], 0)
+
+
+class EstimatePopulateUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.product = make_product(self.temp_dir.name)
+        self.vector_db_dir = self.product.db_configs[0].vector_db_dir
+
+    def tearDown(self):
+        release_chroma_client(self.vector_db_dir)
+        self.temp_dir.cleanup()
+
+    def test_estimate_without_a_database(self):
+        estimate = populate.estimate_populate_from_product(self.product)
+        self.assertEqual(estimate["new"], 3)
+        self.assertEqual(estimate["stale"], 0)
+        self.assertEqual(estimate["embedding_calls"], 3)
+        self.assertEqual(estimate["estimated_seconds"], 90)
+        # A dry run doesn't create the database.
+        self.assertFalse(os.path.exists(self.vector_db_dir))
+
+    def test_estimate_with_existing_entries(self):
+        client = chromadb.PersistentClient(path=self.vector_db_dir)
+        collection = client.get_or_create_collection("docs_collection")
+        entries = {
+            "uuid-a": ("hash-a", "a_0.md"),
+            "uuid-b": ("old-hash-b", "b_0.md"),
+            # The same text chunk file with an older ID isn't stale, since
+            # populate deletes entries by their text chunk file.
+            "old-uuid-c": ("hash-c", "c_0.md"),
+            "uuid-removed": ("hash-removed", "removed_0.md"),
+        }
+        collection.add(
+            ids=list(entries),
+            embeddings=[[1.0, 0.0]] * len(entries),
+            metadatas=[
+                {"md_hash": md_hash, "text_chunk_filename": text_chunk_filename}
+                for md_hash, text_chunk_filename in entries.values()
+            ],
+        )
+        estimate = populate.estimate_populate_from_product(self.product)
+        self.assertEqual(estimate["unchanged"], 1)
+        self.assertEqual(estimate["changed"], 1)
+        self.assertEqual(estimate["new"], 1)
+        self.assertEqual(estimate["stale"], 1)
+        self.assertEqual(estimate["embedding_calls"], 2)
+        self.assertGreater(estimate["embedding_tokens"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Unit tests for reranking search results."""
+
+import os
+import time
+import unittest
+from unittest import mock
+
+from absl import logging
+
+from docs_agent.agents.docs_agent import DocsAgent
+from docs_agent.postprocess.rerankers import LexicalReranker
+from docs_agent.postprocess.rerankers import get_identifiers
+from docs_agent.postprocess.rerankers import rerank_results
+from docs_agent.utilities.config import ReadConfig
+from docs_agent.utilities.helpers import get_project_path
+
+
+class Item:
+    def __init__(self, id, distance, document, section_title=""):
+        self.id = id
+        self.distance = distance
+        self.document = document
+        self.metadata = {"page_title": "Page", "section_title": section_title}
+
+
+class SlowReranker:
+    def __init__(self, delay):
+        self.delay = delay
+        self.batches = []
+
+    def score(self, question, candidates):
+        self.batches.append(len(candidates))
+        time.sleep(self.delay)
+        return [-index for index in range(len(candidates))]
+
+
+def make_items():
+    return [
+        Item("a", 0.10, "Install the SDK on Linux."),
+        Item("b", 0.11, "Build the component."),
+        Item("c", 0.12, "The ZX_ERR_NOT_FOUND error means a missing file."),
+        Item("d", 0.13, "Logging for components.", "ZX_ERR_NOT_FOUND errors"),
+    ]
+
+
+class RerankersUnitTest(unittest.TestCase):
+    def test_get_identifiers(self):
+        self.assertEqual(
+            get_identifiers("Why ZX_ERR_NOT_FOUND in fuchsia.io.Directory?"),
+            {"zx_err_not_found", "fuchsia.io.directory"},
+        )
+        self.assertEqual(get_identifiers("How do I install?"), set())
+
+    def test_lexical_reranker_promotes_matches(self):
+        result = rerank_results(
+            "What does ZX_ERR_NOT_FOUND mean?",
+            make_items(),
+            LexicalReranker(),
+            top_n=4,
+            batch_size=3,
+            latency_budget_ms=1000,
+        )
+        self.assertEqual(result.status, "reranked")
+        self.assertEqual(result.batches, 2)
+        self.assertEqual([item.id for item in result.items], ["c", "a", "d", "b"])
+        self.assertGreater(result.items[0].rerank_score, result.items[1].rerank_score)
+
+    def test_timeout_keeps_the_vector_order(self):
+        items = make_items()
+        reranker = SlowReranker(delay=0.02)
+        result = rerank_results(
+            "question", items, reranker, top_n=4, batch_size=1, latency_budget_ms=10
+        )
+        self.assertEqual(result.status, "timeout")
+        self.assertEqual(result.items, items)
+        # Scoring stops at the first batch that ends after the deadline.
+        self.assertEqual(reranker.batches, [1])
+        result = rerank_results(
+            "question", items, SlowReranker(0.0), top_n=2, latency_budget_ms=1000
+        )
+        self.assertEqual([item.id for item in result.items], ["a", "b", "c", "d"])
+
+
+class DocsAgentRerankerUnitTest(unittest.TestCase):
+    def get_warnings(self, reranker):
+        config_path = os.path.join(get_project_path(), "config.yaml")
+        product = ReadConfig(config_path).returnProducts().products[0]
+        product.reranker = reranker
+        with mock.patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}):
+            with self.assertLogs(level="WARNING") as logs:
+                logging.warning("Creating a DocsAgent.")
+                docs_agent = DocsAgent(config=product, init_chroma=False)
+        self.assertIsNone(docs_agent.reranker)
+        return [line for line in logs.output if "Unknown reranker" in line]
+
+    def test_known_reranker_without_chroma(self):
+        self.assertEqual(self.get_warnings("lexical"), [])
+
+    def test_unknown_reranker(self):
+        self.assertEqual(len(self.get_warnings("bm25")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Unit tests for asking several products from the console."""
+
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+
+from docs_agent.interfaces import run_console
+from docs_agent.interfaces.run_console import ProductAnswer
+
+
+class Models:
+    language_model = "models/aqa"
+
+
+class Product:
+    def __init__(self, product_name, delay):
+        self.product_name = product_name
+        self.delay = delay
+        self.models = Models()
+
+
+class ProductConfigs:
+    def __init__(self, products):
+        self.products = products
+
+
+class RunConsoleUnitTest(unittest.TestCase):
+    def ask(self, products, **kwargs):
+        running = []
+        max_running = [0]
+        lock = threading.Lock()
+
+        def ask_product(question, product, filters, generation_lock, on_status):
+            if generation_lock is None:
+                generation_lock = threading.Lock()
+            with generation_lock:
+                with lock:
+                    running.append(product.product_name)
+                    max_running[0] = max(max_running[0], len(running))
+                time.sleep(product.delay)
+                with lock:
+                    running.remove(product.product_name)
+            return ProductAnswer(
+                product.product_name,
+                f"Answer of {product.product_name}",
+                [],
+                link=f"https://example.com/{product.product_name}",
+            )
+
+        output = io.StringIO()
+        with mock.patch.object(run_console, "ask_product", ask_product), mock.patch(
+            "sys.stdout", output
+        ):
+            start = time.perf_counter()
+            result = run_console.ask_model(
+                "question", ProductConfigs(products), return_output=True, **kwargs
+            )
+            elapsed = time.perf_counter() - start
+        return result, output.getvalue(), elapsed, max_running[0]
+
+    def test_products_are_asked_at_the_same_time(self):
+        products = [Product("slow", 0.3), Product("fast", 0.2)]
+        result, output, elapsed, max_running = self.ask(products)
+        self.assertEqual(max_running, 2)
+        # Asking them one after another takes at least 0.5 seconds.
+        self.assertLess(elapsed, 0.5)
+        # Answers are printed as they complete, and returned in product order.
+        self.assertLess(output.index("Answer of fast"), output.index("Answer of slow"))
+        self.assertLess(result.index("Answer of slow"), result.index("Answer of fast"))
+        self.assertIn("https://example.com/fast", result)
+
+    def test_sequential_generation(self):
+        products = [Product("a", 0.05), Product("b", 0.05)]
+        result, output, elapsed, max_running = self.ask(
+            products, parallel_generation=False
+        )
+        self.assertEqual(max_running, 1)
+        self.assertIn("Answer of a", result)
+        self.assertIn("Answer of b", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
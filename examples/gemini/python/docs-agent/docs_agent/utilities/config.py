@@ -33,6 +33,34 @@ class DbConfig:
         # These for 'chroma'
         vector_db_dir: typing.Optional[str] = None,
         collection_name: typing.Optional[str] = None,
+        # HNSW index settings of the collection ('hnsw:space', 'hnsw:M', and
+        # 'hnsw:construction_ef' are only used when the collection is created)
+        hnsw_space: typing.Optional[str] = None,
+        hnsw_construction_ef: typing.Optional[int] = None,
+        hnsw_m: typing.Optional[int] = None,
+        hnsw_search_ef: typing.Optional[int] = None,
+        # Either 'chroma' or 'numpy' (a memory-mapped export of the collection)
+        vector_backend: typing.Optional[str] = "chroma",
+        numpy_dir: typing.Optional[str] = None,
+        numpy_block_size: typing.Optional[int] = 0,
+        # Either 'none', 'int8', or 'pq' (for the 'numpy' backend)
+        quantization: typing.Optional[str] = "none",
+        pq_subvectors: typing.Optional[int] = 0,
+        rerank_oversample: typing.Optional[int] = 4,
+        # Either 'none', 'pca', or 'random_projection' (for the 'numpy' backend)
+        reduction: typing.Optional[str] = "none",
+        reduced_dimension: typing.Optional[int] = 0,
+        # Fuse vector results with a full-text (BM25) index of the collection
+        enable_hybrid_search: typing.Optional[str] = "False",
+        lexical_index_dir: typing.Optional[str] = None,
+        hybrid_vector_k: typing.Optional[int] = 0,
+        hybrid_lexical_k: typing.Optional[int] = 0,
+        hybrid_vector_weight: typing.Optional[float] = 1.0,
+        hybrid_lexical_weight: typing.Optional[float] = 1.0,
+        rrf_k: typing.Optional[int] = 60,
+        # Precompute the context windows of sections in a side store
+        enable_context_windows: typing.Optional[str] = "False",
+        context_window_dir: typing.Optional[str] = None,
         # These for 'google_semantic_retriever'
         corpus_name: typing.Optional[str] = None,
         # Only used when creating a corpus
@@ -43,6 +71,27 @@ class DbConfig:
         self.db_type = db_type
         self.vector_db_dir = vector_db_dir
         self.collection_name = collection_name
+        self.hnsw_space = hnsw_space
+        self.hnsw_construction_ef = hnsw_construction_ef
+        self.hnsw_m = hnsw_m
+        self.hnsw_search_ef = hnsw_search_ef
+        self.vector_backend = vector_backend
+        self.numpy_dir = numpy_dir
+        self.numpy_block_size = numpy_block_size
+        self.quantization = quantization
+        self.pq_subvectors = pq_subvectors
+        self.rerank_oversample = rerank_oversample
+        self.reduction = reduction
+        self.reduced_dimension = reduced_dimension
+        self.enable_hybrid_search = enable_hybrid_search
+        self.lexical_index_dir = lexical_index_dir
+        self.hybrid_vector_k = hybrid_vector_k
+        self.hybrid_lexical_k = hybrid_lexical_k
+        self.hybrid_vector_weight = hybrid_vector_weight
+        self.hybrid_lexical_weight = hybrid_lexical_weight
+        self.rrf_k = rrf_k
+        self.enable_context_windows = enable_context_windows
+        self.context_window_dir = context_window_dir
         self.corpus_name = corpus_name
         self.corpus_display = corpus_display
         self.secondary_db_type = secondary_db_type
@@ -55,6 +104,31 @@ class DbConfig:
             help_str += f"Vector database dir: {self.vector_db_dir}\n"
         if self.collection_name is not None and self.collection_name != "":
             help_str += f"Collection name: {self.collection_name}\n"
+        hnsw_settings = {
+            "space": self.hnsw_space,
+            "construction_ef": self.hnsw_construction_ef,
+            "M": self.hnsw_m,
+            "search_ef": self.hnsw_search_ef,
+        }
+        hnsw_settings = {
+            key: value for key, value in hnsw_settings.items() if value is not None
+        }
+        if hnsw_settings:
+            help_str += f"HNSW settings: {hnsw_settings}\n"
+        if self.vector_backend is not None and self.vector_backend != "chroma":
+            help_str += f"Vector backend: {self.vector_backend}\n"
+        if self.numpy_dir is not None and self.numpy_dir != "":
+            help_str += f"NumPy store dir: {self.numpy_dir}\n"
+        if self.quantization is not None and self.quantization != "none":
+            help_str += f"Quantization: {self.quantization}\n"
+        if self.reduction is not None and self.reduction != "none":
+            help_str += (
+                f"Reduction: {self.reduction} ({self.reduced_dimension} dimensions)\n"
+            )
+        if self.enable_hybrid_search == "True":
+            help_str += f"Hybrid search: {self.enable_hybrid_search}\n"
+        if self.enable_context_windows == "True":
+            help_str += f"Context windows: {self.enable_context_windows}\n"
         if self.corpus_name is not None and self.corpus_name != "":
             help_str += f"Corpus name: {self.corpus_name}\n"
         if self.corpus_display is not None and self.corpus_display != "":
@@ -86,6 +160,29 @@ class ReadDbConfigs:
                         db_type=db_type,
                         vector_db_dir=item["vector_db_dir"],
                         collection_name=item["collection_name"],
+                        hnsw_space=item.get("hnsw_space", None),
+                        hnsw_construction_ef=item.get("hnsw_construction_ef", None),
+                        hnsw_m=item.get("hnsw_m", None),
+                        hnsw_search_ef=item.get("hnsw_search_ef", None),
+                        vector_backend=item.get("vector_backend", "chroma"),
+                        numpy_dir=item.get("numpy_dir", None),
+                        numpy_block_size=item.get("numpy_block_size", 0),
+                        quantization=item.get("quantization", "none"),
+                        pq_subvectors=item.get("pq_subvectors", 0),
+                        rerank_oversample=item.get("rerank_oversample", 4),
+                        reduction=item.get("reduction", "none"),
+                        reduced_dimension=item.get("reduced_dimension", 0),
+                        enable_hybrid_search=item.get("enable_hybrid_search", "False"),
+                        lexical_index_dir=item.get("lexical_index_dir", None),
+                        hybrid_vector_k=item.get("hybrid_vector_k", 0),
+                        hybrid_lexical_k=item.get("hybrid_lexical_k", 0),
+                        hybrid_vector_weight=item.get("hybrid_vector_weight", 1.0),
+                        hybrid_lexical_weight=item.get("hybrid_lexical_weight", 1.0),
+                        rrf_k=item.get("rrf_k", 60),
+                        enable_context_windows=item.get(
+                            "enable_context_windows", "False"
+                        ),
+                        context_window_dir=item.get("context_window_dir", None),
                     )
                 elif db_type == "google_semantic_retriever":
                     input_item = DbConfig(
@@ -349,6 +446,32 @@ class ProductConfig:
         enable_logs_to_markdown: str = "False",
         enable_logs_for_debugging: str = "False",
         enable_delete_chunks: str = "False",
+        populate_order: str = "default",
+        embedding_store_path: str = "",
+        enable_near_duplicate_collapsing: str = "False",
+        near_duplicate_threshold: str = "0.9",
+        near_duplicate_canonical: str = "first",
+        query_embedding_cache_size: str = "1024",
+        query_embedding_store_path: str = "",
+        enable_answer_cache: str = "False",
+        answer_cache_threshold: str = "0.95",
+        answer_cache_path: str = "./cache/answer_cache.db",
+        answer_cache_size: str = "1024",
+        page_cache_size: str = "256",
+        context_packer: str = "even",
+        result_diversity: str = "",
+        mmr_lambda: str = "0.5",
+        max_results_per_page: str = "0",
+        reranker: str = "",
+        reranker_model: str = "",
+        rerank_top_n: str = "20",
+        rerank_batch_size: str = "16",
+        rerank_latency_budget_ms: str = "50",
+        adaptive_top_k: str = "False",
+        adaptive_min_k: str = "1",
+        adaptive_max_k: str = "0",
+        adaptive_distance_gap: str = "0.05",
+        adaptive_relevance_threshold: str = "0.8",
         secondary_db_type: typing.Optional[str] = None,
         secondary_corpus_name: typing.Optional[str] = None,
     ):
@@ -369,6 +492,32 @@ class ProductConfig:
         self.enable_logs_to_markdown = enable_logs_to_markdown
         self.enable_logs_for_debugging = enable_logs_for_debugging
         self.enable_delete_chunks = enable_delete_chunks
+        self.populate_order = populate_order
+        self.embedding_store_path = embedding_store_path
+        self.enable_near_duplicate_collapsing = enable_near_duplicate_collapsing
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.near_duplicate_canonical = near_duplicate_canonical
+        self.query_embedding_cache_size = query_embedding_cache_size
+        self.query_embedding_store_path = query_embedding_store_path
+        self.enable_answer_cache = enable_answer_cache
+        self.answer_cache_threshold = answer_cache_threshold
+        self.answer_cache_path = answer_cache_path
+        self.answer_cache_size = answer_cache_size
+        self.page_cache_size = page_cache_size
+        self.context_packer = context_packer
+        self.result_diversity = result_diversity
+        self.mmr_lambda = mmr_lambda
+        self.max_results_per_page = max_results_per_page
+        self.reranker = reranker
+        self.reranker_model = reranker_model
+        self.rerank_top_n = rerank_top_n
+        self.rerank_batch_size = rerank_batch_size
+        self.rerank_latency_budget_ms = rerank_latency_budget_ms
+        self.adaptive_top_k = adaptive_top_k
+        self.adaptive_min_k = adaptive_min_k
+        self.adaptive_max_k = adaptive_max_k
+        self.adaptive_distance_gap = adaptive_distance_gap
+        self.adaptive_relevance_threshold = adaptive_relevance_threshold
         self.secondary_db_type = secondary_db_type
         self.secondary_corpus_name = secondary_corpus_name
 
@@ -402,6 +551,90 @@ class ProductConfig:
             help_str += f"Enable logs for debugging: {self.enable_logs_for_debugging}\n"
         if self.enable_delete_chunks is not None and self.enable_delete_chunks != "":
             help_str += f"Enable delete chunks: {self.enable_delete_chunks}\n"
+        if self.populate_order is not None and self.populate_order != "":
+            help_str += f"Populate order: {self.populate_order}\n"
+        if self.embedding_store_path is not None and self.embedding_store_path != "":
+            help_str += f"Embedding store path: {self.embedding_store_path}\n"
+        if (
+            self.enable_near_duplicate_collapsing is not None
+            and self.enable_near_duplicate_collapsing != ""
+        ):
+            help_str += f"Enable near-duplicate collapsing: {self.enable_near_duplicate_collapsing}\n"
+        if (
+            self.near_duplicate_threshold is not None
+            and self.near_duplicate_threshold != ""
+        ):
+            help_str += f"Near-duplicate threshold: {self.near_duplicate_threshold}\n"
+        if (
+            self.near_duplicate_canonical is not None
+            and self.near_duplicate_canonical != ""
+        ):
+            help_str += (
+                f"Near-duplicate canonical chunk: {self.near_duplicate_canonical}\n"
+            )
+        if (
+            self.query_embedding_cache_size is not None
+            and self.query_embedding_cache_size != ""
+        ):
+            help_str += (
+                f"Query embedding cache size: {self.query_embedding_cache_size}\n"
+            )
+        if (
+            self.query_embedding_store_path is not None
+            and self.query_embedding_store_path != ""
+        ):
+            help_str += (
+                f"Query embedding store path: {self.query_embedding_store_path}\n"
+            )
+        if self.enable_answer_cache is not None and self.enable_answer_cache != "":
+            help_str += f"Enable answer cache: {self.enable_answer_cache}\n"
+        if (
+            self.answer_cache_threshold is not None
+            and self.answer_cache_threshold != ""
+        ):
+            help_str += f"Answer cache threshold: {self.answer_cache_threshold}\n"
+        if self.answer_cache_path is not None and self.answer_cache_path != "":
+            help_str += f"Answer cache path: {self.answer_cache_path}\n"
+        if self.answer_cache_size is not None and self.answer_cache_size != "":
+            help_str += f"Answer cache size: {self.answer_cache_size}\n"
+        if self.page_cache_size is not None and self.page_cache_size != "":
+            help_str += f"Page cache size: {self.page_cache_size}\n"
+        if self.context_packer is not None and self.context_packer != "":
+            help_str += f"Context packer: {self.context_packer}\n"
+        if self.result_diversity is not None and self.result_diversity != "":
+            help_str += f"Result diversity: {self.result_diversity}\n"
+        if self.mmr_lambda is not None and self.mmr_lambda != "":
+            help_str += f"MMR lambda: {self.mmr_lambda}\n"
+        if self.max_results_per_page is not None and self.max_results_per_page != "":
+            help_str += f"Max results per page: {self.max_results_per_page}\n"
+        if self.reranker is not None and self.reranker != "":
+            help_str += f"Reranker: {self.reranker}\n"
+        if self.reranker_model is not None and self.reranker_model != "":
+            help_str += f"Reranker model: {self.reranker_model}\n"
+        if self.rerank_top_n is not None and self.rerank_top_n != "":
+            help_str += f"Rerank top N: {self.rerank_top_n}\n"
+        if self.rerank_batch_size is not None and self.rerank_batch_size != "":
+            help_str += f"Rerank batch size: {self.rerank_batch_size}\n"
+        if (
+            self.rerank_latency_budget_ms is not None
+            and self.rerank_latency_budget_ms != ""
+        ):
+            help_str += f"Rerank latency budget (ms): {self.rerank_latency_budget_ms}\n"
+        if self.adaptive_top_k is not None and self.adaptive_top_k != "":
+            help_str += f"Adaptive top-k: {self.adaptive_top_k}\n"
+        if self.adaptive_min_k is not None and self.adaptive_min_k != "":
+            help_str += f"Adaptive min k: {self.adaptive_min_k}\n"
+        if self.adaptive_max_k is not None and self.adaptive_max_k != "":
+            help_str += f"Adaptive max k: {self.adaptive_max_k}\n"
+        if self.adaptive_distance_gap is not None and self.adaptive_distance_gap != "":
+            help_str += f"Adaptive distance gap: {self.adaptive_distance_gap}\n"
+        if (
+            self.adaptive_relevance_threshold is not None
+            and self.adaptive_relevance_threshold != ""
+        ):
+            help_str += (
+                f"Adaptive relevance threshold: {self.adaptive_relevance_threshold}\n"
+            )
         if self.markdown_splitter is not None and self.markdown_splitter != "":
             help_str += f"Markdown splitter: {self.markdown_splitter}\n"
         if self.db_type is not None and self.db_type != "":
@@ -519,6 +752,112 @@ class ReadConfig:
                     enable_delete_chunks = item["enable_delete_chunks"]
                 except KeyError:
                     enable_delete_chunks = "False"
+                try:
+                    populate_order = item["populate_order"]
+                except KeyError:
+                    populate_order = "default"
+                try:
+                    embedding_store_path = item["embedding_store_path"]
+                except KeyError:
+                    embedding_store_path = ""
+                try:
+                    enable_near_duplicate_collapsing = item[
+                        "enable_near_duplicate_collapsing"
+                    ]
+                except KeyError:
+                    enable_near_duplicate_collapsing = "False"
+                try:
+                    near_duplicate_threshold = item["near_duplicate_threshold"]
+                except KeyError:
+                    near_duplicate_threshold = "0.9"
+                try:
+                    near_duplicate_canonical = item["near_duplicate_canonical"]
+                except KeyError:
+                    near_duplicate_canonical = "first"
+                try:
+                    query_embedding_cache_size = item["query_embedding_cache_size"]
+                except KeyError:
+                    query_embedding_cache_size = "1024"
+                try:
+                    query_embedding_store_path = item["query_embedding_store_path"]
+                except KeyError:
+                    query_embedding_store_path = ""
+                try:
+                    enable_answer_cache = item["enable_answer_cache"]
+                except KeyError:
+                    enable_answer_cache = "False"
+                try:
+                    answer_cache_threshold = item["answer_cache_threshold"]
+                except KeyError:
+                    answer_cache_threshold = "0.95"
+                try:
+                    answer_cache_path = item["answer_cache_path"]
+                except KeyError:
+                    answer_cache_path = "./cache/answer_cache.db"
+                try:
+                    answer_cache_size = item["answer_cache_size"]
+                except KeyError:
+                    answer_cache_size = "1024"
+                try:
+                    page_cache_size = item["page_cache_size"]
+                except KeyError:
+                    page_cache_size = "256"
+                try:
+                    context_packer = item["context_packer"]
+                except KeyError:
+                    context_packer = "even"
+                try:
+                    result_diversity = item["result_diversity"]
+                except KeyError:
+                    result_diversity = ""
+                try:
+                    mmr_lambda = item["mmr_lambda"]
+                except KeyError:
+                    mmr_lambda = "0.5"
+                try:
+                    max_results_per_page = item["max_results_per_page"]
+                except KeyError:
+                    max_results_per_page = "0"
+                try:
+                    reranker = item["reranker"]
+                except KeyError:
+                    reranker = ""
+                try:
+                    reranker_model = item["reranker_model"]
+                except KeyError:
+                    reranker_model = ""
+                try:
+                    rerank_top_n = item["rerank_top_n"]
+                except KeyError:
+                    rerank_top_n = "20"
+                try:
+                    rerank_batch_size = item["rerank_batch_size"]
+                except KeyError:
+                    rerank_batch_size = "16"
+                try:
+                    rerank_latency_budget_ms = item["rerank_latency_budget_ms"]
+                except KeyError:
+                    rerank_latency_budget_ms = "50"
+                try:
+                    adaptive_top_k = item["adaptive_top_k"]
+                except KeyError:
+                    adaptive_top_k = "False"
+                try:
+                    adaptive_min_k = item["adaptive_min_k"]
+                except KeyError:
+                    adaptive_min_k = "1"
+                try:
+                    adaptive_max_k = item["adaptive_max_k"]
+                except KeyError:
+                    adaptive_max_k = "0"
+                try:
+                    adaptive_distance_gap = item["adaptive_distance_gap"]
+                except KeyError:
+                    adaptive_distance_gap = "0.05"
+                try:
+                    adaptive_relevance_threshold = item["adaptive_relevance_threshold"]
+                except KeyError:
+                    adaptive_relevance_threshold = "0.8"
                 try:
                     secondary_db_type = item["secondary_db_type"]
                 except KeyError:
@@ -546,6 +885,32 @@ class ReadConfig:
                         enable_logs_to_markdown=enable_logs_to_markdown,
                         enable_logs_for_debugging=enable_logs_for_debugging,
                         enable_delete_chunks=enable_delete_chunks,
+                        populate_order=populate_order,
+                        embedding_store_path=embedding_store_path,
+                        enable_near_duplicate_collapsing=enable_near_duplicate_collapsing,
+                        near_duplicate_threshold=near_duplicate_threshold,
+                        near_duplicate_canonical=near_duplicate_canonical,
+                        query_embedding_cache_size=query_embedding_cache_size,
+                        query_embedding_store_path=query_embedding_store_path,
+                        enable_answer_cache=enable_answer_cache,
+                        answer_cache_threshold=answer_cache_threshold,
+                        answer_cache_path=answer_cache_path,
+                        answer_cache_size=answer_cache_size,
+                        page_cache_size=page_cache_size,
+                        context_packer=context_packer,
+                        result_diversity=result_diversity,
+                        mmr_lambda=mmr_lambda,
+                        max_results_per_page=max_results_per_page,
+                        reranker=reranker,
+                        reranker_model=reranker_model,
+                        rerank_top_n=rerank_top_n,
+                        rerank_batch_size=rerank_batch_size,
+                        rerank_latency_budget_ms=rerank_latency_budget_ms,
+                        adaptive_top_k=adaptive_top_k,
+                        adaptive_min_k=adaptive_min_k,
+                        adaptive_max_k=adaptive_max_k,
+                        adaptive_distance_gap=adaptive_distance_gap,
+                        adaptive_relevance_threshold=adaptive_relevance_threshold,
                         secondary_db_type=secondary_db_type,
                         secondary_corpus_name=secondary_corpus_name,
                     )